@@ -0,0 +1,109 @@
+"""
+Maintenance commands that are run by hand against the configured database.
+
+    python -m app.commands rebuild-rollups [--group GROUP_ID]
+    python -m app.commands rebuild-search
+    python -m app.commands run-recurring
+    python -m app.commands precompress-static
+    python -m app.commands compact-changes
+    python -m app.commands purge-idempotency-keys
+"""
+
+import logging
+import argparse
+from datetime import datetime, timezone
+from pathlib import Path
+
+from sqlmodel import Session, select
+
+from app.config.vars import get_db_vars, get_storage_vars
+from app.logger import logger
+from app.repository.models import Group, get_engine
+from app.repository.types import str_to_id
+from app.routes.recurring import materialize_with_configured_vars
+from app.utils.changelog import compact_changes
+from app.utils.idempotency import purge_expired_keys
+from app.utils.receipts import RECEIPT_DIR
+from app.utils.recurring import RecurringScheduler, utc_today
+from app.utils.rollup import rebuild_rollups
+from app.utils.search import search_backend
+from app.utils.static import precompress
+
+
+def rebuild_rollups_command(session: Session, group_id: str | None) -> None:
+    """Backfills the monthly spend rollups, one transaction per group."""
+    if group_id is not None:
+        group_ids = [str_to_id(group_id)]
+    else:
+        group_ids = list(session.exec(select(Group.id)).all())
+
+    for gid in group_ids:
+        rows = rebuild_rollups(session, gid)
+        session.commit()
+        logger.info("rebuilt %d monthly spend rows for group %s", rows, gid)
+
+
+def rebuild_search_command(session: Session) -> None:
+    """Reindexes every expense, for backfills and after restoring the database from a dump."""
+    indexed = search_backend(session).rebuild(session)
+    session.commit()
+    logger.info("rebuilt the expense search index over %d expenses", indexed)
+
+
+def run_recurring_command(session: Session) -> None:
+    """Records every due occurrence once, for deployments that disable the in-process scheduler."""
+    scheduler = RecurringScheduler(materialize_with_configured_vars)
+    scheduler.load(session)
+    handled = scheduler.run_due(session, utc_today())
+    logger.info("recorded due occurrences of %d recurring expenses", handled)
+
+
+def compact_changes_command(session: Session) -> None:
+    """Drops the changes superseded by later ones, so clients starting a sync from scratch replay less."""
+    dropped = compact_changes(session)
+    session.commit()
+    logger.info("dropped %d superseded changes from the change log", dropped)
+
+
+def purge_idempotency_keys_command(session: Session) -> None:
+    """Drops the idempotency keys past their time to live, retries sent with them write again."""
+    purged = purge_expired_keys(session, datetime.now(timezone.utc))
+    session.commit()
+    logger.info("purged %d expired idempotency keys", purged)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m app.commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    rollups = commands.add_parser("rebuild-rollups", help="recompute the monthly spend rollups from the ledger")
+    rollups.add_argument("--group", help="only rebuild this group")
+    commands.add_parser("rebuild-search", help="rebuild the full text index over expenses")
+    commands.add_parser("run-recurring", help="record the due occurrences of recurring expenses")
+    commands.add_parser("precompress-static", help="write the gzip and brotli variants of the static files")
+    commands.add_parser("compact-changes", help="drop the changes of the sync log that later ones supersede")
+    commands.add_parser("purge-idempotency-keys", help="drop the idempotency keys past their time to live")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "precompress-static":
+        # a build step, it needs no database
+        precompress(Path(get_storage_vars().static_root), (RECEIPT_DIR,))
+        return
+
+    engine = get_engine(get_db_vars())
+    with Session(engine) as session:
+        if args.command == "rebuild-rollups":
+            rebuild_rollups_command(session, args.group)
+        elif args.command == "rebuild-search":
+            rebuild_search_command(session)
+        elif args.command == "run-recurring":
+            run_recurring_command(session)
+        elif args.command == "compact-changes":
+            compact_changes_command(session)
+        elif args.command == "purge-idempotency-keys":
+            purge_idempotency_keys_command(session)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 from abc import ABC
+from datetime import timedelta
 from typing import Annotated
 
 from fastapi import Depends
@@ -54,3 +55,150 @@ def get_jwt_vars():
 
 
 JWTVarsDep = Annotated[JWTVars, Depends(get_jwt_vars)]
+
+
+class LedgerVars(EnvVars):
+    checkpoint_interval: int = Field(alias="LEDGER_CHECKPOINT_INTERVAL", default=500)
+    # entries younger than this may still be committing, checkpoints never cover them
+    checkpoint_lag_seconds: int = Field(alias="LEDGER_CHECKPOINT_LAG_SECONDS", default=60)
+    # new expenses of a group arriving within this window are recorded in one transaction, 0 turns it off
+    coalesce_window_ms: int = Field(alias="LEDGER_COALESCE_WINDOW_MS", default=0)
+    coalesce_max_batch: int = Field(alias="LEDGER_COALESCE_MAX_BATCH", default=128)
+
+
+def get_ledger_vars():
+    return LedgerVars()
+
+
+LedgerVarsDep = Annotated[LedgerVars, Depends(get_ledger_vars)]
+
+
+class CurrencyVars(EnvVars):
+    # csv with the columns date,currency,rate where rate is the units of currency one unit of
+    # the base currency buys on that date, each rate holds until the next date of the currency
+    rates_file: str = Field(alias="CURRENCY_RATES_FILE", default="rates.csv")
+    base_currency: str = Field(alias="CURRENCY_BASE", default="EUR")
+
+
+def get_currency_vars():
+    return CurrencyVars()
+
+
+CurrencyVarsDep = Annotated[CurrencyVars, Depends(get_currency_vars)]
+
+
+class RecurringVars(EnvVars):
+    scheduler_enabled: bool = Field(alias="RECURRING_SCHEDULER_ENABLED", default=True)
+    # occurrences recorded per transaction when a template is caught up after downtime
+    catch_up_batch: int = Field(alias="RECURRING_CATCH_UP_BATCH", default=100)
+    # the scheduler wakes up at least this often even when nothing is due earlier
+    max_sleep_seconds: int = Field(alias="RECURRING_MAX_SLEEP_SECONDS", default=3600)
+
+
+def get_recurring_vars():
+    return RecurringVars()
+
+
+RecurringVarsDep = Annotated[RecurringVars, Depends(get_recurring_vars)]
+
+
+class TaskVars(EnvVars):
+    scanner_enabled: bool = Field(alias="TASK_SCANNER_ENABLED", default=True)
+    # a pending task is due soon once its deadline is this close
+    reminder_lead_minutes: int = Field(alias="TASK_REMINDER_LEAD_MINUTES", default=1440)
+    # how often the scanner reads the next slice of deadlines, it also sleeps at most this long
+    scan_interval_seconds: int = Field(alias="TASK_SCAN_INTERVAL_SECONDS", default=300)
+
+
+def get_task_vars():
+    return TaskVars()
+
+
+TaskVarsDep = Annotated[TaskVars, Depends(get_task_vars)]
+
+
+class StorageVars(EnvVars):
+    # served under /static, uploaded receipts are stored in it by content
+    static_root: str = Field(alias="STORAGE_STATIC_ROOT", default="public")
+    receipt_max_bytes: int = Field(alias="STORAGE_RECEIPT_MAX_BYTES", default=20 * 1024 * 1024)
+    # longest side of a receipt thumbnail in pixels
+    thumbnail_size: int = Field(alias="STORAGE_THUMBNAIL_SIZE", default=320)
+    thumbnail_workers: int = Field(alias="STORAGE_THUMBNAIL_WORKERS", default=2)
+    # writes the gzip and brotli variants of the static files when the app starts
+    precompress_on_startup: bool = Field(alias="STORAGE_PRECOMPRESS_ON_STARTUP", default=True)
+    # memory for the contents of hot small static files, none are kept when it is 0
+    static_cache_bytes: int = Field(alias="STORAGE_STATIC_CACHE_BYTES", default=0)
+    static_cache_max_file_bytes: int = Field(alias="STORAGE_STATIC_CACHE_MAX_FILE_BYTES", default=64 * 1024)
+
+
+def get_storage_vars():
+    return StorageVars()
+
+
+StorageVarsDep = Annotated[StorageVars, Depends(get_storage_vars)]
+
+
+class SyncVars(EnvVars):
+    page_size: int = Field(alias="SYNC_PAGE_SIZE", default=500)
+    # sequence numbers are taken when a change is written but become visible when it commits, so a
+    # cursor only moves past changes older than this, later ones are sent again on the next sync,
+    # and reads under a group are only tagged once the last change of the group is older than this
+    commit_grace_seconds: float = Field(alias="SYNC_COMMIT_GRACE_SECONDS", default=5.0)
+
+    @property
+    def commit_grace(self) -> timedelta:
+        return timedelta(seconds=self.commit_grace_seconds)
+
+
+def get_sync_vars():
+    return SyncVars()
+
+
+SyncVarsDep = Annotated[SyncVars, Depends(get_sync_vars)]
+
+
+class EventVars(EnvVars):
+    # events a client may fall behind by before it is told it lagged and they are dropped
+    max_queued: int = Field(alias="EVENTS_MAX_QUEUED", default=64)
+    # events kept per group for clients that reconnect with Last-Event-ID
+    history_size: int = Field(alias="EVENTS_HISTORY_SIZE", default=256)
+    heartbeat_seconds: float = Field(alias="EVENTS_HEARTBEAT_SECONDS", default=15.0)
+
+
+def get_event_vars():
+    return EventVars()
+
+
+EventVarsDep = Annotated[EventVars, Depends(get_event_vars)]
+
+
+class ResponseVars(EnvVars):
+    # bodies smaller than this are sent as they are, compressing them saves less than it costs
+    compress_min_bytes: int = Field(alias="RESPONSE_COMPRESS_MIN_BYTES", default=1024)
+    gzip_level: int = Field(alias="RESPONSE_GZIP_LEVEL", default=6)
+    zstd_level: int = Field(alias="RESPONSE_ZSTD_LEVEL", default=3)
+
+
+def get_response_vars():
+    return ResponseVars()
+
+
+ResponseVarsDep = Annotated[ResponseVars, Depends(get_response_vars)]
+
+
+class IdempotencyVars(EnvVars):
+    # how long a retry with the same key is answered from the stored response
+    ttl_seconds: int = Field(alias="IDEMPOTENCY_TTL_SECONDS", default=24 * 60 * 60)
+    # a request handled for longer than this is taken for dead, a retry then runs it again
+    lease_seconds: float = Field(alias="IDEMPOTENCY_LEASE_SECONDS", default=60.0)
+    # how long a retry waits for the original still being handled before it gives up with a 409
+    wait_seconds: float = Field(alias="IDEMPOTENCY_WAIT_SECONDS", default=10.0)
+    # originals handled by another worker are polled for, those of this process wake the retry
+    poll_seconds: float = Field(alias="IDEMPOTENCY_POLL_SECONDS", default=0.05)
+
+
+def get_idempotency_vars():
+    return IdempotencyVars()
+
+
+IdempotencyVarsDep = Annotated[IdempotencyVars, Depends(get_idempotency_vars)]
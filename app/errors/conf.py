@@ -1,21 +1,31 @@
 from abc import ABC
 from collections.abc import Callable, Coroutine
 from enum import StrEnum
-from typing import Any, ClassVar, final
+from typing import Any, ClassVar, final, get_args
 
+import pydantic_core
 from fastapi import Request, Response
 from fastapi.encoders import jsonable_encoder
-from fastapi.responses import JSONResponse
 from requests.structures import CaseInsensitiveDict
 
 HandlerFunc = Callable[[Request, "ErrBase[Any]"], Coroutine[Any, Any, Response]]
 handler_dict: dict[int | type[Exception], HandlerFunc] = {}
 
+# bodies of errors with a detail built at raise time are not kept once a class has this many
+ERROR_BODY_CACHE_SIZE = 1024
+
+
+def encode_error_body(code: StrEnum, detail: Any) -> bytes:
+    content = {"code": code} if detail is None else {"code": code, "detail": detail}
+    return pydantic_core.to_json(content)
+
 
 class ErrBase[C: StrEnum](Exception, ABC):
     default_status_code: ClassVar[int] = 400
     """When a class extends this `ErrBase`, then `__init_subclass__` will be called,
     which will set this default status code value vie updating the class property"""
+    _bodies: ClassVar[dict[tuple[StrEnum, str | None], bytes]]
+    """Encoded bodies by (code, detail), so that raising a known error encodes nothing."""
 
     def __init__(self, code: C, status: int | None = None, detail: Any = None, headers: dict[str, str] | None = None):
         self.code = code
@@ -39,6 +49,12 @@ class ErrBase[C: StrEnum](Exception, ABC):
         """
         super().__init_subclass__(**kwargs)
         handler_dict[cls] = cls.handle_error_response
+        # every code of the class without a detail is encoded once, when the class is declared
+        cls._bodies = {}
+        for base in getattr(cls, "__orig_bases__", ()):
+            for code_type in get_args(base):
+                if isinstance(code_type, type) and issubclass(code_type, StrEnum):
+                    cls._bodies.update({(code, None): encode_error_body(code, None) for code in code_type})
 
     @staticmethod
     async def handle_error_response(_: Request, exc: "ErrBase[C]") -> Response:
@@ -47,5 +63,19 @@ class ErrBase[C: StrEnum](Exception, ABC):
 
     @final
     def create_json_response(self) -> Response:
-        content = jsonable_encoder(self, exclude={"status", "headers"}, exclude_none=True)
-        return JSONResponse(content, self.status, self.headers)
+        return Response(self.encoded_body(), self.status, self.headers, media_type="application/json")
+
+    @final
+    def encoded_body(self) -> bytes:
+        if self.detail is not None and not isinstance(self.detail, str):
+            # structured details carry values of the failed request, they are encoded every time
+            return encode_error_body(self.code, jsonable_encoder(self.detail, exclude_none=True))
+
+        key = (self.code, self.detail)
+        body = self._bodies.get(key)
+        if body is None:
+            # messages are mostly constants, the first raise of each encodes it for all later ones
+            body = encode_error_body(self.code, self.detail)
+            if len(self._bodies) < ERROR_BODY_CACHE_SIZE:
+                self._bodies[key] = body
+        return body
@@ -11,6 +11,7 @@ from app.errors.conf import ErrBase
 class CodeGroupAuth(StrEnum):
     FORBIDDEN_NOT_MEMBER = auto()
     FORBIDDEN_NOT_ADMIN = auto()
+    FORBIDDEN_DELETE_EXPENSE = auto()
     FORBIDDEN_DISABLED = auto()
 
 
@@ -38,6 +39,10 @@ class CodeItemNotFound(StrEnum):
     USER_NOT_FOUND = auto()
     GROUP_NOT_FOUND = auto()
     INVITATION_NOT_FOUND = auto()
+    EXPENSE_NOT_FOUND = auto()
+    PAYMENT_NOT_FOUND = auto()
+    RECURRING_EXPENSE_NOT_FOUND = auto()
+    TASK_NOT_FOUND = auto()
 
 
 class ErrItemNotFound(ErrBase[CodeItemNotFound]):
@@ -116,3 +121,146 @@ class CodeInvitationAuth(StrEnum):
 
 class ErrInvitationAuth(ErrBase[CodeInvitationAuth]):
     default_status_code = 403
+
+
+# ------------------------------------------------------------------------------
+
+
+class CodeExpense(StrEnum):
+    GROUP_MISMATCH = auto()
+    PAYER_NOT_MEMBER = auto()
+    DUPLICATE_SPLIT_USER = auto()
+    SPLIT_USERS_MISMATCH = auto()
+    SPLIT_TOTAL_MISMATCH = auto()
+    UNEXPECTED_SPLITS = auto()
+    NO_DELETE_FILTER = auto()
+    INVALID_SCHEDULE = auto()
+    UNSUPPORTED_RECEIPT = auto()
+    RECEIPT_TOO_LARGE = auto()
+
+
+class ErrExpense(ErrBase[CodeExpense]):
+    default_status_code = 400
+
+
+# ------------------------------------------------------------------------------
+
+
+class CodePayment(StrEnum):
+    SAME_PAYER_PAYEE = auto()
+    NOT_MEMBER = auto()
+    ALREADY_SETTLED = auto()
+    ALREADY_DECLINED = auto()
+    ALREADY_CANCELLED = auto()
+    EMPTY_PLAN = auto()
+    PLAN_MISMATCH = auto()
+
+
+class ErrPayment(ErrBase[CodePayment]):
+    default_status_code = 400
+
+
+# ------------------------------------------------------------------------------
+
+
+class CodePaymentAuth(StrEnum):
+    FORBIDDEN_NOT_PARTY = auto()
+    FORBIDDEN_NOT_REQUESTER = auto()
+
+
+class ErrPaymentAuth(ErrBase[CodePaymentAuth]):
+    default_status_code = 403
+
+
+# ------------------------------------------------------------------------------
+
+
+class CodeConcurrency(StrEnum):
+    VERSION_MISMATCH = auto()
+    INVALID_IF_MATCH = auto()
+
+
+class ErrConcurrency(ErrBase[CodeConcurrency]):
+    default_status_code = 412
+
+
+# ------------------------------------------------------------------------------
+
+
+class CodeCurrency(StrEnum):
+    RATE_UNAVAILABLE = auto()
+
+
+class ErrCurrency(ErrBase[CodeCurrency]):
+    default_status_code = 422
+
+
+# ------------------------------------------------------------------------------
+
+
+class CodeSearch(StrEnum):
+    INVALID_CURSOR = auto()
+
+
+class ErrSearch(ErrBase[CodeSearch]):
+    default_status_code = 400
+
+
+# ------------------------------------------------------------------------------
+
+
+class CodeSync(StrEnum):
+    INVALID_CURSOR = auto()
+
+
+class ErrSync(ErrBase[CodeSync]):
+    default_status_code = 400
+
+
+# ------------------------------------------------------------------------------
+
+
+class CodeTask(StrEnum):
+    ASSIGNEE_NOT_MEMBER = auto()
+    INVALID_CURSOR = auto()
+    INVALID_TRANSITION = auto()
+
+
+class ErrTask(ErrBase[CodeTask]):
+    default_status_code = 400
+
+
+# ------------------------------------------------------------------------------
+
+
+class CodeTaskAuth(StrEnum):
+    FORBIDDEN_NOT_ASSIGNEE = auto()
+    FORBIDDEN_NOT_ASSIGNER = auto()
+
+
+class ErrTaskAuth(ErrBase[CodeTaskAuth]):
+    default_status_code = 403
+
+
+# ------------------------------------------------------------------------------
+
+
+class CodeBatch(StrEnum):
+    NOT_APPLIED = auto()
+    OPERATION_FAILED = auto()
+
+
+class ErrBatch(ErrBase[CodeBatch]):
+    default_status_code = 424
+
+
+# ------------------------------------------------------------------------------
+
+
+class CodeIdempotency(StrEnum):
+    KEY_IN_USE = auto()
+    KEY_REUSED = auto()
+
+
+class ErrIdempotency(ErrBase[CodeIdempotency]):
+    default_status_code = 409
@@ -1,23 +1,55 @@
+import asyncio
+import contextlib
 from contextlib import asynccontextmanager
+from pathlib import Path
 
 from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
 
+from app.config.vars import get_db_vars, get_recurring_vars, get_response_vars, get_storage_vars, get_task_vars
 from app.errors.conf import handler_dict
-from app.middleware import ProcessTimeMiddleware
+from app.middleware import NegotiationMiddleware, ProcessTimeMiddleware
+from app.repository.models import get_engine
 
 # from app.repository.session import create_db_and_tables
+from app.routes.batch import batch_router
 from app.routes.expense import expense_router
 from app.routes.group import group_router
 from app.routes.invitation import invitation_router
+from app.routes.payment import payment_router
+from app.routes.recurring import recurring_router, recurring_scheduler
 from app.routes.security import security_router
+from app.routes.sync import sync_router
+from app.routes.task import due_soon_scanner, task_router
 from app.routes.user import user_router
+from app.utils.receipts import RECEIPT_DIR, thumbnailer
+from app.utils.static import CachedStaticFiles, precompress
 
 
 @asynccontextmanager
 async def lifespan(_: FastAPI):
     # create_db_and_tables()
+    recurring_vars = get_recurring_vars()
+    task_vars = get_task_vars()
+    storage_vars = get_storage_vars()
+    if storage_vars.precompress_on_startup:
+        # receipts are images and pdfs that do not compress
+        await asyncio.to_thread(precompress, Path(storage_vars.static_root), (RECEIPT_DIR,))
+
+    background: list[asyncio.Task] = []
+    if recurring_vars.scheduler_enabled or task_vars.scanner_enabled:
+        engine = get_engine(get_db_vars())
+        if recurring_vars.scheduler_enabled:
+            background.append(asyncio.create_task(recurring_scheduler.run(engine, recurring_vars.max_sleep_seconds)))
+        if task_vars.scanner_enabled:
+            background.append(asyncio.create_task(due_soon_scanner.run(engine, task_vars.scan_interval_seconds)))
+
     yield
+    for job in background:
+        job.cancel()
+    for job in background:
+        with contextlib.suppress(asyncio.CancelledError):
+            await job
+    await asyncio.to_thread(thumbnailer.shutdown)
 
 
 app = FastAPI(
@@ -25,11 +57,34 @@ app = FastAPI(
     summary="split tasks and pay, all in one application",
     lifespan=lifespan,
     exception_handlers=handler_dict,
+    # no default_response_class: with one set, fastapi turns a response model into a dict of plain
+    # values for that class to encode, without one it dumps the validated model to bytes in one pass
+)
+storage_vars = get_storage_vars()
+app.mount(
+    "/static",
+    CachedStaticFiles(
+        directory=storage_vars.static_root,
+        immutable_dirs=(RECEIPT_DIR,),
+        cache_bytes=storage_vars.static_cache_bytes,
+        cache_max_file_bytes=storage_vars.static_cache_max_file_bytes,
+    ),
 )
-app.mount("/static", StaticFiles(directory="public"))
 app.add_middleware(ProcessTimeMiddleware)
+response_vars = get_response_vars()
+app.add_middleware(
+    NegotiationMiddleware,
+    compress_min_bytes=response_vars.compress_min_bytes,
+    gzip_level=response_vars.gzip_level,
+    zstd_level=response_vars.zstd_level,
+)
 app.include_router(user_router, prefix="/user")
 app.include_router(group_router, prefix="/group")
 app.include_router(invitation_router, prefix="/invitation")
 app.include_router(expense_router, prefix="/expense")
+app.include_router(payment_router, prefix="/payment")
+app.include_router(recurring_router, prefix="/recurring")
+app.include_router(task_router, prefix="/task")
+app.include_router(sync_router, prefix="/sync")
+app.include_router(batch_router, prefix="/batch")
 app.include_router(security_router)
@@ -1,7 +1,19 @@
 import time
 
+import anyio
 from fastapi import Request, Response
+from starlette.datastructures import Headers, MutableHeaders
 from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.responses import (
+    JSON_MEDIA_TYPE,
+    compressors,
+    negotiate_encoding,
+    negotiate_media_type,
+    representation_etag,
+    transcode,
+)
 
 
 class ProcessTimeMiddleware(BaseHTTPMiddleware):  # pylint: disable=too-few-public-methods
@@ -17,3 +29,87 @@ class ProcessTimeMiddleware(BaseHTTPMiddleware):  # pylint: disable=too-few-publ
         # port = getattr(getattr(request, "client", None), "port", None)
         response.headers["X-Process-Time"] = f"{process_time:.2f}"
         return response
+
+
+class NegotiationMiddleware:
+    """
+    Answers JSON responses of every route in the format and content coding the client asks for.
+    A body is re-encoded as MessagePack or CBOR when the `Accept` header prefers one, and then
+    compressed with zstd or gzip when it is at least the threshold and the client accepts one,
+    and a strong etag of the route is suffixed with the representation it now tags.
+    Streamed responses, such as the event streams and exports, and bodies that already carry a
+    content coding, such as precompressed static files, go through untouched and unbuffered.
+    """
+
+    def __init__(self, app: ASGIApp, compress_min_bytes: int, gzip_level: int, zstd_level: int):
+        self.app = app
+        self.compress_min_bytes = compress_min_bytes
+        self.codings = compressors(gzip_level, zstd_level)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = Headers(scope=scope)
+        media_type = negotiate_media_type(request_headers.get("accept", ""))
+        coding = negotiate_encoding(request_headers.get("accept-encoding", ""), self.codings)
+        start: Message | None = None
+        chunks: list[bytes] = []
+
+        async def send_negotiated(message: Message) -> None:
+            nonlocal start
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(raw=message["headers"])
+                if headers.get("content-type", "").partition(";")[0].strip() != JSON_MEDIA_TYPE:
+                    await send(message)
+                    return
+                headers.add_vary_header("Accept")
+                headers.add_vary_header("Accept-Encoding")
+                if "content-encoding" in headers or "content-length" not in headers:
+                    await send(message)
+                    return
+                if media_type == JSON_MEDIA_TYPE and coding is None:
+                    await send(message)
+                    return
+                # held back until the whole body is known, its length and type change with it
+                start = message
+                return
+
+            if start is None or message["type"] != "http.response.body":
+                await send(message)
+                return
+            chunks.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+
+            body = b"".join(chunks)
+            if len(body) < self.compress_min_bytes:
+                body, response_type, encoding = self.encode(body, media_type, None)
+            else:
+                # large bodies are encoded off the event loop, it keeps serving other requests meanwhile
+                body, response_type, encoding = await anyio.to_thread.run_sync(self.encode, body, media_type, coding)
+            headers = MutableHeaders(raw=start["headers"])
+            headers["content-type"] = response_type
+            headers["content-length"] = str(len(body))
+            if encoding is not None:
+                headers["content-encoding"] = encoding
+            if "etag" in headers:
+                headers["etag"] = representation_etag(headers["etag"], response_type, encoding)
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_negotiated)
+
+    def encode(self, body: bytes, media_type: str, coding: str | None) -> tuple[bytes, str, str | None]:
+        """Returns the body in the media type with the coding applied, when it pays off."""
+        if len(body) > 0 and media_type != JSON_MEDIA_TYPE:
+            body = transcode(body, media_type)
+        else:
+            media_type = JSON_MEDIA_TYPE
+        if coding is None or len(body) < self.compress_min_bytes:
+            return body, media_type, None
+        compressed = self.codings[coding](body)
+        if len(compressed) >= len(body):
+            return body, media_type, None
+        return compressed, media_type, coding
@@ -50,3 +50,13 @@ class Enabled(SQLModel):
             "server_default": true(),
         },
     )
+
+
+class Version(SQLModel):
+    version: int = SQLField(
+        default=1,
+        nullable=False,
+        sa_column_kwargs={
+            "server_default": "1",
+        },
+    )
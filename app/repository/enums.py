@@ -24,3 +24,27 @@ class MembershipStatus(StrEnum):
     CANCELLED = auto()
     REMOVED = auto()
     EXITED = auto()
+
+
+class SplitPolicy(StrEnum):
+    EQUAL = auto()
+    """amount is divided equally among the active members, no split rows are stored"""
+    CUSTOM = auto()
+
+
+class RecurrenceFrequency(StrEnum):
+    DAILY = auto()
+    WEEKLY = auto()
+    MONTHLY = auto()
+    """on the day of the month of the first occurrence, or the last day of shorter months"""
+    YEARLY = auto()
+
+
+class ChangeKind(StrEnum):
+    """entities whose changes are replayed to clients by the sync endpoint"""
+
+    GROUP = auto()
+    ACCOUNT = auto()
+    EXPENSE = auto()
+    """the splits of an expense are synced with it, changing a split logs its expense"""
+    TASK = auto()
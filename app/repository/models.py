@@ -5,7 +5,7 @@ from fastapi import Depends
 from fastapi.encoders import jsonable_encoder
 from pydantic import EmailStr, HttpUrl, model_validator
 from pydantic_extra_types.currency_code import Currency
-from sqlalchemy import Engine, false
+from sqlalchemy import Engine, Index, LargeBinary, UniqueConstraint, false
 from sqlalchemy.sql.sqltypes import Date, DateTime
 from sqlmodel import (
     AutoString,
@@ -16,9 +16,16 @@ from sqlmodel import (
 )
 
 from app.config.vars import DBVarsDep
-from app.repository.base_models import CreatedAt, Enabled, Id, UpdatedAt
-from app.repository.enums import MembershipStatus, TaskStatus
-from app.repository.types import TypeBalance, TypeId, TypeMobile, TypeMoney
+from app.repository.base_models import CreatedAt, Enabled, Id, UpdatedAt, Version
+from app.repository.enums import (
+    ChangeKind,
+    MembershipStatus,
+    PaymentStatus,
+    RecurrenceFrequency,
+    SplitPolicy,
+    TaskStatus,
+)
+from app.repository.types import TypeBalance, TypeId, TypeMobile, TypeMoney, TypeRate
 
 
 class Account(Id, Enabled, table=True):
@@ -29,12 +36,12 @@ class Account(Id, Enabled, table=True):
     balance: TypeBalance
     membership_status: MembershipStatus = SQLField(default=MembershipStatus.PENDING)
     invited_at: datetime = SQLField(nullable=False, sa_type=DateTime(timezone=True))
-    member_since: datetime | None = SQLField(default=None, nullable=False, sa_type=DateTime(timezone=True))
+    member_since: datetime | None = SQLField(default=None, nullable=True, sa_type=DateTime(timezone=True))
     owner: "User" = Relationship(back_populates="accounts", sa_relationship_kwargs={"foreign_keys": "Account.owner_id"})
     group: "Group" = Relationship(back_populates="accounts")
 
 
-class User(Id, CreatedAt, UpdatedAt, Enabled, table=True):
+class User(Id, CreatedAt, UpdatedAt, Enabled, Version, table=True):
     name: str | None = SQLField(default=None, max_length=72, nullable=True)
     email: EmailStr | None = SQLField(unique=True, index=True, default=None, max_length=255, nullable=True)
     mobile: TypeMobile | None = SQLField(unique=True, index=True, default=None, max_length=30, nullable=True)
@@ -71,7 +78,7 @@ class User(Id, CreatedAt, UpdatedAt, Enabled, table=True):
         return any(group_id == a.group_id for a in self.accounts if a.membership_status == MembershipStatus.ACTIVE)
 
 
-class Group(Id, CreatedAt, Enabled, table=True):
+class Group(Id, CreatedAt, Enabled, Version, table=True):
     name: str = SQLField(min_length=1, max_length=255)
     description: str | None = SQLField(default=None, nullable=True)
     currency: Currency
@@ -92,6 +99,14 @@ class Group(Id, CreatedAt, Enabled, table=True):
 
 
 class Task(Id, CreatedAt, UpdatedAt, table=True):
+    # listings page through the tasks of one assignee or group in deadline order within a status,
+    # the due soon scanner reads the pending tasks by deadline range across every group
+    __table_args__ = (
+        Index("ix_task_assignee_id_status_deadline", "assignee_id", "status", "deadline"),
+        Index("ix_task_group_id_status_deadline", "group_id", "status", "deadline"),
+        Index("ix_task_status_deadline", "status", "deadline"),
+    )
+
     title: str = SQLField(max_length=255)
     description: str | None = SQLField(default=None, nullable=True)
     status: TaskStatus = TaskStatus.PENDING
@@ -111,7 +126,14 @@ class Task(Id, CreatedAt, UpdatedAt, table=True):
     )
 
 
-class Expense(Id, CreatedAt, UpdatedAt, table=True):
+class Expense(Id, CreatedAt, UpdatedAt, Version, table=True):
+    # balance replay walks the ledger of one group in the order it was recorded
+    __table_args__ = (
+        Index("ix_expense_group_id_created_at", "group_id", "created_at"),
+        # an occurrence of a recurring expense is recorded at most once, however often it is retried
+        UniqueConstraint("recurring_id", "occurrence", name="uq_expense_recurring_id_occurrence"),
+    )
+
     title: str = SQLField(max_length=255)
     details: str | None = SQLField(default=None, nullable=True)
     group_id: TypeId = SQLField(foreign_key="group.id")
@@ -119,22 +141,44 @@ class Expense(Id, CreatedAt, UpdatedAt, table=True):
     paid_by: TypeId = SQLField(foreign_key="user.id")
     created_by: TypeId = SQLField(foreign_key="user.id")
     paid_on: date = SQLField(sa_type=Date())
+    # always in the currency of the group, every balance and report is kept in that currency
     amount: TypeMoney
-    splits: list["Split"] = Relationship(back_populates="expense")
+    # set only for expenses paid in another currency, the rate is fixed when the expense is recorded
+    currency: Currency | None = SQLField(default=None, nullable=True)
+    original_amount: TypeMoney | None = SQLField(default=None, nullable=True)
+    exchange_rate: TypeRate | None = SQLField(default=None, nullable=True)
+    split_policy: SplitPolicy = SQLField(default=SplitPolicy.CUSTOM)
+    # number of members an equal split is divided among, only set for equal splits
+    split_count: int | None = SQLField(default=None, nullable=True)
+    splits: list["Split"] = Relationship(
+        back_populates="expense", sa_relationship_kwargs={"cascade": "all, delete-orphan"}
+    )
     images: list["ExpenseImage"] = Relationship(back_populates="expense")
+    # set only for expenses recorded from a recurring expense, numbering its occurrences from 0
+    recurring_id: TypeId | None = SQLField(default=None, nullable=True, foreign_key="recurringexpense.id")
+    occurrence: int | None = SQLField(default=None, nullable=True)
 
 
-class ExpenseImage(Id, table=True):
+class ExpenseImage(Id, CreatedAt, table=True):
     """This is a weak entity and will only exist when there is an expense"""
 
+    # the same receipt is attached to an expense once, however often it is uploaded
+    __table_args__ = (UniqueConstraint("expense_id", "digest", name="uq_expenseimage_expense_id_digest"),)
+
     uploaded_by: TypeId = SQLField(foreign_key="user.id")
-    permalink: HttpUrl = SQLField(sa_type=AutoString)
+    # sha256 of the content, files are stored under it so identical receipts are stored once
+    digest: str = SQLField(max_length=64, index=True)
+    content_type: str = SQLField(max_length=64)
+    size: int
+    # paths under the static mount, the thumbnail is written off the request path after upload
+    permalink: str = SQLField(max_length=255)
+    thumbnail: str | None = SQLField(default=None, max_length=255, nullable=True)
     expense_id: TypeId | None = SQLField(default=None, foreign_key="expense.id", index=True)
     expense: Expense | None = Relationship(back_populates="images")
 
 
 class Split(SQLModel, table=True):
-    """This is a weak entity and will only exist when there is an expense"""
+    """This is a weak entity and will only exist when there is an expense with custom split policy"""
 
     amount: TypeMoney
     user_id: TypeId = SQLField(foreign_key="user.id", primary_key=True)
@@ -142,6 +186,134 @@ class Split(SQLModel, table=True):
     expense: Expense | None = Relationship(back_populates="splits")
 
 
+class RecurringExpense(Id, CreatedAt, UpdatedAt, Enabled, Version, table=True):
+    """Template of an expense that is recorded again on every occurrence of its schedule"""
+
+    # the scheduler loads what is due from the enabled templates ordered by when they are due
+    __table_args__ = (Index("ix_recurringexpense_enabled_next_due", "enabled", "next_due"),)
+
+    group_id: TypeId = SQLField(foreign_key="group.id", index=True)
+    group: Group = Relationship()
+    created_by: TypeId = SQLField(foreign_key="user.id")
+    title: str = SQLField(max_length=255)
+    details: str | None = SQLField(default=None, nullable=True)
+    paid_by: TypeId = SQLField(foreign_key="user.id")
+    # in the currency of the template, every occurrence is converted on the day it falls on
+    amount: TypeMoney
+    currency: Currency | None = SQLField(default=None, nullable=True)
+    split_policy: SplitPolicy = SQLField(default=SplitPolicy.CUSTOM)
+    splits: list["RecurringSplit"] = Relationship(
+        back_populates="recurring", sa_relationship_kwargs={"cascade": "all, delete-orphan"}
+    )
+    frequency: RecurrenceFrequency
+    interval: int = SQLField(default=1, ge=1)
+    starts_on: date = SQLField(sa_type=Date())
+    ends_on: date | None = SQLField(default=None, nullable=True, sa_type=Date())
+    # occurrences recorded so far, which is also the number of the next one
+    occurrences: int = SQLField(default=0)
+    # day of the next occurrence, none once the schedule ended
+    next_due: date | None = SQLField(default=None, nullable=True, sa_type=Date())
+
+
+class RecurringSplit(SQLModel, table=True):
+    """This is a weak entity and will only exist when there is a recurring expense with custom split policy"""
+
+    amount: TypeMoney
+    user_id: TypeId = SQLField(foreign_key="user.id", primary_key=True)
+    recurring_id: TypeId | None = SQLField(default=None, foreign_key="recurringexpense.id", primary_key=True)
+    recurring: RecurringExpense | None = Relationship(back_populates="splits")
+
+
+class Payment(Id, CreatedAt, UpdatedAt, table=True):
+    """Money paid by one member of a group to another to settle their balances"""
+
+    __table_args__ = (Index("ix_payment_group_id_settled_at", "group_id", "settled_at"),)
+
+    group_id: TypeId = SQLField(foreign_key="group.id", index=True)
+    payer_id: TypeId = SQLField(foreign_key="user.id", index=True)
+    payee_id: TypeId = SQLField(foreign_key="user.id", index=True)
+    requested_by: TypeId = SQLField(foreign_key="user.id")
+    amount: TypeMoney
+    status: PaymentStatus = SQLField(default=PaymentStatus.REQUESTED)
+    details: str | None = SQLField(default=None, nullable=True)
+    settled_at: datetime | None = SQLField(default=None, nullable=True, sa_type=DateTime(timezone=True))
+
+
+class BalanceCheckpoint(Id, CreatedAt, table=True):
+    """Balances of every member of a group after all ledger entries up to the watermark"""
+
+    __table_args__ = (Index("ix_balancecheckpoint_group_id_watermark", "group_id", "watermark"),)
+
+    group_id: TypeId = SQLField(foreign_key="group.id")
+    watermark: datetime = SQLField(sa_type=DateTime(timezone=True))
+    balances: list["CheckpointBalance"] = Relationship(
+        back_populates="checkpoint", sa_relationship_kwargs={"cascade": "all, delete-orphan"}
+    )
+
+
+class CheckpointBalance(SQLModel, table=True):
+    """This is a weak entity and will only exist when there is a balance checkpoint"""
+
+    checkpoint_id: TypeId | None = SQLField(default=None, foreign_key="balancecheckpoint.id", primary_key=True)
+    user_id: TypeId = SQLField(foreign_key="user.id", primary_key=True)
+    balance: TypeBalance
+    checkpoint: BalanceCheckpoint | None = Relationship(back_populates="balances")
+
+
+class MonthlySpend(SQLModel, table=True):
+    """What a member paid for and owes in a group per calendar month, maintained on every ledger write"""
+
+    group_id: TypeId = SQLField(foreign_key="group.id", primary_key=True)
+    user_id: TypeId = SQLField(foreign_key="user.id", primary_key=True)
+    # formatted as YYYY-MM so that the rows of a group sort chronologically
+    year_month: str = SQLField(primary_key=True, min_length=7, max_length=7)
+    paid: TypeBalance
+    owed: TypeBalance
+
+
+class Change(SQLModel, table=True):
+    """
+    Append only log of the writes to synced entities, written in the transaction of the write.
+    The sequence only ever grows, so clients replay what changed after the last change they saw.
+    """
+
+    # clients read the changes of their groups in order, compaction finds the older changes per entity
+    __table_args__ = (
+        Index("ix_change_group_id_seq", "group_id", "seq"),
+        Index("ix_change_kind_entity_id_seq", "kind", "entity_id", "seq"),
+    )
+
+    seq: int | None = SQLField(default=None, primary_key=True, sa_column_kwargs={"autoincrement": True})
+    kind: ChangeKind
+    entity_id: TypeId
+    group_id: TypeId = SQLField(foreign_key="group.id")
+    # a tombstone, the entity is gone
+    deleted: bool = SQLField(default=False)
+    logged_at: datetime = SQLField(sa_type=DateTime(timezone=True))
+
+
+class IdempotencyKey(SQLModel, table=True):
+    """
+    The outcome of a write sent with an `Idempotency-Key`, kept so that a retry is answered with
+    the stored response instead of writing again. A key without a status is still being handled.
+    """
+
+    # expired keys are purged in bulk
+    __table_args__ = (Index("ix_idempotencykey_expires_at", "expires_at"),)
+
+    # keys are chosen by clients, so they are only unique per user
+    user_id: TypeId = SQLField(foreign_key="user.id", primary_key=True)
+    key: str = SQLField(primary_key=True, max_length=255)
+    route: str = SQLField(max_length=64)
+    # a retry must send the same request, a key reused for another one is refused
+    request_hash: str = SQLField(max_length=64)
+    status_code: int | None = SQLField(default=None, nullable=True)
+    body: bytes | None = SQLField(default=None, nullable=True, sa_type=LargeBinary)
+    etag: str | None = SQLField(default=None, nullable=True, max_length=64)
+    claimed_at: datetime = SQLField(sa_type=DateTime(timezone=True))
+    expires_at: datetime = SQLField(sa_type=DateTime(timezone=True))
+
+
 def get_engine(db_vars: DBVarsDep):
     engine = create_engine(db_vars.get_database_url(), echo=True)
     return engine
@@ -1,6 +1,9 @@
+from collections.abc import Iterator
+from contextlib import contextmanager
 from typing import Annotated
 
 from fastapi import Depends
+from sqlalchemy import Engine, RootTransaction
 from sqlmodel import Session, SQLModel
 
 from app.config.vars import get_db_vars
@@ -15,7 +18,26 @@ def get_session(engine: EngineDep):
 SessionDep = Annotated[Session, Depends(get_session)]
 
 
+@contextmanager
+def savepoint_session(engine: Engine) -> Iterator[tuple[Session, RootTransaction]]:
+    """
+    A session whose commits only release a savepoint of one enclosing transaction, so handlers
+    that commit can run one after another and still be kept or thrown away together. The caller
+    commits or rolls back the transaction it is handed, otherwise it is rolled back on the way out.
+    """
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        if connection.dialect.name == "sqlite" and not connection.connection.dbapi_connection.in_transaction:  # type: ignore
+            # pysqlite only begins before the first write, releasing a savepoint ahead of it would commit
+            connection.exec_driver_sql("BEGIN")
+        with Session(bind=connection, join_transaction_mode="create_savepoint", expire_on_commit=False) as session:
+            yield session, transaction
+
+
 def create_db_and_tables():
+    # importing the module registers the ddl of the expense search index on the expense table
+    import app.utils.search  # noqa: F401
+
     engine = get_engine(get_db_vars())
     SQLModel.metadata.drop_all(engine)
     SQLModel.metadata.create_all(engine)
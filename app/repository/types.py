@@ -9,6 +9,9 @@ from pydantic_extra_types.phone_numbers import PhoneNumberValidator
 # removed the non negative condition because account balance can also be negative
 TypeBalance = Annotated[Decimal, Field(max_digits=13, decimal_places=4)]
 TypeMoney = Annotated[Decimal, Field(ge=0.0, max_digits=13, decimal_places=4)]
+# amounts that move money between members, a transfer of nothing is not a payment
+TypePositiveMoney = Annotated[Decimal, Field(gt=0.0, max_digits=13, decimal_places=4)]
+TypeRate = Annotated[Decimal, Field(gt=0.0, max_digits=18, decimal_places=8)]
 
 TypeId = uuid.UUID
 TypeMobile = Annotated[str, PhoneNumberValidator(default_region="IN", number_format="INTERNATIONAL")]
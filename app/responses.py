@@ -0,0 +1,99 @@
+import gzip
+from collections.abc import Callable
+from typing import Any
+
+import cbor2
+import msgpack
+import pydantic_core
+
+from app.utils.static import accepted_encodings
+
+try:
+    # zstd is part of the standard library from python 3.14, older interpreters only get gzip
+    from compression import zstd  # type: ignore
+except ImportError:
+    zstd = None
+
+
+JSON_MEDIA_TYPE = "application/json"
+# binary formats a client can ask for instead of JSON, preferred in this order when it accepts several
+BINARY_ENCODERS: dict[str, Callable[[Any], bytes]] = {
+    "application/msgpack": msgpack.packb,
+    "application/x-msgpack": msgpack.packb,
+    "application/cbor": cbor2.dumps,
+}
+
+
+def media_type_weights(accept: str) -> dict[str, float]:
+    weights: dict[str, float] = {}
+    for part in accept.split(","):
+        name, _, params = part.partition(";")
+        weight = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        if name.strip():
+            weights[name.strip().lower()] = weight
+    return weights
+
+
+def negotiate_media_type(accept: str) -> str:
+    """
+    The media type to answer with. A binary format is only chosen when the client names it and
+    does not prefer JSON to it, wildcards always get JSON, and so does a client that accepts
+    nothing we can send, rather than a 406.
+    """
+    if not accept:
+        return JSON_MEDIA_TYPE
+    weights = media_type_weights(accept)
+    best, best_weight = JSON_MEDIA_TYPE, max(weights.get(t, 0.0) for t in (JSON_MEDIA_TYPE, "application/*", "*/*"))
+    for media_type in BINARY_ENCODERS:
+        weight = weights.get(media_type, 0.0)
+        if weight > best_weight or (weight > 0 and weight == best_weight and best == JSON_MEDIA_TYPE):
+            best, best_weight = media_type, weight
+    return best
+
+
+def transcode(body: bytes, media_type: str) -> bytes:
+    """
+    Re-encodes a JSON body in the binary format. The values are the ones the models serialize
+    to in JSON, so every format carries decimals as strings with their exact digits, and ids
+    and dates exactly as a JSON client receives them.
+    """
+    return BINARY_ENCODERS[media_type](pydantic_core.from_json(body))
+
+
+def representation_etag(etag: str, media_type: str, coding: str | None) -> str:
+    """
+    The etag of the body in another format or coding than the JSON the route tagged. A strong
+    etag names exact bytes, so every representation gets a suffix of its own, the same as the
+    precompressed static files. The tag still starts with the version, `If-Match` pins that.
+    """
+    if etag.startswith("W/"):
+        # a weak etag only promises equivalent content, which every representation is
+        return etag
+    suffixes = [] if media_type == JSON_MEDIA_TYPE else [media_type.rpartition("/")[2].removeprefix("x-")]
+    if coding is not None:
+        suffixes.append(coding)
+    if len(suffixes) == 0:
+        return etag
+    tag, suffix = etag.strip('"'), "-".join(suffixes)
+    return f'"{tag}-{suffix}"'
+
+
+def compressors(gzip_level: int, zstd_level: int) -> dict[str, Callable[[bytes], bytes]]:
+    """Content codings applied to large bodies, preferred in this order."""
+    codings: dict[str, Callable[[bytes], bytes]] = {}
+    if zstd is not None:
+        codings["zstd"] = lambda data: zstd.compress(data, level=zstd_level)
+    codings["gzip"] = lambda data: gzip.compress(data, compresslevel=gzip_level, mtime=0)
+    return codings
+
+
+def negotiate_encoding(accept_encoding: str, codings: dict[str, Callable[[bytes], bytes]]) -> str | None:
+    accepted = accepted_encodings(accept_encoding)
+    return next((coding for coding in codings if coding in accepted), None)
@@ -0,0 +1,274 @@
+from abc import abstractmethod
+from dataclasses import dataclass
+from enum import StrEnum
+from typing import Annotated, Any, ClassVar, Literal
+
+import pydantic_core
+from fastapi import APIRouter, BackgroundTasks, Body, Response, status
+from pydantic import Field
+from sqlmodel import Session
+
+from app.config.vars import LedgerVars, LedgerVarsDep
+from app.errors.conf import ErrBase
+from app.errors.error import CodeBatch, ErrBatch
+from app.logger import logger
+from app.repository.models import User
+from app.repository.session import SessionDep, savepoint_session
+from app.repository.types import TypeId
+from app.routes.base_payload import BasePayload
+from app.routes.expense import (
+    ExpensePatch,
+    ExpensePayload,
+    delete_expense,
+    patch_expense,
+    record_expense,
+    update_expense,
+)
+from app.routes.group import InviteUser, record_invitation
+from app.routes.invitation import accept_invitation, cancel_invitation, decline_invitation
+from app.routes.security import CurrentUserDep
+from app.utils.currency import RateTable, RateTableDep
+from app.utils.events import EventHub, EventHubDep
+
+batch_router = APIRouter(tags=["batch"])
+
+MAX_BATCH_OPERATIONS = 100
+
+
+@dataclass(frozen=True)
+class BatchContext:
+    """What every operation of a batch shares, the user is loaded once by the session of the batch."""
+
+    session: Session
+    current_user: User
+    background_tasks: BackgroundTasks
+    ledger_vars: LedgerVars
+    rate_table: RateTable
+    events: EventHub
+
+
+class Operation(BasePayload):
+    status_code: ClassVar[int] = status.HTTP_200_OK
+
+    @abstractmethod
+    def run(self, batch: BatchContext, response: Response) -> Any:
+        """Calls the handler of the route the operation stands for, with the session of the batch."""
+
+
+class CreateExpenseOperation(Operation):
+    status_code = status.HTTP_201_CREATED
+    op: Literal["create_expense"]
+    body: ExpensePayload
+
+    def run(self, batch: BatchContext, response: Response) -> Any:
+        return record_expense(
+            payload=self.body,
+            current_user=batch.current_user,
+            session=batch.session,
+            background_tasks=batch.background_tasks,
+            ledger_vars=batch.ledger_vars,
+            rate_table=batch.rate_table,
+            response=response,
+            events=batch.events,
+        )
+
+
+class UpdateExpenseOperation(Operation):
+    op: Literal["update_expense"]
+    expense_id: TypeId
+    body: ExpensePayload
+    if_match: str | None = None
+
+    def run(self, batch: BatchContext, response: Response) -> Any:
+        return update_expense(
+            expense_id=self.expense_id,
+            payload=self.body,
+            current_user=batch.current_user,
+            session=batch.session,
+            rate_table=batch.rate_table,
+            response=response,
+            events=batch.events,
+            if_match=self.if_match,
+        )
+
+
+class PatchExpenseOperation(Operation):
+    op: Literal["patch_expense"]
+    expense_id: TypeId
+    body: ExpensePatch
+    if_match: str | None = None
+
+    def run(self, batch: BatchContext, response: Response) -> Any:
+        return patch_expense(
+            expense_id=self.expense_id,
+            payload=self.body,
+            current_user=batch.current_user,
+            session=batch.session,
+            response=response,
+            events=batch.events,
+            if_match=self.if_match,
+        )
+
+
+class DeleteExpenseOperation(Operation):
+    status_code = status.HTTP_204_NO_CONTENT
+    op: Literal["delete_expense"]
+    expense_id: TypeId
+    if_match: str | None = None
+
+    def run(self, batch: BatchContext, response: Response) -> Any:
+        return delete_expense(
+            expense_id=self.expense_id,
+            current_user=batch.current_user,
+            session=batch.session,
+            events=batch.events,
+            if_match=self.if_match,
+        )
+
+
+class InviteUserOperation(Operation):
+    op: Literal["invite_user"]
+    body: InviteUser
+
+    def run(self, batch: BatchContext, response: Response) -> Any:
+        return record_invitation(
+            invitation=self.body, current_user=batch.current_user, session=batch.session, events=batch.events
+        )
+
+
+class AcceptInvitationOperation(Operation):
+    op: Literal["accept_invitation"]
+    invitation_id: TypeId
+
+    def run(self, batch: BatchContext, response: Response) -> Any:
+        return accept_invitation(self.invitation_id, batch.current_user, batch.session, batch.events)
+
+
+class DeclineInvitationOperation(Operation):
+    op: Literal["decline_invitation"]
+    invitation_id: TypeId
+
+    def run(self, batch: BatchContext, response: Response) -> Any:
+        return decline_invitation(self.invitation_id, batch.current_user, batch.session, batch.events)
+
+
+class CancelInvitationOperation(Operation):
+    op: Literal["cancel_invitation"]
+    invitation_id: TypeId
+
+    def run(self, batch: BatchContext, response: Response) -> Any:
+        return cancel_invitation(self.invitation_id, batch.current_user, batch.session, batch.events)
+
+
+AnyOperation = Annotated[
+    CreateExpenseOperation
+    | UpdateExpenseOperation
+    | PatchExpenseOperation
+    | DeleteExpenseOperation
+    | InviteUserOperation
+    | AcceptInvitationOperation
+    | DeclineInvitationOperation
+    | CancelInvitationOperation,
+    Field(discriminator="op"),
+]
+
+
+class BatchMode(StrEnum):
+    # the first failure rolls every operation back, nothing of the batch is kept
+    ATOMIC = "atomic"
+    # a failed operation is rolled back on its own, the others are kept
+    INDEPENDENT = "independent"
+
+
+class BatchPayload(BasePayload):
+    mode: BatchMode = BatchMode.ATOMIC
+    operations: list[AnyOperation] = Field(min_length=1, max_length=MAX_BATCH_OPERATIONS)
+
+
+class OperationResult(BasePayload):
+    # the status and body the operation would have answered with on its own
+    status: int
+    body: Any = None
+    headers: dict[str, str] = {}
+
+
+class BatchResult(BasePayload):
+    # false when an atomic batch failed and nothing of it was written
+    committed: bool
+    results: list[OperationResult]
+
+
+def error_result(exc: ErrBase[Any]) -> OperationResult:
+    body = {"code": exc.code} if exc.detail is None else {"code": exc.code, "detail": exc.detail}
+    return OperationResult(
+        status=exc.status, body=pydantic_core.to_jsonable_python(body), headers=dict(exc.headers.items())
+    )
+
+
+def run_operation(batch: BatchContext, operation: Operation) -> OperationResult:
+    response = Response()
+    try:
+        result = operation.run(batch, response)
+    except ErrBase as exc:
+        # throws away the savepoint of this operation only, and whatever it loaded
+        batch.session.rollback()
+        return error_result(exc)
+    except Exception:  # noqa: BLE001
+        # an unexpected failure fails the operation like it would fail its own request, not the batch,
+        # it is logged with its traceback and the client gets the 500 it would have got on its own
+        batch.session.rollback()
+        logger.exception("%s operation of a batch failed", type(operation).__name__)
+        return error_result(ErrBatch(code=CodeBatch.OPERATION_FAILED, status=status.HTTP_500_INTERNAL_SERVER_ERROR))
+    etag = response.headers.get("etag")
+    return OperationResult(
+        status=operation.status_code,
+        body=pydantic_core.to_jsonable_python(result, by_alias=True),
+        headers={"ETag": etag} if etag is not None else {},
+    )
+
+
+@batch_router.post("", response_model=BatchResult)
+def run_batch(
+    payload: Annotated[BatchPayload, Body()],
+    current_user: CurrentUserDep,
+    session: SessionDep,
+    background_tasks: BackgroundTasks,
+    ledger_vars: LedgerVarsDep,
+    rate_table: RateTableDep,
+    events: EventHubDep,
+):
+    """
+    Runs the operations in order through the same handlers as their own routes, in one
+    transaction on one connection, and answers with what each of them would have answered.
+    The user is authenticated once and its memberships loaded once for the whole batch, and
+    every operation commits to a savepoint, so an atomic batch keeps all of them or none.
+    Events are published once the batch commits, a rolled back batch announces nothing.
+    """
+    with savepoint_session(session.get_bind().engine) as (batch_session, transaction):
+        batch = BatchContext(
+            session=batch_session,
+            current_user=batch_session.get_one(User, current_user.id),
+            background_tasks=background_tasks,
+            # the coalescer records expenses in transactions of its own, outside of the batch
+            ledger_vars=ledger_vars.model_copy(update={"coalesce_window_ms": 0}),
+            rate_table=rate_table,
+            events=events,
+        )
+        results: list[OperationResult] = []
+        with events.deferred() as pending:
+            for operation in payload.operations:
+                result = run_operation(batch, operation)
+                results.append(result)
+                if result.status >= 400 and payload.mode == BatchMode.ATOMIC:
+                    break
+
+            failed = next((i for i, r in enumerate(results) if r.status >= 400), None)
+            if failed is not None and payload.mode == BatchMode.ATOMIC:
+                transaction.rollback()
+                pending.clear()
+                not_applied = error_result(ErrBatch(code=CodeBatch.NOT_APPLIED))
+                results = [results[i] if i == failed else not_applied for i in range(len(payload.operations))]
+                return BatchResult(committed=False, results=results)
+            transaction.commit()
+    events.flush(pending)
+    return BatchResult(committed=True, results=results)
@@ -1,16 +1,64 @@
 import math
 from datetime import date
-from typing import Annotated
-
-from fastapi import APIRouter, Body, status
-
-from app.errors.error import CodeItemNotFound, ErrItemNotFound
-from app.repository.enums import MembershipStatus
-from app.repository.models import Account, Expense, Group, Split
+from typing import Annotated, Any
+
+from fastapi import APIRouter, BackgroundTasks, Body, Header, Query, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+from pydantic_extra_types.currency_code import Currency
+from sqlalchemy import func
+from sqlmodel import col, delete, select
+
+from app.config.vars import LedgerVarsDep
+from app.errors.error import (
+    CodeExpense,
+    CodeGroupAuth,
+    CodeItemNotFound,
+    ErrExpense,
+    ErrGroupAuth,
+    ErrItemNotFound,
+)
+from app.repository.enums import ChangeKind, MembershipStatus, SplitPolicy
+from app.repository.models import Account, Expense, ExpenseImage, Group, Split
 from app.repository.session import SessionDep
-from app.repository.types import TypeId, TypeMoney, id_to_str
+from app.repository.types import TypeId, TypeMoney, TypeRate, id_to_str
 from app.routes.base_payload import BasePayload
 from app.routes.security import CurrentUserDep
+from app.utils.changelog import log_changes
+from app.utils.checkpoint import invalidate_checkpoints, schedule_checkpoint
+from app.utils.coalescer import expense_coalescer
+from app.utils.currency import RateTable, RateTableDep, convert_amount, convert_shares
+from app.utils.events import EventHubDep
+from app.utils.idempotency import IdempotencyKeyHeader, IdempotencyStoreDep
+from app.utils.ledger import (
+    apply_balance_deltas,
+    equal_shares,
+    expense_balance_deltas,
+    expense_shares,
+    merge_deltas,
+    negate_deltas,
+    split_roster,
+)
+from app.utils.posting import post_expenses
+from app.utils.receipts import ReceiptStoreDep, StoredReceipt, ThumbnailerDep
+from app.utils.rollup import (
+    RollupDeltas,
+    apply_rollup_deltas,
+    expense_rollup_deltas,
+    merge_rollup_deltas,
+    month_deltas,
+    negate_rollup_deltas,
+    year_month,
+)
+from app.utils.search import SearchCursor, index_expenses, search_backend, search_terms, unindex_expenses
+from app.utils.versioning import (
+    VersionConflictError,
+    check_pinned_version,
+    guarded_update,
+    parse_if_match,
+    precondition_failed,
+    retry_on_conflict,
+    version_etag,
+)
 
 
 class SplitPayload(BasePayload):
@@ -25,111 +73,368 @@ class ExpensePayload(BasePayload):
     details: str | None = None
     paid_on: date
     amount: TypeMoney
+    # the currency the amount and the splits are in, the currency of the group when not given
+    currency: Currency | None = None
+    split_policy: SplitPolicy = SplitPolicy.CUSTOM
+    # only custom splits carry one entry per member, equal splits are derived from the group
+    splits: list[SplitPayload] = []
+
+
+class ExpensePatch(BasePayload):
+    title: str | None = None
+    paid_by: TypeId | None = None
+    details: str | None = None
+    paid_on: date | None = None
+    # in the currency the expense was recorded in, converted with the rate it was recorded with
+    amount: TypeMoney | None = None
+    # only the splits of members whose share changed, not the whole split
+    splits: list[SplitPayload] | None = None
+
+
+class ExpenseDetail(BasePayload):
+    id: TypeId
+    title: str
+    paid_by: TypeId
+    group_id: TypeId
+    created_by: TypeId
+    details: str | None
+    paid_on: date
+    amount: TypeMoney
+    currency: Currency | None
+    original_amount: TypeMoney | None
+    exchange_rate: TypeRate | None
+    split_policy: SplitPolicy
     splits: list[SplitPayload]
 
 
 expense_router = APIRouter(tags=["expenses"])
 
+IfMatchHeader = Annotated[str | None, Header(description="ETag of the version the change is based on")]
+
+# fields whose new value does not depend on the rest of the expense, setting them
+# commutes with any concurrent change to other fields
+COMMUTATIVE_FIELDS = frozenset({"title", "details", "paid_on"})
+
 
 def validate_active_group_members_have_split_entry(group: Group, payload: ExpensePayload):
     group_users = [id_to_str(a.owner_id) for a in group.accounts if a.membership_status == MembershipStatus.ACTIVE]
     if len(group_users) != len(set(group_users)):
         # same user with active status exists multiple time in DB
-        raise
+        raise RuntimeError("multiple active accounts exist for the same user in one group")
+
+    if payload.split_policy == SplitPolicy.EQUAL:
+        if len(payload.splits) != 0:
+            # equal splits are derived from the group, explicit entries would be ignored
+            raise ErrExpense(code=CodeExpense.UNEXPECTED_SPLITS, detail="equal split must not contain splits")
+        return
 
     payload_users = [id_to_str(split.user_id) for split in payload.splits]
     if len(payload_users) != len(set(payload_users)):
         # duplicate entries for one user exist
-        raise
+        raise ErrExpense(code=CodeExpense.DUPLICATE_SPLIT_USER)
 
     if set(group_users) != set(payload_users):
         # users in payload does not belong to the group
-        raise
+        raise ErrExpense(code=CodeExpense.SPLIT_USERS_MISMATCH, detail="every active member needs a split")
 
 
 def validate_expense_amount_matches_split_total(payload: ExpensePayload):
+    if payload.split_policy == SplitPolicy.EQUAL:
+        # equal shares always add up to the amount by construction
+        return
+
     split_sum = sum(s.amount for s in payload.splits)
     if not math.isclose(payload.amount, split_sum, rel_tol=1e-4):
         # sum of split is not equal to the total amount
-        raise
+        raise ErrExpense(code=CodeExpense.SPLIT_TOTAL_MISMATCH)
 
 
 def validate_expense_can_be_added_for_account(account: Account, group: Group):
     if not account.enabled:
-        raise
+        raise ErrExpense(code=CodeExpense.PAYER_NOT_MEMBER, detail="account of the payer is disabled")
 
     if not account.owner.is_active_member_of(group.id):
-        raise
+        raise ErrExpense(code=CodeExpense.PAYER_NOT_MEMBER)
+
+
+def get_active_account_map(group: Group) -> dict[TypeId, Account]:
+    return {a.owner_id: a for a in group.accounts if a.membership_status == MembershipStatus.ACTIVE}
+
+
+def to_group_currency(
+    payload: ExpensePayload, group: Group, rate_table: RateTable
+) -> tuple[ExpensePayload, TypeRate | None]:
+    """
+    Returns the payload with the amount and the splits converted into the currency of the group
+    at the rate of the day it was paid on, together with that rate. The ledger never holds any
+    other currency, so balances, rollups and checkpoints stay sums of plain amounts.
+    """
+    if payload.currency is None or payload.currency == group.currency:
+        return payload, None
+
+    rate = rate_table.cross_rate(payload.currency, group.currency, payload.paid_on)
+    shares = convert_shares(payload.amount, {s.user_id: s.amount for s in payload.splits}, rate)
+    converted = payload.model_copy(
+        update={
+            "amount": convert_amount(payload.amount, rate),
+            "splits": [SplitPayload(user_id=user_id, amount=share) for user_id, share in shares.items()],
+        }
+    )
+    return converted, rate
 
 
-# ─────────────────────────────────────────────────────────────
-# CREATE EXPENSE
-# ─────────────────────────────────────────────────────────────
+def record_original_currency(expense: Expense, payload: ExpensePayload, rate: TypeRate | None):
+    expense.currency = payload.currency if rate is not None else None
+    expense.original_amount = payload.amount if rate is not None else None
+    expense.exchange_rate = rate
 
 
-@expense_router.post("", status_code=status.HTTP_201_CREATED)
-def create_expense(
-    payload: Annotated[ExpensePayload, Body()],
-    current_user: CurrentUserDep,
-    session: SessionDep,
-):
-    group = session.get(Group, payload.group_id)
-    if group is None:
-        raise ErrItemNotFound(code=CodeItemNotFound.GROUP_NOT_FOUND)
+def apply_split_payload(expense: Expense, payload: ExpensePayload, roster: list[TypeId]):
+    """Stores the split of the payload on the expense, only custom splits are kept as rows."""
+    expense.split_policy = SplitPolicy(payload.split_policy)
 
-    if not current_user.is_active_member_of(group.id):
-        # only a member of a group can add expense in the group
-        raise
+    if expense.split_policy == SplitPolicy.EQUAL:
+        expense.split_count = len(roster)
+        expense.splits.clear()
+        return
 
+    expense.split_count = None
+    split_map = {s.user_id: s for s in expense.splits}
+    splits: list[Split] = []
+    for ps in payload.splits:
+        # reuse the existing row of a member, rows missing from the payload are orphaned and deleted
+        s = split_map.get(ps.user_id) or Split(user_id=ps.user_id, amount=ps.amount)
+        s.amount = ps.amount
+        splits.append(s)
+    expense.splits = splits
+
+
+def validate_new_expense(group: Group, payload: ExpensePayload):
     validate_active_group_members_have_split_entry(group, payload)
     validate_expense_amount_matches_split_total(payload)
 
-    ac_map = {id_to_str(ac.id): ac for ac in group.accounts}
+    ac_map = get_active_account_map(group)
 
-    # add the balance to the user who actually paid
-    paid_by_ac = ac_map.get(id_to_str(payload.paid_by))
+    # the user who actually paid needs an active account in the group
+    paid_by_ac = ac_map.get(payload.paid_by)
     if paid_by_ac is None:
-        raise
+        raise ErrExpense(code=CodeExpense.PAYER_NOT_MEMBER)
 
     validate_expense_can_be_added_for_account(paid_by_ac, group)
 
-    paid_by_ac.balance += payload.amount
-    session.add(paid_by_ac)
 
+def new_expense(
+    group: Group, payload: ExpensePayload, created_by: TypeId, rate_table: RateTable, roster: list[TypeId]
+) -> Expense:
+    """Validates the payload against the group and builds the expense it describes, in the currency of the group."""
+    validate_new_expense(group, payload)
+    converted, rate = to_group_currency(payload, group, rate_table)
     expense = Expense(
         title=payload.title,
         details=payload.details,
         group_id=payload.group_id,
         group=group,
         paid_by=payload.paid_by,
-        created_by=current_user.id,
-        amount=payload.amount,
+        created_by=created_by,
+        amount=converted.amount,
         paid_on=payload.paid_on,
         splits=[],
         images=[],
     )
+    record_original_currency(expense, payload, rate)
+    apply_split_payload(expense, converted, roster)
+    return expense
 
-    for ps in payload.splits:
-        # create a split to show in the group
-        s = Split(user_id=ps.user_id, amount=ps.amount)
-        expense.splits.append(s)
-
-        # update the balance for this account
-        ac = ac_map.get(id_to_str(ps.user_id))
-        if ac is None:
-            # this is impossible condition as previously we have checked all users in the group
-            # are in the expense and this map contains mapping for all users in the group. this
-            # is to satisfy pylance because it thinks map might not have the key
-            raise
-        ac.balance -= ps.amount
-
-        session.add(s)
-        session.add(ac)
 
-    session.add(expense)
-    session.commit()
-    session.refresh(expense)
+# ─────────────────────────────────────────────────────────────
+# SEARCH
+# ─────────────────────────────────────────────────────────────
+
+
+class ExpenseSearchHit(BasePayload):
+    id: TypeId
+    title: str
+    details: str | None
+    paid_by: TypeId
+    paid_on: date
+    amount: TypeMoney
+    score: float
+
+
+class ExpenseSearchPage(BasePayload):
+    hits: list[ExpenseSearchHit]
+    # pass it back as `cursor` for the next page, none once there are no more hits
+    next_cursor: str | None
+
+
+# declared before /{expense_id} so that "search" is never parsed as an expense id
+@expense_router.get("/search", response_model=ExpenseSearchPage)
+def search_expenses(
+    group_id: TypeId,
+    q: Annotated[str, Query(min_length=1, max_length=200, description="words the title or details contain")],
+    current_user: CurrentUserDep,
+    session: SessionDep,
+    limit: Annotated[int, Query(ge=1, le=100)] = 20,
+    cursor: Annotated[str | None, Query(description="next_cursor of the previous page")] = None,
+):
+    """
+    Ranks the expenses of the group by how well their title and details match every word of
+    the query, the last word also matching as a prefix. Pages continue after the last hit of
+    the previous page instead of skipping an offset, so deep pages cost the same as the first.
+    """
+    if not current_user.is_active_member_of(group_id):
+        raise ErrGroupAuth(code=CodeGroupAuth.FORBIDDEN_NOT_MEMBER)
+
+    terms = search_terms(q)
+    if len(terms) == 0:
+        return ExpenseSearchPage(hits=[], next_cursor=None)
+
+    after = SearchCursor.decode(cursor) if cursor is not None else None
+    # one hit more than the page tells whether another page follows
+    hits = search_backend(session).search(session, group_id, terms, limit + 1, after)
+    page = hits[:limit]
+
+    expenses = session.exec(select(Expense).where(col(Expense.id).in_([h.expense_id for h in page]))).all()
+    expense_map = {e.id: e for e in expenses}
+    next_cursor = None
+    if len(hits) > limit:
+        next_cursor = SearchCursor(score=page[-1].score, expense_id=page[-1].expense_id).encode()
+
+    return ExpenseSearchPage(
+        hits=[
+            ExpenseSearchHit(
+                id=e.id,
+                title=e.title,
+                details=e.details,
+                paid_by=e.paid_by,
+                paid_on=e.paid_on,
+                amount=e.amount,
+                score=h.score,
+            )
+            for h in page
+            if (e := expense_map.get(h.expense_id)) is not None
+        ],
+        next_cursor=next_cursor,
+    )
+
+
+# ─────────────────────────────────────────────────────────────
+# GET EXPENSE
+# ─────────────────────────────────────────────────────────────
+
+
+def get_expense_for_member(session: SessionDep, expense_id: TypeId, current_user: CurrentUserDep) -> Expense:
+    expense = session.get(Expense, expense_id)
+    if expense is None:
+        raise ErrItemNotFound(code=CodeItemNotFound.EXPENSE_NOT_FOUND)
+
+    if not current_user.is_active_member_of(expense.group_id):
+        raise ErrGroupAuth(code=CodeGroupAuth.FORBIDDEN_NOT_MEMBER)
+    return expense
+
+
+@expense_router.get("/{expense_id}", response_model=ExpenseDetail)
+def get_expense(expense_id: TypeId, current_user: CurrentUserDep, session: SessionDep, response: Response):
+    expense = get_expense_for_member(session, expense_id, current_user)
+
+    # equal splits are not stored per member, expand them from the group roster
+    shares = expense_shares(expense, split_roster(expense.group.accounts))
+    response.headers["ETag"] = version_etag(expense.version)
+    return ExpenseDetail(
+        id=expense.id,
+        title=expense.title,
+        paid_by=expense.paid_by,
+        group_id=expense.group_id,
+        created_by=expense.created_by,
+        details=expense.details,
+        paid_on=expense.paid_on,
+        amount=expense.amount,
+        currency=expense.currency,
+        original_amount=expense.original_amount,
+        exchange_rate=expense.exchange_rate,
+        split_policy=expense.split_policy,
+        splits=[SplitPayload(user_id=user_id, amount=amount) for user_id, amount in shares.items()],
+    )
+
+
+# ─────────────────────────────────────────────────────────────
+# CREATE EXPENSE
+# ─────────────────────────────────────────────────────────────
+
+
+@expense_router.post("", response_model=Expense, status_code=status.HTTP_201_CREATED)
+def create_expense(
+    payload: Annotated[ExpensePayload, Body()],
+    current_user: CurrentUserDep,
+    session: SessionDep,
+    background_tasks: BackgroundTasks,
+    ledger_vars: LedgerVarsDep,
+    rate_table: RateTableDep,
+    response: Response,
+    events: EventHubDep,
+    idempotency: IdempotencyStoreDep,
+    idempotency_key: IdempotencyKeyHeader = None,
+):
+    """A retry sent with the same `Idempotency-Key` records nothing and gets the response of the original."""
+    if idempotency_key is not None:
+        # the expense commits together with the response stored for the key, the coalescer commits on its own
+        ledger_vars = ledger_vars.model_copy(update={"coalesce_window_ms": 0})
+    return idempotency.run(
+        session,
+        current_user.id,
+        idempotency_key,
+        "create_expense",
+        payload,
+        status.HTTP_201_CREATED,
+        response,
+        events,
+        lambda s: record_expense(payload, current_user, s, background_tasks, ledger_vars, rate_table, response, events),
+    )
+
+
+def record_expense(
+    payload: ExpensePayload,
+    current_user: CurrentUserDep,
+    session: SessionDep,
+    background_tasks: BackgroundTasks,
+    ledger_vars: LedgerVarsDep,
+    rate_table: RateTableDep,
+    response: Response,
+    events: EventHubDep,
+) -> Expense:
+    group = session.get(Group, payload.group_id)
+    if group is None:
+        raise ErrItemNotFound(code=CodeItemNotFound.GROUP_NOT_FOUND)
 
+    if not current_user.is_active_member_of(group.id):
+        # only a member of a group can add expense in the group
+        raise ErrGroupAuth(code=CodeGroupAuth.FORBIDDEN_NOT_MEMBER)
+
+    if ledger_vars.coalesce_window_ms > 0:
+        group_id, user_id = group.id, current_user.id
+        # ends the read only transaction, the connection goes back to the pool while the batch
+        # is applied, otherwise every waiting request holds one and the leader starves for its own
+        session.commit()
+        # validated and recorded by the batch, against the group as its transaction sees it
+        future = expense_coalescer.submit(
+            session.get_bind(),
+            group_id,
+            lambda s, g, roster: new_expense(g, payload, user_id, rate_table, roster),
+            ledger_vars.coalesce_window_ms / 1000,
+            ledger_vars.coalesce_max_batch,
+        )
+        expense = session.get_one(Expense, future.result())
+    else:
+        roster = split_roster(group.accounts)
+        expense = new_expense(group, payload, current_user.id, rate_table, roster)
+        post_expenses(session, group.id, [expense], roster)
+
+        session.commit()
+        session.refresh(expense)
+
+    events.publish(expense.group_id, "expense.created", {"id": expense.id, "by": current_user.id})
+    schedule_checkpoint(session, background_tasks, group.id, ledger_vars)
+    response.headers["ETag"] = version_etag(expense.version)
     return expense
 
 
@@ -138,40 +443,45 @@ def create_expense(
 # ─────────────────────────────────────────────────────────────
 
 
-@expense_router.put("/{expense_id}")
+@expense_router.put("/{expense_id}", response_model=Expense)
 def update_expense(
     expense_id: TypeId,
     payload: Annotated[ExpensePayload, Body()],
     current_user: CurrentUserDep,
     session: SessionDep,
+    rate_table: RateTableDep,
+    response: Response,
+    events: EventHubDep,
+    if_match: IfMatchHeader = None,
 ):
+    pinned_version = parse_if_match(if_match)
+
     expense = session.get(Expense, expense_id)
     if not expense:
-        raise
+        raise ErrItemNotFound(code=CodeItemNotFound.EXPENSE_NOT_FOUND)
+
+    version = expense.version
+    try:
+        check_pinned_version(pinned_version, version)
+    except VersionConflictError as exc:
+        raise precondition_failed(exc) from exc
 
     if expense.group_id != payload.group_id:
         # ensure the expense id belongs to the same group
-        raise
+        raise ErrExpense(code=CodeExpense.GROUP_MISMATCH)
 
     if not current_user.is_active_member_of(expense.group_id):
-        # only if
-        raise
+        # only current members of the group can update an expense
+        raise ErrGroupAuth(code=CodeGroupAuth.FORBIDDEN_NOT_MEMBER)
 
     validate_active_group_members_have_split_entry(expense.group, payload)
     validate_expense_amount_matches_split_total(payload)
 
-    expense.title = payload.title
-    expense.details = payload.details
-    expense.paid_on = payload.paid_on
-
-    # revert back old split amounts and add new split amounts
-
-    ac_map = {id_to_str(ac.id): ac for ac in expense.group.accounts}
-    split_map = {id_to_str(split.user_id): split for split in expense.splits}
+    ac_map = get_active_account_map(expense.group)
 
     # add the balance to the user who actually paid
-    new_paid_by_ac = ac_map.get(id_to_str(payload.paid_by))
-    old_paid_by_ac = ac_map.get(id_to_str(expense.paid_by))
+    new_paid_by_ac = ac_map.get(payload.paid_by)
+    old_paid_by_ac = ac_map.get(expense.paid_by)
 
     if old_paid_by_ac is None:
         # this branch should never be triggered as old account should exist
@@ -179,73 +489,321 @@ def update_expense(
         # But what is someone has left the group and their balance is settled and then
         # someone tries to update the balance and makes his account balance positive?
         # Possible Solution - check whether paid_by account is active atleast.
-        raise
+        raise ErrExpense(code=CodeExpense.PAYER_NOT_MEMBER, detail="previous payer is not a member anymore")
 
     if new_paid_by_ac is None:
         # ensure the account who paid exists in the group
-        raise
+        raise ErrExpense(code=CodeExpense.PAYER_NOT_MEMBER)
 
     validate_expense_can_be_added_for_account(new_paid_by_ac, expense.group)
     validate_expense_can_be_added_for_account(old_paid_by_ac, expense.group)
 
-    old_paid_by_ac.balance -= expense.amount
-    new_paid_by_ac.balance += payload.amount
+    # revert the old form of the expense and apply the new one, both the old and
+    # the new split can be either equal or custom, so go through the deltas
+    roster = split_roster(expense.group.accounts)
+    old_deltas = expense_balance_deltas(expense, roster)
+    old_rollup = expense_rollup_deltas(expense, roster)
 
-    expense.amount = payload.amount
-    expense.paid_by = payload.paid_by
+    # a full replacement records the rate again, the day or the currency may have changed
+    converted, rate = to_group_currency(payload, expense.group, rate_table)
 
-    session.add(old_paid_by_ac)
-    session.add(new_paid_by_ac)
+    expense.title = payload.title
+    expense.details = payload.details
+    expense.paid_on = payload.paid_on
+    expense.amount = converted.amount
+    expense.paid_by = payload.paid_by
+    record_original_currency(expense, payload, rate)
+    apply_split_payload(expense, converted, roster)
 
-    for ps in payload.splits:
-        # create a split to show in the group
-        s = split_map.get(id_to_str(ps.user_id))
-        assert s is not None
+    new_deltas = expense_balance_deltas(expense, roster)
+    new_rollup = expense_rollup_deltas(expense, roster)
+    session.add(expense)
 
-        # update the balance for this account
-        ac = ac_map.get(id_to_str(ps.user_id))
-        assert ac is not None
+    try:
+        # a full replacement never commutes with a concurrent change, the loser gets a 412
+        guarded_update(session, Expense, expense.id, version, {})
+    except VersionConflictError as exc:
+        session.rollback()
+        raise precondition_failed(exc) from exc
 
-        ac.balance += s.amount
-        ac.balance -= ps.amount
-        s.amount = ps.amount
+    apply_balance_deltas(session, expense.group_id, merge_deltas(negate_deltas(old_deltas), new_deltas))
+    apply_rollup_deltas(session, expense.group_id, merge_rollup_deltas(negate_rollup_deltas(old_rollup), new_rollup))
+    index_expenses(session, [expense.id])
 
-        session.add(s)
-        session.add(ac)
+    # balances recorded after this expense are different now
+    invalidate_checkpoints(session, expense.group_id, expense.created_at)
+    log_changes(session, ChangeKind.EXPENSE, expense.group_id, [expense.id])
 
-    session.add(expense)
     session.commit()
     session.refresh(expense)
+    events.publish(expense.group_id, "expense.updated", {"id": expense.id, "by": current_user.id})
 
+    response.headers["ETag"] = version_etag(expense.version)
     return expense
 
 
 # ─────────────────────────────────────────────────────────────
-# ADD IMAGE
+# PATCH EXPENSE
 # ─────────────────────────────────────────────────────────────
 
-# @expense_router.post("/{expense_id}/images")
-# def add_expense_image(
-#     expense_id: str,
-#     permalink: str = Body(...),
-#     current_user: CurrentUserDep,
-#     session: SessionDep,
-# ):
-#     expense = session.exec(select(Expense).where(Expense.id == expense_id)).one_or_none()
-#     if not expense:
-#         raise HTTPException(404, "Expense not found")
 
-#     ensure_user_in_group(current_user, expense.group_id)
+def validate_active_members(session: SessionDep, group_id: TypeId, user_ids: set[TypeId]):
+    """Checks with a single indexed lookup that every user has an enabled active account in the group."""
+    stmt = select(Account.owner_id).where(
+        col(Account.group_id) == group_id,
+        col(Account.owner_id).in_(user_ids),
+        col(Account.membership_status) == MembershipStatus.ACTIVE,
+        col(Account.enabled),
+    )
+    if set(session.exec(stmt).all()) != user_ids:
+        raise ErrExpense(code=CodeExpense.SPLIT_USERS_MISMATCH, detail="users must be active members of the group")
+
+
+def patch_custom_splits(
+    session: SessionDep, expense: Expense, patches: list[SplitPayload], amount: TypeMoney, rate: TypeRate | None
+) -> dict[TypeId, TypeMoney]:
+    """
+    Writes only the split rows named in the patch and returns how the share of each of
+    those members changed. The total of the untouched splits comes from one aggregate.
+    The shares of a foreign expense are converted with its rate so that, together with
+    the untouched splits, they add up to the converted amount exactly.
+    """
+    patch_map = {ps.user_id: ps.amount for ps in patches}
+    if len(patch_map) != len(patches):
+        raise ErrExpense(code=CodeExpense.DUPLICATE_SPLIT_USER)
+
+    split_total = session.exec(select(func.sum(Split.amount)).where(col(Split.expense_id) == expense.id)).one()
+    stmt = select(Split).where(col(Split.expense_id) == expense.id, col(Split.user_id).in_(patch_map.keys()))
+    split_map = {s.user_id: s for s in session.exec(stmt).all()}
+
+    untouched_total = (split_total or 0) - sum(s.amount for s in split_map.values())
+    if rate is not None:
+        patch_map = convert_shares(sum(patch_map.values()), patch_map, rate, total=amount - untouched_total)
+    new_total = untouched_total + sum(patch_map.values())
+    if not math.isclose(amount, new_total, rel_tol=1e-4):
+        raise ErrExpense(code=CodeExpense.SPLIT_TOTAL_MISMATCH)
+
+    share_deltas: dict[TypeId, TypeMoney] = {}
+    for user_id, share in patch_map.items():
+        split = split_map.get(user_id)
+        if split is None:
+            # a member who joined after the expense was recorded gets a share now
+            split = Split(user_id=user_id, expense_id=expense.id, amount=share)
+            share_deltas[user_id] = share
+        else:
+            share_deltas[user_id] = share - split.amount
+            split.amount = share
+        session.add(split)
+    return share_deltas
+
+
+def current_shares(session: SessionDep, expense: Expense) -> dict[TypeId, TypeMoney]:
+    """The shares of the expense as stored, read before any of its split rows is patched."""
+    if expense.split_policy == SplitPolicy.EQUAL:
+        members = split_roster(expense.group.accounts)[: expense.split_count or 0]
+        return equal_shares(expense.amount, members)
+    stmt = select(Split.user_id, Split.amount).where(col(Split.expense_id) == expense.id)
+    return {user_id: amount for user_id, amount in session.exec(stmt).all()}
+
+
+@expense_router.patch("/{expense_id}", response_model=Expense)
+def patch_expense(
+    expense_id: TypeId,
+    payload: Annotated[ExpensePatch, Body()],
+    current_user: CurrentUserDep,
+    session: SessionDep,
+    response: Response,
+    events: EventHubDep,
+    if_match: IfMatchHeader = None,
+):
+    """
+    Applies only the fields present in the payload. Unlike the full update, which touches
+    every split and account of the group, only the changed split rows are written and each
+    affected account receives one net balance delta, so editing a note is a single write.
+    """
+    pinned_version = parse_if_match(if_match)
+    fields = payload.model_fields_set
+
+    def attempt() -> Expense:
+        expense = session.get(Expense, expense_id)
+        if not expense:
+            raise ErrItemNotFound(code=CodeItemNotFound.EXPENSE_NOT_FOUND)
+
+        if not current_user.is_active_member_of(expense.group_id):
+            raise ErrGroupAuth(code=CodeGroupAuth.FORBIDDEN_NOT_MEMBER)
+
+        version = expense.version
+        check_pinned_version(pinned_version, version)
+
+        values: dict[str, Any] = {}
+        if "title" in fields and payload.title is not None:
+            values["title"] = payload.title
+        if "details" in fields:
+            values["details"] = payload.details
+        if "paid_on" in fields and payload.paid_on is not None:
+            values["paid_on"] = payload.paid_on
+
+        # a foreign expense keeps the rate it was recorded with, patches are converted with it
+        rate = expense.exchange_rate
+        patch_amount, patch_splits = payload.amount, payload.splits
+        if rate is not None and patch_amount is not None:
+            values["original_amount"] = patch_amount
+            patch_amount = convert_amount(patch_amount, rate)
+
+        old_paid_by, old_amount = expense.paid_by, expense.amount
+        new_paid_by = payload.paid_by or old_paid_by
+        new_amount = patch_amount if patch_amount is not None else old_amount
+        if new_paid_by != old_paid_by:
+            values["paid_by"] = new_paid_by
+        if new_amount != old_amount:
+            values["amount"] = new_amount
+
+        old_month = year_month(expense.paid_on)
+        new_month = year_month(values.get("paid_on", expense.paid_on))
+        # moving the expense to another month moves every share, only then are all of them needed
+        old_shares = current_shares(session, expense) if new_month != old_month else None
+
+        # how much more each member owes than before
+        share_deltas: dict[TypeId, TypeMoney] = {}
+        if expense.split_policy == SplitPolicy.EQUAL:
+            if patch_splits is not None:
+                raise ErrExpense(code=CodeExpense.UNEXPECTED_SPLITS, detail="equal split must not contain splits")
+            if new_amount != old_amount:
+                # every share of an equal split depends on the amount, there is no way around the roster
+                members = split_roster(expense.group.accounts)[: expense.split_count or 0]
+                share_deltas = merge_deltas(
+                    equal_shares(new_amount, members), negate_deltas(equal_shares(old_amount, members))
+                )
+        elif patch_splits is not None or new_amount != old_amount:
+            share_deltas = patch_custom_splits(session, expense, patch_splits or [], new_amount, rate)
+
+        net_deltas = merge_deltas({old_paid_by: -old_amount}, {new_paid_by: new_amount}, negate_deltas(share_deltas))
+        if new_paid_by != old_paid_by or len(net_deltas) != 0:
+            validate_active_members(session, expense.group_id, set(net_deltas) | {new_paid_by})
+
+        # the changed columns and the version check go out as one conditional statement
+        guarded_update(session, Expense, expense.id, version, values)
+
+        if len(net_deltas) != 0:
+            apply_balance_deltas(session, expense.group_id, net_deltas)
+            invalidate_checkpoints(session, expense.group_id, expense.created_at)
+
+        if old_shares is None:
+            paid_deltas = merge_deltas({old_paid_by: -old_amount}, {new_paid_by: new_amount})
+            rollup = merge_rollup_deltas(month_deltas(old_month, paid_deltas, share_deltas))
+        else:
+            rollup = merge_rollup_deltas(
+                month_deltas(old_month, {old_paid_by: -old_amount}, negate_deltas(old_shares)),
+                month_deltas(new_month, {new_paid_by: new_amount}, merge_deltas(old_shares, share_deltas)),
+            )
+        apply_rollup_deltas(session, expense.group_id, rollup)
+        if "title" in values or "details" in values:
+            index_expenses(session, [expense.id])
+        log_changes(session, ChangeKind.EXPENSE, expense.group_id, [expense.id])
+
+        session.commit()
+        session.refresh(expense)
+        return expense
+
+    try:
+        if pinned_version is None and fields <= COMMUTATIVE_FIELDS:
+            # the client did not pin a version and only sets descriptive fields, losing
+            # a race is resolved by simply applying the same change on the newer version
+            expense = retry_on_conflict(session, attempt)
+        else:
+            expense = attempt()
+    except VersionConflictError as exc:
+        session.rollback()
+        raise precondition_failed(exc) from exc
+
+    events.publish(expense.group_id, "expense.updated", {"id": expense.id, "by": current_user.id})
+    response.headers["ETag"] = version_etag(expense.version)
+    return expense
+
+
+# ─────────────────────────────────────────────────────────────
+# ADD RECEIPT
+# ─────────────────────────────────────────────────────────────
 
-#     image = ExpenseImage(
-#         uploaded_by=current_user.id,
-#         expense_id=expense_id,
-#         permalink=permalink,
-#     )
 
-#     session.add(image)
-#     session.commit()
-#     return image
+class ExpenseImageDetail(BasePayload):
+    id: TypeId
+    expense_id: TypeId
+    uploaded_by: TypeId
+    digest: str
+    content_type: str
+    size: int
+    url: str
+    # the thumbnail is written shortly after the upload, until then the url is not found
+    thumbnail_url: str | None
+
+
+def expense_image_detail(image: ExpenseImage) -> ExpenseImageDetail:
+    return ExpenseImageDetail(
+        id=image.id,
+        expense_id=image.expense_id,
+        uploaded_by=image.uploaded_by,
+        digest=image.digest,
+        content_type=image.content_type,
+        size=image.size,
+        url=f"/static/{image.permalink}",
+        thumbnail_url=f"/static/{image.thumbnail}" if image.thumbnail is not None else None,
+    )
+
+
+def attach_receipt(
+    session: SessionDep, expense_id: TypeId, current_user: CurrentUserDep, receipt: StoredReceipt, thumbnail: str | None
+) -> tuple[ExpenseImage, bool]:
+    stmt = select(ExpenseImage).where(
+        col(ExpenseImage.expense_id) == expense_id, col(ExpenseImage.digest) == receipt.digest
+    )
+    image = session.exec(stmt).first()
+    if image is not None:
+        return image, False
+
+    image = ExpenseImage(
+        expense_id=expense_id,
+        uploaded_by=current_user.id,
+        digest=receipt.digest,
+        content_type=receipt.content_type,
+        size=receipt.size,
+        permalink=receipt.path,
+        thumbnail=thumbnail,
+    )
+    session.add(image)
+    session.commit()
+    session.refresh(image)
+    return image, True
+
+
+@expense_router.post(
+    "/{expense_id}/images",
+    response_model=ExpenseImageDetail,
+    status_code=status.HTTP_201_CREATED,
+    openapi_extra={"requestBody": {"content": {"image/*": {}, "application/pdf": {}}, "required": True}},
+)
+async def upload_expense_image(
+    expense_id: TypeId,
+    request: Request,
+    response: Response,
+    current_user: CurrentUserDep,
+    session: SessionDep,
+    store: ReceiptStoreDep,
+    thumbnailer: ThumbnailerDep,
+):
+    """
+    Attaches the receipt sent as the raw request body. The body streams to the store in chunks
+    and is never held in memory as a whole, so receipts of several megabytes cost no more memory
+    than small ones. A receipt already attached to the expense is returned as it is.
+    """
+    # the database is only used from worker threads, the event loop only moves bytes
+    await run_in_threadpool(get_expense_for_member, session, expense_id, current_user)
+    receipt = await store.save(request.stream())
+    thumbnail = thumbnailer.submit(store.root, receipt)
+    image, created = await run_in_threadpool(attach_receipt, session, expense_id, current_user, receipt, thumbnail)
+    if not created:
+        response.status_code = status.HTTP_200_OK
+    return expense_image_detail(image)
 
 
 # ─────────────────────────────────────────────────────────────
@@ -253,23 +811,159 @@ def update_expense(
 # ─────────────────────────────────────────────────────────────
 
 
+BULK_DELETE_CHUNK_SIZE = 500
+
+
+class ExpenseBulkDelete(BasePayload):
+    group_id: TypeId
+    expense_ids: list[TypeId] | None = None
+    paid_from: date | None = None
+    paid_to: date | None = None
+    created_by: TypeId | None = None
+
+
+class ExpenseBulkDeleted(BasePayload):
+    deleted: int
+
+
+def validate_can_delete_expenses(group: Group, current_user: CurrentUserDep):
+    if not current_user.is_active_member_of(group.id):
+        # only current members of the group can delete expense
+        raise ErrGroupAuth(code=CodeGroupAuth.FORBIDDEN_NOT_MEMBER)
+
+    if not group.can_users_delete_expense and current_user.id != group.admin_id:
+        raise ErrGroupAuth(code=CodeGroupAuth.FORBIDDEN_DELETE_EXPENSE, detail="only admin can delete expenses")
+
+
+def reversal_deltas(
+    session: SessionDep, group: Group, expense_ids: list[TypeId]
+) -> tuple[dict[TypeId, TypeMoney], RollupDeltas]:
+    """
+    Aggregates in SQL what the expenses added to every balance and every monthly rollup and
+    returns the opposite. Equal splits have no rows to sum, they are grouped by (count, amount)
+    instead so each distinct division is expanded only once no matter how many expenses share it.
+    """
+    in_chunk = col(Expense.id).in_(expense_ids)
+
+    paid_stmt = (
+        select(Expense.paid_by, Expense.paid_on, func.sum(Expense.amount))
+        .where(in_chunk)
+        .group_by(col(Expense.paid_by), col(Expense.paid_on))
+    )
+    split_stmt = (
+        select(Split.user_id, Expense.paid_on, func.sum(Split.amount))
+        .join(Expense, col(Expense.id) == col(Split.expense_id))
+        .where(in_chunk)
+        .group_by(col(Split.user_id), col(Expense.paid_on))
+    )
+    equal_stmt = (
+        select(Expense.split_count, Expense.amount, Expense.paid_on, func.count())
+        .where(in_chunk, col(Expense.split_policy) == SplitPolicy.EQUAL)
+        .group_by(col(Expense.split_count), col(Expense.amount), col(Expense.paid_on))
+    )
+
+    roster = split_roster(group.accounts)
+    deltas: list[dict[TypeId, TypeMoney]] = []
+    rollups: list[RollupDeltas] = []
+    for user_id, paid_on, paid in session.exec(paid_stmt).all():
+        deltas.append({user_id: -paid})
+        rollups.append(month_deltas(year_month(paid_on), {user_id: -paid}, {}))
+    for user_id, paid_on, owed in session.exec(split_stmt).all():
+        deltas.append({user_id: owed})
+        rollups.append(month_deltas(year_month(paid_on), {}, {user_id: -owed}))
+    for split_count, amount, paid_on, times in session.exec(equal_stmt).all():
+        shares = {user_id: share * times for user_id, share in equal_shares(amount, roster[: split_count or 0]).items()}
+        deltas.append(shares)
+        rollups.append(month_deltas(year_month(paid_on), {}, negate_deltas(shares)))
+    return merge_deltas(*deltas), merge_rollup_deltas(*rollups)
+
+
+def delete_expense_chunk(session: SessionDep, group: Group, expense_ids: list[TypeId]) -> None:
+    """Reverts the balances and deletes the expenses with their children using set based statements."""
+    balance_deltas, rollup_deltas = reversal_deltas(session, group, expense_ids)
+    apply_balance_deltas(session, group.id, balance_deltas)
+    apply_rollup_deltas(session, group.id, rollup_deltas)
+
+    oldest = session.exec(select(func.min(Expense.created_at)).where(col(Expense.id).in_(expense_ids))).one()
+    invalidate_checkpoints(session, group.id, oldest)
+
+    unindex_expenses(session, expense_ids)
+    session.exec(delete(Split).where(col(Split.expense_id).in_(expense_ids)))
+    session.exec(delete(ExpenseImage).where(col(ExpenseImage.expense_id).in_(expense_ids)))
+    session.exec(delete(Expense).where(col(Expense.id).in_(expense_ids)))
+    log_changes(session, ChangeKind.EXPENSE, group.id, expense_ids, deleted=True)
+
+
+@expense_router.post("/bulk-delete", response_model=ExpenseBulkDeleted)
+def bulk_delete_expenses(
+    payload: Annotated[ExpenseBulkDelete, Body()],
+    current_user: CurrentUserDep,
+    session: SessionDep,
+    events: EventHubDep,
+):
+    """
+    Deletes every expense of the group matching all the given filters. The work is split in
+    chunks that are committed one by one, so no transaction grows with the size of the import.
+    """
+    group = session.get(Group, payload.group_id)
+    if group is None:
+        raise ErrItemNotFound(code=CodeItemNotFound.GROUP_NOT_FOUND)
+
+    validate_can_delete_expenses(group, current_user)
+
+    filters = [col(Expense.group_id) == group.id]
+    if payload.expense_ids is not None:
+        filters.append(col(Expense.id).in_(payload.expense_ids))
+    if payload.paid_from is not None:
+        filters.append(col(Expense.paid_on) >= payload.paid_from)
+    if payload.paid_to is not None:
+        filters.append(col(Expense.paid_on) <= payload.paid_to)
+    if payload.created_by is not None:
+        filters.append(col(Expense.created_by) == payload.created_by)
+
+    if len(filters) == 1:
+        # wiping the whole ledger of a group is never what a cleanup meant
+        raise ErrExpense(code=CodeExpense.NO_DELETE_FILTER, detail="at least one filter is required")
+
+    expense_ids = list(session.exec(select(Expense.id).where(*filters).order_by(col(Expense.id))).all())
+    # read before the first commit expires them
+    group_id, user_id = group.id, current_user.id
+    for start in range(0, len(expense_ids), BULK_DELETE_CHUNK_SIZE):
+        chunk = expense_ids[start : start + BULK_DELETE_CHUNK_SIZE]
+        delete_expense_chunk(session, group, chunk)
+        session.commit()
+        events.publish(group_id, "expense.deleted", {"ids": chunk, "by": user_id})
+
+    return ExpenseBulkDeleted(deleted=len(expense_ids))
+
+
 @expense_router.delete("/{expense_id}", status_code=204)
 def delete_expense(
     expense_id: TypeId,
     current_user: CurrentUserDep,
     session: SessionDep,
+    events: EventHubDep,
+    if_match: IfMatchHeader = None,
 ):
+    pinned_version = parse_if_match(if_match)
+
     expense = session.get(Expense, expense_id)
     if not expense:
         # no expense with given id exists
-        raise
+        raise ErrItemNotFound(code=CodeItemNotFound.EXPENSE_NOT_FOUND)
 
-    if not current_user.is_active_member_of(expense.group_id):
-        # only current members of the group can delete expense
-        raise
+    validate_can_delete_expenses(expense.group, current_user)
 
-    if not expense.group.can_users_delete_expense and current_user.id != expense.group.admin_id:
-        raise
+    version = expense.version
+    try:
+        check_pinned_version(pinned_version, version)
+        # claims the row before its balances are reverted, a writer that got in since it was read wins
+        guarded_update(session, Expense, expense.id, version, {})
+    except VersionConflictError as exc:
+        session.rollback()
+        raise precondition_failed(exc) from exc
 
-    session.delete(expense)
+    group_id, data = expense.group_id, {"ids": [expense.id], "by": current_user.id}
+    delete_expense_chunk(session, expense.group, [expense.id])
     session.commit()
+    events.publish(group_id, "expense.deleted", data)
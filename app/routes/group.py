@@ -1,12 +1,16 @@
-from datetime import datetime, timezone
+from datetime import date, datetime, timezone
 from decimal import Decimal
 from typing import Annotated
+from urllib.parse import quote
 
-from fastapi import APIRouter, Body, status
-from fastapi.encoders import jsonable_encoder
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Body, Header, Query, Response, status
+from fastapi.responses import StreamingResponse
+from pydantic import HttpUrl
 from pydantic_extra_types.currency_code import Currency
+from sqlalchemy import func
+from sqlmodel import col, select
 
+from app.config.vars import SyncVarsDep
 from app.errors.error import (
     CodeGroupAuth,
     CodeGroupInvite,
@@ -17,11 +21,34 @@ from app.errors.error import (
     ErrInvitationAuth,
     ErrItemNotFound,
 )
-from app.repository.models import Account, Group, User
+from app.repository.enums import ChangeKind, MembershipStatus
+from app.repository.models import Account, Expense, Group, MonthlySpend, User
 from app.repository.session import SessionDep
-from app.repository.types import TypeId, id_to_str
+from app.repository.types import TypeBalance, TypeId, TypeMoney, id_to_str
 from app.routes.base_payload import BasePayload
 from app.routes.security import CurrentUserDep
+from app.utils.analytics import get_snapshot
+from app.utils.changelog import log_changes, read_group_revision
+from app.utils.checkpoint import balances_as_of
+from app.utils.currency import RateTable, RateTableDep
+from app.utils.events import EventHubDep
+from app.utils.export import ExportFormat, export_group
+from app.utils.idempotency import IdempotencyKeyHeader, IdempotencyStoreDep
+from app.utils.ledger import compute_group_balances, split_roster
+from app.utils.rollup import month_end
+from app.utils.versioning import (
+    IfNoneMatchHeader,
+    VersionConflictError,
+    bump_user_version,
+    check_pinned_version,
+    group_etag,
+    guarded_update,
+    not_modified,
+    parse_if_match,
+    precondition_failed,
+    retry_on_conflict,
+    version_etag,
+)
 
 group_router = APIRouter()
 
@@ -38,7 +65,6 @@ class GroupIdentifier(BasePayload):
 
 @group_router.post(
     "/create",
-    response_class=JSONResponse,
     response_model=GroupIdentifier,
     status_code=status.HTTP_201_CREATED,
     tags=["group"],
@@ -57,10 +83,9 @@ def create_group(
     )
 
     session.add(new_group)
+    log_changes(session, ChangeKind.GROUP, new_group.id, [new_group.id])
     session.commit()
-    payload = GroupIdentifier(id=new_group.id)
-
-    return JSONResponse(status_code=status.HTTP_201_CREATED, content=jsonable_encoder(payload))
+    return GroupIdentifier(id=new_group.id)
 
 
 class InviteUser(BasePayload):
@@ -77,8 +102,33 @@ class GroupInvitation(BasePayload):
     requested_at: datetime
 
 
-@group_router.post("/invite", response_class=JSONResponse, response_model=GroupInvitation, tags=["group", "account"])
-def invite_user(invitation: Annotated[InviteUser, Body()], current_user: CurrentUserDep, session: SessionDep):
+@group_router.post("/invite", response_model=GroupInvitation, tags=["group", "account"])
+def invite_user(
+    invitation: Annotated[InviteUser, Body()],
+    current_user: CurrentUserDep,
+    session: SessionDep,
+    events: EventHubDep,
+    response: Response,
+    idempotency: IdempotencyStoreDep,
+    idempotency_key: IdempotencyKeyHeader = None,
+):
+    """A retry sent with the same `Idempotency-Key` invites nobody and gets the response of the original."""
+    return idempotency.run(
+        session,
+        current_user.id,
+        idempotency_key,
+        "invite_user",
+        invitation,
+        status.HTTP_200_OK,
+        response,
+        events,
+        lambda s: record_invitation(invitation, current_user, s, events),
+    )
+
+
+def record_invitation(
+    invitation: InviteUser, current_user: CurrentUserDep, session: SessionDep, events: EventHubDep
+) -> GroupInvitation:
     group = session.get(Group, invitation.group_id)
 
     if group is None:
@@ -126,8 +176,10 @@ def invite_user(invitation: Annotated[InviteUser, Body()], current_user: Current
         invited_at=datetime.now(timezone.utc),
     )
     session.add(account)
+    log_changes(session, ChangeKind.ACCOUNT, group.id, [account.id])
+    bump_user_version(session, invitee.id)
     session.commit()
-    payload = GroupInvitation(
+    created = GroupInvitation(
         account_id=account.id,
         group_id=group.id,
         invitee_id=invitee.id,
@@ -135,4 +187,470 @@ def invite_user(invitation: Annotated[InviteUser, Body()], current_user: Current
         inviter_id=current_user.id,
         requested_at=account.invited_at,
     )
-    return JSONResponse(content=jsonable_encoder(payload))
+    data = {"id": created.account_id, "by": created.inviter_id}
+    events.publish(created.group_id, "invitation.created", data, admin_only=not group.can_users_see_invitations)
+    return created
+
+
+class BalanceMismatch(BasePayload):
+    account_id: TypeId
+    owner_id: TypeId
+    balance: TypeBalance
+    expected: TypeBalance
+
+
+@group_router.get("/{group_id}/reconcile", response_model=list[BalanceMismatch], tags=["group"])
+def reconcile_group_balances(group_id: TypeId, current_user: CurrentUserDep, session: SessionDep):
+    """Replays the ledger of the group and lists the accounts whose stored balance drifted from it."""
+    group = session.get(Group, group_id)
+    if group is None:
+        raise ErrItemNotFound(code=CodeItemNotFound.GROUP_NOT_FOUND)
+
+    if group.admin_id != current_user.id:
+        raise ErrGroupAuth(code=CodeGroupAuth.FORBIDDEN_NOT_ADMIN)
+
+    expected = compute_group_balances(session, group.id)
+    return [
+        BalanceMismatch(account_id=a.id, owner_id=a.owner_id, balance=a.balance, expected=expected[a.owner_id])
+        for a in group.accounts
+        if a.membership_status == MembershipStatus.ACTIVE and a.balance != expected[a.owner_id]
+    ]
+
+
+CurrencyQuery = Annotated[Currency | None, Query(description="report amounts in this currency, not the group's")]
+
+
+class MemberBalance(BasePayload):
+    user_id: TypeId
+    balance: TypeBalance
+
+
+@group_router.get("/{group_id}/balances", response_model=list[MemberBalance], tags=["group"])
+def get_group_balances(
+    group_id: TypeId,
+    current_user: CurrentUserDep,
+    session: SessionDep,
+    rate_table: RateTableDep,
+    sync_vars: SyncVarsDep,
+    response: Response,
+    as_of: Annotated[datetime | None, Query(description="balances as they were at this point in time")] = None,
+    currency: CurrencyQuery = None,
+    if_none_match: IfNoneMatchHeader = None,
+):
+    group = session.get(Group, group_id)
+    if group is None:
+        raise ErrItemNotFound(code=CodeItemNotFound.GROUP_NOT_FOUND)
+
+    if not current_user.is_active_member_of(group.id):
+        raise ErrGroupAuth(code=CodeGroupAuth.FORBIDDEN_NOT_MEMBER)
+
+    # converted balances also depend on the rates of the day, only the group's own are tagged
+    needs_conversion = currency is not None and currency != group.currency
+    etag = group_etag(group, read_group_revision(session, group.id, sync_vars.commit_grace))
+    if not needs_conversion and (unchanged := not_modified(if_none_match, etag, response)) is not None:
+        return unchanged
+
+    if as_of is None:
+        accounts = [a for a in group.accounts if a.membership_status == MembershipStatus.ACTIVE]
+        balances = {a.owner_id: a.balance for a in accounts}
+    else:
+        stored = balances_as_of(session, group.id, as_of)
+        balances = {user_id: stored.get(user_id, Decimal(0)) for user_id in split_roster(group.accounts)}
+
+    if needs_conversion:
+        # every balance is converted at the rate of the same day in a single batch
+        on = (as_of or datetime.now(timezone.utc)).date()
+        converted_balances = rate_table.convert_many(
+            list(balances.values()), [group.currency] * len(balances), currency, [on] * len(balances)
+        )
+        balances = dict(zip(balances, converted_balances))
+    return [MemberBalance(user_id=user_id, balance=balance) for user_id, balance in balances.items()]
+
+
+class MemberSpend(BasePayload):
+    user_id: TypeId
+    monthly: list[TypeBalance]
+
+
+class MemberTotal(BasePayload):
+    user_id: TypeId
+    total: TypeBalance
+
+
+class GroupAnalytics(BasePayload):
+    months: list[str]
+    spend: list[MemberSpend]
+    top_payers: list[MemberTotal]
+
+
+class BalancePoint(BasePayload):
+    day: date
+    balance: TypeBalance
+
+
+def get_group_for_member(session: SessionDep, group_id: TypeId, current_user: CurrentUserDep) -> Group:
+    group = session.get(Group, group_id)
+    if group is None:
+        raise ErrItemNotFound(code=CodeItemNotFound.GROUP_NOT_FOUND)
+
+    if not current_user.is_active_member_of(group.id):
+        raise ErrGroupAuth(code=CodeGroupAuth.FORBIDDEN_NOT_MEMBER)
+    return group
+
+
+@group_router.get("/{group_id}/analytics", response_model=GroupAnalytics, tags=["group"])
+def get_group_analytics(
+    group_id: TypeId,
+    current_user: CurrentUserDep,
+    session: SessionDep,
+    sync_vars: SyncVarsDep,
+    response: Response,
+    top: Annotated[int, Query(ge=1, le=100, description="number of top payers to list")] = 5,
+    if_none_match: IfNoneMatchHeader = None,
+):
+    """Spend of every member per month and the members who paid the most, from the ledger snapshot."""
+    group = get_group_for_member(session, group_id, current_user)
+    revision = read_group_revision(session, group.id, sync_vars.commit_grace)
+    if (unchanged := not_modified(if_none_match, group_etag(group, revision), response)) is not None:
+        return unchanged
+    snapshot = get_snapshot(session, group, revision)
+
+    months, spend = snapshot.monthly_spend()
+    return GroupAnalytics(
+        months=months,
+        spend=[MemberSpend(user_id=user_id, monthly=monthly) for user_id, monthly in spend.items()],
+        top_payers=[MemberTotal(user_id=user_id, total=total) for user_id, total in snapshot.top_payers(top)],
+    )
+
+
+@group_router.get("/{group_id}/analytics/balance-curve", response_model=list[BalancePoint], tags=["group"])
+def get_balance_curve(
+    group_id: TypeId,
+    current_user: CurrentUserDep,
+    session: SessionDep,
+    sync_vars: SyncVarsDep,
+    response: Response,
+    user_id: Annotated[TypeId | None, Query(description="member to plot, the current user by default")] = None,
+    if_none_match: IfNoneMatchHeader = None,
+):
+    group = get_group_for_member(session, group_id, current_user)
+    revision = read_group_revision(session, group.id, sync_vars.commit_grace)
+    if (unchanged := not_modified(if_none_match, group_etag(group, revision), response)) is not None:
+        return unchanged
+    snapshot = get_snapshot(session, group, revision)
+    curve = snapshot.balance_curve(user_id or current_user.id)
+    return [BalancePoint(day=day, balance=balance) for day, balance in curve]
+
+
+class DashboardMember(BasePayload):
+    account_id: TypeId
+    user_id: TypeId
+    name: str | None
+    balance: TypeBalance
+    member_since: datetime | None
+
+
+class DashboardExpense(BasePayload):
+    id: TypeId
+    title: str
+    paid_by: TypeId
+    paid_on: date
+    amount: TypeMoney
+    # the currency the expense was paid in when it was not the one of the group
+    currency: Currency | None
+    created_at: datetime | None
+
+
+class GroupDashboard(BasePayload):
+    group: Group
+    # the active members with their balances, in the order they joined
+    members: list[DashboardMember]
+    # none when the group only lets its admin see the pending invitations
+    invitations: list[GroupInvitation] | None
+    # the latest expenses first
+    recent_expenses: list[DashboardExpense]
+
+
+@group_router.get("/{group_id}/dashboard", response_model=GroupDashboard, tags=["group"])
+def get_group_dashboard(
+    group_id: TypeId,
+    current_user: CurrentUserDep,
+    session: SessionDep,
+    sync_vars: SyncVarsDep,
+    response: Response,
+    expenses: Annotated[int, Query(ge=0, le=100, description="number of recent expenses to list")] = 20,
+    if_none_match: IfNoneMatchHeader = None,
+):
+    """
+    Everything a client shows when a group is opened, in four queries whatever the size of the
+    group: the group, its members and pending invitations joined with the names of their users,
+    the revision of the group that tags the read, and the latest expenses off the index on the
+    group and creation time. The membership of the
+    current user is checked against the members read, nothing is loaded through relationships.
+    """
+    group = session.get(Group, group_id)
+    if group is None:
+        raise ErrItemNotFound(code=CodeItemNotFound.GROUP_NOT_FOUND)
+
+    sees_invitations = group.can_users_see_invitations or group.admin_id == current_user.id
+    statuses = [MembershipStatus.ACTIVE, MembershipStatus.PENDING] if sees_invitations else [MembershipStatus.ACTIVE]
+    stmt = (
+        select(Account, User.name)
+        .join(User, col(Account.owner_id) == col(User.id))
+        .where(col(Account.group_id) == group.id, col(Account.membership_status).in_(statuses))
+        .order_by(col(Account.member_since), col(Account.invited_at))
+    )
+    accounts = session.exec(stmt).all()
+
+    active = [(a, name) for a, name in accounts if a.membership_status == MembershipStatus.ACTIVE]
+    if not any(a.owner_id == current_user.id for a, _ in active):
+        raise ErrGroupAuth(code=CodeGroupAuth.FORBIDDEN_NOT_MEMBER)
+    # a write to the group bumps its version, one to its members or its ledger moves its revision
+    etag = group_etag(group, read_group_revision(session, group.id, sync_vars.commit_grace))
+    if (unchanged := not_modified(if_none_match, etag, response)) is not None:
+        return unchanged
+
+    recent: list[Expense] = []
+    if expenses > 0:
+        stmt = (
+            select(Expense)
+            .where(col(Expense.group_id) == group.id)
+            .order_by(col(Expense.created_at).desc(), col(Expense.id).desc())
+            .limit(expenses)
+        )
+        recent = list(session.exec(stmt).all())
+
+    return GroupDashboard(
+        group=group,
+        members=[
+            DashboardMember(
+                account_id=a.id, user_id=a.owner_id, name=name, balance=a.balance, member_since=a.member_since
+            )
+            for a, name in active
+        ],
+        invitations=[
+            GroupInvitation(
+                account_id=a.id,
+                group_id=group.id,
+                invitee_id=a.owner_id,
+                invitee_name=name,
+                inviter_id=a.invited_by,
+                requested_at=a.invited_at,
+            )
+            for a, name in accounts
+            if a.membership_status == MembershipStatus.PENDING
+        ]
+        if sees_invitations
+        else None,
+        recent_expenses=[DashboardExpense.model_validate(e, from_attributes=True) for e in recent],
+    )
+
+
+class MonthlySpendRow(BasePayload):
+    year_month: str
+    user_id: TypeId
+    paid: TypeBalance
+    owed: TypeBalance
+
+
+class MemberSpendTotal(BasePayload):
+    user_id: TypeId
+    paid: TypeBalance
+    owed: TypeBalance
+
+
+YearMonthQuery = Annotated[str | None, Query(pattern=r"^\d{4}-\d{2}$", description="month formatted as YYYY-MM")]
+
+
+def month_range_filters(group_id: TypeId, from_month: str | None, to_month: str | None) -> list:
+    filters = [col(MonthlySpend.group_id) == group_id]
+    if from_month is not None:
+        filters.append(col(MonthlySpend.year_month) >= from_month)
+    if to_month is not None:
+        filters.append(col(MonthlySpend.year_month) <= to_month)
+    return filters
+
+
+def monthly_spend_rows(
+    session: SessionDep, group: Group, rate_table: RateTable, currency: str | None, filters: list
+) -> list[MonthlySpendRow]:
+    """
+    Reads the rollup rows and, when another currency is asked for, converts the whole report in
+    one batch. Every month is converted at the rate of its last day.
+    """
+    stmt = select(MonthlySpend).where(*filters).order_by(col(MonthlySpend.year_month), col(MonthlySpend.user_id))
+    rows = [MonthlySpendRow.model_validate(r, from_attributes=True) for r in session.exec(stmt).all()]
+    if currency is None or currency == group.currency or len(rows) == 0:
+        return rows
+
+    days = [month_end(r.year_month) for r in rows]
+    amounts = rate_table.convert_many(
+        [r.paid for r in rows] + [r.owed for r in rows], [group.currency] * 2 * len(rows), currency, days + days
+    )
+    return [
+        r.model_copy(update={"paid": paid, "owed": owed})
+        for r, paid, owed in zip(rows, amounts[: len(rows)], amounts[len(rows) :])
+    ]
+
+
+@group_router.get("/{group_id}/report/monthly", response_model=list[MonthlySpendRow], tags=["group"])
+def get_monthly_report(
+    group_id: TypeId,
+    current_user: CurrentUserDep,
+    session: SessionDep,
+    rate_table: RateTableDep,
+    from_month: YearMonthQuery = None,
+    to_month: YearMonthQuery = None,
+    currency: CurrencyQuery = None,
+):
+    """What every member paid and owes per month, read straight off the rollup rows."""
+    group = get_group_for_member(session, group_id, current_user)
+    return monthly_spend_rows(session, group, rate_table, currency, month_range_filters(group.id, from_month, to_month))
+
+
+@group_router.get("/{group_id}/report/members", response_model=list[MemberSpendTotal], tags=["group"])
+def get_member_report(
+    group_id: TypeId,
+    current_user: CurrentUserDep,
+    session: SessionDep,
+    rate_table: RateTableDep,
+    from_month: YearMonthQuery = None,
+    to_month: YearMonthQuery = None,
+    currency: CurrencyQuery = None,
+):
+    """Totals per member over a range of months, summing one rollup row per member and month."""
+    group = get_group_for_member(session, group_id, current_user)
+    filters = month_range_filters(group.id, from_month, to_month)
+
+    if currency is not None and currency != group.currency:
+        # the months have different rates, so they are converted before they are added up
+        totals: dict[TypeId, list[Decimal]] = {}
+        for row in monthly_spend_rows(session, group, rate_table, currency, filters):
+            total = totals.setdefault(row.user_id, [Decimal(0), Decimal(0)])
+            total[0] += row.paid
+            total[1] += row.owed
+        return [MemberSpendTotal(user_id=user_id, paid=paid, owed=owed) for user_id, (paid, owed) in totals.items()]
+
+    stmt = (
+        select(MonthlySpend.user_id, func.sum(MonthlySpend.paid), func.sum(MonthlySpend.owed))
+        .where(*filters)
+        .group_by(col(MonthlySpend.user_id))
+    )
+    return [MemberSpendTotal(user_id=user_id, paid=paid, owed=owed) for user_id, paid, owed in session.exec(stmt).all()]
+
+
+@group_router.get("/{group_id}/export", response_class=StreamingResponse, tags=["group"])
+def export_group_ledger(
+    group_id: TypeId,
+    current_user: CurrentUserDep,
+    session: SessionDep,
+    fmt: Annotated[ExportFormat, Query(alias="format")] = ExportFormat.CSV,
+    gzip: Annotated[bool, Query(description="compress the file as it is written")] = False,
+):
+    """
+    Every expense of the group with the share of each member, as a file written while it is
+    read. The session stays open until the response is sent, so the cursor behind the stream
+    outlives this function.
+    """
+    group = get_group_for_member(session, group_id, current_user)
+
+    filename = f"{group.name}-{date.today().isoformat()}.{fmt}" + (".gz" if gzip else "")
+    media_type = "text/csv" if fmt == ExportFormat.CSV else "application/x-ndjson"
+    return StreamingResponse(
+        export_group(session, group.id, fmt, gzip),
+        media_type="application/gzip" if gzip else media_type,
+        headers={"Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename)}"},
+    )
+
+
+@group_router.get("/{group_id}/events", response_class=StreamingResponse, tags=["group"])
+def stream_group_events(
+    group_id: TypeId,
+    current_user: CurrentUserDep,
+    session: SessionDep,
+    events: EventHubDep,
+    last_event_id: Annotated[
+        str | None, Header(description="id of the last event received before reconnecting")
+    ] = None,
+):
+    """
+    Server sent events announcing what changes in the group as it is committed, such as new
+    expenses and invitations. Events carry the ids of what changed, clients read the changes
+    themselves. A stream that fell behind, or resumed from an event no longer kept, receives
+    a `lagged` event instead of what it missed and should sync before it carries on.
+    """
+    group = get_group_for_member(session, group_id, current_user)
+    is_admin = group.admin_id == current_user.id
+    # the stream stays open for as long as the client listens, it must not keep a pooled connection
+    session.close()
+    return StreamingResponse(
+        events.stream(group_id, is_admin, last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+class GroupPatch(BasePayload):
+    name: str | None = None
+    description: str | None = None
+    display_image: HttpUrl | None = None
+    can_users_invite: bool | None = None
+    can_users_edit_info: bool | None = None
+    can_users_see_invitations: bool | None = None
+    can_users_delete_expense: bool | None = None
+
+
+# members may edit these when the group allows it, everything else is for the admin only
+GROUP_INFO_FIELDS = frozenset({"name", "description", "display_image"})
+
+
+@group_router.patch("/{group_id}", response_model=Group, tags=["group"])
+def patch_group(
+    group_id: TypeId,
+    payload: Annotated[GroupPatch, Body()],
+    current_user: CurrentUserDep,
+    session: SessionDep,
+    response: Response,
+    events: EventHubDep,
+    if_match: Annotated[str | None, Header(description="ETag of the version the change is based on")] = None,
+):
+    pinned_version = parse_if_match(if_match)
+    fields = payload.model_fields_set
+
+    def attempt() -> Group:
+        group = session.get(Group, group_id)
+        if group is None:
+            raise ErrItemNotFound(code=CodeItemNotFound.GROUP_NOT_FOUND)
+
+        if not current_user.is_active_member_of(group.id):
+            raise ErrGroupAuth(code=CodeGroupAuth.FORBIDDEN_NOT_MEMBER)
+
+        is_admin = group.admin_id == current_user.id
+        if not is_admin and (not group.can_users_edit_info or not fields <= GROUP_INFO_FIELDS):
+            raise ErrGroupAuth(code=CodeGroupAuth.FORBIDDEN_NOT_ADMIN, detail="only admin can edit the group")
+
+        version = group.version
+        check_pinned_version(pinned_version, version)
+
+        values = payload.model_dump(include=fields, mode="json", exclude_none=True)
+        if "description" in fields:
+            # description can be cleared, every other field is only ever replaced
+            values["description"] = payload.description
+        guarded_update(session, Group, group.id, version, values)
+        log_changes(session, ChangeKind.GROUP, group.id, [group.id])
+
+        session.commit()
+        session.refresh(group)
+        return group
+
+    try:
+        # every field is set to a value independent of the others, so a client that did
+        # not pin a version simply has its change applied on top of the newer version
+        group = attempt() if pinned_version is not None else retry_on_conflict(session, attempt)
+    except VersionConflictError as exc:
+        session.rollback()
+        raise precondition_failed(exc) from exc
+
+    events.publish(group.id, "group.updated", {"id": group.id, "by": current_user.id})
+    response.headers["ETag"] = version_etag(group.version)
+    return group
@@ -1,9 +1,10 @@
 from collections.abc import Sequence
 from datetime import datetime, timezone
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Response
 from sqlmodel import col, select, update
 
+from app.config.vars import SyncVarsDep
 from app.errors.error import (
     CodeAccountAuth,
     CodeGroupAuth,
@@ -16,11 +17,20 @@ from app.errors.error import (
     ErrInvitationAuth,
     ErrItemNotFound,
 )
-from app.repository.enums import MembershipStatus
+from app.repository.enums import ChangeKind, MembershipStatus
 from app.repository.models import Account, Group
 from app.repository.session import SessionDep
 from app.repository.types import TypeId
 from app.routes.security import CurrentUserDep
+from app.utils.changelog import log_changes, log_group_state, log_selected_changes, read_group_revision
+from app.utils.events import EventHubDep
+from app.utils.versioning import (
+    IfNoneMatchHeader,
+    bump_user_version,
+    group_etag,
+    not_modified,
+    user_etag,
+)
 
 invitation_router = APIRouter()
 
@@ -36,7 +46,12 @@ class ErrMsgInvitation:
 
 
 @invitation_router.get("/pending/user", response_model=Sequence[Account], tags=["invitation", "user"])
-def get_pending_user_invitations(current_user: CurrentUserDep, session: SessionDep):
+def get_pending_user_invitations(
+    current_user: CurrentUserDep, session: SessionDep, response: Response, if_none_match: IfNoneMatchHeader = None
+):
+    # the user was read to authenticate the request, polling costs nothing more while it is unchanged
+    if (unchanged := not_modified(if_none_match, user_etag(current_user), response)) is not None:
+        return unchanged
     stmt = (
         select(Account)
         .where(
@@ -50,7 +65,14 @@ def get_pending_user_invitations(current_user: CurrentUserDep, session: SessionD
 
 
 @invitation_router.get("/pending/group/{group_id}", response_model=list[Account], tags=["invitation", "group"])
-def get_pending_group_invitations(group_id: TypeId, current_user: CurrentUserDep, session: SessionDep):
+def get_pending_group_invitations(
+    group_id: TypeId,
+    current_user: CurrentUserDep,
+    session: SessionDep,
+    sync_vars: SyncVarsDep,
+    response: Response,
+    if_none_match: IfNoneMatchHeader = None,
+):
     group = session.get(Group, group_id)
     if group is None:
         raise ErrItemNotFound(code=CodeItemNotFound.GROUP_NOT_FOUND)
@@ -59,6 +81,9 @@ def get_pending_group_invitations(group_id: TypeId, current_user: CurrentUserDep
     if not group.can_users_see_invitations and group.admin_id != current_user.id:
         err_msg = "only admin can view pending invitations"
         raise ErrInvitationAuth(code=CodeInvitationAuth.ADMIN_ONLY_ACCESS, detail=err_msg)
+    etag = group_etag(group, read_group_revision(session, group.id, sync_vars.commit_grace))
+    if (unchanged := not_modified(if_none_match, etag, response)) is not None:
+        return unchanged
     stmt = (
         select(Account)
         .where(
@@ -91,7 +116,7 @@ def confirm_processability(account: Account) -> None:
 
 
 @invitation_router.get("/accept/{invitation_id}", tags=["invitation"])
-def accept_invitation(invitation_id: TypeId, current_user: CurrentUserDep, session: SessionDep):
+def accept_invitation(invitation_id: TypeId, current_user: CurrentUserDep, session: SessionDep, events: EventHubDep):
     account = session.get(Account, invitation_id)
     if account is None:
         raise ErrItemNotFound(code=CodeItemNotFound.INVITATION_NOT_FOUND)
@@ -112,17 +137,17 @@ def accept_invitation(invitation_id: TypeId, current_user: CurrentUserDep, sessi
         # In case we want to remove old stale invitations from the table, this is the place to do that
         # In future we might delete old invitations and put them into some table for audit purpose only,
         # that will keep the account table small and fast.
-        mark_stmt = (
-            update(Account)
-            .where(
-                col(Account.id) != account.id,
-                col(Account.owner_id) == current_user.id,
-                col(Account.group_id) == account.group_id,
-                col(Account.membership_status) == MembershipStatus.PENDING,
-            )
-            .values(membership_status=MembershipStatus.ALTERNATE)
+        alternates = (
+            col(Account.id) != account.id,
+            col(Account.owner_id) == current_user.id,
+            col(Account.group_id) == account.group_id,
+            col(Account.membership_status) == MembershipStatus.PENDING,
         )
+        # logged before they are marked, once marked the same filter no longer finds them
+        log_selected_changes(session, ChangeKind.ACCOUNT, account.group_id, select(Account.id).where(*alternates))
+        mark_stmt = update(Account).where(*alternates).values(membership_status=MembershipStatus.ALTERNATE)
         session.exec(mark_stmt)
+        bump_user_version(session, current_user.id)
         session.commit()
 
         err_msg = "user already member of the group"
@@ -131,11 +156,17 @@ def accept_invitation(invitation_id: TypeId, current_user: CurrentUserDep, sessi
     account.member_since = datetime.now(timezone.utc)
     account.membership_status = MembershipStatus.ACTIVE
     session.add(account)
+    # the new member has not seen anything of the group yet, its whole state is sent on the next sync
+    log_group_state(session, account.group_id)
+    bump_user_version(session, account.owner_id)
+    # read before the commit expires them, the event only goes out once the change is committed
+    group_id, data = account.group_id, {"id": account.id, "by": current_user.id}
     session.commit()
+    events.publish(group_id, "invitation.accepted", data)
 
 
 @invitation_router.get("/decline/{invitation_id}", tags=["invitation"])
-def decline_invitation(invitation_id: TypeId, current_user: CurrentUserDep, session: SessionDep):
+def decline_invitation(invitation_id: TypeId, current_user: CurrentUserDep, session: SessionDep, events: EventHubDep):
     account = session.get(Account, invitation_id)
     if account is None:
         raise ErrItemNotFound(code=CodeItemNotFound.INVITATION_NOT_FOUND)
@@ -147,11 +178,16 @@ def decline_invitation(invitation_id: TypeId, current_user: CurrentUserDep, sess
 
     account.membership_status = MembershipStatus.DECLINED
     session.add(account)
+    log_changes(session, ChangeKind.ACCOUNT, account.group_id, [account.id])
+    bump_user_version(session, account.owner_id)
+    group_id, data = account.group_id, {"id": account.id, "by": current_user.id}
+    admin_only = not account.group.can_users_see_invitations
     session.commit()
+    events.publish(group_id, "invitation.declined", data, admin_only=admin_only)
 
 
 @invitation_router.get("/cancel/{invitation_id}", tags=["invitation"])
-def cancel_invitation(invitation_id: TypeId, current_user: CurrentUserDep, session: SessionDep):
+def cancel_invitation(invitation_id: TypeId, current_user: CurrentUserDep, session: SessionDep, events: EventHubDep):
     account = session.get(Account, invitation_id)
     if account is None:
         raise ErrItemNotFound(code=CodeItemNotFound.INVITATION_NOT_FOUND)
@@ -163,4 +199,9 @@ def cancel_invitation(invitation_id: TypeId, current_user: CurrentUserDep, sessi
 
     account.membership_status = MembershipStatus.CANCELLED
     session.add(account)
+    log_changes(session, ChangeKind.ACCOUNT, account.group_id, [account.id])
+    bump_user_version(session, account.owner_id)
+    group_id, data = account.group_id, {"id": account.id, "by": current_user.id}
+    admin_only = not account.group.can_users_see_invitations
     session.commit()
+    events.publish(group_id, "invitation.cancelled", data, admin_only=admin_only)
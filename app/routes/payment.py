@@ -0,0 +1,266 @@
+from collections.abc import Sequence
+from datetime import datetime, timezone
+from typing import Annotated
+
+from fastapi import APIRouter, BackgroundTasks, Body, status
+from sqlmodel import col, insert, select, update
+
+from app.config.vars import LedgerVarsDep
+from app.errors.error import (
+    CodeGroupAuth,
+    CodeItemNotFound,
+    CodePayment,
+    CodePaymentAuth,
+    ErrGroupAuth,
+    ErrItemNotFound,
+    ErrPayment,
+    ErrPaymentAuth,
+)
+from app.repository.enums import MembershipStatus, PaymentStatus
+from app.repository.models import Group, Payment
+from app.repository.session import SessionDep
+from app.repository.types import TypeId, TypePositiveMoney
+from app.routes.base_payload import BasePayload
+from app.routes.group import get_group_for_member
+from app.routes.security import CurrentUserDep
+from app.utils.checkpoint import schedule_checkpoint
+from app.utils.ledger import (
+    apply_balance_deltas,
+    merge_deltas,
+    payment_balance_deltas,
+    settle_up_plan,
+    split_roster,
+)
+
+payment_router = APIRouter(tags=["payment"])
+
+
+class ErrMsgPayment:
+    NOT_PARTY = "unauthorised; payment is not between current user and another member"
+    NOT_REQUESTER = "unauthorised; payment was not requested by current user"
+    ALREADY_SETTLED = "payment is already settled"
+    ALREADY_DECLINED = "payment has been declined; create a new request"
+    ALREADY_CANCELLED = "payment has been cancelled; create a new request"
+
+
+class PaymentRequest(BasePayload):
+    group_id: TypeId
+    payer_id: TypeId
+    amount: TypePositiveMoney
+    details: str | None = None
+
+
+class PlannedPayment(BasePayload):
+    payer_id: TypeId
+    payee_id: TypeId
+    amount: TypePositiveMoney
+
+
+class SettlePlan(BasePayload):
+    payments: list[PlannedPayment]
+
+
+def validate_parties(group: Group, payer_id: TypeId, payee_id: TypeId):
+    if payer_id == payee_id:
+        raise ErrPayment(code=CodePayment.SAME_PAYER_PAYEE, detail="payer and payee must be different members")
+
+    roster = set(split_roster(group.accounts))
+    if payer_id not in roster or payee_id not in roster:
+        raise ErrPayment(code=CodePayment.NOT_MEMBER, detail="payer and payee must be active members of the group")
+
+
+def confirm_payment_pending(payment: Payment) -> None:
+    if payment.status == PaymentStatus.SETTLED:
+        raise ErrPayment(code=CodePayment.ALREADY_SETTLED, detail=ErrMsgPayment.ALREADY_SETTLED)
+
+    if payment.status == PaymentStatus.DECLINED:
+        raise ErrPayment(code=CodePayment.ALREADY_DECLINED, detail=ErrMsgPayment.ALREADY_DECLINED)
+
+    if payment.status == PaymentStatus.CANCELLED:
+        raise ErrPayment(code=CodePayment.ALREADY_CANCELLED, detail=ErrMsgPayment.ALREADY_CANCELLED)
+
+
+def get_payment_for_party(session: SessionDep, payment_id: TypeId, current_user: CurrentUserDep) -> Payment:
+    payment = session.get(Payment, payment_id)
+    if payment is None:
+        raise ErrItemNotFound(code=CodeItemNotFound.PAYMENT_NOT_FOUND)
+
+    if current_user.id not in (payment.payer_id, payment.payee_id):
+        raise ErrPaymentAuth(code=CodePaymentAuth.FORBIDDEN_NOT_PARTY, detail=ErrMsgPayment.NOT_PARTY)
+
+    confirm_payment_pending(payment)
+    return payment
+
+
+# ─────────────────────────────────────────────────────────────
+# REQUEST / SETTLE / DECLINE / CANCEL
+# ─────────────────────────────────────────────────────────────
+
+
+@payment_router.post("/request", response_model=Payment, status_code=status.HTTP_201_CREATED)
+def request_payment(payload: Annotated[PaymentRequest, Body()], current_user: CurrentUserDep, session: SessionDep):
+    """The current user asks another member of the group to pay them."""
+    group = get_group_for_member(session, payload.group_id, current_user)
+    validate_parties(group, payload.payer_id, current_user.id)
+
+    payment = Payment(
+        group_id=group.id,
+        payer_id=payload.payer_id,
+        payee_id=current_user.id,
+        requested_by=current_user.id,
+        amount=payload.amount,
+        details=payload.details,
+    )
+    session.add(payment)
+    session.commit()
+    session.refresh(payment)
+    return payment
+
+
+@payment_router.post("/settle/{payment_id}", response_model=Payment)
+def settle_payment(
+    payment_id: TypeId,
+    current_user: CurrentUserDep,
+    session: SessionDep,
+    background_tasks: BackgroundTasks,
+    ledger_vars: LedgerVarsDep,
+):
+    """Either party marks the money as paid, only now do the balances move."""
+    payment = get_payment_for_party(session, payment_id, current_user)
+
+    # both parties must still be members, someone might have left since the request
+    group = get_group_for_member(session, payment.group_id, current_user)
+    validate_parties(group, payment.payer_id, payment.payee_id)
+
+    payment.status = PaymentStatus.SETTLED
+    payment.settled_at = datetime.now(timezone.utc)
+    session.add(payment)
+    apply_balance_deltas(session, group.id, payment_balance_deltas(payment.payer_id, payment.payee_id, payment.amount))
+    session.commit()
+    session.refresh(payment)
+
+    schedule_checkpoint(session, background_tasks, group.id, ledger_vars)
+    return payment
+
+
+@payment_router.post("/decline/{payment_id}", response_model=Payment)
+def decline_payment(payment_id: TypeId, current_user: CurrentUserDep, session: SessionDep):
+    payment = get_payment_for_party(session, payment_id, current_user)
+    if payment.payer_id != current_user.id:
+        # only the one asked to pay can decline, the requester cancels instead
+        raise ErrPaymentAuth(code=CodePaymentAuth.FORBIDDEN_NOT_PARTY, detail=ErrMsgPayment.NOT_PARTY)
+
+    payment.status = PaymentStatus.DECLINED
+    session.add(payment)
+    session.commit()
+    session.refresh(payment)
+    return payment
+
+
+@payment_router.post("/cancel/{payment_id}", response_model=Payment)
+def cancel_payment(payment_id: TypeId, current_user: CurrentUserDep, session: SessionDep):
+    payment = get_payment_for_party(session, payment_id, current_user)
+    if payment.requested_by != current_user.id:
+        raise ErrPaymentAuth(code=CodePaymentAuth.FORBIDDEN_NOT_REQUESTER, detail=ErrMsgPayment.NOT_REQUESTER)
+
+    payment.status = PaymentStatus.CANCELLED
+    session.add(payment)
+    session.commit()
+    session.refresh(payment)
+    return payment
+
+
+@payment_router.get("/pending/group/{group_id}", response_model=Sequence[Payment])
+def get_pending_group_payments(group_id: TypeId, current_user: CurrentUserDep, session: SessionDep):
+    group = get_group_for_member(session, group_id, current_user)
+    stmt = (
+        select(Payment)
+        .where(
+            col(Payment.group_id) == group.id,
+            col(Payment.status) == PaymentStatus.REQUESTED,
+        )
+        .order_by(col(Payment.created_at))
+    )
+    return session.exec(stmt).all()
+
+
+# ─────────────────────────────────────────────────────────────
+# SETTLE ALL
+# ─────────────────────────────────────────────────────────────
+
+
+@payment_router.get("/settle-plan/{group_id}", response_model=SettlePlan)
+def get_settle_plan(group_id: TypeId, current_user: CurrentUserDep, session: SessionDep):
+    """Suggests the payments that settle every balance of the group."""
+    group = get_group_for_member(session, group_id, current_user)
+    balances = {a.owner_id: a.balance for a in group.accounts if a.membership_status == MembershipStatus.ACTIVE}
+    plan = settle_up_plan(balances)
+    return SettlePlan(payments=[PlannedPayment(payer_id=p, payee_id=q, amount=a) for p, q, a in plan])
+
+
+@payment_router.post("/settle-all/{group_id}", response_model=Sequence[Payment], status_code=status.HTTP_201_CREATED)
+def settle_all(
+    group_id: TypeId,
+    plan: Annotated[SettlePlan, Body()],
+    current_user: CurrentUserDep,
+    session: SessionDep,
+    background_tasks: BackgroundTasks,
+    ledger_vars: LedgerVarsDep,
+):
+    """
+    Records a whole settle up plan as settled payments in one transaction. The plan must bring
+    every balance of the group exactly to zero, as the one from `settle-plan` does, so the admin
+    cannot record transfers the balances do not call for. The payments are written with a single
+    bulk insert and the balances move by one merged delta per member.
+    """
+    group = get_group_for_member(session, group_id, current_user)
+    if group.admin_id != current_user.id:
+        raise ErrGroupAuth(code=CodeGroupAuth.FORBIDDEN_NOT_ADMIN, detail="only admin can settle the whole group")
+
+    if len(plan.payments) == 0:
+        raise ErrPayment(code=CodePayment.EMPTY_PLAN)
+
+    for p in plan.payments:
+        validate_parties(group, p.payer_id, p.payee_id)
+
+    deltas = merge_deltas(*(payment_balance_deltas(p.payer_id, p.payee_id, p.amount) for p in plan.payments))
+    balances = {a.owner_id: a.balance for a in group.accounts if a.membership_status == MembershipStatus.ACTIVE}
+    if any(balance + deltas.get(user_id, 0) != 0 for user_id, balance in balances.items()):
+        # the balances moved since the plan was made, or it was never one that settles them
+        raise ErrPayment(code=CodePayment.PLAN_MISMATCH, detail="plan does not settle the current balances")
+
+    settled_at = datetime.now(timezone.utc)
+    payments = [
+        Payment(
+            group_id=group.id,
+            payer_id=p.payer_id,
+            payee_id=p.payee_id,
+            requested_by=current_user.id,
+            amount=p.amount,
+            status=PaymentStatus.SETTLED,
+            settled_at=settled_at,
+        )
+        for p in plan.payments
+    ]
+    # created_at and updated_at are left to the server defaults
+    rows = [p.model_dump(exclude={"created_at", "updated_at"}) for p in payments]
+    session.execute(insert(Payment), rows)
+
+    apply_balance_deltas(session, group.id, deltas)
+
+    # the group is being settled as a whole, open requests are superseded by the plan
+    cancel_stmt = (
+        update(Payment)
+        .where(
+            col(Payment.group_id) == group.id,
+            col(Payment.status) == PaymentStatus.REQUESTED,
+        )
+        .values(status=PaymentStatus.CANCELLED)
+    )
+    session.exec(cancel_stmt)
+    session.commit()
+
+    schedule_checkpoint(session, background_tasks, group.id, ledger_vars)
+
+    stmt = select(Payment).where(col(Payment.id).in_([p.id for p in payments]))
+    return session.exec(stmt).all()
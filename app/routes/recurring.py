@@ -0,0 +1,247 @@
+from collections.abc import Sequence
+from datetime import date, timedelta
+from typing import Annotated
+
+from fastapi import APIRouter, Body, Depends, status
+from pydantic import Field
+from pydantic_extra_types.currency_code import Currency
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, col, select
+
+from app.config.vars import LedgerVars, get_currency_vars, get_ledger_vars, get_recurring_vars
+from app.errors.error import (
+    CodeExpense,
+    CodeGroupAuth,
+    CodeItemNotFound,
+    ErrCurrency,
+    ErrExpense,
+    ErrGroupAuth,
+    ErrItemNotFound,
+)
+from app.logger import logger
+from app.repository.enums import RecurrenceFrequency, SplitPolicy
+from app.repository.models import RecurringExpense, RecurringSplit
+from app.repository.session import SessionDep
+from app.repository.types import TypeId, TypeMoney
+from app.routes.base_payload import BasePayload
+from app.routes.expense import ExpensePayload, SplitPayload, new_expense, validate_new_expense
+from app.routes.group import get_group_for_member
+from app.routes.security import CurrentUserDep
+from app.utils.checkpoint import checkpoint_watermark, create_checkpoint, entries_since_checkpoint
+from app.utils.currency import RateTable, load_rate_table
+from app.utils.ledger import split_roster
+from app.utils.posting import post_expenses
+from app.utils.recurring import RecurringScheduler, due_occurrences, next_occurrence
+from app.utils.versioning import VersionConflictError, guarded_update
+
+recurring_router = APIRouter(tags=["recurring"])
+
+
+class RecurringExpensePayload(BasePayload):
+    title: str
+    paid_by: TypeId
+    group_id: TypeId
+    details: str | None = None
+    amount: TypeMoney
+    currency: Currency | None = None
+    split_policy: SplitPolicy = SplitPolicy.CUSTOM
+    splits: list[SplitPayload] = []
+    frequency: RecurrenceFrequency
+    # every how many days, weeks, months or years the expense recurs
+    interval: Annotated[int, Field(ge=1, le=1000)] = 1
+    # day of the first occurrence, a day in the past records the missed occurrences right away
+    starts_on: date
+    ends_on: date | None = None
+
+
+class RecurringExpenseDetail(BasePayload):
+    id: TypeId
+    group_id: TypeId
+    created_by: TypeId
+    title: str
+    details: str | None
+    paid_by: TypeId
+    amount: TypeMoney
+    currency: Currency | None
+    split_policy: SplitPolicy
+    splits: list[SplitPayload]
+    frequency: RecurrenceFrequency
+    interval: int
+    starts_on: date
+    ends_on: date | None
+    occurrences: int
+    next_due: date | None
+    enabled: bool
+
+
+def occurrence_payload(template: RecurringExpense | RecurringExpensePayload, on: date) -> ExpensePayload:
+    """The expense recorded for the occurrence on the day, the same as if a member had posted it."""
+    return ExpensePayload(
+        title=template.title,
+        paid_by=template.paid_by,
+        group_id=template.group_id,
+        details=template.details,
+        paid_on=on,
+        amount=template.amount,
+        currency=template.currency,
+        split_policy=template.split_policy,
+        splits=[SplitPayload(user_id=s.user_id, amount=s.amount) for s in template.splits],
+    )
+
+
+def materialize_due(
+    session: Session,
+    template_id: TypeId,
+    today: date,
+    rate_table: RateTable,
+    ledger_vars: LedgerVars,
+    batch_size: int,
+) -> date | None:
+    """
+    Records the occurrences of the template that are due up to today, at most a batch of them in
+    one transaction, and returns the day the template is due next. The batch is claimed with a
+    versioned update of the template and every occurrence is unique per template, so a batch
+    that another scheduler recorded first is rolled back instead of being recorded twice.
+    """
+    template = session.get(RecurringExpense, template_id)
+    if template is None or not template.enabled:
+        return None
+
+    due = due_occurrences(template, today, batch_size)
+    if len(due) == 0:
+        return template.next_due
+
+    group = template.group
+    roster = split_roster(group.accounts)
+    try:
+        # the batch is only added to the session once it is complete
+        with session.no_autoflush:
+            expenses = [
+                new_expense(group, occurrence_payload(template, on), template.created_by, rate_table, roster)
+                for _, on in due
+            ]
+    except ErrCurrency as exc:
+        # rates are sometimes published late, the occurrence is retried once they are in
+        session.rollback()
+        logger.warning("recurring expense %s is waiting for an exchange rate: %s", template_id, exc.detail)
+        return today + timedelta(days=1)
+    except ErrExpense as exc:
+        # the group changed under the template, for instance the payer left, a member has to fix it
+        session.rollback()
+        template = session.get(RecurringExpense, template_id)
+        if template is not None:
+            template.enabled = False
+            session.commit()
+        logger.warning("paused recurring expense %s as it no longer fits its group: %s", template_id, exc.code)
+        return None
+
+    for (n, _), expense in zip(due, expenses):
+        expense.recurring_id = template.id
+        expense.occurrence = n
+
+    occurrences = due[-1][0] + 1
+    next_due = next_occurrence(template, occurrences)
+    try:
+        post_expenses(session, group.id, expenses, roster)
+        values = {"occurrences": occurrences, "next_due": next_due}
+        guarded_update(session, RecurringExpense, template.id, template.version, values)
+        session.commit()
+    except (VersionConflictError, IntegrityError) as exc:
+        session.rollback()
+        logger.info("occurrences of recurring expense %s were recorded concurrently: %r", template_id, exc)
+        template = session.get(RecurringExpense, template_id)
+        return template.next_due if template is not None and template.enabled else None
+
+    logger.info("recorded %d occurrences of recurring expense %s", len(expenses), template_id)
+    until = checkpoint_watermark(ledger_vars)
+    if entries_since_checkpoint(session, group.id, until) >= ledger_vars.checkpoint_interval:
+        create_checkpoint(session, group.id, until)
+    return next_due
+
+
+def materialize_with_configured_vars(session: Session, template_id: TypeId, today: date) -> date | None:
+    recurring_vars = get_recurring_vars()
+    rate_table = load_rate_table(get_currency_vars())
+    return materialize_due(session, template_id, today, rate_table, get_ledger_vars(), recurring_vars.catch_up_batch)
+
+
+recurring_scheduler = RecurringScheduler(materialize_with_configured_vars)
+
+
+def get_recurring_scheduler() -> RecurringScheduler:
+    return recurring_scheduler
+
+
+RecurringSchedulerDep = Annotated[RecurringScheduler, Depends(get_recurring_scheduler)]
+
+
+@recurring_router.post("", response_model=RecurringExpenseDetail, status_code=status.HTTP_201_CREATED)
+def create_recurring_expense(
+    payload: Annotated[RecurringExpensePayload, Body()],
+    current_user: CurrentUserDep,
+    session: SessionDep,
+    scheduler: RecurringSchedulerDep,
+):
+    group = get_group_for_member(session, payload.group_id, current_user)
+
+    if payload.ends_on is not None and payload.ends_on < payload.starts_on:
+        raise ErrExpense(code=CodeExpense.INVALID_SCHEDULE, detail="schedule ends before it starts")
+
+    # occurrences are validated again when they are recorded, the group may have changed by then
+    validate_new_expense(group, occurrence_payload(payload, payload.starts_on))
+
+    template = RecurringExpense(
+        group_id=group.id,
+        created_by=current_user.id,
+        title=payload.title,
+        details=payload.details,
+        paid_by=payload.paid_by,
+        amount=payload.amount,
+        currency=payload.currency,
+        split_policy=SplitPolicy(payload.split_policy),
+        splits=[RecurringSplit(user_id=s.user_id, amount=s.amount) for s in payload.splits],
+        frequency=RecurrenceFrequency(payload.frequency),
+        interval=payload.interval,
+        starts_on=payload.starts_on,
+        ends_on=payload.ends_on,
+        next_due=payload.starts_on,
+    )
+    session.add(template)
+    session.commit()
+    session.refresh(template)
+
+    scheduler.schedule(template.id, template.next_due)
+    return RecurringExpenseDetail.model_validate(template, from_attributes=True)
+
+
+@recurring_router.get("/group/{group_id}", response_model=Sequence[RecurringExpenseDetail])
+def list_recurring_expenses(group_id: TypeId, current_user: CurrentUserDep, session: SessionDep):
+    group = get_group_for_member(session, group_id, current_user)
+    stmt = (
+        select(RecurringExpense)
+        .where(col(RecurringExpense.group_id) == group.id)
+        .order_by(col(RecurringExpense.next_due), col(RecurringExpense.id))
+    )
+    return [RecurringExpenseDetail.model_validate(t, from_attributes=True) for t in session.exec(stmt).all()]
+
+
+@recurring_router.delete("/{recurring_id}", status_code=204)
+def stop_recurring_expense(
+    recurring_id: TypeId,
+    current_user: CurrentUserDep,
+    session: SessionDep,
+    scheduler: RecurringSchedulerDep,
+):
+    """Stops the schedule, the occurrences recorded so far stay in the ledger like any other expense."""
+    template = session.get(RecurringExpense, recurring_id)
+    if template is None:
+        raise ErrItemNotFound(code=CodeItemNotFound.RECURRING_EXPENSE_NOT_FOUND)
+
+    group = get_group_for_member(session, template.group_id, current_user)
+    if current_user.id not in (template.created_by, group.admin_id):
+        raise ErrGroupAuth(code=CodeGroupAuth.FORBIDDEN_NOT_ADMIN, detail="only its creator or admin can stop it")
+
+    template.enabled = False
+    template.next_due = None
+    session.commit()
+    scheduler.schedule(recurring_id, None)
@@ -3,8 +3,7 @@ from typing import Annotated, Any
 
 import jwt
 from email_validator import EmailNotValidError
-from fastapi import APIRouter, Depends, status
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Depends, Response, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 
 from app.config.vars import JWTVars, JWTVarsDep
@@ -46,7 +45,6 @@ security_router = APIRouter()
 @security_router.post(
     "/token",
     response_model=TokenPayload,
-    response_class=JSONResponse,
     status_code=status.HTTP_201_CREATED,
     description="if the user account is disabled, no access token will be granted.",
     tags=["security"],
@@ -55,6 +53,7 @@ def login_for_access_token(
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
     session: SessionDep,
     jwt_vars: JWTVarsDep,
+    response: Response,
 ):
     try:
         user = authenticate_user(form_data.username, form_data.password, session)
@@ -82,18 +81,13 @@ def login_for_access_token(
 
     access_token = create_access_token(id_to_str(user.id), jwt_vars)
 
-    payload = TokenPayload(
+    response.headers["cache-control"] = "no-store"
+    return TokenPayload(
         access_token=access_token,
         token_type="Bearer",
         expires_in=jwt_vars.expiry_minutes * 60,
     )
 
-    return JSONResponse(
-        status_code=status.HTTP_201_CREATED,
-        content=payload.model_dump(mode="json"),
-        headers={"cache-control": "no-store"},
-    )
-
 
 def get_current_user(token: OAuth2SchemeDep, jwt_vars: JWTVarsDep, session: SessionDep):
     try:
@@ -0,0 +1,137 @@
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Annotated
+
+from fastapi import APIRouter, Query
+from sqlalchemy.orm import selectinload
+from sqlmodel import col, select
+
+from app.config.vars import SyncVarsDep
+from app.repository.enums import ChangeKind, SplitPolicy
+from app.repository.models import Account, Expense, Group, Task
+from app.repository.session import SessionDep
+from app.repository.types import TypeId
+from app.routes.base_payload import BasePayload
+from app.routes.expense import ExpenseDetail, SplitPayload
+from app.routes.security import CurrentUserDep
+from app.routes.task import TaskDetail
+from app.utils.changelog import SyncCursor, advance_cursor, read_changes
+from app.utils.ledger import expense_shares, split_roster
+
+sync_router = APIRouter(tags=["sync"])
+
+
+class Tombstone(BasePayload):
+    kind: ChangeKind
+    id: TypeId
+
+
+class SyncPage(BasePayload):
+    # the current state of every entity that changed, however often it changed
+    groups: list[Group]
+    accounts: list[Account]
+    expenses: list[ExpenseDetail]
+    tasks: list[TaskDetail]
+    # entities that are gone, the client drops its copy
+    deleted: list[Tombstone]
+    # pass it back as `cursor` on the next sync
+    cursor: str
+    # true while more changes are waiting, sync again right away with the new cursor
+    has_more: bool
+
+
+def expense_details(session: SessionDep, expense_ids: list[TypeId]) -> list[ExpenseDetail]:
+    """Reads the expenses with their splits, equal splits are expanded from the roster of their group."""
+    if len(expense_ids) == 0:
+        return []
+    stmt = select(Expense).where(col(Expense.id).in_(expense_ids)).options(selectinload(Expense.splits))  # type: ignore
+    expenses = list(session.exec(stmt).all())
+
+    equal_groups = {e.group_id for e in expenses if e.split_policy == SplitPolicy.EQUAL}
+    accounts: defaultdict[TypeId, list[Account]] = defaultdict(list)
+    if len(equal_groups) > 0:
+        for account in session.exec(select(Account).where(col(Account.group_id).in_(equal_groups))).all():
+            accounts[account.group_id].append(account)
+    rosters = {group_id: split_roster(group_accounts) for group_id, group_accounts in accounts.items()}
+
+    return [
+        ExpenseDetail(
+            id=e.id,
+            title=e.title,
+            paid_by=e.paid_by,
+            group_id=e.group_id,
+            created_by=e.created_by,
+            details=e.details,
+            paid_on=e.paid_on,
+            amount=e.amount,
+            currency=e.currency,
+            original_amount=e.original_amount,
+            exchange_rate=e.exchange_rate,
+            split_policy=e.split_policy,
+            splits=[
+                SplitPayload(user_id=user_id, amount=amount)
+                for user_id, amount in expense_shares(e, rosters.get(e.group_id, [])).items()
+            ],
+        )
+        for e in expenses
+    ]
+
+
+@sync_router.get("", response_model=SyncPage)
+def sync(
+    current_user: CurrentUserDep,
+    session: SessionDep,
+    sync_vars: SyncVarsDep,
+    cursor: Annotated[str | None, Query(description="cursor of the previous sync, none to start over")] = None,
+    limit: Annotated[int | None, Query(ge=1, le=5000, description="changes per page")] = None,
+):
+    """
+    Every change to the groups, accounts, expenses, splits and tasks the user can see since the
+    cursor. A page reads a slice of the change log and then the current state of each entity
+    that changed in it with one query per kind, so a sync costs as much as what changed. An
+    entity that changed many times is sent once, and one that was deleted comes as a tombstone.
+    """
+    after = SyncCursor.decode(cursor)
+    limit = limit or sync_vars.page_size
+    changes = read_changes(session, current_user.id, after, limit)
+    page = changes[:limit]
+
+    # the last change of an entity in the page decides whether it is sent or buried
+    latest: dict[tuple[ChangeKind, TypeId], bool] = {}
+    for change in page:
+        latest[(change.kind, change.entity_id)] = change.deleted
+    changed: defaultdict[ChangeKind, list[TypeId]] = defaultdict(list)
+    deleted: list[Tombstone] = []
+    for (kind, entity_id), is_deleted in latest.items():
+        if is_deleted:
+            deleted.append(Tombstone(kind=kind, id=entity_id))
+        else:
+            changed[kind].append(entity_id)
+
+    def read[T](model: type[T], ids: list[TypeId]) -> list[T]:
+        if len(ids) == 0:
+            return []
+        return list(session.exec(select(model).where(col(model.id).in_(ids))).all())  # type: ignore
+
+    groups = read(Group, changed[ChangeKind.GROUP])
+    accounts = read(Account, changed[ChangeKind.ACCOUNT])
+    expenses = expense_details(session, changed[ChangeKind.EXPENSE])
+    tasks = [TaskDetail.model_validate(t, from_attributes=True) for t in read(Task, changed[ChangeKind.TASK])]
+
+    # an entity deleted by a change on a later page is already gone, it is buried right away
+    found = {(ChangeKind.GROUP, g.id) for g in groups} | {(ChangeKind.ACCOUNT, a.id) for a in accounts}
+    found |= {(ChangeKind.EXPENSE, e.id) for e in expenses} | {(ChangeKind.TASK, t.id) for t in tasks}
+    for kind, ids in changed.items():
+        deleted.extend(Tombstone(kind=kind, id=entity_id) for entity_id in ids if (kind, entity_id) not in found)
+
+    next_cursor = advance_cursor(after, page, datetime.now(timezone.utc), sync_vars.commit_grace)
+    return SyncPage(
+        groups=groups,
+        accounts=accounts,
+        expenses=expenses,
+        tasks=tasks,
+        deleted=deleted,
+        cursor=next_cursor.encode(),
+        # a cursor held back by the grace period is not followed right away, the same page would come back
+        has_more=len(changes) > limit and len(page) > 0 and next_cursor.seq == page[-1].seq,
+    )
@@ -0,0 +1,322 @@
+from datetime import datetime, timedelta, timezone
+from typing import Annotated
+
+from fastapi import APIRouter, Body, Depends, Query, status
+from pydantic import AwareDatetime, Field
+from sqlmodel import Session, col, or_, select, update
+
+from app.config.vars import get_task_vars
+from app.errors.error import (
+    CodeGroupAuth,
+    CodeItemNotFound,
+    CodeTask,
+    CodeTaskAuth,
+    ErrItemNotFound,
+    ErrTask,
+    ErrTaskAuth,
+)
+from app.repository.enums import ChangeKind, TaskStatus
+from app.repository.models import Group, Task, User
+from app.repository.session import SessionDep
+from app.repository.types import TypeId
+from app.routes.base_payload import BasePayload
+from app.routes.group import get_group_for_member
+from app.routes.security import CurrentUserDep
+from app.utils.changelog import log_changes
+from app.utils.checkpoint import to_utc
+from app.utils.ledger import split_roster
+from app.utils.tasks import DueSoonScanner, TaskCursor, log_reminders
+
+task_router = APIRouter(tags=["task"])
+
+
+class ErrMsgTask:
+    ASSIGNEE_NOT_MEMBER = "tasks can only be assigned to active members of the group"
+    NOT_ASSIGNER = "only the one who assigned the task or admin can change it"
+
+
+class TaskPayload(BasePayload):
+    group_id: TypeId
+    assignee_id: TypeId
+    title: Annotated[str, Field(min_length=1, max_length=255)]
+    description: str | None = None
+    deadline: AwareDatetime
+
+
+class TaskPatch(BasePayload):
+    assignee_id: TypeId | None = None
+    title: Annotated[str | None, Field(min_length=1, max_length=255)] = None
+    description: str | None = None
+    deadline: AwareDatetime | None = None
+
+
+class TaskDetail(BasePayload):
+    id: TypeId
+    group_id: TypeId
+    assignee_id: TypeId
+    assigner_id: TypeId
+    title: str
+    description: str | None
+    status: TaskStatus
+    deadline: datetime
+
+
+class TaskPage(BasePayload):
+    tasks: list[TaskDetail]
+    # pass it back as `cursor` for the next page, none once there are no more tasks
+    next_cursor: str | None
+
+
+class TaskStatusChange(BasePayload):
+    task_ids: Annotated[list[TypeId], Field(min_length=1, max_length=500)]
+    status: TaskStatus
+
+
+class RejectedTask(BasePayload):
+    id: TypeId
+    code: str
+
+
+class TaskStatusResult(BasePayload):
+    updated: list[TypeId]
+    rejected: list[RejectedTask]
+
+
+# statuses a task can move to, the statuses it can move from and whether the assignee makes the
+# move, every other move is made by the one who assigned the task or by the admin of the group
+TRANSITIONS: dict[TaskStatus, tuple[frozenset[TaskStatus], bool]] = {
+    TaskStatus.FINISHED: (frozenset({TaskStatus.PENDING}), True),
+    TaskStatus.DECLINED: (frozenset({TaskStatus.PENDING}), True),
+    TaskStatus.CANCELLED: (frozenset({TaskStatus.PENDING}), False),
+    TaskStatus.PENDING: (frozenset({TaskStatus.FINISHED, TaskStatus.DECLINED, TaskStatus.CANCELLED}), False),
+}
+
+
+task_vars = get_task_vars()
+due_soon_scanner = DueSoonScanner(
+    log_reminders,
+    lead=timedelta(minutes=task_vars.reminder_lead_minutes),
+    look_ahead=timedelta(seconds=task_vars.scan_interval_seconds),
+)
+
+
+def get_due_soon_scanner() -> DueSoonScanner:
+    return due_soon_scanner
+
+
+DueSoonScannerDep = Annotated[DueSoonScanner, Depends(get_due_soon_scanner)]
+
+
+def validate_assignee(group: Group, assignee_id: TypeId) -> None:
+    if assignee_id not in split_roster(group.accounts):
+        raise ErrTask(code=CodeTask.ASSIGNEE_NOT_MEMBER, detail=ErrMsgTask.ASSIGNEE_NOT_MEMBER)
+
+
+def get_task_for_member(session: Session, task_id: TypeId, current_user: User) -> tuple[Task, Group]:
+    task = session.get(Task, task_id)
+    if task is None:
+        raise ErrItemNotFound(code=CodeItemNotFound.TASK_NOT_FOUND)
+    return task, get_group_for_member(session, task.group_id, current_user)
+
+
+def confirm_assigner_or_admin(task: Task, group: Group, current_user: User) -> None:
+    if current_user.id not in (task.assigner_id, group.admin_id):
+        raise ErrTaskAuth(code=CodeTaskAuth.FORBIDDEN_NOT_ASSIGNER, detail=ErrMsgTask.NOT_ASSIGNER)
+
+
+def task_page(session: Session, stmt, limit: int, cursor: str | None) -> TaskPage:
+    """
+    Continues the listing after the cursor in (deadline, id) order. The statement filters on the
+    leading columns of a composite index ending in the deadline, so the page is read straight off
+    the index and deep pages cost the same as the first.
+    """
+    if cursor is not None:
+        after = TaskCursor.decode(cursor)
+        stmt = stmt.where(
+            or_(
+                col(Task.deadline) > after.deadline,
+                (col(Task.deadline) == after.deadline) & (col(Task.id) > after.task_id),
+            )
+        )
+    # one task more than the page tells whether another page follows
+    tasks = session.exec(stmt.order_by(col(Task.deadline), col(Task.id)).limit(limit + 1)).all()
+    page = tasks[:limit]
+    next_cursor = None
+    if len(tasks) > limit:
+        next_cursor = TaskCursor(deadline=page[-1].deadline, task_id=page[-1].id).encode()
+    return TaskPage(tasks=[TaskDetail.model_validate(t, from_attributes=True) for t in page], next_cursor=next_cursor)
+
+
+@task_router.post("", response_model=TaskDetail, status_code=status.HTTP_201_CREATED)
+def create_task(
+    payload: Annotated[TaskPayload, Body()],
+    current_user: CurrentUserDep,
+    session: SessionDep,
+    scanner: DueSoonScannerDep,
+):
+    group = get_group_for_member(session, payload.group_id, current_user)
+    validate_assignee(group, payload.assignee_id)
+
+    task = Task(
+        group_id=group.id,
+        assignee_id=payload.assignee_id,
+        assigner_id=current_user.id,
+        title=payload.title,
+        description=payload.description,
+        deadline=payload.deadline.astimezone(timezone.utc),
+    )
+    session.add(task)
+    log_changes(session, ChangeKind.TASK, group.id, [task.id])
+    session.commit()
+    session.refresh(task)
+
+    scanner.track(task.id, task.deadline)
+    return TaskDetail.model_validate(task, from_attributes=True)
+
+
+# the listings are declared before /{task_id} so that "assigned" is never parsed as a task id
+@task_router.get("/assigned", response_model=TaskPage)
+def list_assigned_tasks(
+    current_user: CurrentUserDep,
+    session: SessionDep,
+    task_status: Annotated[TaskStatus, Query(alias="status")] = TaskStatus.PENDING,
+    limit: Annotated[int, Query(ge=1, le=100)] = 20,
+    cursor: Annotated[str | None, Query(description="next_cursor of the previous page")] = None,
+):
+    """Tasks assigned to the current user in any group, the closest deadline first."""
+    stmt = select(Task).where(col(Task.assignee_id) == current_user.id, col(Task.status) == task_status)
+    return task_page(session, stmt, limit, cursor)
+
+
+@task_router.get("/group/{group_id}", response_model=TaskPage)
+def list_group_tasks(
+    group_id: TypeId,
+    current_user: CurrentUserDep,
+    session: SessionDep,
+    task_status: Annotated[TaskStatus, Query(alias="status")] = TaskStatus.PENDING,
+    limit: Annotated[int, Query(ge=1, le=100)] = 20,
+    cursor: Annotated[str | None, Query(description="next_cursor of the previous page")] = None,
+):
+    group = get_group_for_member(session, group_id, current_user)
+    stmt = select(Task).where(col(Task.group_id) == group.id, col(Task.status) == task_status)
+    return task_page(session, stmt, limit, cursor)
+
+
+@task_router.post("/status", response_model=TaskStatusResult)
+def change_task_status(
+    payload: Annotated[TaskStatusChange, Body()],
+    current_user: CurrentUserDep,
+    session: SessionDep,
+    scanner: DueSoonScannerDep,
+):
+    """
+    Moves every task that the current user may move to the status, in one read of the tasks
+    and one update, and reports the rest with the reason they were left alone. The update
+    only applies to tasks still in a status they can move from, so a task another request
+    moved in the meantime is reported as rejected instead of being overwritten.
+    """
+    target = TaskStatus(payload.status)
+    sources, by_assignee = TRANSITIONS[target]
+    task_ids = list(dict.fromkeys(payload.task_ids))
+
+    stmt = (
+        select(Task.id, Task.group_id, Task.assignee_id, Task.assigner_id, Task.status, Group.admin_id)
+        .join(Group, col(Group.id) == col(Task.group_id))
+        .where(col(Task.id).in_(task_ids))
+    )
+    rows = {row[0]: row for row in session.exec(stmt).all()}
+
+    rejected: dict[TypeId, str] = {}
+    allowed: list[TypeId] = []
+    for task_id in task_ids:
+        row = rows.get(task_id)
+        if row is None:
+            rejected[task_id] = CodeItemNotFound.TASK_NOT_FOUND
+            continue
+        _, group_id, assignee_id, assigner_id, task_status, admin_id = row
+        if not current_user.is_active_member_of(group_id):
+            rejected[task_id] = CodeGroupAuth.FORBIDDEN_NOT_MEMBER
+        elif by_assignee and current_user.id != assignee_id:
+            rejected[task_id] = CodeTaskAuth.FORBIDDEN_NOT_ASSIGNEE
+        elif not by_assignee and current_user.id not in (assigner_id, admin_id):
+            rejected[task_id] = CodeTaskAuth.FORBIDDEN_NOT_ASSIGNER
+        elif task_status not in sources:
+            rejected[task_id] = CodeTask.INVALID_TRANSITION
+        else:
+            allowed.append(task_id)
+
+    moved: dict[TypeId, datetime] = {}
+    if len(allowed) > 0:
+        update_stmt = (
+            update(Task)
+            .where(col(Task.id).in_(allowed), col(Task.status).in_(sources))
+            .values(status=target)
+            .returning(col(Task.id), col(Task.deadline))
+        )
+        moved = {task_id: deadline for task_id, deadline in session.exec(update_stmt).all()}
+        moved_by_group: dict[TypeId, list[TypeId]] = {}
+        for task_id in moved:
+            moved_by_group.setdefault(rows[task_id][1], []).append(task_id)
+        for group_id, group_task_ids in moved_by_group.items():
+            log_changes(session, ChangeKind.TASK, group_id, group_task_ids)
+        session.commit()
+
+    for task_id in allowed:
+        if task_id not in moved:
+            rejected[task_id] = CodeTask.INVALID_TRANSITION
+    for task_id, deadline in moved.items():
+        scanner.track(task_id, deadline if target == TaskStatus.PENDING else None)
+
+    return TaskStatusResult(
+        updated=[task_id for task_id in task_ids if task_id in moved],
+        rejected=[RejectedTask(id=task_id, code=code) for task_id, code in rejected.items()],
+    )
+
+
+@task_router.get("/{task_id}", response_model=TaskDetail)
+def get_task(task_id: TypeId, current_user: CurrentUserDep, session: SessionDep):
+    task, _ = get_task_for_member(session, task_id, current_user)
+    return TaskDetail.model_validate(task, from_attributes=True)
+
+
+@task_router.patch("/{task_id}", response_model=TaskDetail)
+def patch_task(
+    task_id: TypeId,
+    payload: Annotated[TaskPatch, Body()],
+    current_user: CurrentUserDep,
+    session: SessionDep,
+    scanner: DueSoonScannerDep,
+):
+    task, group = get_task_for_member(session, task_id, current_user)
+    confirm_assigner_or_admin(task, group, current_user)
+
+    fields = payload.model_fields_set
+    if payload.assignee_id is not None:
+        validate_assignee(group, payload.assignee_id)
+        task.assignee_id = payload.assignee_id
+    if payload.title is not None:
+        task.title = payload.title
+    if "description" in fields:
+        # description can be cleared, every other field is only ever replaced
+        task.description = payload.description
+    if payload.deadline is not None:
+        task.deadline = payload.deadline.astimezone(timezone.utc)
+    session.add(task)
+    log_changes(session, ChangeKind.TASK, group.id, [task.id])
+    session.commit()
+    session.refresh(task)
+
+    if task.status == TaskStatus.PENDING:
+        scanner.track(task.id, to_utc(task.deadline))
+    return TaskDetail.model_validate(task, from_attributes=True)
+
+
+@task_router.delete("/{task_id}", status_code=204)
+def delete_task(task_id: TypeId, current_user: CurrentUserDep, session: SessionDep, scanner: DueSoonScannerDep):
+    task, group = get_task_for_member(session, task_id, current_user)
+    confirm_assigner_or_admin(task, group, current_user)
+
+    session.delete(task)
+    log_changes(session, ChangeKind.TASK, group.id, [task_id], deleted=True)
+    session.commit()
+    scanner.track(task_id, None)
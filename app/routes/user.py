@@ -1,8 +1,6 @@
 from typing import Annotated
 
 from fastapi import APIRouter, Body, status
-from fastapi.encoders import jsonable_encoder
-from fastapi.responses import JSONResponse
 from pydantic import EmailStr, SecretStr, StringConstraints, model_validator
 from sqlmodel import and_, col, select
 
@@ -35,8 +33,8 @@ class UserIdentifier(BasePayload):
 
 @user_router.post(
     "/register",
-    response_class=JSONResponse,
     response_model=UserIdentifier,
+    status_code=status.HTTP_201_CREATED,
     tags=["user"],
 )
 def register_user(user_reg: Annotated[UserRegister, Body()], session: SessionDep):
@@ -57,5 +55,4 @@ def register_user(user_reg: Annotated[UserRegister, Body()], session: SessionDep
         mobile=user_reg.mobile,
         password=user_reg.password.get_secret_value(),
     )
-    payload = UserIdentifier(id=db_user.id)
-    return JSONResponse(status_code=status.HTTP_201_CREATED, content=jsonable_encoder(payload))
+    return UserIdentifier(id=db_user.id)
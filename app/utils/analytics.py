@@ -0,0 +1,263 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import date
+from decimal import Decimal
+
+import numpy as np
+from sqlmodel import Session, col, select
+
+from app.repository.enums import PaymentStatus, SplitPolicy
+from app.repository.models import Account, Expense, Group, Payment, Split
+from app.repository.types import TypeId
+from app.utils.changelog import GroupRevision
+from app.utils.ledger import MONEY_QUANTUM, split_roster
+
+# money is held as integer counts of MONEY_QUANTUM so that every sum stays exact
+MINOR_UNITS = int(1 / MONEY_QUANTUM)
+
+# snapshots of the groups read most recently, each one is a few arrays per ledger entry
+SNAPSHOT_CACHE_SIZE = 256
+
+
+def to_minor_units(amount: Decimal) -> int:
+    return int(amount * MINOR_UNITS)
+
+
+def from_minor_units(units: int | np.integer) -> Decimal:
+    return Decimal(int(units)) * MONEY_QUANTUM
+
+
+def month_key(d: date) -> int:
+    return d.year * 12 + d.month - 1
+
+
+def month_label(key: int) -> str:
+    return f"{key // 12:04d}-{key % 12 + 1:02d}"
+
+
+def _column(values: list, dtype) -> np.ndarray:
+    return np.array(values, dtype=dtype) if len(values) > 0 else np.empty(0, dtype=dtype)
+
+
+def expand_equal_shares(amount: np.ndarray, count: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Vectorized `equal_shares` over many expenses at once. Returns the expense row, the roster
+    position and the share of every member taking part in an equally split expense, handing the
+    leftover quanta to the first members exactly the way `equal_shares` does.
+    """
+    rows = np.repeat(np.arange(len(amount)), count)
+    # position of each member within its own expense, 0 .. count - 1
+    starts = np.repeat(np.cumsum(count) - count, count)
+    position = np.arange(len(rows)) - starts
+
+    share, leftover = np.divmod(amount[rows], count[rows])
+    share += position < leftover
+    return rows, position, share
+
+
+@dataclass(frozen=True)
+class LedgerSnapshot:
+    """
+    The ledger of a group held as columns, one array per attribute, so that analytics run as
+    vectorized array operations instead of walking ORM objects. Members are referred to by their
+    index in `members`, days by their proleptic ordinal and money by integer minor units.
+    """
+
+    group_id: TypeId
+    members: tuple[TypeId, ...]
+
+    expense_day: np.ndarray
+    expense_payer: np.ndarray
+    expense_amount: np.ndarray
+
+    # one row per (expense, member) share, equal splits are already expanded
+    share_expense: np.ndarray
+    share_member: np.ndarray
+    share_amount: np.ndarray
+
+    payment_day: np.ndarray
+    payment_payer: np.ndarray
+    payment_payee: np.ndarray
+    payment_amount: np.ndarray
+
+    member_index: dict[TypeId, int] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, "member_index", {m: i for i, m in enumerate(self.members)})
+
+    def _member_totals(self, member: np.ndarray, amount: np.ndarray) -> np.ndarray:
+        totals = np.zeros(len(self.members), dtype=np.int64)
+        np.add.at(totals, member, amount)
+        return totals
+
+    def balances(self) -> dict[TypeId, Decimal]:
+        """Net balance of every member, the same figures `compute_group_balances` replays."""
+        totals = (
+            self._member_totals(self.expense_payer, self.expense_amount)
+            - self._member_totals(self.share_member, self.share_amount)
+            + self._member_totals(self.payment_payer, self.payment_amount)
+            - self._member_totals(self.payment_payee, self.payment_amount)
+        )
+        return {m: from_minor_units(t) for m, t in zip(self.members, totals)}
+
+    def top_payers(self, limit: int) -> list[tuple[TypeId, Decimal]]:
+        """Members ordered by how much they paid for the group, largest first."""
+        totals = self._member_totals(self.expense_payer, self.expense_amount)
+        # stable sort keeps the roster order among members who paid the same
+        order = np.argsort(-totals, kind="stable")[:limit]
+        return [(self.members[i], from_minor_units(totals[i])) for i in order if totals[i] > 0]
+
+    def monthly_spend(self) -> tuple[list[str], dict[TypeId, list[Decimal]]]:
+        """
+        Returns the months that had any expense and, for every member, the total of the shares
+        they owe in each of those months. This is what each member consumed, not what they paid.
+        """
+        if len(self.expense_day) == 0:
+            return [], {m: [] for m in self.members}
+
+        # ordinals cannot be split into months without going through dates, but there are
+        # far fewer distinct days than expenses so only the distinct days are converted
+        days, day_inverse = np.unique(self.expense_day, return_inverse=True)
+        day_month = np.array([month_key(date.fromordinal(int(d))) for d in days], dtype=np.int32)
+        months, month_inverse = np.unique(day_month[day_inverse], return_inverse=True)
+
+        cells = np.zeros(len(self.members) * len(months), dtype=np.int64)
+        np.add.at(cells, self.share_member * len(months) + month_inverse[self.share_expense], self.share_amount)
+        grid = cells.reshape(len(self.members), len(months))
+
+        labels = [month_label(int(k)) for k in months]
+        return labels, {m: [from_minor_units(v) for v in grid[i]] for i, m in enumerate(self.members)}
+
+    def balance_curve(self, user_id: TypeId) -> list[tuple[date, Decimal]]:
+        """Running balance of a member at the end of every day their balance changed."""
+        i = self.member_index.get(user_id)
+        if i is None:
+            return []
+
+        paid = self.expense_payer == i
+        owed = self.share_member == i
+        sent = self.payment_payer == i
+        received = self.payment_payee == i
+
+        days = np.concatenate(
+            (
+                self.expense_day[paid],
+                self.expense_day[self.share_expense[owed]],
+                self.payment_day[sent],
+                self.payment_day[received],
+            )
+        )
+        deltas = np.concatenate(
+            (
+                self.expense_amount[paid],
+                -self.share_amount[owed],
+                self.payment_amount[sent],
+                -self.payment_amount[received],
+            )
+        )
+        if len(days) == 0:
+            return []
+
+        unique_days, inverse = np.unique(days, return_inverse=True)
+        per_day = np.zeros(len(unique_days), dtype=np.int64)
+        np.add.at(per_day, inverse, deltas)
+        running = np.cumsum(per_day)
+        return [(date.fromordinal(int(d)), from_minor_units(b)) for d, b in zip(unique_days, running)]
+
+
+def load_snapshot(session: Session, group: Group) -> LedgerSnapshot:
+    """
+    Reads the ledger entries of the group with plain column queries, no ORM objects are built
+    for them, and lays them out as arrays. Equal splits are expanded against the current roster.
+    """
+    accounts = session.exec(select(Account).where(col(Account.group_id) == group.id)).all()
+    roster = split_roster(accounts)
+    members = list(roster)
+    index = {m: i for i, m in enumerate(members)}
+
+    def member_of(user_id: TypeId) -> int:
+        # custom splits and payments may still name someone who is no longer active
+        if user_id not in index:
+            index[user_id] = len(members)
+            members.append(user_id)
+        return index[user_id]
+
+    expense_stmt = select(
+        Expense.id, Expense.paid_by, Expense.amount, Expense.paid_on, Expense.split_policy, Expense.split_count
+    ).where(col(Expense.group_id) == group.id)
+    expenses = session.exec(expense_stmt).all()
+
+    split_stmt = (
+        select(Split.expense_id, Split.user_id, Split.amount)
+        .join(Expense, col(Expense.id) == col(Split.expense_id))
+        .where(col(Expense.group_id) == group.id, col(Expense.split_policy) == SplitPolicy.CUSTOM)
+    )
+    splits = session.exec(split_stmt).all()
+
+    payment_stmt = select(Payment.payer_id, Payment.payee_id, Payment.amount, Payment.settled_at).where(
+        col(Payment.group_id) == group.id,
+        col(Payment.status) == PaymentStatus.SETTLED,
+    )
+    payments = session.exec(payment_stmt).all()
+
+    row_of = {e.id: r for r, e in enumerate(expenses)}
+    expense_amount = _column([to_minor_units(e.amount) for e in expenses], np.int64)
+
+    # equal splits only store how many of the first members share them
+    equal_rows = _column([r for r, e in enumerate(expenses) if e.split_policy == SplitPolicy.EQUAL], np.int64)
+    equal_count = _column(
+        [min(e.split_count or 0, len(roster)) for e in expenses if e.split_policy == SplitPolicy.EQUAL], np.int64
+    )
+    keep = equal_count > 0
+    equal_rows, equal_count = equal_rows[keep], equal_count[keep]
+    rows, position, share = expand_equal_shares(expense_amount[equal_rows], equal_count)
+
+    share_expense = np.concatenate((equal_rows[rows], _column([row_of[s.expense_id] for s in splits], np.int64)))
+    share_member = np.concatenate((position, _column([member_of(s.user_id) for s in splits], np.int64)))
+    share_amount = np.concatenate((share, _column([to_minor_units(s.amount) for s in splits], np.int64)))
+
+    return LedgerSnapshot(
+        group_id=group.id,
+        expense_day=_column([e.paid_on.toordinal() for e in expenses], np.int64),
+        expense_payer=_column([member_of(e.paid_by) for e in expenses], np.int64),
+        expense_amount=expense_amount,
+        share_expense=share_expense,
+        share_member=share_member,
+        share_amount=share_amount,
+        payment_day=_column([p.settled_at.date().toordinal() for p in payments], np.int64),
+        payment_payer=_column([member_of(p.payer_id) for p in payments], np.int64),
+        payment_payee=_column([member_of(p.payee_id) for p in payments], np.int64),
+        payment_amount=_column([to_minor_units(p.amount) for p in payments], np.int64),
+        # members is only final once every entry has been mapped
+        members=tuple(members),
+    )
+
+
+# the snapshot of each group together with the revision of the group it was read at
+_snapshots: OrderedDict[TypeId, tuple[int, LedgerSnapshot]] = OrderedDict()
+_snapshots_lock = threading.Lock()
+
+
+def get_snapshot(session: Session, group: Group, revision: GroupRevision) -> LedgerSnapshot:
+    """
+    Returns the cached snapshot of the group while the revision of the group is unchanged. Every
+    write to the ledger or the roster logs a change and so moves the revision, a matching one
+    means the cached arrays still describe the group exactly and no invalidation hook is needed.
+    An unsettled revision may still be joined by a late commit, the snapshot is read but not kept.
+    """
+    with _snapshots_lock:
+        cached = _snapshots.get(group.id)
+        if revision.settled and cached is not None and cached[0] == revision.seq:
+            _snapshots.move_to_end(group.id)
+            return cached[1]
+
+    snapshot = load_snapshot(session, group)
+    if not revision.settled:
+        return snapshot
+    with _snapshots_lock:
+        _snapshots[group.id] = (revision.seq, snapshot)
+        _snapshots.move_to_end(group.id)
+        while len(_snapshots) > SNAPSHOT_CACHE_SIZE:
+            _snapshots.popitem(last=False)
+    return snapshot
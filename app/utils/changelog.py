@@ -0,0 +1,174 @@
+import base64
+from collections.abc import Iterable, Sequence
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import Select, and_, delete, exists, false, insert, literal, or_
+from sqlalchemy.orm import aliased
+from sqlmodel import Session, col, select
+
+from app.errors.error import CodeSync, ErrSync
+from app.repository.enums import ChangeKind, MembershipStatus
+from app.repository.models import Account, Change, Expense, Task
+from app.repository.types import TypeId
+
+
+def log_changes(
+    session: Session, kind: ChangeKind, group_id: TypeId, entity_ids: Iterable[TypeId], deleted: bool = False
+) -> None:
+    """Appends a change for every entity to the log, in the transaction of the write that changed them."""
+    logged_at = datetime.now(timezone.utc)
+    rows = [
+        {"kind": kind, "entity_id": entity_id, "group_id": group_id, "deleted": deleted, "logged_at": logged_at}
+        for entity_id in dict.fromkeys(entity_ids)
+    ]
+    if len(rows) > 0:
+        session.execute(insert(Change), rows)
+
+
+def log_selected_changes(session: Session, kind: ChangeKind, group_id: TypeId, entity_ids: Select) -> None:
+    """
+    Appends a change for every entity the statement selects the id of. The ids never leave the
+    database, the log is written with a single `INSERT ... SELECT` whatever the number of rows.
+    """
+    table = Change.__table__  # type: ignore
+    ids = entity_ids.subquery()
+    rows = select(
+        literal(kind, table.c.kind.type),
+        ids.c[0],
+        literal(group_id, table.c.group_id.type),
+        false(),
+        literal(datetime.now(timezone.utc), table.c.logged_at.type),
+    )
+    stmt = insert(Change).from_select(["kind", "entity_id", "group_id", "deleted", "logged_at"], rows)
+    session.execute(stmt)
+
+
+def log_group_state(session: Session, group_id: TypeId) -> None:
+    """
+    Logs the group, its accounts, expenses and tasks as changed, so that a member who joins the
+    group receives all of it on the next sync. The cursor of the member may already be past the
+    changes that created them, those were logged before the member could see the group.
+    """
+    log_changes(session, ChangeKind.GROUP, group_id, [group_id])
+    log_selected_changes(
+        session, ChangeKind.ACCOUNT, group_id, select(Account.id).where(col(Account.group_id) == group_id)
+    )
+    log_selected_changes(
+        session, ChangeKind.EXPENSE, group_id, select(Expense.id).where(col(Expense.group_id) == group_id)
+    )
+    log_selected_changes(session, ChangeKind.TASK, group_id, select(Task.id).where(col(Task.group_id) == group_id))
+
+
+def compact_changes(session: Session) -> int:
+    """
+    Drops every change that a later change of the same entity supersedes and returns how many.
+    A client always reads the later one as well, so no cursor misses anything, and replaying the
+    log from the start costs one change per entity instead of one per write. Tombstones are the
+    last change of their entity and are kept, so deletes still reach clients that synced long ago.
+    """
+    later = aliased(Change)
+    superseded = exists().where(
+        col(later.kind) == col(Change.kind),
+        col(later.entity_id) == col(Change.entity_id),
+        col(later.seq) > col(Change.seq),
+    )
+    result = session.exec(delete(Change).where(superseded))  # type: ignore
+    return result.rowcount
+
+
+@dataclass(frozen=True)
+class SyncCursor:
+    """Position in the change log, the client has seen every change up to and including this sequence."""
+
+    seq: int
+
+    def encode(self) -> str:
+        return base64.urlsafe_b64encode(f"seq|{self.seq}".encode()).decode()
+
+    @classmethod
+    def decode(cls, cursor: str | None) -> "SyncCursor":
+        if cursor is None:
+            # a client without a cursor replays the whole log, compacted it holds every entity once
+            return cls(seq=0)
+        try:
+            prefix, seq = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+            if prefix != "seq":
+                raise ValueError(prefix)
+            return cls(seq=int(seq))
+        except ValueError as exc:
+            raise ErrSync(code=CodeSync.INVALID_CURSOR, detail="cursor is not one returned by a sync") from exc
+
+
+def read_changes(session: Session, user_id: TypeId, after: SyncCursor, limit: int) -> list[Change]:
+    """
+    Reads up to one more than the limit of the changes after the cursor that the user may see.
+    These are the changes to the groups the user is an active member of, and the changes to the
+    user's own accounts, which includes the invitations to groups the user has not joined yet.
+    """
+    member_of = select(Account.group_id).where(
+        col(Account.owner_id) == user_id, col(Account.membership_status) == MembershipStatus.ACTIVE
+    )
+    own_accounts = select(Account.id).where(col(Account.owner_id) == user_id)
+    stmt = (
+        select(Change)
+        .where(
+            col(Change.seq) > after.seq,
+            or_(
+                col(Change.group_id).in_(member_of),
+                and_(col(Change.kind) == ChangeKind.ACCOUNT, col(Change.entity_id).in_(own_accounts)),
+            ),
+        )
+        .order_by(col(Change.seq))
+        .limit(limit + 1)
+    )
+    return list(session.exec(stmt).all())
+
+
+@dataclass(frozen=True)
+class GroupRevision:
+    """
+    Where the change log of a group stands, the last change logged for it. Every write to the
+    ledger or the roster of a group logs a change, so the revision moves whenever what is shown
+    under the group does, and reading it never touches a row that writers update. A revision
+    whose change is still within the grace period is unsettled, an older change may yet commit.
+    """
+
+    seq: int
+    settled: bool
+
+
+def read_group_revision(session: Session, group_id: TypeId, grace: timedelta) -> GroupRevision:
+    """Reads the revision of the group off the index on the group and sequence of the change log."""
+    now = datetime.now(timezone.utc)
+    stmt = (
+        select(Change.seq, Change.logged_at)
+        .where(col(Change.group_id) == group_id)
+        .order_by(col(Change.seq).desc())
+        .limit(1)
+    )
+    last = session.exec(stmt).first()
+    if last is None:
+        return GroupRevision(seq=0, settled=True)
+    seq, logged_at = last
+    return GroupRevision(seq=seq or 0, settled=_in_utc(logged_at) <= now - grace)
+
+
+def _in_utc(logged_at: datetime) -> datetime:
+    # sqlite hands back naive datetimes, every change is logged in utc
+    return logged_at if logged_at.tzinfo else logged_at.replace(tzinfo=timezone.utc)
+
+
+def advance_cursor(after: SyncCursor, changes: Sequence[Change], now: datetime, grace: timedelta) -> SyncCursor:
+    """
+    Moves the cursor past the changes read, but not past one logged within the grace period. A
+    sequence number is taken when the change is written and shows up when its transaction
+    commits, so a younger change may still be joined by an older one that commits after it.
+    Such changes are sent again on the next sync, applying a change twice leaves the same state.
+    """
+    seq = after.seq
+    for change in changes:
+        if _in_utc(change.logged_at) > now - grace:
+            break
+        seq = change.seq or seq
+    return SyncCursor(seq=seq)
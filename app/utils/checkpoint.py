@@ -0,0 +1,167 @@
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from fastapi import BackgroundTasks
+from sqlalchemy import Engine, func
+from sqlalchemy.orm import selectinload
+from sqlmodel import Session, col, delete, select
+
+from app.config.vars import LedgerVars
+from app.logger import logger
+from app.repository.enums import PaymentStatus
+from app.repository.models import Account, BalanceCheckpoint, CheckpointBalance, Expense, Payment
+from app.repository.types import TypeId
+from app.utils.ledger import expense_balance_deltas, merge_deltas, payment_balance_deltas, split_roster
+
+
+def to_utc(dt: datetime) -> datetime:
+    # sqlite drops the timezone of stored datetimes, they are always written in utc
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+def latest_checkpoint(session: Session, group_id: TypeId, at_or_before: datetime | None = None):
+    stmt = (
+        select(BalanceCheckpoint)
+        .where(col(BalanceCheckpoint.group_id) == group_id)
+        .order_by(col(BalanceCheckpoint.watermark).desc())
+        .limit(1)
+    )
+    if at_or_before is not None:
+        stmt = stmt.where(col(BalanceCheckpoint.watermark) <= at_or_before)
+    return session.exec(stmt).first()
+
+
+def ledger_deltas(session: Session, group_id: TypeId, after: datetime | None, until: datetime) -> dict[TypeId, Decimal]:
+    """
+    Returns the net balance change of every member caused by the ledger entries
+    of the group recorded in the interval (after, until].
+    """
+    accounts = session.exec(select(Account).where(col(Account.group_id) == group_id)).all()
+    roster = split_roster(accounts)
+
+    expense_stmt = (
+        select(Expense)
+        .where(col(Expense.group_id) == group_id, col(Expense.created_at) <= until)
+        .options(selectinload(Expense.splits))  # type: ignore
+    )
+    payment_stmt = select(Payment).where(
+        col(Payment.group_id) == group_id,
+        col(Payment.status) == PaymentStatus.SETTLED,
+        col(Payment.settled_at) <= until,
+    )
+    if after is not None:
+        expense_stmt = expense_stmt.where(col(Expense.created_at) > after)
+        payment_stmt = payment_stmt.where(col(Payment.settled_at) > after)
+
+    expenses = session.exec(expense_stmt).all()
+    payments = session.exec(payment_stmt).all()
+
+    return merge_deltas(
+        *(expense_balance_deltas(e, roster) for e in expenses),
+        *(payment_balance_deltas(p.payer_id, p.payee_id, p.amount) for p in payments),
+    )
+
+
+def balances_as_of(session: Session, group_id: TypeId, as_of: datetime) -> dict[TypeId, Decimal]:
+    """
+    Loads the nearest checkpoint before `as_of` and replays only the entries recorded after
+    its watermark, so the work is bounded by the checkpoint interval, not the group history.
+    """
+    as_of = to_utc(as_of)
+    checkpoint = latest_checkpoint(session, group_id, as_of)
+    if checkpoint is None:
+        return ledger_deltas(session, group_id, None, as_of)
+
+    base = {b.user_id: b.balance for b in checkpoint.balances}
+    return merge_deltas(base, ledger_deltas(session, group_id, to_utc(checkpoint.watermark), as_of))
+
+
+def create_checkpoint(session: Session, group_id: TypeId, until: datetime) -> BalanceCheckpoint | None:
+    """Builds the next checkpoint incrementally from the previous one and the entries after it."""
+    until = to_utc(until)
+    previous = latest_checkpoint(session, group_id)
+    if previous is not None and to_utc(previous.watermark) >= until:
+        return None
+
+    base = {b.user_id: b.balance for b in previous.balances} if previous is not None else {}
+    after = to_utc(previous.watermark) if previous is not None else None
+    deltas = ledger_deltas(session, group_id, after, until)
+
+    checkpoint = BalanceCheckpoint(group_id=group_id, watermark=until)
+    checkpoint.balances = [
+        CheckpointBalance(user_id=user_id, balance=balance) for user_id, balance in merge_deltas(base, deltas).items()
+    ]
+    session.add(checkpoint)
+    session.commit()
+    session.refresh(checkpoint)
+    return checkpoint
+
+
+def entries_since_checkpoint(session: Session, group_id: TypeId, until: datetime) -> int:
+    """Counts the entries a checkpoint built right now would fold in."""
+    previous = latest_checkpoint(session, group_id)
+
+    expense_stmt = (
+        select(func.count())
+        .select_from(Expense)
+        .where(col(Expense.group_id) == group_id, col(Expense.created_at) <= until)
+    )
+    payment_stmt = (
+        select(func.count())
+        .select_from(Payment)
+        .where(
+            col(Payment.group_id) == group_id,
+            col(Payment.status) == PaymentStatus.SETTLED,
+            col(Payment.settled_at) <= until,
+        )
+    )
+    if previous is not None:
+        expense_stmt = expense_stmt.where(col(Expense.created_at) > previous.watermark)
+        payment_stmt = payment_stmt.where(col(Payment.settled_at) > previous.watermark)
+
+    return session.exec(expense_stmt).one() + session.exec(payment_stmt).one()
+
+
+def invalidate_checkpoints(session: Session, group_id: TypeId, since: datetime | None) -> None:
+    """
+    Editing an entry changes every balance after it was recorded, the checkpoints covering
+    it are dropped here and rebuilt incrementally from the last checkpoint still valid.
+    """
+    if since is None:
+        return
+
+    stale = select(BalanceCheckpoint.id).where(
+        col(BalanceCheckpoint.group_id) == group_id,
+        col(BalanceCheckpoint.watermark) >= since,
+    )
+    session.exec(delete(CheckpointBalance).where(col(CheckpointBalance.checkpoint_id).in_(stale)))
+    session.exec(
+        delete(BalanceCheckpoint).where(
+            col(BalanceCheckpoint.group_id) == group_id,
+            col(BalanceCheckpoint.watermark) >= since,
+        )
+    )
+
+
+def checkpoint_watermark(ledger_vars: LedgerVars) -> datetime:
+    # entries younger than the lag might still be part of transactions that are in flight
+    return datetime.now(timezone.utc) - timedelta(seconds=ledger_vars.checkpoint_lag_seconds)
+
+
+def checkpoint_in_background(engine: Engine, group_id: TypeId, until: datetime) -> None:
+    with Session(engine) as session:
+        checkpoint = create_checkpoint(session, group_id, until)
+        if checkpoint is not None:
+            logger.info("created balance checkpoint %s for group %s", checkpoint.id, group_id)
+
+
+def schedule_checkpoint(
+    session: Session, background_tasks: BackgroundTasks, group_id: TypeId, ledger_vars: LedgerVars
+) -> None:
+    """Queues a checkpoint to be built after the response once enough entries piled up."""
+    until = checkpoint_watermark(ledger_vars)
+    if entries_since_checkpoint(session, group_id, until) >= ledger_vars.checkpoint_interval:
+        # a session joined to the connection of a batch hands back that connection, which is closed by then
+        background_tasks.add_task(checkpoint_in_background, session.get_bind().engine, group_id, until)
@@ -0,0 +1,121 @@
+import threading
+from collections.abc import Callable
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+
+from sqlalchemy import Engine
+from sqlmodel import Session
+
+from app.errors.conf import ErrBase
+from app.errors.error import CodeItemNotFound, ErrItemNotFound
+from app.logger import logger
+from app.repository.models import Expense, Group
+from app.repository.types import TypeId
+from app.utils.ledger import split_roster
+from app.utils.posting import post_expenses
+
+# builds the expense of one write against the group as the batch transaction sees it
+BuildExpense = Callable[[Session, Group, list[TypeId]], Expense]
+
+
+@dataclass
+class PendingWrite:
+    build: BuildExpense
+    future: Future[TypeId] = field(default_factory=Future)
+
+
+@dataclass
+class Batch:
+    writes: list[PendingWrite] = field(default_factory=list)
+    # set once the batch is full, so that its leader stops waiting for more writes
+    full: threading.Event = field(default_factory=threading.Event)
+
+
+class WriteCoalescer:
+    """
+    Group commit for expenses of the same group. The first write of a group to arrive becomes
+    the leader of a batch, waits a few milliseconds for more writes of the group to join and
+    then applies all of them in one transaction, so that every account of the group gets one
+    `balance = balance + delta` for the whole batch instead of one per expense. Every writer
+    gets a future completed with the id of its own expense or with its own error.
+    """
+
+    def __init__(self):
+        self._batches: dict[TypeId, Batch] = {}
+        self._lock = threading.Lock()
+
+    def submit(
+        self, engine: Engine, group_id: TypeId, build: BuildExpense, window_seconds: float, max_batch: int
+    ) -> Future[TypeId]:
+        write = PendingWrite(build)
+        with self._lock:
+            batch = self._batches.get(group_id)
+            leader = batch is None
+            if batch is None:
+                batch = self._batches[group_id] = Batch()
+            batch.writes.append(write)
+            if len(batch.writes) >= max_batch:
+                batch.full.set()
+                # later writes start a batch of their own
+                del self._batches[group_id]
+
+        if leader:
+            batch.full.wait(window_seconds)
+            with self._lock:
+                if self._batches.get(group_id) is batch:
+                    del self._batches[group_id]
+            self._apply(engine, group_id, batch.writes)
+        return write.future
+
+    def _apply(self, engine: Engine, group_id: TypeId, writes: list[PendingWrite]) -> None:
+        # whatever fails is handed to the futures and raised again in the threads of the writers,
+        # the leader applies the writes of others and must never leave one of them waiting
+        with Session(engine) as session:
+            try:
+                self._apply_batch(session, group_id, writes)
+                return
+            except BaseException as exc:  # noqa: BLE001
+                session.rollback()
+                if len(writes) == 1:
+                    if not writes[0].future.done():
+                        writes[0].future.set_exception(exc)
+                    return
+                logger.warning("batch of %d writes to group %s failed, retrying one by one", len(writes), group_id)
+
+            # one transaction per write, so that only the write at fault fails
+            for write in writes:
+                if write.future.done():
+                    continue
+                try:
+                    self._apply_batch(session, group_id, [write])
+                except BaseException as exc:  # noqa: BLE001
+                    session.rollback()
+                    write.future.set_exception(exc)
+
+    def _apply_batch(self, session: Session, group_id: TypeId, writes: list[PendingWrite]) -> None:
+        group = session.get(Group, group_id)
+        if group is None:
+            for write in writes:
+                write.future.set_exception(ErrItemNotFound(code=CodeItemNotFound.GROUP_NOT_FOUND))
+            return
+
+        roster = split_roster(group.accounts)
+        built: list[tuple[PendingWrite, Expense]] = []
+        # the expenses are only added to the session once the whole batch is built
+        with session.no_autoflush:
+            for write in writes:
+                if write.future.done():
+                    continue
+                try:
+                    built.append((write, write.build(session, group, roster)))
+                except ErrBase as exc:
+                    # an invalid write fails on its own, the rest of the batch goes ahead
+                    write.future.set_exception(exc)
+
+        post_expenses(session, group.id, [expense for _, expense in built], roster)
+        session.commit()
+        for write, expense in built:
+            write.future.set_result(expense.id)
+
+
+expense_coalescer = WriteCoalescer()
@@ -0,0 +1,164 @@
+import os
+import csv
+import threading
+from collections import defaultdict
+from collections.abc import Sequence
+from dataclasses import dataclass
+from datetime import date
+from decimal import ROUND_DOWN, Decimal
+from pathlib import Path
+from typing import Annotated
+
+import numpy as np
+from fastapi import Depends
+
+from app.config.vars import CurrencyVars, CurrencyVarsDep
+from app.errors.error import CodeCurrency, ErrCurrency
+from app.logger import logger
+from app.repository.types import TypeId
+from app.utils.ledger import MONEY_QUANTUM
+
+RATE_QUANTUM = Decimal("0.00000001")
+
+
+def rate_unavailable(currency: str, on: date) -> ErrCurrency:
+    return ErrCurrency(code=CodeCurrency.RATE_UNAVAILABLE, detail=f"no exchange rate for {currency} on {on}")
+
+
+@dataclass(frozen=True)
+class RateTable:
+    """
+    Exchange rates against a base currency, each valid from its date until the next date listed
+    for the same currency. Every currency keeps its interval starts as a sorted array of date
+    ordinals, so finding the interval covering a day is a binary search, and for a whole batch
+    of days a single vectorized search.
+    """
+
+    base: str
+    starts: dict[str, np.ndarray]
+    rates: dict[str, tuple[Decimal, ...]]
+
+    @classmethod
+    def from_csv(cls, path: str | Path, base: str) -> "RateTable":
+        series: defaultdict[str, dict[int, Decimal]] = defaultdict(dict)
+        with open(path, newline="") as f:
+            for row in csv.DictReader(f):
+                on = date.fromisoformat(row["date"].strip())
+                series[row["currency"].strip().upper()][on.toordinal()] = Decimal(row["rate"].strip())
+
+        starts: dict[str, np.ndarray] = {}
+        rates: dict[str, tuple[Decimal, ...]] = {}
+        for currency, by_day in series.items():
+            days = sorted(by_day)
+            starts[currency] = np.array(days, dtype=np.int64)
+            rates[currency] = tuple(by_day[d] for d in days)
+        return cls(base=base.upper(), starts=starts, rates=rates)
+
+    def rate(self, currency: str, on: date) -> Decimal:
+        """Units of the currency one unit of the base currency buys on the day."""
+        if currency == self.base:
+            return Decimal(1)
+        if currency not in self.starts:
+            raise rate_unavailable(currency, on)
+        i = int(np.searchsorted(self.starts[currency], on.toordinal(), side="right")) - 1
+        if i < 0:
+            raise rate_unavailable(currency, on)
+        return self.rates[currency][i]
+
+    def rates_on(self, currency: str, days: Sequence[date]) -> list[Decimal]:
+        """The rate of one currency on every one of the days, looked up in one pass."""
+        if currency == self.base or len(days) == 0:
+            return [Decimal(1)] * len(days)
+        if currency not in self.starts:
+            raise rate_unavailable(currency, days[0])
+
+        ordinals = np.fromiter((d.toordinal() for d in days), dtype=np.int64, count=len(days))
+        index = np.searchsorted(self.starts[currency], ordinals, side="right") - 1
+        if len(index) > 0 and index.min() < 0:
+            raise rate_unavailable(currency, days[int(index.argmin())])
+        rates = self.rates[currency]
+        return [rates[i] for i in index.tolist()]
+
+    def cross_rate(self, source: str, target: str, on: date) -> Decimal:
+        """Units of the target currency one unit of the source currency buys on the day."""
+        if source == target:
+            return Decimal(1)
+        return (self.rate(target, on) / self.rate(source, on)).quantize(RATE_QUANTUM)
+
+    def convert_many(
+        self, amounts: Sequence[Decimal], sources: Sequence[str], target: str, days: Sequence[date]
+    ) -> list[Decimal]:
+        """
+        Converts a batch of amounts, each from its own currency on its own day, into the target
+        currency. The lookups are grouped by currency so that every currency is searched once for
+        all of its days, instead of once per amount.
+        """
+        converted = list(amounts)
+        by_source: defaultdict[str, list[int]] = defaultdict(list)
+        for i, source in enumerate(sources):
+            if source != target:
+                by_source[source].append(i)
+
+        for source, rows in by_source.items():
+            rows_days = [days[i] for i in rows]
+            pairs = zip(rows, self.rates_on(source, rows_days), self.rates_on(target, rows_days))
+            for i, source_rate, target_rate in pairs:
+                converted[i] = convert_amount(amounts[i], (target_rate / source_rate).quantize(RATE_QUANTUM))
+        return converted
+
+
+def convert_amount(amount: Decimal, rate: Decimal) -> Decimal:
+    return (amount * rate).quantize(MONEY_QUANTUM)
+
+
+def convert_shares(
+    amount: Decimal, shares: dict[TypeId, Decimal], rate: Decimal, total: Decimal | None = None
+) -> dict[TypeId, Decimal]:
+    """
+    Converts the shares of an expense so that they still add up to the converted amount, or to
+    the total when only some of the shares are converted and the rest are already stored. Every
+    share is rounded down and the quanta lost to rounding go one each to the first members, the
+    same way the leftover of an equal split is handed out.
+    """
+    converted = {u: (share * rate).quantize(MONEY_QUANTUM, rounding=ROUND_DOWN) for u, share in shares.items()}
+    if total is None:
+        total = convert_amount(amount, rate)
+    leftover = int((total - sum(converted.values())) / MONEY_QUANTUM)
+    if 0 < leftover <= len(converted):
+        for user_id in list(converted)[:leftover]:
+            converted[user_id] += MONEY_QUANTUM
+    return converted
+
+
+_tables: dict[tuple[str, str], tuple[float, RateTable]] = {}
+_tables_lock = threading.Lock()
+
+
+def load_rate_table(currency_vars: CurrencyVars) -> RateTable:
+    """
+    Returns the rate table of the configured file, parsed only again once the file changed on
+    disk. Without a file only amounts already in the base currency can be converted.
+    """
+    path, base = currency_vars.rates_file, currency_vars.base_currency.upper()
+    try:
+        mtime = os.stat(path).st_mtime
+    except FileNotFoundError:
+        return RateTable(base=base, starts={}, rates={})
+
+    with _tables_lock:
+        cached = _tables.get((path, base))
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+    table = RateTable.from_csv(path, base)
+    logger.info("loaded exchange rates of %d currencies from %s", len(table.starts), path)
+    with _tables_lock:
+        _tables[(path, base)] = (mtime, table)
+    return table
+
+
+def get_rate_table(currency_vars: CurrencyVarsDep) -> RateTable:
+    return load_rate_table(currency_vars)
+
+
+RateTableDep = Annotated[RateTable, Depends(get_rate_table)]
@@ -0,0 +1,279 @@
+import time
+import asyncio
+import threading
+from abc import ABC, abstractmethod
+from collections import deque
+from collections.abc import AsyncIterator, Callable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Annotated, Any
+
+import pydantic_core
+from fastapi import Depends
+
+from app.config.vars import get_event_vars
+from app.logger import logger
+from app.repository.types import TypeId
+
+
+@dataclass(frozen=True, slots=True)
+class GroupEvent:
+    group_id: TypeId
+    # numbers the events of a group within one epoch of the backend
+    seq: int
+    epoch: str
+    # only sent to the admin, for events about invitations that members may not see
+    admin_only: bool
+    # the event as it goes over the wire, encoded once however many subscribers receive it
+    frame: bytes
+
+    @property
+    def id(self) -> str:
+        return f"{self.epoch}-{self.seq}"
+
+
+def encode_frame(event_id: str, event_type: str, data: dict[str, Any]) -> bytes:
+    return b"id: %s\nevent: %s\ndata: %s\n\n" % (event_id.encode(), event_type.encode(), pydantic_core.to_json(data))
+
+
+# written between events so proxies keep the connection open and dead clients are noticed
+HEARTBEAT_FRAME = b": heartbeat\n\n"
+
+
+def lagged_frame(data: dict[str, Any]) -> bytes:
+    # carries no id, the client keeps resuming from the last event it actually received
+    return b"event: lagged\ndata: %s\n\n" % pydantic_core.to_json(data)
+
+
+Deliver = Callable[[GroupEvent], None]
+
+# group id, event type, data and admin only, as passed to `EventHub.publish`
+PendingEvent = tuple[TypeId, str, dict[str, Any], bool]
+
+
+class EventBackend(ABC):
+    """
+    Numbers the events of every group and hands them to every hub attached to it, with a short
+    history of each group for clients that resume. The local backend serves the hubs of one
+    process, a backend shared by several workers, such as one over a message broker, also hands
+    each worker the events published by the others.
+    """
+
+    @abstractmethod
+    def publish(self, group_id: TypeId, event_type: str, data: dict[str, Any], admin_only: bool) -> None: ...
+
+    @abstractmethod
+    def attach(self, deliver: Deliver) -> None: ...
+
+    @abstractmethod
+    def replay(self, group_id: TypeId, last_event_id: str) -> list[GroupEvent] | None:
+        """The events of the group after the one with the id, none when the history no longer reaches back to it."""
+
+
+class LocalEventBackend(EventBackend):
+    def __init__(self, history_size: int):
+        # a restarted process numbers events anew, ids of an earlier epoch cannot be resumed from
+        self.epoch = format(time.time_ns(), "x")
+        self._history_size = history_size
+        self._history: dict[TypeId, deque[GroupEvent]] = {}
+        self._seq: dict[TypeId, int] = {}
+        self._hubs: list[Deliver] = []
+        self._lock = threading.Lock()
+
+    def publish(self, group_id: TypeId, event_type: str, data: dict[str, Any], admin_only: bool) -> None:
+        with self._lock:
+            seq = self._seq.get(group_id, 0) + 1
+            self._seq[group_id] = seq
+            frame = encode_frame(f"{self.epoch}-{seq}", event_type, data)
+            event = GroupEvent(group_id=group_id, seq=seq, epoch=self.epoch, admin_only=admin_only, frame=frame)
+            history = self._history.get(group_id)
+            if history is None:
+                history = self._history[group_id] = deque(maxlen=self._history_size)
+            history.append(event)
+            hubs = list(self._hubs)
+        for deliver in hubs:
+            deliver(event)
+
+    def attach(self, deliver: Deliver) -> None:
+        with self._lock:
+            self._hubs.append(deliver)
+
+    def replay(self, group_id: TypeId, last_event_id: str) -> list[GroupEvent] | None:
+        epoch, _, seq = last_event_id.partition("-")
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        with self._lock:
+            history = list(self._history.get(group_id, ()))
+        after = int(seq)
+        if after > (history[-1].seq if history else 0):
+            return None
+        if history and history[0].seq > after + 1:
+            # events between the last one seen and the oldest kept were dropped
+            return None
+        return [e for e in history if e.seq > after]
+
+
+class Subscription:
+    """
+    Events of one group waiting to be sent to one client. An idle subscription holds an empty
+    deque and, while its stream waits, one future, so thousands of them cost little memory. A
+    client that falls behind by more than the bound loses the queued events and is told it lagged.
+    """
+
+    __slots__ = ("_events", "_max_queued", "_waiter", "group_id", "is_admin", "lagged")
+
+    def __init__(self, group_id: TypeId, is_admin: bool, max_queued: int):
+        self.group_id = group_id
+        self.is_admin = is_admin
+        self.lagged = False
+        self._events: deque[GroupEvent] = deque()
+        self._max_queued = max_queued
+        self._waiter: asyncio.Future[None] | None = None
+
+    def push(self, event: GroupEvent) -> None:
+        if event.admin_only and not self.is_admin:
+            return
+        if self.lagged:
+            return
+        if len(self._events) >= self._max_queued:
+            self._events.clear()
+            self.lagged = True
+        else:
+            self._events.append(event)
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def next(self, timeout: float) -> GroupEvent | None:
+        """The next queued event, none when the subscription lagged or nothing came within the timeout."""
+        if not self._events and not self.lagged:
+            self._waiter = asyncio.get_running_loop().create_future()
+            try:
+                await asyncio.wait_for(self._waiter, timeout)
+            except TimeoutError:
+                pass
+            finally:
+                self._waiter = None
+        if self._events and not self.lagged:
+            return self._events.popleft()
+        return None
+
+
+class EventHub:
+    """
+    Fans the events of every group out to the clients streaming them in this process. Routes
+    publish after they commit, from worker threads, and every event is handed to the event loop
+    that serves the streams, so the subscriptions are only ever touched from that loop.
+    """
+
+    def __init__(self, backend: EventBackend, max_queued: int, heartbeat_seconds: float):
+        self.backend = backend
+        self.max_queued = max_queued
+        self.heartbeat_seconds = heartbeat_seconds
+        self._subscriptions: dict[TypeId, set[Subscription]] = {}
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._pending: ContextVar[list[PendingEvent] | None] = ContextVar("pending_events", default=None)
+        backend.attach(self._deliver)
+
+    def publish(self, group_id: TypeId, event_type: str, data: dict[str, Any], admin_only: bool = False) -> None:
+        """Announces a committed change, a failure to publish never fails the write it announces."""
+        pending = self._pending.get()
+        if pending is not None:
+            pending.append((group_id, event_type, data, admin_only))
+            return
+        try:
+            self.backend.publish(group_id, event_type, data, admin_only)
+        except Exception:  # noqa: BLE001
+            # the change is committed already, whatever a backend raises is logged and not retried
+            logger.exception("failed to publish %s to group %s", event_type, group_id)
+
+    @contextmanager
+    def deferred(self) -> Iterator[list[PendingEvent]]:
+        """
+        Holds back what is published within the block, for writes whose commit only counts once
+        an enclosing transaction commits. The caller publishes the events with `flush` after that
+        commit, or drops them when the transaction is rolled back.
+        """
+        pending: list[PendingEvent] = []
+        token = self._pending.set(pending)
+        try:
+            yield pending
+        finally:
+            self._pending.reset(token)
+
+    def flush(self, pending: list[PendingEvent]) -> None:
+        for group_id, event_type, data, admin_only in pending:
+            self.publish(group_id, event_type, data, admin_only)
+        pending.clear()
+
+    def _deliver(self, event: GroupEvent) -> None:
+        loop = self._loop
+        if loop is None or loop.is_closed() or event.group_id not in self._subscriptions:
+            return
+        loop.call_soon_threadsafe(self._fan_out, event)
+
+    def _fan_out(self, event: GroupEvent) -> None:
+        for subscription in self._subscriptions.get(event.group_id, ()):
+            subscription.push(event)
+
+    def subscribers(self, group_id: TypeId) -> int:
+        return len(self._subscriptions.get(group_id, ()))
+
+    async def stream(self, group_id: TypeId, is_admin: bool, last_event_id: str | None) -> AsyncIterator[bytes]:
+        """
+        The frames of a server sent event stream of the group, starting after the last event
+        the client received when it resumes. A client the history cannot catch up, or one that
+        lagged behind, gets a `lagged` event and should refetch what it shows before going on.
+        """
+        self._loop = asyncio.get_running_loop()
+        subscription = Subscription(group_id, is_admin, self.max_queued)
+        # subscribed before the history is read, so no event falls between the two
+        self._subscriptions.setdefault(group_id, set()).add(subscription)
+        try:
+            yield b"retry: 3000\n\n"
+            sent = 0
+            if last_event_id is not None:
+                replayed = self.backend.replay(group_id, last_event_id)
+                if replayed is None:
+                    yield lagged_frame({"reason": "history"})
+                else:
+                    for event in replayed:
+                        if is_admin or not event.admin_only:
+                            yield event.frame
+                        sent = event.seq
+
+            while True:
+                event = await subscription.next(self.heartbeat_seconds)
+                if subscription.lagged:
+                    subscription.lagged = False
+                    yield lagged_frame({"reason": "queue"})
+                elif event is None:
+                    yield HEARTBEAT_FRAME
+                elif event.seq > sent:
+                    # events that arrived while the history was replayed are not sent twice
+                    yield event.frame
+        finally:
+            subscribers = self._subscriptions.get(group_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscriptions[group_id]
+
+
+def configured_event_hub() -> EventHub:
+    event_vars = get_event_vars()
+    return EventHub(
+        LocalEventBackend(event_vars.history_size),
+        max_queued=event_vars.max_queued,
+        heartbeat_seconds=event_vars.heartbeat_seconds,
+    )
+
+
+event_hub = configured_event_hub()
+
+
+def get_event_hub() -> EventHub:
+    return event_hub
+
+
+EventHubDep = Annotated[EventHub, Depends(get_event_hub)]
@@ -0,0 +1,178 @@
+import io
+import csv
+import json
+import zlib
+from collections import defaultdict
+from collections.abc import Iterable, Iterator, Sequence
+from enum import StrEnum, auto
+
+from sqlalchemy import Row
+from sqlmodel import Session, col, select
+
+from app.repository.enums import SplitPolicy
+from app.repository.models import Account, Expense, Split
+from app.repository.types import TypeId
+from app.utils.ledger import equal_shares, split_roster
+
+# expenses read per round trip of the cursor, memory use of an export is bounded by one batch
+EXPORT_BATCH_SIZE = 1000
+
+EXPORT_COLUMNS = (
+    Expense.id,
+    Expense.paid_on,
+    Expense.title,
+    Expense.details,
+    Expense.paid_by,
+    Expense.amount,
+    Expense.currency,
+    Expense.original_amount,
+    Expense.exchange_rate,
+    Expense.split_policy,
+    Expense.split_count,
+)
+
+CSV_HEADER = (
+    "expense_id",
+    "paid_on",
+    "title",
+    "details",
+    "paid_by",
+    "amount",
+    "currency",
+    "original_amount",
+    "exchange_rate",
+    "split_policy",
+    "user_id",
+    "share",
+)
+
+
+class ExportFormat(StrEnum):
+    CSV = auto()
+    NDJSON = auto()
+
+
+def expense_batches(
+    session: Session, group_id: TypeId, batch_size: int = EXPORT_BATCH_SIZE
+) -> Iterator[list[tuple[Row, dict[str, str]]]]:
+    """
+    Yields the expenses of the group oldest first, a batch at a time, each with the share owed
+    by every member. The expenses come off a server side cursor, so only one batch is ever held,
+    and the custom splits of a batch are read with a single query keyed by its expense ids.
+    """
+    accounts = session.exec(select(Account).where(col(Account.group_id) == group_id)).all()
+    roster = split_roster(accounts)
+    # the same few members appear on every line, their ids are formatted once
+    names: dict[TypeId, str] = {}
+
+    def name(user_id: TypeId) -> str:
+        if user_id not in names:
+            names[user_id] = str(user_id)
+        return names[user_id]
+
+    stmt = (
+        select(*EXPORT_COLUMNS)
+        .where(col(Expense.group_id) == group_id)
+        .order_by(col(Expense.paid_on), col(Expense.id))
+        .execution_options(yield_per=batch_size)
+    )
+    for batch in session.exec(stmt).partitions():
+        custom_ids = [e.id for e in batch if e.split_policy == SplitPolicy.CUSTOM]
+        splits: defaultdict[TypeId, dict[str, str]] = defaultdict(dict)
+        if len(custom_ids) > 0:
+            split_stmt = select(Split.expense_id, Split.user_id, Split.amount).where(
+                col(Split.expense_id).in_(custom_ids)
+            )
+            for expense_id, user_id, amount in session.exec(split_stmt).all():
+                splits[expense_id][name(user_id)] = str(amount)
+
+        yield [
+            (
+                e,
+                {name(u): str(s) for u, s in equal_shares(e.amount, roster[: e.split_count or 0]).items()}
+                if e.split_policy == SplitPolicy.EQUAL
+                else splits[e.id],
+            )
+            for e in batch
+        ]
+
+
+def _optional(value) -> str | None:
+    return None if value is None else str(value)
+
+
+def csv_chunks(batches: Iterable[Sequence[tuple[Row, dict[str, str]]]]) -> Iterator[str]:
+    """One line per share, so that every line carries the expense it belongs to."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_HEADER)
+    for batch in batches:
+        for e, shares in batch:
+            # the csv writer writes None as an empty field
+            expense = (
+                e.id,
+                e.paid_on.isoformat(),
+                e.title,
+                e.details,
+                e.paid_by,
+                e.amount,
+                e.currency,
+                e.original_amount,
+                e.exchange_rate,
+                e.split_policy,
+            )
+            # an expense nobody shares still gets its line, with the share columns empty
+            writer.writerows((*expense, user_id, share) for user_id, share in shares.items() or [(None, None)])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def ndjson_chunks(batches: Iterable[Sequence[tuple[Row, dict[str, str]]]]) -> Iterator[str]:
+    """One JSON document per expense and line, with its shares nested."""
+    for batch in batches:
+        lines = [
+            json.dumps(
+                {
+                    "expense_id": str(e.id),
+                    "paid_on": e.paid_on.isoformat(),
+                    "title": e.title,
+                    "details": e.details,
+                    "paid_by": str(e.paid_by),
+                    "amount": str(e.amount),
+                    "currency": e.currency,
+                    "original_amount": _optional(e.original_amount),
+                    "exchange_rate": _optional(e.exchange_rate),
+                    "split_policy": e.split_policy,
+                    "splits": [{"user_id": u, "amount": s} for u, s in shares.items()],
+                },
+                separators=(",", ":"),
+            )
+            for e, shares in batch
+        ]
+        yield "\n".join(lines) + "\n" if lines else ""
+
+
+def encode_chunks(chunks: Iterable[str], gzip: bool) -> Iterator[bytes]:
+    """Encodes the text as utf-8 and, if asked for, compresses it as one gzip stream on the fly."""
+    if not gzip:
+        for chunk in chunks:
+            if chunk:
+                yield chunk.encode()
+        return
+
+    # wbits of 16 + 15 writes the gzip header and trailer around a raw deflate stream
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk.encode())
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_group(
+    session: Session, group_id: TypeId, fmt: ExportFormat, gzip: bool, batch_size: int = EXPORT_BATCH_SIZE
+) -> Iterator[bytes]:
+    batches = expense_batches(session, group_id, batch_size)
+    chunks = csv_chunks(batches) if fmt == ExportFormat.CSV else ndjson_chunks(batches)
+    return encode_chunks(chunks, gzip)
@@ -0,0 +1,202 @@
+import time
+import hashlib
+import threading
+from collections.abc import Callable
+from datetime import datetime, timedelta, timezone
+from typing import Annotated
+
+import pydantic_core
+from fastapi import Depends, Header, Response
+from pydantic import BaseModel
+from sqlalchemy import ColumnElement, Engine, delete, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, col
+
+from app.config.vars import get_idempotency_vars
+from app.errors.error import CodeIdempotency, ErrIdempotency
+from app.repository.models import IdempotencyKey
+from app.repository.session import savepoint_session
+from app.repository.types import TypeId
+from app.utils.events import EventHub
+
+IdempotencyKeyHeader = Annotated[
+    str | None,
+    Header(alias="Idempotency-Key", min_length=1, max_length=255, description="retries with the same key write once"),
+]
+
+
+def request_hash(route: str, payload: BaseModel) -> str:
+    return hashlib.sha256(f"{route}\0{payload.model_dump_json()}".encode()).hexdigest()
+
+
+def as_utc(value: datetime) -> datetime:
+    # sqlite hands back naive datetimes, every key is stored in utc
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def replay_response(record: IdempotencyKey) -> Response:
+    headers = {"Idempotent-Replayed": "true"}
+    if record.etag is not None:
+        headers["ETag"] = record.etag
+    return Response(
+        content=record.body, status_code=record.status_code or 200, media_type="application/json", headers=headers
+    )
+
+
+def claimed_by(claim: IdempotencyKey) -> tuple[ColumnElement[bool], ...]:
+    """Matches the key as long as it is unsettled and still held by that claim, and not by a later one."""
+    return (
+        col(IdempotencyKey.user_id) == claim.user_id,
+        col(IdempotencyKey.key) == claim.key,
+        col(IdempotencyKey.claimed_at) == claim.claimed_at,
+        col(IdempotencyKey.status_code).is_(None),
+    )
+
+
+def purge_expired_keys(session: Session, now: datetime) -> int:
+    """Drops the keys past their time to live and returns how many, retries after that write again."""
+    result = session.exec(delete(IdempotencyKey).where(col(IdempotencyKey.expires_at) < now))  # type: ignore
+    return result.rowcount
+
+
+class IdempotencyStore:
+    """
+    Runs a write once per `Idempotency-Key` of a user. The key is claimed with an insert that is
+    committed before the write starts, so every duplicate finds it. A duplicate that arrives
+    while the original is being handled waits for it instead of running it again, and is then
+    answered with the response the original stored, without touching the ledger. The response
+    is stored in the transaction of the write, so a key is settled exactly when its write is
+    committed, and a write whose claim was taken over after its lease ran out is rolled back
+    instead of being committed twice. A write that fails releases its key, only successful
+    responses are stored and replayed.
+    """
+
+    def __init__(self, ttl_seconds: int, lease_seconds: float, wait_seconds: float, poll_seconds: float):
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.lease = timedelta(seconds=lease_seconds)
+        self.wait_seconds = wait_seconds
+        self.poll_seconds = poll_seconds
+        # woken whenever a key of this process is completed or released
+        self._settled = threading.Condition()
+
+    def run[T](
+        self,
+        session: Session,
+        user_id: TypeId,
+        key: str | None,
+        route: str,
+        payload: BaseModel,
+        status_code: int,
+        response: Response,
+        events: EventHub,
+        handler: Callable[[Session], T],
+    ) -> T | Response:
+        if key is None:
+            return handler(session)
+
+        # keys are claimed in transactions of their own, ahead of the write
+        engine = session.get_bind().engine
+        record = self.claim(engine, user_id, key, route, request_hash(route, payload))
+        if record.status_code is not None:
+            return replay_response(record)
+        try:
+            # the commits of the handler only release savepoints, the write and its response commit together
+            with savepoint_session(engine) as (write_session, transaction), events.deferred() as pending:
+                result = handler(write_session)
+                body = pydantic_core.to_json(result, by_alias=True)
+                self.complete(write_session, record, status_code, body, response.headers.get("etag"))
+                transaction.commit()
+        except BaseException:
+            self.release(engine, record)
+            raise
+        finally:
+            with self._settled:
+                self._settled.notify_all()
+        events.flush(pending)
+        return result
+
+    def claim(self, engine: Engine, user_id: TypeId, key: str, route: str, digest: str) -> IdempotencyKey:
+        """Claims the key and returns the claim, or returns the settled key of the request that claimed it first."""
+        deadline = time.monotonic() + self.wait_seconds
+        while True:
+            with Session(engine, expire_on_commit=False) as session:
+                now = datetime.now(timezone.utc)
+                claim = IdempotencyKey(
+                    user_id=user_id,
+                    key=key,
+                    route=route,
+                    request_hash=digest,
+                    claimed_at=now,
+                    expires_at=now + self.ttl,
+                )
+                session.add(claim)
+                try:
+                    session.commit()
+                    return claim
+                except IntegrityError:
+                    session.rollback()
+
+                record = session.get(IdempotencyKey, (user_id, key))
+                if record is None:
+                    # released in the meantime, the key is free again
+                    continue
+                settled = record.status_code is not None
+                if as_utc(record.expires_at) <= now or (not settled and as_utc(record.claimed_at) + self.lease <= now):
+                    # an expired key, or one whose request died before it finished, is claimed anew
+                    session.delete(record)
+                    session.commit()
+                    continue
+                if record.route != route or record.request_hash != digest:
+                    raise ErrIdempotency(
+                        code=CodeIdempotency.KEY_REUSED,
+                        status=422,
+                        detail="the idempotency key was already used for a different request",
+                    )
+                if settled:
+                    return record
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise ErrIdempotency(
+                    code=CodeIdempotency.KEY_IN_USE, detail="a request with the idempotency key is still being handled"
+                )
+            with self._settled:
+                self._settled.wait(min(remaining, self.poll_seconds))
+
+    def complete(self, session: Session, claim: IdempotencyKey, status_code: int, body: bytes, etag: str | None):
+        """Stores the response with the write, in the transaction of the session that wrote it."""
+        result = session.exec(
+            update(IdempotencyKey)  # type: ignore
+            .where(*claimed_by(claim))
+            .values(status_code=status_code, body=body, etag=etag)
+        )
+        if result.rowcount == 0:
+            # the lease ran out and a duplicate claimed the key anew, that request makes the write
+            raise ErrIdempotency(
+                code=CodeIdempotency.KEY_IN_USE, detail="a request with the idempotency key is still being handled"
+            )
+
+    def release(self, engine: Engine, claim: IdempotencyKey) -> None:
+        with Session(engine) as session:
+            session.exec(delete(IdempotencyKey).where(*claimed_by(claim)))  # type: ignore
+            session.commit()
+
+
+def configured_idempotency_store() -> IdempotencyStore:
+    idempotency_vars = get_idempotency_vars()
+    return IdempotencyStore(
+        ttl_seconds=idempotency_vars.ttl_seconds,
+        lease_seconds=idempotency_vars.lease_seconds,
+        wait_seconds=idempotency_vars.wait_seconds,
+        poll_seconds=idempotency_vars.poll_seconds,
+    )
+
+
+idempotency_store = configured_idempotency_store()
+
+
+def get_idempotency_store() -> IdempotencyStore:
+    return idempotency_store
+
+
+IdempotencyStoreDep = Annotated[IdempotencyStore, Depends(get_idempotency_store)]
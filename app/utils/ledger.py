@@ -0,0 +1,164 @@
+import heapq
+from collections import defaultdict
+from collections.abc import Iterable, Sequence
+from datetime import datetime, timezone
+from decimal import ROUND_DOWN, Decimal
+
+from sqlalchemy import bindparam, update
+from sqlalchemy.orm import selectinload
+from sqlmodel import Session, col, select
+
+from app.repository.enums import ChangeKind, MembershipStatus, PaymentStatus, SplitPolicy
+from app.repository.models import Account, Expense, Payment
+from app.repository.types import TypeId
+from app.utils.changelog import log_selected_changes
+
+# smallest amount representable by TypeMoney (4 decimal places)
+MONEY_QUANTUM = Decimal("0.0001")
+
+
+def _joined_at(account: Account) -> datetime:
+    # sqlite hands back naive datetimes while in-memory objects can still hold
+    # aware ones, normalize both so that the roster order is always comparable
+    joined = account.member_since or datetime.min
+    if joined.tzinfo is None:
+        return joined.replace(tzinfo=timezone.utc)
+    return joined.astimezone(timezone.utc)
+
+
+def split_roster(accounts: Iterable[Account]) -> list[TypeId]:
+    """
+    Returns the owners of the active accounts of a group in the order they joined.
+
+    Members never leave a group today, so the active roster only grows by appending
+    at the end. Hence the first `split_count` members of the roster are exactly the
+    members who were active when an equally split expense was recorded, which lets
+    an equal split be stored as a single count instead of one row per member.
+    """
+    active = [a for a in accounts if a.membership_status == MembershipStatus.ACTIVE]
+    active.sort(key=lambda a: (_joined_at(a), a.owner_id))
+    return [a.owner_id for a in active]
+
+
+def equal_shares(amount: Decimal, members: Sequence[TypeId]) -> dict[TypeId, Decimal]:
+    """
+    Divides the amount equally among the members. The quanta left over after rounding
+    the shares down are handed out one each to the first members, so the shares always
+    add up to exactly the amount and every reader expands the split the same way.
+    """
+    if len(members) == 0:
+        return {}
+    share = (amount / len(members)).quantize(MONEY_QUANTUM, rounding=ROUND_DOWN)
+    leftover = int((amount - share * len(members)) / MONEY_QUANTUM)
+    return {m: share + (MONEY_QUANTUM if i < leftover else 0) for i, m in enumerate(members)}
+
+
+def expense_shares(expense: Expense, roster: Sequence[TypeId]) -> dict[TypeId, Decimal]:
+    """Expands the split of an expense into the share owed by each member."""
+    if expense.split_policy == SplitPolicy.EQUAL:
+        return equal_shares(expense.amount, roster[: expense.split_count or 0])
+    return {s.user_id: s.amount for s in expense.splits}
+
+
+def expense_balance_deltas(expense: Expense, roster: Sequence[TypeId]) -> dict[TypeId, Decimal]:
+    """Returns the change an expense makes to the balance of every member it involves."""
+    deltas: defaultdict[TypeId, Decimal] = defaultdict(Decimal)
+    deltas[expense.paid_by] += expense.amount
+    for user_id, share in expense_shares(expense, roster).items():
+        deltas[user_id] -= share
+    return dict(deltas)
+
+
+def merge_deltas(*all_deltas: dict[TypeId, Decimal]) -> dict[TypeId, Decimal]:
+    merged: defaultdict[TypeId, Decimal] = defaultdict(Decimal)
+    for deltas in all_deltas:
+        for user_id, delta in deltas.items():
+            merged[user_id] += delta
+    return {user_id: delta for user_id, delta in merged.items() if delta != 0}
+
+
+def negate_deltas(deltas: dict[TypeId, Decimal]) -> dict[TypeId, Decimal]:
+    return {user_id: -delta for user_id, delta in deltas.items()}
+
+
+def compute_group_balances(session: Session, group_id: TypeId) -> dict[TypeId, Decimal]:
+    """Recomputes the balance of every member of a group by replaying its whole ledger."""
+    accounts = session.exec(select(Account).where(col(Account.group_id) == group_id)).all()
+    roster = split_roster(accounts)
+
+    stmt = select(Expense).where(col(Expense.group_id) == group_id).options(selectinload(Expense.splits))  # type: ignore
+    expenses = session.exec(stmt).all()
+
+    payment_stmt = select(Payment).where(
+        col(Payment.group_id) == group_id,
+        col(Payment.status) == PaymentStatus.SETTLED,
+    )
+    payments = session.exec(payment_stmt).all()
+
+    balances = merge_deltas(
+        *(expense_balance_deltas(e, roster) for e in expenses),
+        *(payment_balance_deltas(p.payer_id, p.payee_id, p.amount) for p in payments),
+    )
+    return {user_id: balances.get(user_id, Decimal(0)) for user_id in roster}
+
+
+def apply_balance_deltas(session: Session, group_id: TypeId, deltas: dict[TypeId, Decimal]) -> None:
+    """
+    Adds the deltas to the active accounts of the group. Every account gets a single atomic
+    `balance = balance + delta` statement, all sent in one round trip, so that concurrent
+    writers never overwrite each other the way a read-modify-write of the balance would.
+    """
+    if len(deltas) == 0:
+        return
+
+    table = Account.__table__  # type: ignore
+    stmt = (
+        update(table)
+        .where(
+            table.c.group_id == group_id,
+            table.c.owner_id == bindparam("b_owner_id"),
+            table.c.membership_status == MembershipStatus.ACTIVE,
+        )
+        .values(balance=table.c.balance + bindparam("b_delta"))
+    )
+    session.execute(stmt, [{"b_owner_id": user_id, "b_delta": delta} for user_id, delta in deltas.items()])
+    changed = select(Account.id).where(
+        col(Account.group_id) == group_id,
+        col(Account.owner_id).in_(deltas),
+        col(Account.membership_status) == MembershipStatus.ACTIVE,
+    )
+    log_selected_changes(session, ChangeKind.ACCOUNT, group_id, changed)
+
+    # the balances held by accounts already loaded in this session are stale now
+    for obj in list(session.identity_map.values()):
+        if isinstance(obj, Account) and obj.group_id == group_id:
+            session.expire(obj, ["balance"])
+
+
+def settle_up_plan(balances: dict[TypeId, Decimal]) -> list[tuple[TypeId, TypeId, Decimal]]:
+    """
+    Returns the payments as (payer, payee, amount) that bring every balance to zero. The
+    largest debtor always pays the largest creditor, so that the plan needs at most one
+    payment less than the number of members who have a non zero balance.
+    """
+    debtors = [(balance, user_id) for user_id, balance in balances.items() if balance < 0]
+    creditors = [(-balance, user_id) for user_id, balance in balances.items() if balance > 0]
+    heapq.heapify(debtors)
+    heapq.heapify(creditors)
+
+    plan: list[tuple[TypeId, TypeId, Decimal]] = []
+    while debtors and creditors:
+        debt, debtor = heapq.heappop(debtors)
+        credit, creditor = heapq.heappop(creditors)
+        amount = min(-debt, -credit)
+        plan.append((debtor, creditor, amount))
+        if debt + amount < 0:
+            heapq.heappush(debtors, (debt + amount, debtor))
+        if credit + amount < 0:
+            heapq.heappush(creditors, (credit + amount, creditor))
+    return plan
+
+
+def payment_balance_deltas(payer_id: TypeId, payee_id: TypeId, amount: Decimal) -> dict[TypeId, Decimal]:
+    """The payer owes that much less to the group and the payee is owed that much less."""
+    return merge_deltas({payer_id: amount}, {payee_id: -amount})
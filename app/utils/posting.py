@@ -0,0 +1,28 @@
+from collections.abc import Sequence
+
+from sqlmodel import Session
+
+from app.repository.enums import ChangeKind
+from app.repository.models import Expense
+from app.repository.types import TypeId
+from app.utils.changelog import log_changes
+from app.utils.ledger import apply_balance_deltas, expense_balance_deltas, merge_deltas
+from app.utils.rollup import apply_rollup_deltas, expense_rollup_deltas, merge_rollup_deltas
+from app.utils.search import index_expenses
+
+
+def post_expenses(session: Session, group_id: TypeId, expenses: Sequence[Expense], roster: Sequence[TypeId]) -> None:
+    """
+    Records new expenses of one group in the ledger. The balances, the monthly rollups, the
+    search index and the change log are each written once for the whole batch, so recording
+    many expenses together costs about as many statements as recording one.
+    """
+    if len(expenses) == 0:
+        return
+
+    session.add_all(expenses)
+    # credit the payers and debit every member their shares in one pass
+    apply_balance_deltas(session, group_id, merge_deltas(*(expense_balance_deltas(e, roster) for e in expenses)))
+    apply_rollup_deltas(session, group_id, merge_rollup_deltas(*(expense_rollup_deltas(e, roster) for e in expenses)))
+    index_expenses(session, [e.id for e in expenses])
+    log_changes(session, ChangeKind.EXPENSE, group_id, [e.id for e in expenses])
@@ -0,0 +1,199 @@
+import os
+import asyncio
+import hashlib
+import tempfile
+import threading
+from collections.abc import AsyncIterator, Callable
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Annotated, BinaryIO
+
+from fastapi import Depends, status
+from PIL import Image, ImageOps
+
+from app.config.vars import StorageVarsDep, get_storage_vars
+from app.errors.error import CodeExpense, ErrExpense
+from app.logger import logger
+
+RECEIPT_DIR = "receipts"
+# the body is written to disk once this much of it has arrived, never held in memory as a whole
+WRITE_BUFFER_BYTES = 1024 * 1024
+
+# content type, extension and leading bytes of every kind of receipt that is accepted, the kind
+# is told from the content itself rather than from what the client claims it uploads
+RECEIPT_SIGNATURES: tuple[tuple[str, str, Callable[[bytes], bool]], ...] = (
+    ("image/jpeg", ".jpg", lambda head: head.startswith(b"\xff\xd8\xff")),
+    ("image/png", ".png", lambda head: head.startswith(b"\x89PNG\r\n\x1a\n")),
+    ("image/webp", ".webp", lambda head: head[:4] == b"RIFF" and head[8:12] == b"WEBP"),
+    ("application/pdf", ".pdf", lambda head: head.startswith(b"%PDF-")),
+)
+SNIFF_BYTES = 12
+
+
+def sniff_receipt(head: bytes) -> tuple[str, str]:
+    for content_type, extension, matches in RECEIPT_SIGNATURES:
+        if matches(head):
+            return content_type, extension
+    raise ErrExpense(
+        status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+        code=CodeExpense.UNSUPPORTED_RECEIPT,
+        detail="receipts must be jpeg, png, webp or pdf",
+    )
+
+
+@dataclass(frozen=True)
+class StoredReceipt:
+    digest: str
+    size: int
+    content_type: str
+    # relative to the root of the store, which is the directory served under /static
+    path: str
+    # false when an identical receipt was already stored
+    created: bool
+
+
+def receipt_path(digest: str, extension: str) -> str:
+    # fanned out by the first byte of the digest so that no directory grows too large
+    return f"{RECEIPT_DIR}/{digest[:2]}/{digest}{extension}"
+
+
+def thumbnail_path(digest: str) -> str:
+    return f"{RECEIPT_DIR}/{digest[:2]}/{digest}.thumb.webp"
+
+
+class ReceiptStore:
+    """
+    Content addressed store of receipts on the local disk. The body is hashed while it streams
+    to a temporary file and the file is then moved to the path named by its digest, an upload
+    whose digest is already stored is dropped instead. Stored files never change, so they can
+    be served with immutable cache headers and referenced from any number of expenses.
+    """
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+
+    async def save(self, chunks: AsyncIterator[bytes]) -> StoredReceipt:
+        tmp_dir = self.root / RECEIPT_DIR / "tmp"
+        await asyncio.to_thread(tmp_dir.mkdir, parents=True, exist_ok=True)
+        file: BinaryIO = await asyncio.to_thread(tempfile.NamedTemporaryFile, dir=tmp_dir, delete=False)
+        tmp = Path(file.name)
+        hasher = hashlib.sha256()
+        head = b""
+        size = 0
+        buffer = bytearray()
+
+        def flush(data: bytes):
+            # hashlib releases the gil on large inputs, hashing runs alongside the event loop
+            hasher.update(data)
+            file.write(data)
+
+        try:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > self.max_bytes:
+                    raise ErrExpense(
+                        status=status.HTTP_413_CONTENT_TOO_LARGE,
+                        code=CodeExpense.RECEIPT_TOO_LARGE,
+                        detail=f"receipts are limited to {self.max_bytes} bytes",
+                    )
+                if len(head) < SNIFF_BYTES:
+                    head = (head + chunk)[:SNIFF_BYTES]
+                buffer += chunk
+                if len(buffer) >= WRITE_BUFFER_BYTES:
+                    await asyncio.to_thread(flush, bytes(buffer))
+                    buffer.clear()
+            await asyncio.to_thread(flush, bytes(buffer))
+            await asyncio.to_thread(file.close)
+            content_type, extension = sniff_receipt(head)
+
+            digest = hasher.hexdigest()
+            path = receipt_path(digest, extension)
+            created = await asyncio.to_thread(self._publish, tmp, self.root / path)
+            return StoredReceipt(digest=digest, size=size, content_type=content_type, path=path, created=created)
+        finally:
+            await asyncio.to_thread(file.close)
+            tmp.unlink(missing_ok=True)
+
+    @staticmethod
+    def _publish(tmp: Path, target: Path) -> bool:
+        if target.exists():
+            return False
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp.chmod(0o644)
+        # atomic, a concurrent upload of the same receipt replaces it with identical content
+        os.replace(tmp, target)
+        return True
+
+
+def get_receipt_store(storage_vars: StorageVarsDep) -> ReceiptStore:
+    return ReceiptStore(Path(storage_vars.static_root), storage_vars.receipt_max_bytes)
+
+
+ReceiptStoreDep = Annotated[ReceiptStore, Depends(get_receipt_store)]
+
+
+def make_thumbnail(source: str, target: str, size: int) -> None:
+    """Runs in a worker process, decoding a large receipt is too slow for the request path."""
+    with Image.open(source) as image:
+        # jpeg decodes straight at a fraction of its size instead of decoding every pixel
+        image.draft("RGB", (size, size))
+        thumbnail = ImageOps.exif_transpose(image)
+        thumbnail.thumbnail((size, size))
+        tmp = f"{target}.{os.getpid()}.tmp"
+        thumbnail.convert("RGB").save(tmp, "WEBP", quality=80)
+    os.replace(tmp, target)
+
+
+class Thumbnailer:
+    """Writes receipt thumbnails in a pool of worker processes, started on the first receipt."""
+
+    def __init__(self, size: int, make_executor: Callable[[], Executor]):
+        self.size = size
+        self._make_executor = make_executor
+        self._executor: Executor | None = None
+        self._lock = threading.Lock()
+
+    def submit(self, root: Path, receipt: StoredReceipt) -> str | None:
+        """Queues the thumbnail of the receipt and returns the path it will be written to."""
+        if not receipt.content_type.startswith("image/"):
+            return None
+        path = thumbnail_path(receipt.digest)
+        if (root / path).exists():
+            return path
+        with self._lock:
+            if self._executor is None:
+                self._executor = self._make_executor()
+            executor = self._executor
+        future = executor.submit(make_thumbnail, str(root / receipt.path), str(root / path), self.size)
+        future.add_done_callback(lambda f: self._log_failure(f, receipt.digest))
+        return path
+
+    @staticmethod
+    def _log_failure(future: Future, digest: str) -> None:
+        if (exc := future.exception()) is not None:
+            logger.warning("failed to write the thumbnail of receipt %s: %r", digest, exc)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+def configured_thumbnailer() -> Thumbnailer:
+    storage_vars = get_storage_vars()
+    return Thumbnailer(
+        storage_vars.thumbnail_size, lambda: ProcessPoolExecutor(max_workers=storage_vars.thumbnail_workers)
+    )
+
+
+thumbnailer = configured_thumbnailer()
+
+
+def get_thumbnailer() -> Thumbnailer:
+    return thumbnailer
+
+
+ThumbnailerDep = Annotated[Thumbnailer, Depends(get_thumbnailer)]
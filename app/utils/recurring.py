@@ -0,0 +1,184 @@
+import heapq
+import asyncio
+import calendar
+import threading
+from collections.abc import Callable
+from datetime import date, datetime, time, timedelta, timezone
+
+from sqlalchemy import Engine
+from sqlmodel import Session, col, select
+
+from app.logger import logger
+from app.repository.enums import RecurrenceFrequency
+from app.repository.models import RecurringExpense
+from app.repository.types import TypeId
+
+
+def add_months(d: date, months: int) -> date:
+    """Moves the date by whole months, falling back to the last day of months that are too short."""
+    index = d.year * 12 + d.month - 1 + months
+    year, month = divmod(index, 12)
+    month += 1
+    return date(year, month, min(d.day, calendar.monthrange(year, month)[1]))
+
+
+def occurrence_on(template: RecurringExpense, n: int) -> date:
+    """
+    Day of the nth occurrence, counting from 0. Every occurrence is computed from the first one
+    rather than from the one before, so a monthly schedule starting on the 31st falls on the
+    last day of February and is back on the 31st in March instead of drifting to the 28th.
+    """
+    step = n * template.interval
+    match template.frequency:
+        case RecurrenceFrequency.DAILY:
+            return template.starts_on + timedelta(days=step)
+        case RecurrenceFrequency.WEEKLY:
+            return template.starts_on + timedelta(weeks=step)
+        case RecurrenceFrequency.MONTHLY:
+            return add_months(template.starts_on, step)
+        case RecurrenceFrequency.YEARLY:
+            return add_months(template.starts_on, 12 * step)
+
+
+def next_occurrence(template: RecurringExpense, n: int) -> date | None:
+    """Day of the nth occurrence, none when the schedule ends before it."""
+    on = occurrence_on(template, n)
+    if template.ends_on is not None and on > template.ends_on:
+        return None
+    return on
+
+
+def due_occurrences(template: RecurringExpense, today: date, limit: int) -> list[tuple[int, date]]:
+    """The occurrences not yet recorded that fall on or before today, oldest first and at most `limit` of them."""
+    due: list[tuple[int, date]] = []
+    n = template.occurrences
+    while len(due) < limit:
+        on = next_occurrence(template, n)
+        if on is None or on > today:
+            break
+        due.append((n, on))
+        n += 1
+    return due
+
+
+def utc_today() -> date:
+    return datetime.now(timezone.utc).date()
+
+
+# records what is due of one template up to the day, returns when the template is due next
+Materialize = Callable[[Session, TypeId, date], date | None]
+
+
+class RecurringScheduler:
+    """
+    Min-heap of the enabled templates keyed by the day they are due next, so that finding what
+    is due pops entries off the top instead of scanning every template. Templates changed after
+    they were pushed are pushed again, the entry with the older day is recognised as stale when
+    it reaches the top and is dropped. The heap only decides when to look at a template, the
+    template row stays the source of truth and every occurrence is recorded at most once even
+    when several schedulers run against the same database.
+    """
+
+    def __init__(self, materialize: Materialize):
+        self._materialize = materialize
+        self._heap: list[tuple[date, TypeId]] = []
+        self._due: dict[TypeId, date] = {}
+        self._lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._wakeup: asyncio.Event | None = None
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def load(self, session: Session) -> None:
+        """Rebuilds the heap from the templates in the database, in one query over the due index."""
+        stmt = select(RecurringExpense.id, RecurringExpense.next_due).where(
+            col(RecurringExpense.enabled), col(RecurringExpense.next_due).is_not(None)
+        )
+        rows = session.exec(stmt).all()
+        with self._lock:
+            self._due = {template_id: next_due for template_id, next_due in rows if next_due is not None}
+            self._heap = [(next_due, template_id) for template_id, next_due in self._due.items()]
+            heapq.heapify(self._heap)
+
+    def schedule(self, template_id: TypeId, next_due: date | None) -> None:
+        """Tells the scheduler when a template is due next, none once it should no longer run."""
+        with self._lock:
+            if next_due is None:
+                self._due.pop(template_id, None)
+            elif self._due.get(template_id) != next_due:
+                self._due[template_id] = next_due
+                heapq.heappush(self._heap, (next_due, template_id))
+        # requests run on worker threads, the scheduler loop has to be woken on its own thread
+        if next_due is not None and self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def next_due(self) -> date | None:
+        with self._lock:
+            self._drop_stale()
+            return self._heap[0][0] if self._heap else None
+
+    def _drop_stale(self) -> None:
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+    def _pop_due(self, today: date) -> tuple[date, TypeId] | None:
+        with self._lock:
+            self._drop_stale()
+            if not self._heap or self._heap[0][0] > today:
+                return None
+            due, template_id = heapq.heappop(self._heap)
+            del self._due[template_id]
+            return due, template_id
+
+    def run_due(self, session: Session, today: date) -> int:
+        """
+        Records everything due up to today and returns how many templates it handled. A template
+        far behind is recorded a batch at a time, it goes back on the heap after every batch and
+        comes straight back off while it is still due, so a long catch up never holds one
+        transaction open for all of its occurrences.
+        """
+        handled = 0
+        while (popped := self._pop_due(today)) is not None:
+            due, template_id = popped
+            try:
+                next_due = self._materialize(session, template_id, today)
+            except Exception:  # noqa: BLE001
+                # one broken template must not stop the others from being recorded, it is retried tomorrow
+                logger.exception("failed to record the occurrences of recurring expense %s", template_id)
+                session.rollback()
+                next_due = due
+            if next_due is not None and next_due <= due:
+                # no progress was made, looking again today would only fail the same way
+                next_due = today + timedelta(days=1)
+            self.schedule(template_id, next_due)
+            handled += 1
+        return handled
+
+    async def run(self, engine: Engine, max_sleep_seconds: int) -> None:
+        """Runs until cancelled, sleeping until the next template is due or one is scheduled."""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+
+        def load():
+            with Session(engine) as session:
+                self.load(session)
+
+        def run_due():
+            with Session(engine) as session:
+                self.run_due(session, utc_today())
+
+        await asyncio.to_thread(load)
+        while True:
+            self._wakeup.clear()
+            await asyncio.to_thread(run_due)
+
+            sleep = float(max_sleep_seconds)
+            next_due = self.next_due()
+            if next_due is not None:
+                due_at = datetime.combine(next_due, time.min, tzinfo=timezone.utc)
+                sleep = min(sleep, max(0.0, (due_at - datetime.now(timezone.utc)).total_seconds()))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=sleep)
+            except TimeoutError:
+                pass
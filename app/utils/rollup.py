@@ -0,0 +1,144 @@
+import calendar
+from collections import defaultdict
+from collections.abc import Sequence
+from datetime import date
+from decimal import Decimal
+from typing import Any
+
+from sqlalchemy import bindparam, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import selectinload
+from sqlmodel import Session, col, delete, select
+
+from app.repository.models import Account, Expense, MonthlySpend
+from app.repository.types import TypeId
+from app.utils.ledger import expense_shares, split_roster
+
+# (user_id, year_month) -> (paid, owed)
+RollupDeltas = dict[tuple[TypeId, str], tuple[Decimal, Decimal]]
+
+
+def year_month(d: date) -> str:
+    return f"{d.year:04d}-{d.month:02d}"
+
+
+def month_end(month: str) -> date:
+    year, number = int(month[:4]), int(month[5:])
+    return date(year, number, calendar.monthrange(year, number)[1])
+
+
+def month_deltas(month: str, paid: dict[TypeId, Decimal], owed: dict[TypeId, Decimal]) -> RollupDeltas:
+    """Changes to the rollup rows of one month, from what members paid and what they owe."""
+    deltas: defaultdict[tuple[TypeId, str], list[Decimal]] = defaultdict(lambda: [Decimal(0), Decimal(0)])
+    for user_id, amount in paid.items():
+        deltas[(user_id, month)][0] += amount
+    for user_id, amount in owed.items():
+        deltas[(user_id, month)][1] += amount
+    return {key: (p, o) for key, (p, o) in deltas.items()}
+
+
+def expense_rollup_deltas(expense: Expense, roster: Sequence[TypeId]) -> RollupDeltas:
+    return month_deltas(year_month(expense.paid_on), {expense.paid_by: expense.amount}, expense_shares(expense, roster))
+
+
+def merge_rollup_deltas(*all_deltas: RollupDeltas) -> RollupDeltas:
+    merged: defaultdict[tuple[TypeId, str], list[Decimal]] = defaultdict(lambda: [Decimal(0), Decimal(0)])
+    for deltas in all_deltas:
+        for key, (paid, owed) in deltas.items():
+            merged[key][0] += paid
+            merged[key][1] += owed
+    return {key: (paid, owed) for key, (paid, owed) in merged.items() if paid != 0 or owed != 0}
+
+
+def negate_rollup_deltas(deltas: RollupDeltas) -> RollupDeltas:
+    return {key: (-paid, -owed) for key, (paid, owed) in deltas.items()}
+
+
+# dialects that add to a rollup row with `INSERT ... ON CONFLICT DO UPDATE`
+UPSERT_DIALECTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def apply_rollup_deltas(session: Session, group_id: TypeId, deltas: RollupDeltas) -> None:
+    """
+    Adds the deltas to the rollup rows of the group with one `INSERT ... ON CONFLICT DO UPDATE`
+    per row, all sent in one round trip. Like the balances, the rows are only ever incremented
+    in place, so it has to run in the same transaction as the ledger write it accounts for.
+    """
+    if len(deltas) == 0:
+        return
+
+    rows = [
+        {"group_id": group_id, "user_id": user_id, "year_month": month, "paid": paid, "owed": owed}
+        for (user_id, month), (paid, owed) in deltas.items()
+    ]
+    upsert = UPSERT_DIALECTS.get(session.get_bind().dialect.name)
+    if upsert is None:
+        increment_or_insert(session, group_id, rows)
+        return
+
+    insert = upsert(MonthlySpend.__table__)  # type: ignore
+    stmt = insert.on_conflict_do_update(
+        index_elements=["group_id", "user_id", "year_month"],
+        set_={
+            "paid": MonthlySpend.__table__.c.paid + insert.excluded.paid,  # type: ignore
+            "owed": MonthlySpend.__table__.c.owed + insert.excluded.owed,  # type: ignore
+        },
+    )
+    session.execute(stmt, rows)
+
+
+def increment_or_insert(session: Session, group_id: TypeId, rows: list[dict[str, Any]]) -> None:
+    """
+    The upsert for databases without `ON CONFLICT`, in three round trips whatever the number of
+    rows. The rows that exist are incremented in place and the others inserted. Two writers that
+    create the same row at once make one of them fail on the primary key and roll back its write.
+    """
+    table = MonthlySpend.__table__
+    months = {row["year_month"] for row in rows}
+    stmt = select(table.c.user_id, table.c.year_month).where(  # type: ignore
+        table.c.group_id == group_id,  # type: ignore
+        table.c.year_month.in_(months),  # type: ignore
+    )
+    existing = {(user_id, month) for user_id, month in session.execute(stmt).all()}
+
+    increments = [row for row in rows if (row["user_id"], row["year_month"]) in existing]
+    if len(increments) > 0:
+        # bound under names of their own, the columns keep theirs for the values they are added to
+        increment = (
+            update(table)
+            .where(
+                table.c.group_id == bindparam("key_group_id"),  # type: ignore
+                table.c.user_id == bindparam("key_user_id"),  # type: ignore
+                table.c.year_month == bindparam("key_year_month"),  # type: ignore
+            )
+            .values(paid=table.c.paid + bindparam("delta_paid"), owed=table.c.owed + bindparam("delta_owed"))  # type: ignore
+        )
+        session.execute(
+            increment,
+            [
+                {
+                    "key_group_id": row["group_id"],
+                    "key_user_id": row["user_id"],
+                    "key_year_month": row["year_month"],
+                    "delta_paid": row["paid"],
+                    "delta_owed": row["owed"],
+                }
+                for row in increments
+            ],
+        )
+    inserts = [row for row in rows if (row["user_id"], row["year_month"]) not in existing]
+    if len(inserts) > 0:
+        session.execute(table.insert(), inserts)  # type: ignore
+
+
+def rebuild_rollups(session: Session, group_id: TypeId) -> int:
+    """Recomputes the rollup rows of a group from its whole ledger, returns how many rows it wrote."""
+    accounts = session.exec(select(Account).where(col(Account.group_id) == group_id)).all()
+    roster = split_roster(accounts)
+
+    stmt = select(Expense).where(col(Expense.group_id) == group_id).options(selectinload(Expense.splits))  # type: ignore
+    deltas = merge_rollup_deltas(*(expense_rollup_deltas(e, roster) for e in session.exec(stmt).all()))
+
+    session.exec(delete(MonthlySpend).where(col(MonthlySpend.group_id) == group_id))
+    apply_rollup_deltas(session, group_id, deltas)
+    return len(deltas)
@@ -0,0 +1,316 @@
+import re
+import base64
+from abc import ABC, abstractmethod
+from collections.abc import Sequence
+from dataclasses import dataclass
+
+from sqlalchemy import Connection, Uuid, and_, bindparam, case, event, func, literal, or_, text
+from sqlmodel import Session, col, select
+
+from app.errors.error import CodeSearch, ErrSearch
+from app.repository.models import Expense
+from app.repository.types import TypeId, str_to_id
+
+WORD = re.compile(r"\w+", re.UNICODE)
+
+
+@dataclass(frozen=True)
+class SearchHit:
+    expense_id: TypeId
+    # higher is more relevant, only comparable between hits of the same query and backend
+    score: float
+
+
+@dataclass(frozen=True)
+class SearchCursor:
+    """Position after the last hit of a page, hits are ordered by (score desc, expense id)."""
+
+    score: float
+    expense_id: TypeId
+
+    def encode(self) -> str:
+        return base64.urlsafe_b64encode(f"{self.score!r}:{self.expense_id.hex}".encode()).decode()
+
+    @classmethod
+    def decode(cls, cursor: str) -> "SearchCursor":
+        try:
+            score, expense_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(":")
+            return cls(score=float(score), expense_id=str_to_id(expense_id))
+        except ValueError as exc:
+            raise ErrSearch(code=CodeSearch.INVALID_CURSOR, detail="cursor is not one returned by a search") from exc
+
+
+def search_terms(query: str) -> list[str]:
+    """Splits the query into words, every other character only separates words."""
+    return [w.lower() for w in WORD.findall(query)]
+
+
+class SearchBackend(ABC):
+    """
+    Full text index over the title and details of expenses. Writes to expenses call `index` and
+    `unindex` in their own transaction, so the index never sees uncommitted or lost changes.
+    """
+
+    @abstractmethod
+    def create_schema(self, connection: Connection) -> None: ...
+
+    @abstractmethod
+    def drop_schema(self, connection: Connection) -> None: ...
+
+    @abstractmethod
+    def index(self, session: Session, expense_ids: Sequence[TypeId]) -> None:
+        """Indexes the expenses as they are in the expense table right now, replacing older entries."""
+
+    @abstractmethod
+    def unindex(self, session: Session, expense_ids: Sequence[TypeId]) -> None: ...
+
+    @abstractmethod
+    def search(
+        self, session: Session, group_id: TypeId, terms: list[str], limit: int, after: SearchCursor | None
+    ) -> list[SearchHit]:
+        """Expenses of the group containing every term, the last one as a prefix, best match first."""
+
+    @abstractmethod
+    def rebuild(self, session: Session) -> int:
+        """Rebuilds the whole index from the expense table, returns how many expenses it holds."""
+
+
+class SqliteSearchBackend(SearchBackend):
+    """
+    FTS5 table with one row per expense. FTS5 rows are addressed by an integer rowid while
+    expenses have uuids, a small table hands out a stable docid per expense. The group id is
+    indexed as a token of its own column, so restricting a query to a group intersects posting
+    lists inside the index instead of filtering every match of every group afterwards.
+    """
+
+    def create_schema(self, connection: Connection) -> None:
+        connection.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS expense_search_doc ("
+                "docid INTEGER PRIMARY KEY, expense_id CHAR(32) NOT NULL UNIQUE)"
+            )
+        )
+        connection.execute(
+            text(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS expense_search "
+                "USING fts5(title, details, group_key, tokenize = 'unicode61 remove_diacritics 2')"
+            )
+        )
+
+    def drop_schema(self, connection: Connection) -> None:
+        connection.execute(text("DROP TABLE IF EXISTS expense_search"))
+        connection.execute(text("DROP TABLE IF EXISTS expense_search_doc"))
+
+    def index(self, session: Session, expense_ids: Sequence[TypeId]) -> None:
+        if len(expense_ids) == 0:
+            return
+        ids = {"ids": [i.hex for i in expense_ids]}
+        self.unindex_entries(session, ids)
+        session.execute(
+            text(
+                "INSERT OR IGNORE INTO expense_search_doc (expense_id) SELECT id FROM expense WHERE id IN :ids"
+            ).bindparams(bindparam("ids", expanding=True)),
+            ids,
+        )
+        session.execute(
+            text(
+                "INSERT INTO expense_search (rowid, title, details, group_key) "
+                "SELECT d.docid, e.title, coalesce(e.details, ''), e.group_id "
+                "FROM expense e JOIN expense_search_doc d ON d.expense_id = e.id WHERE e.id IN :ids"
+            ).bindparams(bindparam("ids", expanding=True)),
+            ids,
+        )
+
+    def unindex_entries(self, session: Session, ids: dict[str, list[str]]) -> None:
+        session.execute(
+            text(
+                "DELETE FROM expense_search WHERE rowid IN "
+                "(SELECT docid FROM expense_search_doc WHERE expense_id IN :ids)"
+            ).bindparams(bindparam("ids", expanding=True)),
+            ids,
+        )
+
+    def unindex(self, session: Session, expense_ids: Sequence[TypeId]) -> None:
+        if len(expense_ids) == 0:
+            return
+        ids = {"ids": [i.hex for i in expense_ids]}
+        self.unindex_entries(session, ids)
+        session.execute(
+            text("DELETE FROM expense_search_doc WHERE expense_id IN :ids").bindparams(
+                bindparam("ids", expanding=True)
+            ),
+            ids,
+        )
+
+    def search(
+        self, session: Session, group_id: TypeId, terms: list[str], limit: int, after: SearchCursor | None
+    ) -> list[SearchHit]:
+        # every term is quoted so nothing the user typed is read as query syntax
+        words = " AND ".join(f'"{t}"' for t in terms[:-1])
+        words = f'{words} AND "{terms[-1]}" *' if words else f'"{terms[-1]}" *'
+        match = f'group_key : "{group_id.hex}" AND {{title details}} : ({words})'
+
+        keyset = ""
+        params: dict = {"match": match, "limit": limit}
+        if after is not None:
+            keyset = "WHERE s.score < :score OR (s.score = :score AND d.expense_id > :expense_id)"
+            params |= {"score": after.score, "expense_id": after.expense_id.hex}
+
+        # bm25 is lower for better matches, titles weigh ten times the details and the group none
+        stmt = text(
+            "SELECT d.expense_id, s.score FROM ("
+            "SELECT rowid AS docid, -bm25(expense_search, 10.0, 1.0, 0.0) AS score "
+            "FROM expense_search WHERE expense_search MATCH :match"
+            ") s JOIN expense_search_doc d ON d.docid = s.docid "
+            f"{keyset} ORDER BY s.score DESC, d.expense_id LIMIT :limit"
+        )
+        return [SearchHit(expense_id=str_to_id(i), score=score) for i, score in session.execute(stmt, params).all()]
+
+    def rebuild(self, session: Session) -> int:
+        session.execute(text("DELETE FROM expense_search"))
+        session.execute(text("DELETE FROM expense_search_doc"))
+        session.execute(text("INSERT INTO expense_search_doc (expense_id) SELECT id FROM expense"))
+        session.execute(
+            text(
+                "INSERT INTO expense_search (rowid, title, details, group_key) "
+                "SELECT d.docid, e.title, coalesce(e.details, ''), e.group_id "
+                "FROM expense e JOIN expense_search_doc d ON d.expense_id = e.id"
+            )
+        )
+        # merges the segments written by the bulk insert into one
+        session.execute(text("INSERT INTO expense_search (expense_search) VALUES ('optimize')"))
+        return session.execute(text("SELECT count(*) FROM expense_search_doc")).scalar_one()
+
+
+class PostgresSearchBackend(SearchBackend):
+    """
+    A stored generated tsvector column on the expense table with a GIN index over it. Postgres
+    recomputes the column in the statement that writes the row, so there is nothing left for
+    `index` and `unindex` to do, and a row is searchable exactly when its transaction commits.
+    """
+
+    def create_schema(self, connection: Connection) -> None:
+        connection.execute(
+            text(
+                "ALTER TABLE expense ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ("
+                "setweight(to_tsvector('simple', coalesce(title, '')), 'A') || "
+                "setweight(to_tsvector('simple', coalesce(details, '')), 'B')) STORED"
+            )
+        )
+        connection.execute(
+            text("CREATE INDEX IF NOT EXISTS ix_expense_search_vector ON expense USING GIN (search_vector)")
+        )
+
+    def drop_schema(self, connection: Connection) -> None:
+        # the column and its index go away with the expense table
+        pass
+
+    def index(self, session: Session, expense_ids: Sequence[TypeId]) -> None:
+        pass
+
+    def unindex(self, session: Session, expense_ids: Sequence[TypeId]) -> None:
+        pass
+
+    def search(
+        self, session: Session, group_id: TypeId, terms: list[str], limit: int, after: SearchCursor | None
+    ) -> list[SearchHit]:
+        tsquery = " & ".join(terms[:-1] + [f"{terms[-1]}:*"])
+
+        keyset = ""
+        params: dict = {"tsquery": tsquery, "group_id": group_id, "limit": limit}
+        if after is not None:
+            keyset = "WHERE s.score < :score OR (s.score = :score AND s.id > :expense_id)"
+            params |= {"score": after.score, "expense_id": after.expense_id}
+
+        stmt = text(
+            "SELECT s.id, s.score FROM ("
+            "SELECT e.id, ts_rank_cd(e.search_vector, q.query)::float8 AS score "
+            "FROM expense e, to_tsquery('simple', :tsquery) AS q(query) "
+            "WHERE e.group_id = :group_id AND e.search_vector @@ q.query"
+            f") s {keyset} ORDER BY s.score DESC, s.id LIMIT :limit"
+        ).bindparams(bindparam("group_id", type_=Uuid), bindparam("expense_id", type_=Uuid))
+        return [SearchHit(expense_id=i, score=score) for i, score in session.execute(stmt, params).all()]
+
+    def rebuild(self, session: Session) -> int:
+        session.execute(text("REINDEX INDEX ix_expense_search_vector"))
+        return session.execute(text("SELECT count(*) FROM expense")).scalar_one()
+
+
+class LikeSearchBackend(SearchBackend):
+    """
+    Portable fallback for databases without a full text index, it keeps no index of its own.
+    Every term is matched with `LIKE` anywhere in the lowercased title or details, so a search
+    reads every expense of the group instead of posting lists. A match in the title weighs ten
+    times one in the details, as in the other backends.
+    """
+
+    def create_schema(self, connection: Connection) -> None:
+        pass
+
+    def drop_schema(self, connection: Connection) -> None:
+        pass
+
+    def index(self, session: Session, expense_ids: Sequence[TypeId]) -> None:
+        pass
+
+    def unindex(self, session: Session, expense_ids: Sequence[TypeId]) -> None:
+        pass
+
+    def search(
+        self, session: Session, group_id: TypeId, terms: list[str], limit: int, after: SearchCursor | None
+    ) -> list[SearchHit]:
+        title = func.lower(col(Expense.title))
+        details = func.lower(func.coalesce(col(Expense.details), ""))
+        # terms are words, autoescape keeps an underscore in one from matching any character
+        in_title = [title.contains(t, autoescape=True) for t in terms]
+        in_details = [details.contains(t, autoescape=True) for t in terms]
+        score = sum(
+            (case((t, 10.0), else_=0.0) + case((d, 1.0), else_=0.0) for t, d in zip(in_title, in_details)),
+            start=literal(0.0),
+        )
+        scored = (
+            select(col(Expense.id).label("id"), score.label("score"))
+            .where(col(Expense.group_id) == group_id, *(or_(t, d) for t, d in zip(in_title, in_details)))
+            .subquery()
+        )
+
+        stmt = select(scored.c.id, scored.c.score)
+        if after is not None:
+            stmt = stmt.where(
+                or_(scored.c.score < after.score, and_(scored.c.score == after.score, scored.c.id > after.expense_id))
+            )
+        stmt = stmt.order_by(scored.c.score.desc(), scored.c.id).limit(limit)
+        return [SearchHit(expense_id=i, score=float(score)) for i, score in session.execute(stmt).all()]
+
+    def rebuild(self, session: Session) -> int:
+        return session.execute(select(func.count()).select_from(Expense)).scalar_one()
+
+
+_backends: dict[str, SearchBackend] = {"sqlite": SqliteSearchBackend(), "postgresql": PostgresSearchBackend()}
+_fallback_backend = LikeSearchBackend()
+
+
+def backend_for(dialect: str) -> SearchBackend:
+    return _backends.get(dialect, _fallback_backend)
+
+
+def search_backend(session: Session) -> SearchBackend:
+    return backend_for(session.get_bind().dialect.name)
+
+
+def index_expenses(session: Session, expense_ids: Sequence[TypeId]) -> None:
+    search_backend(session).index(session, expense_ids)
+
+
+def unindex_expenses(session: Session, expense_ids: Sequence[TypeId]) -> None:
+    search_backend(session).unindex(session, expense_ids)
+
+
+@event.listens_for(Expense.__table__, "after_create")
+def create_search_schema(_target, connection: Connection, **_):
+    backend_for(connection.dialect.name).create_schema(connection)
+
+
+@event.listens_for(Expense.__table__, "before_drop")
+def drop_search_schema(_target, connection: Connection, **_):
+    backend_for(connection.dialect.name).drop_schema(connection)
@@ -0,0 +1,266 @@
+import os
+import re
+import gzip
+import stat
+import hashlib
+import mimetypes
+import threading
+from collections import OrderedDict
+from email.utils import formatdate, parsedate
+from pathlib import Path
+
+import anyio
+import brotli
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, PathLike, StaticFiles
+from starlette.types import Scope
+
+from app.logger import logger
+
+# a year, the longest lifetime caches are expected to honour
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# everything else may be kept but is revalidated with its etag, which costs a 304 at most
+REVALIDATE_CACHE_CONTROL = "public, no-cache"
+
+# content encodings in the order they are preferred, with the suffix of their precompressed file
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+# names like app.3f9a1c2e.js carry a hash of their content, a changed file gets a new name
+FINGERPRINTED = re.compile(r"\.[0-9a-f]{8,}\.[^./]+$")
+COMPRESSIBLE_TYPES = frozenset(
+    {
+        "application/javascript",
+        "application/json",
+        "application/manifest+json",
+        "application/wasm",
+        "application/xml",
+        "image/svg+xml",
+        "text/javascript",
+    }
+)
+# smaller files barely shrink, and a variant that saves less than a tenth is not worth serving
+MIN_COMPRESS_BYTES = 256
+MIN_COMPRESS_SAVING = 0.1
+ETAG_CACHE_ENTRIES = 4096
+# paths that cannot name a file, starlette answers them with its own status codes
+LOOKUP_ERRORS = (OSError, ValueError)
+
+
+def is_compressible(path: str | Path) -> bool:
+    media_type, _ = mimetypes.guess_type(str(path))
+    return media_type is not None and (media_type.startswith("text/") or media_type in COMPRESSIBLE_TYPES)
+
+
+def accepted_encodings(accept_encoding: str) -> set[str]:
+    """Codings the client accepts, those it lists with `q=0` are refused."""
+    weights: dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        weight = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        if name.strip():
+            weights[name.strip().lower()] = weight
+
+    accepted = {name for name, weight in weights.items() if weight > 0}
+    if "*" in accepted:
+        accepted |= {name for name, _ in ENCODINGS if name not in weights}
+    return accepted
+
+
+def precompress(root: Path, skip_dirs: tuple[str, ...] = ()) -> int:
+    """
+    Writes a brotli and a gzip variant next to every compressible file under the root that does
+    not have a fresh one yet and returns how many were written. A variant takes the modification
+    time of its source, so a variant left behind by an older version of the file is recognised
+    and ignored when serving until the next run replaces it.
+    """
+    written = 0
+    skipped = {root / d for d in skip_dirs}
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if Path(dirpath, d) not in skipped]
+        for filename in filenames:
+            source = Path(dirpath, filename)
+            if source.suffix in (".br", ".gz") or not is_compressible(source):
+                continue
+            source_stat = source.stat()
+            if source_stat.st_size < MIN_COMPRESS_BYTES:
+                continue
+
+            data: bytes | None = None
+            for encoding, suffix in ENCODINGS:
+                variant = source.with_name(source.name + suffix)
+                if variant.exists() and variant.stat().st_mtime_ns == source_stat.st_mtime_ns:
+                    continue
+                if data is None:
+                    data = source.read_bytes()
+                if encoding == "br":
+                    compressed = brotli.compress(data, quality=11)
+                else:
+                    compressed = gzip.compress(data, compresslevel=9, mtime=0)
+                if len(compressed) > len(data) * (1 - MIN_COMPRESS_SAVING):
+                    variant.unlink(missing_ok=True)
+                    continue
+
+                tmp = variant.with_name(f"{variant.name}.{os.getpid()}.tmp")
+                tmp.write_bytes(compressed)
+                os.utime(tmp, ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns))
+                os.replace(tmp, variant)
+                written += 1
+    logger.info("wrote %d precompressed static files", written)
+    return written
+
+
+class ByteBudgetLRU:
+    """Least recently used contents of files, evicted once together they exceed the budget."""
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.size = 0
+        self._entries: OrderedDict[tuple, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> bytes | None:
+        with self._lock:
+            content = self._entries.get(key)
+            if content is not None:
+                self._entries.move_to_end(key)
+            return content
+
+    def put(self, key: tuple, content: bytes) -> None:
+        if len(content) > self.budget:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self._entries[key] = content
+            self.size += len(content)
+            while self.size > self.budget:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+
+class CachedStaticFiles(StaticFiles):
+    """
+    Static files served with strong etags and `304 Not Modified`, in the precompressed variant
+    the client accepts when there is one. Fingerprinted names and files under the immutable
+    directories are named by their content, so they are cached for good instead of being
+    revalidated, and their etag comes from the name without reading the file. Small files can
+    be kept in memory within a byte budget so hot assets are not read from disk on every hit.
+    """
+
+    def __init__(
+        self,
+        *,
+        directory: str,
+        immutable_dirs: tuple[str, ...] = (),
+        cache_bytes: int = 0,
+        cache_max_file_bytes: int = 64 * 1024,
+    ):
+        super().__init__(directory=directory)
+        self.immutable_dirs = tuple(d.strip("/") + "/" for d in immutable_dirs)
+        self.cache = ByteBudgetLRU(cache_bytes) if cache_bytes > 0 else None
+        self.cache_max_file_bytes = cache_max_file_bytes
+        self._etags: OrderedDict[tuple, str] = OrderedDict()
+        self._etags_lock = threading.Lock()
+
+    def is_immutable(self, path: str) -> bool:
+        return path.startswith(self.immutable_dirs) or FINGERPRINTED.search(path) is not None
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        if scope["method"] in ("GET", "HEAD"):
+            try:
+                full_path, stat_result = await anyio.to_thread.run_sync(self.lookup_path, path)
+            except LOOKUP_ERRORS:
+                full_path, stat_result = "", None
+            if stat_result is not None and stat.S_ISREG(stat_result.st_mode):
+                return await anyio.to_thread.run_sync(self.asset_response, path, full_path, stat_result, scope)
+        # directories, missing files and other methods are answered the usual way
+        return await super().get_response(path, scope)
+
+    def asset_response(self, path: str, full_path: PathLike, stat_result: os.stat_result, scope: Scope) -> Response:
+        path = path.replace(os.sep, "/")
+        request_headers = Headers(scope=scope)
+        immutable = self.is_immutable(path)
+        media_type, _ = mimetypes.guess_type(str(full_path))
+        compressible = is_compressible(full_path)
+
+        encoding, served_path, served_stat = None, full_path, stat_result
+        if compressible:
+            accepted = accepted_encodings(request_headers.get("accept-encoding", ""))
+            for name, suffix in ENCODINGS:
+                if name not in accepted:
+                    continue
+                variant = f"{full_path}{suffix}"
+                try:
+                    variant_stat = os.stat(variant)
+                except OSError:
+                    continue
+                if variant_stat.st_mtime_ns == stat_result.st_mtime_ns:
+                    encoding, served_path, served_stat = name, variant, variant_stat
+                    break
+
+        # every representation gets an etag of its own, a strong etag names exact bytes
+        tag = self.etag(path, full_path, stat_result, immutable)
+        headers = {
+            "etag": f'"{tag}"' if encoding is None else f'"{tag}-{encoding}"',
+            "last-modified": formatdate(stat_result.st_mtime, usegmt=True),
+            "cache-control": IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL,
+        }
+        if compressible:
+            headers["vary"] = "Accept-Encoding"
+        if encoding is not None:
+            headers["content-encoding"] = encoding
+
+        if self.not_modified(headers, request_headers):
+            return NotModifiedResponse(Headers(headers))
+
+        if self.cache is not None and served_stat.st_size <= self.cache_max_file_bytes:
+            key = (str(served_path), served_stat.st_mtime_ns, served_stat.st_size)
+            content = self.cache.get(key)
+            if content is None:
+                content = Path(served_path).read_bytes()
+                self.cache.put(key, content)
+            return Response(content, media_type=media_type, headers=headers)
+        return FileResponse(served_path, stat_result=served_stat, media_type=media_type, headers=headers)
+
+    def etag(self, path: str, full_path: PathLike, stat_result: os.stat_result, immutable: bool) -> str:
+        if immutable:
+            # the name already stands for the content
+            return hashlib.blake2b(path.encode(), digest_size=16).hexdigest()
+
+        key = (str(full_path), stat_result.st_mtime_ns, stat_result.st_size)
+        with self._etags_lock:
+            tag = self._etags.get(key)
+            if tag is not None:
+                self._etags.move_to_end(key)
+                return tag
+
+        digest = hashlib.blake2b(digest_size=16)
+        with open(full_path, "rb") as file:
+            while chunk := file.read(1024 * 1024):
+                digest.update(chunk)
+        tag = digest.hexdigest()
+        with self._etags_lock:
+            self._etags[key] = tag
+            if len(self._etags) > ETAG_CACHE_ENTRIES:
+                self._etags.popitem(last=False)
+        return tag
+
+    @staticmethod
+    def not_modified(headers: dict[str, str], request_headers: Headers) -> bool:
+        if if_none_match := request_headers.get("if-none-match"):
+            if if_none_match.strip() == "*":
+                return True
+            # if-none-match compares weakly, a W/ prefix on the client's copy still matches
+            return headers["etag"] in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+
+        if_modified_since = parsedate(request_headers.get("if-modified-since", ""))
+        last_modified = parsedate(headers["last-modified"])
+        return if_modified_since is not None and last_modified is not None and if_modified_since >= last_modified
@@ -0,0 +1,169 @@
+import heapq
+import base64
+import asyncio
+import threading
+from collections.abc import Callable
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import Engine
+from sqlmodel import Session, col, select
+
+from app.errors.error import CodeTask, ErrTask
+from app.logger import logger
+from app.repository.enums import TaskStatus
+from app.repository.models import Task
+from app.repository.types import TypeId, str_to_id
+from app.utils.checkpoint import to_utc
+
+
+@dataclass(frozen=True)
+class TaskCursor:
+    """Position after the last task of a page, tasks are ordered by (deadline, task id)."""
+
+    deadline: datetime
+    task_id: TypeId
+
+    def encode(self) -> str:
+        return base64.urlsafe_b64encode(f"{to_utc(self.deadline).isoformat()}|{self.task_id.hex}".encode()).decode()
+
+    @classmethod
+    def decode(cls, cursor: str) -> "TaskCursor":
+        try:
+            deadline, task_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+            return cls(deadline=to_utc(datetime.fromisoformat(deadline)), task_id=str_to_id(task_id))
+        except ValueError as exc:
+            raise ErrTask(code=CodeTask.INVALID_CURSOR, detail="cursor is not one returned by a listing") from exc
+
+
+# hands over the pending tasks that just became due soon, for instance to notify their assignees
+Remind = Callable[[Session, list[Task]], None]
+
+
+def log_reminders(_: Session, tasks: list[Task]) -> None:
+    for task in tasks:
+        logger.info("task %s of %s is due at %s", task.id, task.assignee_id, task.deadline)
+
+
+class DueSoonScanner:
+    """
+    Finds the pending tasks whose deadline comes within the reminder lead. Every scan reads only
+    the slice of deadlines that entered its look ahead window since the previous scan, one range
+    query over the (status, deadline) index, and pushes them on a min-heap keyed by deadline, so
+    reminders go out when they are due without ever reading all tasks. Tasks changed after they
+    were read are tracked again by the routes, entries left behind are dropped as stale when they
+    reach the top, and every task is read once more before it is reminded. Reminders are kept in
+    memory only, a restarted scanner reminds again of what was due soon when it went down.
+    """
+
+    def __init__(self, remind: Remind, lead: timedelta, look_ahead: timedelta):
+        self._remind = remind
+        self._lead = lead
+        self._look_ahead = look_ahead
+        self._heap: list[tuple[datetime, TypeId]] = []
+        self._deadlines: dict[TypeId, datetime] = {}
+        # deadlines up to here have been read, later ones are left to the next scan
+        self._scanned_until: datetime | None = None
+        self._lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._wakeup: asyncio.Event | None = None
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def scan(self, session: Session, now: datetime) -> int:
+        """Pushes the pending tasks whose deadline entered the window since the last scan, returns how many."""
+        with self._lock:
+            start = self._scanned_until or now
+        until = now + self._lead + self._look_ahead
+        if until <= start:
+            return 0
+
+        stmt = select(Task.id, Task.deadline).where(
+            col(Task.status) == TaskStatus.PENDING,
+            col(Task.deadline) > start,
+            col(Task.deadline) <= until,
+        )
+        rows = session.exec(stmt).all()
+        with self._lock:
+            for task_id, deadline in rows:
+                self._push(task_id, to_utc(deadline))
+            self._scanned_until = until
+        return len(rows)
+
+    def track(self, task_id: TypeId, deadline: datetime | None) -> None:
+        """Tells the scanner the deadline of a pending task, none once the task is no longer pending."""
+        with self._lock:
+            if deadline is None:
+                self._deadlines.pop(task_id, None)
+            elif self._scanned_until is not None and to_utc(deadline) <= self._scanned_until:
+                self._push(task_id, to_utc(deadline))
+            else:
+                # the deadline is still ahead of the window, a later scan reads it
+                self._deadlines.pop(task_id, None)
+        # requests run on worker threads, the scanner loop has to be woken on its own thread
+        if deadline is not None and self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _push(self, task_id: TypeId, deadline: datetime) -> None:
+        if self._deadlines.get(task_id) != deadline:
+            self._deadlines[task_id] = deadline
+            heapq.heappush(self._heap, (deadline, task_id))
+
+    def _drop_stale(self) -> None:
+        while self._heap and self._deadlines.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+    def next_reminder(self) -> datetime | None:
+        with self._lock:
+            self._drop_stale()
+            return self._heap[0][0] - self._lead if self._heap else None
+
+    def remind_due(self, session: Session, now: datetime) -> int:
+        """Reminds of every task that is due soon by now and returns how many were reminded."""
+        popped: dict[TypeId, datetime] = {}
+        with self._lock:
+            while True:
+                self._drop_stale()
+                if not self._heap or self._heap[0][0] - self._lead > now:
+                    break
+                deadline, task_id = heapq.heappop(self._heap)
+                del self._deadlines[task_id]
+                popped[task_id] = deadline
+        if len(popped) == 0:
+            return 0
+
+        # the task may have been finished or moved after it was read, the row decides
+        stmt = select(Task).where(col(Task.id).in_(popped), col(Task.status) == TaskStatus.PENDING)
+        tasks = [t for t in session.exec(stmt).all() if to_utc(t.deadline) == popped[t.id]]
+        if len(tasks) > 0:
+            self._remind(session, tasks)
+        return len(tasks)
+
+    async def run(self, engine: Engine, interval_seconds: int) -> None:
+        """Runs until cancelled, scanning every interval and sleeping until the next reminder is due."""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+
+        def tick():
+            now = datetime.now(timezone.utc)
+            with Session(engine) as session:
+                self.scan(session, now)
+                self.remind_due(session, now)
+
+        while True:
+            self._wakeup.clear()
+            try:
+                await asyncio.to_thread(tick)
+            except Exception:  # noqa: BLE001
+                # the scanner runs for the life of the app, a failed scan must not end the loop
+                logger.exception("due soon scan failed, retrying after the interval")
+
+            sleep = float(interval_seconds)
+            next_reminder = self.next_reminder()
+            if next_reminder is not None:
+                sleep = min(sleep, max(0.0, (next_reminder - datetime.now(timezone.utc)).total_seconds()))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=sleep)
+            except TimeoutError:
+                pass
@@ -0,0 +1,141 @@
+from collections.abc import Callable
+from typing import Annotated, Any
+
+from fastapi import Header, Response, status
+from sqlmodel import Session, col, select, update
+
+from app.errors.error import CodeConcurrency, ErrConcurrency
+from app.repository.models import Group, User
+from app.repository.types import TypeId, id_to_str
+from app.utils.changelog import GroupRevision
+
+
+class VersionConflictError(Exception):
+    def __init__(self, current_version: int | None):
+        super().__init__("row was changed by another writer", current_version)
+        self.current_version = current_version
+
+
+IfNoneMatchHeader = Annotated[str | None, Header(description="ETag of the listing the client already holds")]
+
+# polled listings are kept by the client and revalidated on every read, never by shared caches
+REVALIDATE_CACHE_CONTROL = "private, no-cache"
+
+
+def version_etag(version: int) -> str:
+    return f'"{version}"'
+
+
+def weak_etag(*parts: object) -> str:
+    """
+    Tags a listing with the versions it was read at. The tag stands for the state the listing was
+    read from rather than for its exact bytes, so it is weak and only used to revalidate reads.
+    """
+    return 'W/"' + "-".join(str(p) for p in parts) + '"'
+
+
+def group_etag(group: Group, revision: GroupRevision) -> str | None:
+    """
+    Tags a read under the group with the version of the group's own fields and the revision of
+    its ledger and roster. No tag is given while the revision is unsettled, a change committed
+    late may not move it, and a tag that stays the same would keep the client on a stale copy.
+    """
+    if not revision.settled:
+        return None
+    return weak_etag(id_to_str(group.id), group.version, revision.seq)
+
+
+def user_etag(user: User) -> str:
+    return weak_etag(id_to_str(user.id), user.version)
+
+
+def not_modified(if_none_match: str | None, etag: str | None, response: Response) -> Response | None:
+    """
+    Sets the etag on the response and returns a `304 Not Modified` when the client already holds
+    the listing with that etag, in which case the route answers with it without reading the
+    listing. `If-None-Match` compares weakly, so the `W/` prefix is ignored on both sides. A
+    listing without an etag is read in full and not tagged.
+    """
+    if etag is None:
+        response.headers["Cache-Control"] = REVALIDATE_CACHE_CONTROL
+        return None
+    # what is listed depends on who asks, the bearer token is part of what the tag validates
+    headers = {"ETag": etag, "Cache-Control": REVALIDATE_CACHE_CONTROL, "Vary": "Authorization"}
+    response.headers.update(headers)
+    if if_none_match is None:
+        return None
+    opaque = etag.removeprefix("W/")
+    if if_none_match.strip() == "*" or opaque in (t.strip().removeprefix("W/") for t in if_none_match.split(",")):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return None
+
+
+def parse_if_match(if_match: str | None) -> int | None:
+    """Returns the version the client pinned with `If-Match`, `None` when it did not pin any."""
+    if if_match is None or if_match.strip() == "*":
+        return None
+    # a body sent in another format or coding is tagged with a suffix after the version
+    tag = if_match.strip().removeprefix("W/").strip('"').partition("-")[0]
+    if not tag.isdigit():
+        raise ErrConcurrency(
+            status=status.HTTP_400_BAD_REQUEST,
+            code=CodeConcurrency.INVALID_IF_MATCH,
+            detail="If-Match must be the ETag of a previous response",
+        )
+    return int(tag)
+
+
+def precondition_failed(exc: VersionConflictError) -> ErrConcurrency:
+    headers = {"ETag": version_etag(exc.current_version)} if exc.current_version is not None else None
+    return ErrConcurrency(
+        code=CodeConcurrency.VERSION_MISMATCH,
+        detail={"current_version": exc.current_version},
+        headers=headers,
+    )
+
+
+def check_pinned_version(pinned: int | None, version: int) -> None:
+    if pinned is not None and pinned != version:
+        raise VersionConflictError(version)
+
+
+def guarded_update(session: Session, model: Any, row_id: TypeId, version: int, values: dict[str, Any]) -> int:
+    """
+    Writes the values with `UPDATE ... WHERE id = ? AND version = ?`, bumping the version in the
+    same statement. No lock is held between reading the row and writing it, instead the write
+    fails with `VersionConflictError` when another writer bumped the version in the meantime.
+    """
+    stmt = (
+        update(model)
+        .where(col(model.id) == row_id, col(model.version) == version)
+        .values(**values, version=version + 1)
+    )
+    result = session.exec(stmt)
+    if result.rowcount != 1:
+        current = session.exec(select(model.version).where(col(model.id) == row_id)).one_or_none()
+        raise VersionConflictError(current)
+    return version + 1
+
+
+def retry_on_conflict[T](session: Session, attempt: Callable[[], T], attempts: int = 3) -> T:
+    """
+    Reruns the attempt on fresh state whenever it lost the race against another writer. Only
+    use this for commutative changes, the ones whose result does not depend on what the other
+    writer changed, such as setting descriptive fields the client did not pin a version for.
+    """
+    for i in range(attempts):
+        try:
+            return attempt()
+        except VersionConflictError:
+            session.rollback()
+            if i == attempts - 1:
+                raise
+    raise RuntimeError("retry_on_conflict needs at least one attempt")
+
+
+def bump_user_version(session: Session, user_id: TypeId) -> None:
+    """
+    The user version covers the invitations listed for the user, so creating, accepting,
+    declining or cancelling an invitation bumps the version of the user it was sent to.
+    """
+    session.exec(update(User).where(col(User.id) == user_id).values(version=col(User.version) + 1))
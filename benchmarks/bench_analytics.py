@@ -0,0 +1,146 @@
+"""
+Compares the columnar ledger snapshot against answering the same analytics with ORM objects
+and SQL aggregates. Seeds a single group into a throwaway sqlite database and prints timings.
+
+    python -m benchmarks.bench_analytics --expenses 100000 --members 20
+"""
+
+import time
+import uuid
+import random
+import argparse
+import tempfile
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from pathlib import Path
+
+from sqlalchemy import func, insert
+from sqlalchemy.orm import selectinload
+from sqlmodel import Session, SQLModel, col, create_engine, select
+
+from app.repository.enums import MembershipStatus, SplitPolicy
+from app.repository.models import Account, Expense, Group, Split, User
+from app.utils.analytics import load_snapshot
+from app.utils.ledger import compute_group_balances, expense_shares, split_roster
+
+
+def seed(session: Session, n_members: int, n_expenses: int) -> Group:
+    rng = random.Random(7)
+    now = datetime.now(timezone.utc)
+    users = [User(name=f"member {i}", password_hash="-") for i in range(n_members)]
+    session.add_all(users)
+    session.flush()
+
+    group = Group(name="bench", currency="USD", creator_id=users[0].id, admin_id=users[0].id)
+    session.add(group)
+    session.flush()
+    session.add_all(
+        Account(
+            owner_id=u.id,
+            group_id=group.id,
+            invited_by=users[0].id,
+            balance=Decimal(0),
+            membership_status=MembershipStatus.ACTIVE,
+            invited_at=now,
+            member_since=now + timedelta(seconds=i),
+        )
+        for i, u in enumerate(users)
+    )
+
+    expenses, splits = [], []
+    for _ in range(n_expenses):
+        expense_id = uuid.uuid4()
+        amount = Decimal(rng.randint(100, 1_000_000)) / 100
+        equal = rng.random() < 0.5
+        expenses.append(
+            {
+                "id": expense_id,
+                "title": "bench",
+                "group_id": group.id,
+                "paid_by": rng.choice(users).id,
+                "created_by": users[0].id,
+                "paid_on": date(2024, 1, 1) + timedelta(days=rng.randrange(730)),
+                "amount": amount,
+                "split_policy": SplitPolicy.EQUAL if equal else SplitPolicy.CUSTOM,
+                "split_count": n_members if equal else None,
+                "created_at": now,
+                "updated_at": now,
+                "version": 1,
+            }
+        )
+        if not equal:
+            parties = rng.sample(users, 3)
+            share = (amount / 3).quantize(Decimal("0.0001"))
+            amounts = [share, share, amount - 2 * share]
+            splits.extend({"expense_id": expense_id, "user_id": u.id, "amount": a} for u, a in zip(parties, amounts))
+
+    # an empty parameter list would insert a single row of defaults
+    if expenses:
+        session.execute(insert(Expense), expenses)
+    if splits:
+        session.execute(insert(Split), splits)
+    session.commit()
+    return group
+
+
+def orm_monthly_spend(session: Session, group: Group):
+    accounts = session.exec(select(Account).where(col(Account.group_id) == group.id)).all()
+    roster = split_roster(accounts)
+    stmt = select(Expense).where(col(Expense.group_id) == group.id).options(selectinload(Expense.splits))  # type: ignore
+    spend: defaultdict[tuple, Decimal] = defaultdict(Decimal)
+    for expense in session.exec(stmt).all():
+        for user_id, share in expense_shares(expense, roster).items():
+            spend[(user_id, expense.paid_on.year, expense.paid_on.month)] += share
+    return spend
+
+
+def sql_top_payers(session: Session, group: Group, limit: int):
+    total = func.sum(Expense.amount)
+    stmt = (
+        select(Expense.paid_by, total)
+        .where(col(Expense.group_id) == group.id)
+        .group_by(col(Expense.paid_by))
+        .order_by(total.desc())
+        .limit(limit)
+    )
+    return session.exec(stmt).all()
+
+
+def timed(label: str, fn, repeat: int = 3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    print(f"{label:<40} {best * 1000:>10.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--expenses", type=int, default=100_000)
+    parser.add_argument("--members", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{Path(tmp) / 'bench.db'}")
+        SQLModel.metadata.create_all(engine)
+        with Session(engine) as session:
+            group = seed(session, args.members, args.expenses)
+            print(f"{args.expenses} expenses, {args.members} members\n")
+
+            timed("orm: monthly spend", lambda: orm_monthly_spend(session, group), repeat=1)
+            timed("orm: compute_group_balances", lambda: compute_group_balances(session, group.id), repeat=1)
+            timed("sql: top payers (group by)", lambda: sql_top_payers(session, group, 5))
+
+            timed("snapshot: load (cold cache)", lambda: load_snapshot(session, group), repeat=1)
+            snapshot = load_snapshot(session, group)
+            timed("snapshot: monthly spend", snapshot.monthly_spend)
+            timed("snapshot: balances", snapshot.balances)
+            timed("snapshot: top payers", lambda: snapshot.top_payers(5))
+            timed("snapshot: balance curve", lambda: snapshot.balance_curve(snapshot.members[0]))
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
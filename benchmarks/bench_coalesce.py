@@ -0,0 +1,115 @@
+"""
+Throughput of recording bursts of expenses into one group, with one transaction per expense
+against the write coalescer batching them. Every burst is a number of threads writing at the
+same time, like the requests of an event group would. Runs against a throwaway sqlite file.
+
+    python -m benchmarks.bench_coalesce --writers 32 --bursts 20 --window-ms 5
+"""
+
+import time
+import argparse
+import tempfile
+import statistics
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from decimal import Decimal
+from pathlib import Path
+
+from sqlalchemy import Engine
+from sqlmodel import Session, SQLModel, create_engine
+
+from app.repository.enums import SplitPolicy
+from app.repository.models import Group
+from app.routes.expense import ExpensePayload, new_expense
+from app.utils.coalescer import WriteCoalescer
+from app.utils.currency import RateTable
+from app.utils.ledger import split_roster
+from app.utils.posting import post_expenses
+from benchmarks.bench_analytics import seed
+
+
+def payload_for(group: Group) -> ExpensePayload:
+    return ExpensePayload(
+        title="round",
+        paid_by=group.admin_id,
+        group_id=group.id,
+        paid_on=date(2025, 3, 1),
+        amount=Decimal("12.5000"),
+        split_policy=SplitPolicy.EQUAL,
+    )
+
+
+def direct_write(engine: Engine, group_id, payload: ExpensePayload, rate_table: RateTable) -> None:
+    with Session(engine) as session:
+        group = session.get_one(Group, group_id)
+        roster = split_roster(group.accounts)
+        expense = new_expense(group, payload, group.admin_id, rate_table, roster)
+        post_expenses(session, group.id, [expense], roster)
+        session.commit()
+
+
+def run(label: str, write: Callable[[], None], writers: int, bursts: int) -> None:
+    latencies: list[float] = []
+
+    def timed_write():
+        start = time.perf_counter()
+        write()
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(writers) as pool:
+        for _ in range(bursts):
+            for future in [pool.submit(timed_write) for _ in range(writers)]:
+                future.result()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(
+        f"{label:<24} {len(latencies) / elapsed:>10,.0f} expenses/s"
+        f"   p50 {statistics.median(latencies) * 1000:>7.1f} ms   p99 {p99 * 1000:>7.1f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writers", type=int, default=32)
+    parser.add_argument("--bursts", type=int, default=20)
+    parser.add_argument("--members", type=int, default=20)
+    parser.add_argument("--window-ms", type=float, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # writers wait for the database lock instead of failing right away
+        engine = create_engine(f"sqlite:///{Path(tmp) / 'bench.db'}", connect_args={"timeout": 60})
+        SQLModel.metadata.create_all(engine)
+        with Session(engine) as session:
+            group = seed(session, args.members, 0)
+            group_id, payload = group.id, payload_for(group)
+        rate_table = RateTable(base="USD", starts={}, rates={})
+        print(f"{args.bursts} bursts of {args.writers} concurrent expenses, {args.members} members\n")
+
+        run(
+            "one transaction each",
+            lambda: direct_write(engine, group_id, payload, rate_table),
+            args.writers,
+            args.bursts,
+        )
+
+        coalescer = WriteCoalescer()
+
+        def build(_session, g, roster):
+            return new_expense(g, payload, g.admin_id, rate_table, roster)
+
+        run(
+            f"coalesced, {args.window_ms:g} ms window",
+            lambda: coalescer.submit(engine, group_id, build, args.window_ms / 1000, args.writers).result(),
+            args.writers,
+            args.bursts,
+        )
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Size and encode time of a realistic response in every format and coding the negotiation
+middleware can answer with. The body is what a sync sends for a group, every expense with
+its splits plus the accounts of the group, seeded as in bench_analytics, rendered to JSON
+once and then re-encoded and compressed the way the middleware does it.
+
+    python -m benchmarks.bench_encoding --expenses 2000 --repeat 5
+"""
+
+import time
+import argparse
+import tempfile
+from collections.abc import Callable
+from pathlib import Path
+
+from pydantic import TypeAdapter
+from sqlmodel import Session, SQLModel, col, create_engine, select
+
+from app.repository.models import Account, Expense
+from app.responses import compressors, transcode
+from app.routes.sync import SyncPage, expense_details
+from benchmarks.bench_analytics import seed
+
+
+def best_of(repeat: int, encode: Callable[[], bytes]) -> tuple[float, int]:
+    """Returns the fastest of the runs in seconds, and the size of the body."""
+    best, size = float("inf"), 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        size = len(encode())
+        best = min(best, time.perf_counter() - start)
+    return best, size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--expenses", type=int, default=2_000)
+    parser.add_argument("--members", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--gzip-level", type=int, default=6)
+    parser.add_argument("--zstd-level", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{Path(tmp) / 'bench.db'}")
+        SQLModel.metadata.create_all(engine)
+        with Session(engine) as session:
+            group = seed(session, args.members, args.expenses)
+            ids = list(session.exec(select(Expense.id).where(col(Expense.group_id) == group.id)).all())
+            accounts = list(session.exec(select(Account).where(col(Account.group_id) == group.id)).all())
+            page = SyncPage(
+                groups=[group],
+                accounts=accounts,
+                expenses=expense_details(session, ids),
+                tasks=[],
+                deleted=[],
+                cursor="",
+                has_more=False,
+            )
+        engine.dispose()
+
+    adapter = TypeAdapter(SyncPage)
+    body = adapter.dump_json(page)
+    msgpack_body = transcode(body, "application/msgpack")
+    codings = compressors(args.gzip_level, args.zstd_level)
+
+    # every case starts from the JSON the route rendered, as the middleware does
+    cases: list[tuple[str, Callable[[], bytes]]] = [
+        ("json", lambda: adapter.dump_json(page)),
+        ("msgpack", lambda: transcode(body, "application/msgpack")),
+        ("cbor", lambda: transcode(body, "application/cbor")),
+    ]
+    for coding, compress in codings.items():
+        cases.append((f"json + {coding}", lambda compress=compress: compress(body)))
+        cases.append((f"msgpack + {coding}", lambda compress=compress: compress(msgpack_body)))
+
+    print(f"{len(ids)} expenses, {len(body) / 1024:,.0f} KiB of JSON, best of {args.repeat}\n")
+    for label, encode in cases:
+        seconds, size = best_of(args.repeat, encode)
+        print(f"{label:<18} {seconds * 1000:>9.2f} ms   {size / 1024:>8,.0f} KiB   {size / len(body):>6.1%} of json")
+    if "zstd" not in codings:
+        print("\nzstd needs python 3.14, only gzip was measured")
+
+
+if __name__ == "__main__":
+    main()
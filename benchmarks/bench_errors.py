@@ -0,0 +1,64 @@
+"""
+Cost of answering a failed login with 401, the way the handler used to build the body by running
+`jsonable_encoder` over the exception and `json` behind `JSONResponse`, against the bodies that
+the error classes encode once. Times the handler itself, from the raised error to the response
+ready to be sent, with and without a message.
+
+    python -m benchmarks.bench_errors --iterations 200000
+"""
+
+import time
+import asyncio
+import argparse
+from collections.abc import Callable
+
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from app.errors.error import CodeOAuth, ErrOAuth
+
+
+def encoded_per_raise(exc: ErrOAuth) -> Response:
+    content = jsonable_encoder(exc, exclude={"status", "headers"}, exclude_none=True)
+    return JSONResponse(content, exc.status, exc.headers)
+
+
+def run(make_error: Callable[[], ErrOAuth], respond: Callable[[ErrOAuth], Response], iterations: int) -> float:
+    async def handle(exc: ErrOAuth) -> Response:
+        exc.headers["WWW-Authenticate"] = "Bearer"
+        return respond(exc)
+
+    async def loop() -> float:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            await handle(make_error())
+        return time.perf_counter() - start
+
+    return asyncio.run(loop())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=200_000)
+    args = parser.parse_args()
+
+    errors: list[tuple[str, Callable[[], ErrOAuth]]] = [
+        ("code only", lambda: ErrOAuth(code=CodeOAuth.INVALID_CLIENT)),
+        ("code and message", lambda: ErrOAuth(code=CodeOAuth.INVALID_CLIENT, detail="invalid client credentials")),
+    ]
+    print(f"{args.iterations:,} 401 responses per run\n")
+    for label, make_error in errors:
+        assert encoded_per_raise(make_error()).body == make_error().create_json_response().body
+        before = run(make_error, encoded_per_raise, args.iterations)
+        after = run(make_error, lambda exc: exc.create_json_response(), args.iterations)
+        for name, seconds in (("encoded per raise", before), ("precomputed", after)):
+            print(
+                f"{label:<18} {name:<18} {args.iterations / seconds:>12,.0f} responses/s"
+                f"   {seconds / args.iterations * 1e6:>6.2f} us each"
+            )
+        print(f"{label:<18} {'speedup':<18} x{before / after:.1f}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Measures the throughput of the streaming ledger export in rows per second, and the peak memory
+traced while writing it, which should not grow with the size of the group. Seeds one group into
+a throwaway sqlite database, see bench_analytics for its shape.
+
+    python -m benchmarks.bench_export --expenses 200000 --members 20
+"""
+
+import time
+import argparse
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+from sqlmodel import Session, SQLModel, create_engine
+
+from app.utils.export import EXPORT_BATCH_SIZE, ExportFormat, export_group
+from benchmarks.bench_analytics import seed
+
+
+def run(session: Session, group_id, fmt: ExportFormat, gzip: bool, batch_size: int) -> tuple[int, int, float]:
+    """Returns the lines and bytes written and the seconds it took."""
+    start = time.perf_counter()
+    lines = size = 0
+    for chunk in export_group(session, group_id, fmt, gzip, batch_size):
+        size += len(chunk)
+        lines += chunk.count(b"\n") if not gzip else 0
+    return lines, size, time.perf_counter() - start
+
+
+def peak_memory(session: Session, group_id, fmt: ExportFormat, gzip: bool, batch_size: int) -> int:
+    # tracing slows every allocation down, so it gets a run of its own
+    tracemalloc.start()
+    for _ in export_group(session, group_id, fmt, gzip, batch_size):
+        pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--expenses", type=int, default=200_000)
+    parser.add_argument("--members", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{Path(tmp) / 'bench.db'}")
+        SQLModel.metadata.create_all(engine)
+        with Session(engine) as session:
+            group = seed(session, args.members, args.expenses)
+            print(f"{args.expenses} expenses, {args.members} members, batches of {args.batch_size}\n")
+
+            for fmt in ExportFormat:
+                lines = 0
+                for gzip in (False, True):
+                    written, size, elapsed = run(session, group.id, fmt, gzip, args.batch_size)
+                    peak = peak_memory(session, group.id, fmt, gzip, args.batch_size)
+                    # the compressed stream has no lines to count, it holds as many as the plain one
+                    lines = written or lines
+                    label = f"{fmt}{' + gzip' if gzip else ''}"
+                    print(
+                        f"{label:<16} {lines / elapsed:>12,.0f} rows/s {size / 2**20:>10.1f} MiB"
+                        f" {peak / 2**20:>10.1f} MiB peak"
+                    )
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
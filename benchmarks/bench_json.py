@@ -0,0 +1,81 @@
+"""
+Cost of encoding a large list response, the way routes used to do it with `jsonable_encoder` and
+the stdlib `json` behind `JSONResponse`, against a response model, which fastapi validates and
+dumps to bytes with pydantic-core in one pass. Both ORM rows and payload models are measured,
+loaded from one group seeded into a throwaway sqlite database, see bench_analytics for its shape.
+
+    python -m benchmarks.bench_json --expenses 20000 --repeat 5
+"""
+
+import time
+import argparse
+import tempfile
+from collections.abc import Callable
+from pathlib import Path
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+from sqlmodel import Session, SQLModel, col, create_engine, select
+
+from app.repository.models import Expense
+from app.routes.expense import ExpenseSearchHit
+from benchmarks.bench_analytics import seed
+
+
+def best_of(repeat: int, encode: Callable[[], bytes]) -> tuple[float, int]:
+    """Returns the fastest of the runs in seconds, and the size of the body."""
+    best, size = float("inf"), 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        size = len(encode())
+        best = min(best, time.perf_counter() - start)
+    return best, size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--expenses", type=int, default=20_000)
+    parser.add_argument("--members", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{Path(tmp) / 'bench.db'}")
+        SQLModel.metadata.create_all(engine)
+        with Session(engine) as session:
+            group = seed(session, args.members, args.expenses)
+            expenses = list(session.exec(select(Expense).where(col(Expense.group_id) == group.id)).all())
+        engine.dispose()
+
+    hits = [
+        ExpenseSearchHit(
+            id=e.id, title=e.title, details=e.details, paid_by=e.paid_by, paid_on=e.paid_on, amount=e.amount, score=1.0
+        )
+        for e in expenses
+    ]
+    # what the fast path of a route with a response model does: validate, then dump to bytes
+    rows_adapter = TypeAdapter(list[Expense])
+    hits_adapter = TypeAdapter(list[ExpenseSearchHit])
+
+    cases: list[tuple[str, Callable[[], bytes]]] = [
+        ("rows, jsonable_encoder + json", lambda: JSONResponse(jsonable_encoder(expenses)).body),
+        ("rows, response model", lambda: rows_adapter.dump_json(rows_adapter.validate_python(expenses))),
+        ("models, jsonable_encoder + json", lambda: JSONResponse(jsonable_encoder(hits)).body),
+        ("models, response model", lambda: hits_adapter.dump_json(hits_adapter.validate_python(hits))),
+    ]
+
+    print(f"{len(expenses)} items per response, best of {args.repeat}\n")
+    baselines: dict[str, float] = {}
+    for label, encode in cases:
+        seconds, size = best_of(args.repeat, encode)
+        kind = label.split(",")[0]
+        baseline = baselines.setdefault(kind, seconds)
+        print(
+            f"{label:<34} {seconds * 1000:>9.1f} ms   {len(expenses) / seconds:>12,.0f} items/s"
+            f"   {size / 1024:>8,.0f} KiB   x{baseline / seconds:.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
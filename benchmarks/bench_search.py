@@ -0,0 +1,145 @@
+"""
+Compares searching the titles and details of a group with the full text index against the
+`LIKE '%word%'` scan it replaces. Seeds a throwaway sqlite database, builds the index with one
+rebuild and prints the latency of a few queries, first page and a later keyset page.
+
+    python -m benchmarks.bench_search --expenses 1000000 --groups 50
+"""
+
+import time
+import uuid
+import random
+import argparse
+import tempfile
+import itertools
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from pathlib import Path
+
+from sqlalchemy import insert
+from sqlmodel import Session, SQLModel, col, create_engine, or_, select
+
+from app.repository.enums import SplitPolicy
+from app.repository.models import Expense, Group, User
+from app.utils.search import SearchCursor, search_backend, search_terms
+
+COMMON = (
+    "pizza pasta groceries taxi train flight hotel rent electricity water internet coffee dinner "
+    "lunch breakfast tickets museum concert gas parking laundry cleaning gift pharmacy market"
+).split()
+
+
+def vocabulary(rng: random.Random, size: int) -> list[str]:
+    """Common words first, then made up ones, word frequencies follow a long tail like real titles do."""
+    syllables = [c + v for c in "bcdfghklmnprstvz" for v in "aeiou"]
+    words = list(COMMON)
+    while len(words) < size:
+        words.append("".join(rng.choices(syllables, k=rng.randint(2, 4))))
+    return words
+
+
+def seed(session: Session, n_groups: int, n_expenses: int) -> list[Group]:
+    rng = random.Random(7)
+    now = datetime.now(timezone.utc)
+    user = User(name="bench", password_hash="-")
+    session.add(user)
+    session.flush()
+
+    groups = [Group(name=f"bench {i}", currency="USD", creator_id=user.id, admin_id=user.id) for i in range(n_groups)]
+    session.add_all(groups)
+    session.flush()
+
+    words = vocabulary(rng, 20_000)
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(words))))
+
+    batch = []
+    for i in range(n_expenses):
+        batch.append(
+            {
+                "id": uuid.uuid4(),
+                "title": " ".join(rng.choices(words, cum_weights=cum_weights, k=2)),
+                "details": " ".join(rng.choices(words, cum_weights=cum_weights, k=4)) if rng.random() < 0.5 else None,
+                "group_id": groups[i % n_groups].id,
+                "paid_by": user.id,
+                "created_by": user.id,
+                "paid_on": date(2024, 1, 1) + timedelta(days=rng.randrange(730)),
+                "amount": Decimal(rng.randint(100, 1_000_000)) / 100,
+                "split_policy": SplitPolicy.EQUAL,
+                "split_count": 1,
+                "created_at": now,
+                "updated_at": now,
+                "version": 1,
+            }
+        )
+        if len(batch) == 50_000:
+            session.execute(insert(Expense), batch)
+            batch.clear()
+    if batch:
+        session.execute(insert(Expense), batch)
+    session.commit()
+    return groups
+
+
+def like_search(session: Session, group: Group, query: str, limit: int):
+    conditions = [
+        or_(col(Expense.title).ilike(f"%{term}%"), col(Expense.details).ilike(f"%{term}%"))
+        for term in search_terms(query)
+    ]
+    # ordered like a listing would be, so every match is visited just as ranking has to
+    stmt = (
+        select(Expense.id)
+        .where(col(Expense.group_id) == group.id, *conditions)
+        .order_by(col(Expense.paid_on).desc(), col(Expense.id))
+        .limit(limit)
+    )
+    return session.exec(stmt).all()
+
+
+def fts_search(session: Session, group: Group, query: str, limit: int, pages: int = 1):
+    backend, after = search_backend(session), None
+    for _ in range(pages):
+        hits = backend.search(session, group.id, search_terms(query), limit, after)
+        if len(hits) < limit:
+            break
+        after = SearchCursor(score=hits[-1].score, expense_id=hits[-1].expense_id)
+
+
+def timed(label: str, fn, repeat: int = 5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    print(f"{label:<40} {best * 1000:>10.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--expenses", type=int, default=1_000_000)
+    parser.add_argument("--groups", type=int, default=50)
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{Path(tmp) / 'bench.db'}")
+        SQLModel.metadata.create_all(engine)
+        with Session(engine) as session:
+            groups = seed(session, args.groups, args.expenses)
+            print(f"{args.expenses} expenses in {args.groups} groups\n")
+
+            start = time.perf_counter()
+            search_backend(session).rebuild(session)
+            session.commit()
+            print(f"{'fts: rebuild index':<40} {(time.perf_counter() - start) * 1000:>10.0f} ms\n")
+
+            group = groups[len(groups) // 2]
+            # a frequent word, two words together, a prefix and a word from the long tail
+            for query in ("pizza", "pizza pasta", "groc", "museum"):
+                timed(f"like: {query!r}", lambda query=query: like_search(session, group, query, args.limit))
+                timed(f"fts: {query!r}", lambda query=query: fts_search(session, group, query, args.limit))
+            timed("fts: 'pizza', fifth page", lambda: fts_search(session, group, "pizza", args.limit, pages=5))
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,7 @@
 import os
 import sys
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
 
 import pytest
 from fastapi.testclient import TestClient
@@ -14,7 +16,12 @@ sys.path.append(os.path.dirname(SCRIPT_DIR))
 
 from app.config.vars import JWTVars, get_jwt_vars
 from app.main import app
+from app.repository.enums import MembershipStatus
+from app.repository.models import Account, Group, User
 from app.repository.session import get_session
+from app.repository.types import id_to_str
+from app.routes.security import create_access_token
+from app.utils.authentication import store_user
 
 
 @pytest.fixture(name="session")
@@ -59,3 +66,42 @@ def client_fixture(session: Session, jwt_vars: JWTVars):
     yield client
 
     app.dependency_overrides.clear()
+
+
+members_data = (
+    ("Peter Parker", "peter@dailybugle.com", "+1 202 555 0101"),
+    ("Mary Jane", "mj@dailybugle.com", "+1 202 555 0102"),
+    ("Harry Osborn", "harry@oscorp.com", "+1 202 555 0103"),
+)
+
+
+@pytest.fixture(name="members")
+def members_fixture(session: Session):
+    """A group whose members all have active accounts, the first member is the admin."""
+    users = [store_user(session, name=n, email=e, mobile=m, password="secret_password@123") for n, e, m in members_data]
+    group = Group(name="Spidey Friends", currency="USD", creator_id=users[0].id, admin_id=users[0].id)
+    session.add(group)
+
+    joined = datetime.now(timezone.utc) - timedelta(days=len(users))
+    for i, user in enumerate(users):
+        account = Account(
+            owner_id=user.id,
+            group_id=group.id,
+            invited_by=users[0].id,
+            balance=Decimal(0),
+            membership_status=MembershipStatus.ACTIVE,
+            invited_at=joined,
+            member_since=joined + timedelta(days=i),
+        )
+        session.add(account)
+
+    session.commit()
+    yield group, users
+
+
+@pytest.fixture(name="auth_headers")
+def auth_headers_fixture(jwt_vars: JWTVars):
+    def auth_headers(user: User) -> dict[str, str]:
+        return {"Authorization": f"Bearer {create_access_token(id_to_str(user.id), jwt_vars)}"}
+
+    yield auth_headers
@@ -0,0 +1,101 @@
+import uuid
+from collections.abc import Callable
+
+import pytest
+from fastapi import status
+from fastapi.testclient import TestClient
+from sqlmodel import Session, func, select
+
+from app.main import app
+from app.repository.enums import MembershipStatus
+from app.repository.models import Account, Expense, Group, User
+from app.repository.types import id_to_str
+from app.utils.authentication import store_user
+from app.utils.events import EventHub, LocalEventBackend, get_event_hub
+
+AuthHeaders = Callable[[User], dict[str, str]]
+
+
+def test_batch_runs_operations_atomically_or_independently(
+    members: tuple[Group, list[User]],
+    client: TestClient,
+    session: Session,
+    auth_headers: AuthHeaders,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    group, users = members
+    backend = LocalEventBackend(history_size=16)
+    hub = EventHub(backend, max_queued=8, heartbeat_seconds=15)
+    app.dependency_overrides[get_event_hub] = lambda: hub
+
+    expense = {
+        "title": "Coffee",
+        "paid_by": id_to_str(users[0].id),
+        "group_id": id_to_str(group.id),
+        "paid_on": "2025-03-01",
+        "amount": "30.0000",
+        "split_policy": "equal",
+    }
+    invitee = store_user(session, name="Eddie Brock", email="eddie@dailyglobe.com", password="secret_password@123")
+    operations = [
+        {"op": "create_expense", "body": expense},
+        {"op": "patch_expense", "expense_id": id_to_str(uuid.uuid7()), "body": {"title": "Tea"}},
+        {"op": "invite_user", "body": {"group_id": id_to_str(group.id), "invitee_id": id_to_str(invitee.id)}},
+    ]
+    expense_count = select(func.count()).select_from(Expense)
+
+    # the missing expense fails an atomic batch, the expense before it is rolled back as well
+    resp = client.post("/batch", json={"operations": operations}, headers=auth_headers(users[0]))
+    assert resp.status_code == status.HTTP_200_OK
+    body = resp.json()
+    assert body["committed"] is False
+    assert [r["status"] for r in body["results"]] == [424, 404, 424]
+    assert body["results"][1]["body"]["code"] == "expense_not_found"
+    assert session.exec(expense_count).one() == 0
+    assert backend.replay(group.id, f"{backend.epoch}-0") == []
+
+    # independently, only the failed operation is left out
+    resp = client.post("/batch", json={"mode": "independent", "operations": operations}, headers=auth_headers(users[0]))
+    body = resp.json()
+    assert body["committed"] is True
+    assert [r["status"] for r in body["results"]] == [201, 404, 200]
+    created = body["results"][0]
+    assert created["body"]["title"] == "Coffee" and created["headers"]["ETag"]
+    assert session.exec(expense_count).one() == 1
+    events = backend.replay(group.id, f"{backend.epoch}-0")
+    assert events is not None
+    assert [e.frame.split(b"\n")[1] for e in events] == [b"event: expense.created", b"event: invitation.created"]
+
+    # the invitee accepts and fixes the expense in one go
+    account_id = body["results"][2]["body"]["account_id"]
+    operations = [
+        {"op": "accept_invitation", "invitation_id": account_id},
+        {"op": "patch_expense", "expense_id": created["body"]["id"], "body": {"title": "Espresso"}},
+    ]
+    resp = client.post("/batch", json={"operations": operations}, headers=auth_headers(invitee))
+    assert [r["status"] for r in resp.json()["results"]] == [200, 200]
+    session.expire_all()
+    assert session.get_one(Account, uuid.UUID(account_id)).membership_status == MembershipStatus.ACTIVE
+    assert session.get_one(Expense, uuid.UUID(created["body"]["id"])).title == "Espresso"
+
+    unknown = client.post("/batch", json={"operations": [{"op": "drop_group"}]}, headers=auth_headers(invitee))
+    assert unknown.status_code == status.HTTP_422_UNPROCESSABLE_CONTENT
+
+    # an unexpected error fails only its operation, and still fails an atomic batch as a whole
+    def broken(*_):
+        raise RuntimeError("handler bug")
+
+    monkeypatch.setattr("app.routes.batch.decline_invitation", broken)
+    operations = [
+        {"op": "create_expense", "body": expense},
+        {"op": "decline_invitation", "invitation_id": account_id},
+    ]
+    before = session.exec(expense_count).one()
+    resp = client.post("/batch", json={"mode": "independent", "operations": operations}, headers=auth_headers(users[0]))
+    assert resp.status_code == status.HTTP_200_OK
+    assert [(r["status"], r["body"].get("code")) for r in resp.json()["results"][1:]] == [(500, "operation_failed")]
+    assert session.exec(expense_count).one() == before + 1
+    resp = client.post("/batch", json={"operations": operations}, headers=auth_headers(users[0]))
+    assert resp.json()["committed"] is False
+    assert [r["status"] for r in resp.json()["results"]] == [424, 500]
+    assert session.exec(expense_count).one() == before + 1
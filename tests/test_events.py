@@ -0,0 +1,87 @@
+import uuid
+import asyncio
+from collections.abc import Callable
+
+from fastapi import status
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+from app.main import app
+from app.repository.models import Group, User
+from app.repository.types import id_to_str
+from app.utils.authentication import store_user
+from app.utils.events import HEARTBEAT_FRAME, EventHub, LocalEventBackend, get_event_hub
+
+AuthHeaders = Callable[[User], dict[str, str]]
+
+
+def test_event_streams_fan_out_lag_and_resume():
+    group_id = uuid.uuid7()
+    backend = LocalEventBackend(history_size=4)
+    hub = EventHub(backend, max_queued=2, heartbeat_seconds=0.05)
+
+    async def scenario():
+        member = hub.stream(group_id, is_admin=False, last_event_id=None)
+        admin = hub.stream(group_id, is_admin=True, last_event_id=None)
+        assert await anext(member) == await anext(admin) == b"retry: 3000\n\n"
+        # nothing happened yet, the streams are kept alive
+        assert await anext(member) == HEARTBEAT_FRAME
+        assert hub.subscribers(group_id) == 2
+
+        # routes publish from worker threads after they commit
+        await asyncio.to_thread(hub.publish, group_id, "invitation.created", {"id": 1}, True)
+        await asyncio.to_thread(hub.publish, group_id, "expense.created", {"id": 2})
+        first = await anext(member)
+        assert b"event: expense.created" in first and b'"id":2' in first
+        assert b"event: invitation.created" in await anext(admin)
+        assert b"event: expense.created" in await anext(admin)
+
+        # three events overflow a queue of two, the member is told it lagged instead
+        for i in range(3):
+            hub.publish(group_id, "expense.updated", {"id": i})
+        await asyncio.sleep(0)
+        assert b"event: lagged" in await anext(member)
+        assert await anext(member) == HEARTBEAT_FRAME
+
+        # resuming replays what came after the last event received, while it is still kept
+        last_id = first.split(b"\n")[0].removeprefix(b"id: ").decode()
+        resumed = hub.stream(group_id, is_admin=False, last_event_id=last_id)
+        frames = [await anext(resumed) for _ in range(4)]
+        assert [f.count(b"event: expense.updated") for f in frames[1:]] == [1, 1, 1]
+        too_old = hub.stream(group_id, is_admin=False, last_event_id=f"{backend.epoch}-0")
+        await anext(too_old)
+        assert b"event: lagged" in await anext(too_old)
+
+        for stream in (member, admin, resumed, too_old):
+            await stream.aclose()
+        assert hub.subscribers(group_id) == 0
+
+    asyncio.run(scenario())
+
+
+def test_routes_publish_after_commit(
+    members: tuple[Group, list[User]], client: TestClient, session: Session, auth_headers: AuthHeaders
+):
+    group, users = members
+    backend = LocalEventBackend(history_size=16)
+    hub = EventHub(backend, max_queued=8, heartbeat_seconds=15)
+    app.dependency_overrides[get_event_hub] = lambda: hub
+
+    payload = {
+        "title": "Coffee",
+        "paid_by": id_to_str(users[0].id),
+        "group_id": id_to_str(group.id),
+        "paid_on": "2025-03-01",
+        "amount": "30.0000",
+        "split_policy": "equal",
+    }
+    expense_id = client.post("/expense", json=payload, headers=auth_headers(users[0])).json()["id"]
+    assert client.delete(f"/expense/{expense_id}", headers=auth_headers(users[0])).status_code == 204
+
+    events = backend.replay(group.id, f"{backend.epoch}-0")
+    assert events is not None
+    assert [e.frame.split(b"\n")[1] for e in events] == [b"event: expense.created", b"event: expense.deleted"]
+
+    outsider = store_user(session, name="Eddie Brock", email="eddie@dailyglobe.com", password="secret_password@123")
+    resp = client.get(f"/group/{id_to_str(group.id)}/events", headers=auth_headers(outsider))
+    assert resp.status_code == status.HTTP_403_FORBIDDEN
@@ -0,0 +1,782 @@
+import io
+import time
+import random
+import threading
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from pathlib import Path
+
+import pytest
+from fastapi import Response, status
+from fastapi.testclient import TestClient
+from PIL import Image
+from sqlalchemy import event, update
+from sqlmodel import Session, SQLModel, col, create_engine, select
+
+from app.config.vars import CurrencyVars, LedgerVars, get_currency_vars, get_ledger_vars
+from app.errors.error import ErrExpense, ErrIdempotency
+from app.main import app
+from app.repository.models import Account, Expense, Group, MonthlySpend, Split, User
+from app.repository.session import get_session
+from app.repository.types import TypeId, id_to_str, str_to_id
+from app.routes.expense import ExpensePayload, new_expense
+from app.utils.coalescer import WriteCoalescer
+from app.utils.currency import RateTable
+from app.utils.events import get_event_hub
+from app.utils.idempotency import IdempotencyStore
+from app.utils.ledger import compute_group_balances
+from app.utils.receipts import ReceiptStore, Thumbnailer, get_receipt_store, get_thumbnailer
+from app.utils.rollup import apply_rollup_deltas, increment_or_insert, merge_rollup_deltas, rebuild_rollups
+from app.utils.search import LikeSearchBackend, SearchCursor
+from app.utils.static import CachedStaticFiles
+from app.utils.versioning import VersionConflictError, check_pinned_version, retry_on_conflict
+
+AuthHeaders = Callable[[User], dict[str, str]]
+
+
+def balances_of(session: Session, group: Group) -> dict[str, Decimal]:
+    accounts = session.exec(select(Account).where(col(Account.group_id) == group.id)).all()
+    for account in accounts:
+        session.refresh(account)
+    return {id_to_str(a.owner_id): a.balance for a in accounts}
+
+
+def test_equal_split_stores_no_split_rows(
+    members: tuple[Group, list[User]], client: TestClient, session: Session, auth_headers: AuthHeaders
+):
+    group, users = members
+    payload = {
+        "title": "Pizza",
+        "paid_by": id_to_str(users[0].id),
+        "group_id": id_to_str(group.id),
+        "paid_on": "2025-03-01",
+        "amount": "100.0000",
+        "split_policy": "equal",
+    }
+    resp = client.post("/expense", json=payload, headers=auth_headers(users[0]))
+    assert resp.status_code == status.HTTP_201_CREATED
+
+    expense_id = str_to_id(resp.json()["id"])
+    assert session.exec(select(Split).where(col(Split.expense_id) == expense_id)).all() == []
+
+    # the leftover quantum of the uneven division goes to the member who joined first
+    balances = balances_of(session, group)
+    assert balances[id_to_str(users[0].id)] == Decimal("66.6666")
+    assert balances[id_to_str(users[1].id)] == Decimal("-33.3333")
+    assert balances[id_to_str(users[2].id)] == Decimal("-33.3333")
+
+    resp = client.get(f"/expense/{id_to_str(expense_id)}", headers=auth_headers(users[1]))
+    assert resp.status_code == status.HTTP_200_OK
+    splits = {s["user_id"]: Decimal(s["amount"]) for s in resp.json()["splits"]}
+    assert len(splits) == len(users)
+    assert sum(splits.values()) == Decimal(100)
+
+
+def test_custom_split_stores_rows(
+    members: tuple[Group, list[User]], client: TestClient, session: Session, auth_headers: AuthHeaders
+):
+    group, users = members
+    amounts = ("10.0000", "20.0000", "30.0000")
+    payload = {
+        "title": "Tickets",
+        "paid_by": id_to_str(users[1].id),
+        "group_id": id_to_str(group.id),
+        "paid_on": "2025-03-02",
+        "amount": "60.0000",
+        "splits": [{"user_id": id_to_str(u.id), "amount": a} for u, a in zip(users, amounts)],
+    }
+    resp = client.post("/expense", json=payload, headers=auth_headers(users[1]))
+    assert resp.status_code == status.HTTP_201_CREATED
+
+    expense_id = str_to_id(resp.json()["id"])
+    assert len(session.exec(select(Split).where(col(Split.expense_id) == expense_id)).all()) == len(users)
+
+    balances = balances_of(session, group)
+    assert balances[id_to_str(users[0].id)] == Decimal("-10")
+    assert balances[id_to_str(users[1].id)] == Decimal("40")
+    assert balances[id_to_str(users[2].id)] == Decimal("-30")
+
+
+def test_equal_split_rejects_explicit_splits(
+    members: tuple[Group, list[User]], client: TestClient, auth_headers: AuthHeaders
+):
+    group, users = members
+    payload = {
+        "title": "Snacks",
+        "paid_by": id_to_str(users[0].id),
+        "group_id": id_to_str(group.id),
+        "paid_on": "2025-03-01",
+        "amount": "10.0000",
+        "split_policy": "equal",
+        "splits": [{"user_id": id_to_str(users[0].id), "amount": "10.0000"}],
+    }
+    resp = client.post("/expense", json=payload, headers=auth_headers(users[0]))
+    assert resp.status_code == status.HTTP_400_BAD_REQUEST
+    assert resp.json()["code"] == "unexpected_splits"
+
+
+def test_update_switches_split_policy_and_reconciles(
+    members: tuple[Group, list[User]], client: TestClient, session: Session, auth_headers: AuthHeaders
+):
+    group, users = members
+    headers = auth_headers(users[0])
+    payload = {
+        "title": "Groceries",
+        "paid_by": id_to_str(users[0].id),
+        "group_id": id_to_str(group.id),
+        "paid_on": "2025-03-03",
+        "amount": "90.0000",
+        "split_policy": "equal",
+    }
+    resp = client.post("/expense", json=payload, headers=headers)
+    expense_id = resp.json()["id"]
+
+    payload["split_policy"] = "custom"
+    payload["paid_by"] = id_to_str(users[2].id)
+    payload["splits"] = [{"user_id": id_to_str(u.id), "amount": "30.0000"} for u in users]
+    resp = client.put(f"/expense/{expense_id}", json=payload, headers=headers)
+    assert resp.status_code == status.HTTP_200_OK
+
+    balances = balances_of(session, group)
+    assert balances[id_to_str(users[0].id)] == Decimal("-30")
+    assert balances[id_to_str(users[2].id)] == Decimal("60")
+    assert {id_to_str(k): v for k, v in compute_group_balances(session, group.id).items()} == balances
+
+    payload["split_policy"] = "equal"
+    payload["splits"] = []
+    resp = client.put(f"/expense/{expense_id}", json=payload, headers=headers)
+    assert resp.status_code == status.HTTP_200_OK
+    assert session.exec(select(Split).where(col(Split.expense_id) == str_to_id(expense_id))).all() == []
+
+    resp = client.get(f"/group/{id_to_str(group.id)}/reconcile", headers=headers)
+    assert resp.status_code == status.HTTP_200_OK
+    assert resp.json() == []
+
+
+def test_patch_details_does_not_touch_splits_or_accounts(
+    members: tuple[Group, list[User]], client: TestClient, session: Session, auth_headers: AuthHeaders
+):
+    group, users = members
+    headers = auth_headers(users[0])
+    payload = {
+        "title": "Rent",
+        "paid_by": id_to_str(users[0].id),
+        "group_id": id_to_str(group.id),
+        "paid_on": "2025-03-01",
+        "amount": "300.0000",
+        "split_policy": "equal",
+    }
+    expense_id = client.post("/expense", json=payload, headers=headers).json()["id"]
+
+    writes: list[str] = []
+
+    def record_writes(_conn, _cursor, statement: str, *_):
+        # the search index of the changed details and the change log are maintained on their own tables
+        if (
+            not statement.lstrip().upper().startswith(("SELECT", "INSERT INTO CHANGE "))
+            and "expense_search" not in statement
+        ):
+            writes.append(statement)
+
+    engine = session.get_bind()
+    event.listen(engine, "before_cursor_execute", record_writes)
+    try:
+        resp = client.patch(f"/expense/{expense_id}", json={"details": "march rent"}, headers=headers)
+    finally:
+        event.remove(engine, "before_cursor_execute", record_writes)
+
+    assert resp.status_code == status.HTTP_200_OK
+    assert resp.json()["details"] == "march rent"
+    assert resp.json()["title"] == "Rent"
+    # the expense row itself, no split, account or group
+    assert len(writes) == 1
+    assert writes[0].lstrip().upper().startswith("UPDATE EXPENSE")
+
+
+def test_patch_changed_splits_only(
+    members: tuple[Group, list[User]], client: TestClient, session: Session, auth_headers: AuthHeaders
+):
+    group, users = members
+    headers = auth_headers(users[0])
+    payload = {
+        "title": "Tickets",
+        "paid_by": id_to_str(users[0].id),
+        "group_id": id_to_str(group.id),
+        "paid_on": "2025-03-02",
+        "amount": "60.0000",
+        "splits": [{"user_id": id_to_str(u.id), "amount": "20.0000"} for u in users],
+    }
+    expense_id = client.post("/expense", json=payload, headers=headers).json()["id"]
+
+    # moving 5 from one member to another keeps the total intact
+    patch = {"splits": [{"user_id": id_to_str(users[1].id), "amount": "25.0000"}]}
+    resp = client.patch(f"/expense/{expense_id}", json=patch, headers=headers)
+    assert resp.status_code == status.HTTP_400_BAD_REQUEST
+    assert resp.json()["code"] == "split_total_mismatch"
+
+    patch["splits"].append({"user_id": id_to_str(users[2].id), "amount": "15.0000"})
+    resp = client.patch(f"/expense/{expense_id}", json=patch, headers=headers)
+    assert resp.status_code == status.HTTP_200_OK
+
+    patch = {"amount": "90.0000", "paid_by": id_to_str(users[2].id)}
+    patch["splits"] = [{"user_id": id_to_str(users[0].id), "amount": "50.0000"}]
+    resp = client.patch(f"/expense/{expense_id}", json=patch, headers=headers)
+    assert resp.status_code == status.HTTP_200_OK
+
+    balances = balances_of(session, group)
+    assert balances[id_to_str(users[0].id)] == Decimal("-50")
+    assert balances[id_to_str(users[1].id)] == Decimal("-25")
+    assert balances[id_to_str(users[2].id)] == Decimal("75")
+    assert {id_to_str(k): v for k, v in compute_group_balances(session, group.id).items()} == balances
+
+
+def test_if_match_mismatch_returns_current_version(
+    members: tuple[Group, list[User]],
+    client: TestClient,
+    session: Session,
+    auth_headers: AuthHeaders,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    group, users = members
+    headers = auth_headers(users[0])
+    payload = {
+        "title": "Museum",
+        "paid_by": id_to_str(users[0].id),
+        "group_id": id_to_str(group.id),
+        "paid_on": "2025-03-04",
+        "amount": "45.0000",
+        "split_policy": "equal",
+    }
+    resp = client.post("/expense", json=payload, headers=headers)
+    expense_id, etag = resp.json()["id"], resp.headers["etag"]
+    assert etag == '"1"'
+
+    resp = client.patch(f"/expense/{expense_id}", json={"title": "Louvre"}, headers=headers | {"If-Match": etag})
+    assert resp.status_code == status.HTTP_200_OK
+    assert resp.headers["etag"] == '"2"'
+
+    # a second writer still holding the first version loses
+    resp = client.patch(f"/expense/{expense_id}", json={"amount": "60.0000"}, headers=headers | {"If-Match": etag})
+    assert resp.status_code == status.HTTP_412_PRECONDITION_FAILED
+    assert resp.json()["detail"] == {"current_version": 2}
+    assert resp.headers["etag"] == '"2"'
+
+    payload["title"] = "Orsay"
+    resp = client.put(f"/expense/{expense_id}", json=payload, headers=headers | {"If-Match": etag})
+    assert resp.status_code == status.HTTP_412_PRECONDITION_FAILED
+
+    resp = client.put(f"/expense/{expense_id}", json=payload, headers=headers | {"If-Match": '"2"'})
+    assert resp.status_code == status.HTTP_200_OK
+    assert resp.json()["version"] == 3
+
+    def write_after_check(pinned: int | None, version: int):
+        check_pinned_version(pinned, version)
+        # another writer lands between the read of the delete and its write
+        stmt = update(Expense).where(col(Expense.id) == str_to_id(expense_id)).values(version=version + 1)
+        session.exec(stmt.execution_options(synchronize_session=False))
+
+    monkeypatch.setattr("app.routes.expense.check_pinned_version", write_after_check)
+    resp = client.delete(f"/expense/{expense_id}", headers=headers | {"If-Match": '"3"'})
+    assert resp.status_code == status.HTTP_412_PRECONDITION_FAILED
+    monkeypatch.undo()
+    assert client.delete(f"/expense/{expense_id}", headers=headers | {"If-Match": '"3"'}).status_code == 204
+
+
+def test_retry_on_conflict_reapplies_commutative_change(session: Session):
+    attempts: list[int] = []
+
+    def attempt() -> int:
+        attempts.append(len(attempts))
+        if len(attempts) < 3:
+            raise VersionConflictError(len(attempts))
+        return len(attempts)
+
+    assert retry_on_conflict(session, attempt) == 3
+
+    attempts.clear()
+    with pytest.raises(VersionConflictError):
+        retry_on_conflict(session, attempt, attempts=2)
+
+
+def test_bulk_delete_reverts_balances(
+    members: tuple[Group, list[User]], client: TestClient, session: Session, auth_headers: AuthHeaders
+):
+    group, users = members
+    headers = auth_headers(users[0])
+
+    def post_expense(paid_on: str, payer: User, split_policy: str) -> str:
+        payload = {
+            "title": "Imported",
+            "paid_by": id_to_str(payer.id),
+            "group_id": id_to_str(group.id),
+            "paid_on": paid_on,
+            "amount": "10.0000",
+            "split_policy": split_policy,
+        }
+        if split_policy == "custom":
+            payload["splits"] = [{"user_id": id_to_str(users[1].id), "amount": "10.0000"}] + [
+                {"user_id": id_to_str(u.id), "amount": "0.0000"} for u in (users[0], users[2])
+            ]
+        resp = client.post("/expense", json=payload, headers=headers)
+        assert resp.status_code == status.HTTP_201_CREATED
+        return resp.json()["id"]
+
+    kept = post_expense("2025-01-15", users[2], "equal")
+    for day in range(1, 6):
+        post_expense(f"2025-02-0{day}", users[day % 2], "equal" if day % 2 else "custom")
+
+    resp = client.post("/expense/bulk-delete", json={"group_id": id_to_str(group.id)}, headers=headers)
+    assert resp.status_code == status.HTTP_400_BAD_REQUEST
+
+    resp = client.post("/expense/bulk-delete", json={"group_id": id_to_str(group.id)}, headers=auth_headers(users[1]))
+    assert resp.status_code == status.HTTP_403_FORBIDDEN
+
+    payload = {"group_id": id_to_str(group.id), "paid_from": "2025-02-01", "paid_to": "2025-02-28"}
+    resp = client.post("/expense/bulk-delete", json=payload, headers=headers)
+    assert resp.status_code == status.HTTP_200_OK
+    assert resp.json() == {"deleted": 5}
+
+    assert session.exec(select(Split)).all() == []
+    balances = balances_of(session, group)
+    assert {id_to_str(k): v for k, v in compute_group_balances(session, group.id).items()} == balances
+    assert balances[id_to_str(users[2].id)] == Decimal("6.6667")
+
+    resp = client.delete(f"/expense/{kept}", headers=headers)
+    assert resp.status_code == status.HTTP_204_NO_CONTENT
+    assert set(balances_of(session, group).values()) == {Decimal(0)}
+
+
+def test_monthly_rollups_follow_every_write(
+    members: tuple[Group, list[User]], client: TestClient, session: Session, auth_headers: AuthHeaders
+):
+    group, users = members
+    headers = auth_headers(users[0])
+
+    def rollups() -> dict[tuple[str, str], tuple[Decimal, Decimal]]:
+        rows = session.exec(select(MonthlySpend).where(col(MonthlySpend.group_id) == group.id)).all()
+        for row in rows:
+            session.refresh(row)
+        return {(id_to_str(r.user_id), r.year_month): (r.paid, r.owed) for r in rows if r.paid != 0 or r.owed != 0}
+
+    custom = {
+        "title": "Tickets",
+        "paid_by": id_to_str(users[0].id),
+        "group_id": id_to_str(group.id),
+        "paid_on": "2025-03-02",
+        "amount": "60.0000",
+        "splits": [{"user_id": id_to_str(u.id), "amount": "20.0000"} for u in users],
+    }
+    custom_id = client.post("/expense", json=custom, headers=headers).json()["id"]
+    equal = custom | {"paid_on": "2025-04-10", "paid_by": id_to_str(users[1].id), "split_policy": "equal", "splits": []}
+    equal_id = client.post("/expense", json=equal, headers=headers).json()["id"]
+    assert rollups()[(id_to_str(users[1].id), "2025-04")] == (Decimal(60), Decimal(20))
+
+    patch = {"splits": [{"user_id": id_to_str(users[1].id), "amount": "30.0000"}]}
+    patch["splits"].append({"user_id": id_to_str(users[2].id), "amount": "10.0000"})
+    assert client.patch(f"/expense/{custom_id}", json=patch, headers=headers).status_code == status.HTTP_200_OK
+
+    patch = {"paid_on": "2025-05-01", "amount": "90.0000"}
+    assert client.patch(f"/expense/{equal_id}", json=patch, headers=headers).status_code == status.HTTP_200_OK
+
+    custom |= {"paid_on": "2025-05-20", "paid_by": id_to_str(users[2].id)}
+    assert client.put(f"/expense/{custom_id}", json=custom, headers=headers).status_code == status.HTTP_200_OK
+
+    maintained = rollups()
+    assert (id_to_str(users[1].id), "2025-04") not in maintained
+    assert maintained[(id_to_str(users[1].id), "2025-05")] == (Decimal(90), Decimal(50))
+
+    rebuild_rollups(session, group.id)
+    session.commit()
+    assert rollups() == maintained
+
+    resp = client.get(f"/group/{id_to_str(group.id)}/report/members", headers=headers, params={"from_month": "2025-05"})
+    assert resp.status_code == status.HTTP_200_OK
+    totals = {str_to_id(t["user_id"]): (Decimal(t["paid"]), Decimal(t["owed"])) for t in resp.json()}
+    assert totals[users[2].id] == (Decimal(60), Decimal(50))
+
+    resp = client.post(
+        "/expense/bulk-delete", json={"group_id": id_to_str(group.id), "paid_from": "2025-05-10"}, headers=headers
+    )
+    assert resp.json() == {"deleted": 1}
+    assert client.delete(f"/expense/{equal_id}", headers=headers).status_code == status.HTTP_204_NO_CONTENT
+    assert rollups() == {}
+
+
+def test_rollups_without_upsert_increment_existing_rows_and_insert_the_others(
+    members: tuple[Group, list[User]], session: Session
+):
+    group, users = members
+    march = {(users[0].id, "2025-03"): (Decimal(30), Decimal(10)), (users[1].id, "2025-03"): (Decimal(0), Decimal(10))}
+    apply_rollup_deltas(session, group.id, march)
+    rows = [
+        {"group_id": group.id, "user_id": user_id, "year_month": month, "paid": paid, "owed": owed}
+        for (user_id, month), (paid, owed) in merge_rollup_deltas(
+            march, {(users[2].id, "2025-04"): (Decimal(5), Decimal(1))}
+        ).items()
+    ]
+    increment_or_insert(session, group.id, rows)
+    session.commit()
+
+    stored = session.exec(select(MonthlySpend).where(col(MonthlySpend.group_id) == group.id)).all()
+    assert {(r.user_id, r.year_month): (r.paid, r.owed) for r in stored} == {
+        (users[0].id, "2025-03"): (Decimal(60), Decimal(20)),
+        (users[1].id, "2025-03"): (Decimal(0), Decimal(20)),
+        (users[2].id, "2025-04"): (Decimal(5), Decimal(1)),
+    }
+
+
+def test_foreign_currency_expense_is_converted_into_group_currency(
+    members: tuple[Group, list[User]], client: TestClient, session: Session, auth_headers: AuthHeaders, tmp_path
+):
+    group, users = members
+    headers = auth_headers(users[0])
+    rates = tmp_path / "rates.csv"
+    rates.write_text("date,currency,rate\n2025-01-01,USD,1.10\n2025-03-01,USD,1.20\n2025-01-01,GBP,0.85\n")
+    currency_vars = CurrencyVars(CURRENCY_RATES_FILE=str(rates), CURRENCY_BASE="EUR")
+    app.dependency_overrides[get_currency_vars] = lambda: currency_vars
+
+    payload = {
+        "title": "Museum",
+        "paid_by": id_to_str(users[0].id),
+        "group_id": id_to_str(group.id),
+        "paid_on": "2025-03-05",
+        "amount": "10.0000",
+        "currency": "EUR",
+        "splits": [{"user_id": id_to_str(u.id), "amount": a} for u, a in zip(users, ("3.3333", "3.3333", "3.3334"))],
+    }
+    resp = client.post("/expense", json=payload, headers=headers)
+    assert resp.status_code == status.HTTP_201_CREATED
+    expense_id = resp.json()["id"]
+
+    resp = client.get(f"/expense/{expense_id}", headers=headers)
+    detail = resp.json()
+    assert (Decimal(detail["amount"]), Decimal(detail["original_amount"])) == (Decimal(12), Decimal(10))
+    assert (detail["currency"], Decimal(detail["exchange_rate"])) == ("EUR", Decimal("1.2"))
+    # the shares still add up to the converted amount exactly
+    assert [Decimal(s["amount"]) for s in detail["splits"]] == [Decimal(4)] * 3
+
+    resp = client.post("/expense", json=payload | {"paid_on": "2024-12-01"}, headers=headers)
+    assert resp.status_code == status.HTTP_422_UNPROCESSABLE_CONTENT
+    assert resp.json()["code"] == "rate_unavailable"
+
+    # patches are converted with the rate the expense was recorded with
+    patch = {"amount": "20.0000", "splits": [{"user_id": id_to_str(users[0].id), "amount": "13.3334"}]}
+    resp = client.patch(f"/expense/{expense_id}", json=patch, headers=headers)
+    assert resp.status_code == status.HTTP_200_OK
+    assert (Decimal(resp.json()["amount"]), Decimal(resp.json()["original_amount"])) == (Decimal(24), Decimal(20))
+    assert balances_of(session, group)[id_to_str(users[0].id)] == Decimal(8)
+
+    resp = client.get(f"/group/{id_to_str(group.id)}/balances", params={"currency": "EUR"}, headers=headers)
+    in_euro = {str_to_id(b["user_id"]): Decimal(b["balance"]) for b in resp.json()}
+    assert in_euro[users[1].id] == Decimal("-3.3333")
+
+    resp = client.get(f"/group/{id_to_str(group.id)}/report/members", params={"currency": "GBP"}, headers=headers)
+    in_pound = {str_to_id(t["user_id"]): Decimal(t["paid"]) for t in resp.json()}
+    assert in_pound[users[0].id] == Decimal("17.0000")
+
+    # patched shares add up to the converted amount exactly, as the shares of a new expense do
+    shares = ("6.6667", "6.6667", "6.6666")
+    patch = {"splits": [{"user_id": id_to_str(u.id), "amount": a} for u, a in zip(users, shares)]}
+    resp = client.patch(f"/expense/{expense_id}", json=patch, headers=headers)
+    assert resp.status_code == status.HTTP_200_OK
+    splits = client.get(f"/expense/{expense_id}", headers=headers).json()["splits"]
+    assert sorted(Decimal(s["amount"]) for s in splits) == [Decimal("7.9999"), Decimal(8), Decimal("8.0001")]
+    assert sum(balances_of(session, group).values()) == 0
+
+
+def test_search_ranks_and_pages_expenses(
+    members: tuple[Group, list[User]], client: TestClient, session: Session, auth_headers: AuthHeaders
+):
+    group, users = members
+    headers = auth_headers(users[0])
+    titles = ("Pizza night", "Pizza and pasta", "Groceries", "Pasta", "Pizzeria tip", "Taxi")
+    ids = {}
+    for title in titles:
+        payload = {
+            "title": title,
+            "details": "pizza leftovers" if title == "Groceries" else None,
+            "paid_by": id_to_str(users[0].id),
+            "group_id": id_to_str(group.id),
+            "paid_on": "2025-03-01",
+            "amount": "9.0000",
+            "split_policy": "equal",
+        }
+        ids[title] = client.post("/expense", json=payload, headers=headers).json()["id"]
+
+    def search(q: str, **params) -> dict:
+        params = {"group_id": id_to_str(group.id), "q": q} | params
+        resp = client.get("/expense/search", params=params, headers=headers)
+        assert resp.status_code == status.HTTP_200_OK
+        return resp.json()
+
+    found = [h["title"] for h in search("pizz")["hits"]]
+    assert set(found) == {"Pizza night", "Pizza and pasta", "Pizzeria tip", "Groceries"}
+    # a word in the title weighs more than the same word in the details
+    assert found[-1] == "Groceries"
+
+    pages, cursor = [], None
+    while True:
+        page = search("pizz", limit=1, **({"cursor": cursor} if cursor else {}))
+        pages.extend(h["title"] for h in page["hits"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert pages == found
+
+    assert [h["title"] for h in search("pasta pizza")["hits"]] == ["Pizza and pasta"]
+
+    # databases without a full text index get the same hits from plain LIKE matches
+    like = LikeSearchBackend()
+    hits = like.search(session, group.id, ["pizz"], 10, None)
+    titles_by_id = {str_to_id(expense_id): title for title, expense_id in ids.items()}
+    assert [titles_by_id[h.expense_id] for h in hits][-1] == "Groceries"
+    assert {titles_by_id[h.expense_id] for h in hits} == set(found)
+    after = SearchCursor(score=hits[0].score, expense_id=hits[0].expense_id)
+    assert like.search(session, group.id, ["pizz"], 10, after) == hits[1:]
+    assert [titles_by_id[h.expense_id] for h in like.search(session, group.id, ["pasta", "pizza"], 10, None)] == [
+        "Pizza and pasta"
+    ]
+
+    client.patch(f"/expense/{ids['Taxi']}", json={"title": "Taxi to the pizzeria"}, headers=headers)
+    client.delete(f"/expense/{ids['Pizza night']}", headers=headers)
+    found = {h["title"] for h in search("pizz")["hits"]}
+    assert found == {"Pizza and pasta", "Pizzeria tip", "Groceries", "Taxi to the pizzeria"}
+
+    resp = client.get(
+        "/expense/search", params={"group_id": id_to_str(group.id), "q": "x", "cursor": "nope"}, headers=headers
+    )
+    assert resp.status_code == status.HTTP_400_BAD_REQUEST
+
+
+def test_coalesced_expenses_commit_together_and_fail_alone(
+    members: tuple[Group, list[User]], client: TestClient, session: Session, auth_headers: AuthHeaders
+):
+    group, users = members
+    engine = session.get_bind()
+    rate_table = RateTable(base="USD", starts={}, rates={})
+    commits = []
+
+    def record_commit(_conn):
+        commits.append(1)
+
+    event.listen(engine, "commit", record_commit)
+
+    def payload(amount: str, split_policy: str = "equal") -> ExpensePayload:
+        return ExpensePayload.model_validate(
+            {
+                "title": "Round",
+                "paid_by": users[0].id,
+                "group_id": group.id,
+                "paid_on": "2025-03-01",
+                "amount": amount,
+                "split_policy": split_policy,
+            }
+        )
+
+    coalescer = WriteCoalescer()
+    # a custom split without any split rows is invalid and must only fail its own write
+    payloads = [payload("3.0000"), payload("6.0000"), payload("9.0000", "custom"), payload("12.0000")]
+
+    def submit(p: ExpensePayload):
+        def build(s: Session, g: Group, roster: list[TypeId]) -> Expense:
+            return new_expense(g, p, users[0].id, rate_table, roster)
+
+        return coalescer.submit(engine, group.id, build, window_seconds=0.2, max_batch=len(payloads))
+
+    with ThreadPoolExecutor(len(payloads)) as pool:
+        futures = [f.result() for f in [pool.submit(submit, p) for p in payloads]]
+
+    assert isinstance(futures[2].exception(), ErrExpense)
+    ids = [f.result() for i, f in enumerate(futures) if i != 2]
+    assert len(commits) == 1
+    assert len(session.exec(select(Expense).where(col(Expense.id).in_(ids))).all()) == 3
+    balances = balances_of(session, group)
+    assert balances[id_to_str(users[0].id)] == Decimal("14.0000")
+    assert balances == {id_to_str(k): v for k, v in compute_group_balances(session, group.id).items()}
+    event.remove(engine, "commit", record_commit)
+
+    # the route hands its expense to the coalescer once a window is configured
+    app.dependency_overrides[get_ledger_vars] = lambda: LedgerVars(LEDGER_COALESCE_WINDOW_MS=5)
+    body = payload("30.0000").model_dump(mode="json")
+    resp = client.post("/expense", json=body, headers=auth_headers(users[0]))
+    assert resp.status_code == status.HTTP_201_CREATED
+    assert balances_of(session, group)[id_to_str(users[0].id)] == Decimal("34.0000")
+
+
+def test_coalesced_requests_do_not_hold_connections_while_waiting(
+    members: tuple[Group, list[User]], client: TestClient, session: Session, auth_headers: AuthHeaders, tmp_path: Path
+):
+    group, users = members
+    # fewer pooled connections than concurrent requests, as under load
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'pooled.db'}",
+        connect_args={"check_same_thread": False},
+        pool_size=2,
+        max_overflow=0,
+        pool_timeout=5,
+    )
+    SQLModel.metadata.create_all(engine)
+    with engine.begin() as connection:
+        for table in SQLModel.metadata.sorted_tables:
+            rows = session.connection().execute(table.select()).mappings().all()
+            if rows:
+                connection.execute(table.insert(), [dict(row) for row in rows])
+
+    def get_pooled_session():
+        with Session(engine) as request_session:
+            yield request_session
+
+    requests = 6
+    app.dependency_overrides[get_session] = get_pooled_session
+    app.dependency_overrides[get_ledger_vars] = lambda: LedgerVars(
+        LEDGER_COALESCE_WINDOW_MS=100, LEDGER_COALESCE_MAX_BATCH=requests
+    )
+    body = {
+        "title": "Round",
+        "paid_by": id_to_str(users[0].id),
+        "group_id": id_to_str(group.id),
+        "paid_on": "2025-03-01",
+        "amount": "3.0000",
+        "split_policy": "equal",
+    }
+
+    def send(user: User):
+        return client.post("/expense", json=body, headers=auth_headers(user)).status_code
+
+    with ThreadPoolExecutor(requests) as pool:
+        codes = list(pool.map(send, [users[i % len(users)] for i in range(requests)]))
+
+    assert codes == [status.HTTP_201_CREATED] * requests
+    with Session(engine) as pooled:
+        assert sum(compute_group_balances(pooled, group.id).values()) == 0
+        assert len(pooled.exec(select(Expense).where(col(Expense.group_id) == group.id)).all()) == requests
+    engine.dispose()
+
+
+def test_receipts_are_stored_once_by_content_and_served_immutable(
+    members: tuple[Group, list[User]], client: TestClient, auth_headers: AuthHeaders, tmp_path: Path
+):
+    group, users = members
+    headers = auth_headers(users[0])
+    store = ReceiptStore(tmp_path, max_bytes=8 * 1024 * 1024)
+    thumbnailer = Thumbnailer(64, lambda: ThreadPoolExecutor(1))
+    app.dependency_overrides[get_receipt_store] = lambda: store
+    app.dependency_overrides[get_thumbnailer] = lambda: thumbnailer
+
+    payload = {
+        "title": "Dinner",
+        "paid_by": id_to_str(users[0].id),
+        "group_id": id_to_str(group.id),
+        "paid_on": "2025-03-01",
+        "amount": "30.0000",
+        "split_policy": "equal",
+    }
+    expense_ids = [client.post("/expense", json=payload, headers=headers).json()["id"] for _ in range(2)]
+
+    # noise does not compress, the receipt spans several write buffers
+    image = Image.frombytes("RGB", (1200, 900), random.Random(7).randbytes(1200 * 900 * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    receipt = buffer.getvalue()
+    assert len(receipt) > 3 * 1024 * 1024
+
+    first = client.post(f"/expense/{expense_ids[0]}/images", content=receipt, headers=headers)
+    assert first.status_code == status.HTTP_201_CREATED
+    again = client.post(f"/expense/{expense_ids[0]}/images", content=receipt, headers=auth_headers(users[1]))
+    assert again.status_code == status.HTTP_200_OK
+    other = client.post(f"/expense/{expense_ids[1]}/images", content=receipt, headers=headers)
+    assert other.status_code == status.HTTP_201_CREATED
+
+    image_detail = first.json()
+    assert again.json()["id"] == image_detail["id"] and other.json()["id"] != image_detail["id"]
+    assert image_detail["content_type"] == "image/png" and image_detail["size"] == len(receipt)
+    assert other.json()["url"] == image_detail["url"]
+
+    thumbnailer.shutdown()
+    digest = image_detail["digest"]
+    assert sorted(p.name for p in tmp_path.rglob("*") if p.is_file()) == [f"{digest}.png", f"{digest}.thumb.webp"]
+    with Image.open(tmp_path / image_detail["thumbnail_url"].removeprefix("/static/")) as thumbnail:
+        assert max(thumbnail.size) == 64
+
+    resp = client.post(f"/expense/{expense_ids[0]}/images", content=b"not a receipt", headers=headers)
+    assert resp.status_code == status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+    store.max_bytes = 1024 * 1024
+    resp = client.post(f"/expense/{expense_ids[0]}/images", content=receipt, headers=headers)
+    assert resp.status_code == status.HTTP_413_CONTENT_TOO_LARGE
+    assert list((tmp_path / "receipts" / "tmp").iterdir()) == []
+
+    static = TestClient(CachedStaticFiles(directory=str(tmp_path), immutable_dirs=("receipts",)))
+    resp = static.get(image_detail["url"].removeprefix("/static"))
+    assert resp.content == receipt
+    assert "immutable" in resp.headers["cache-control"]
+
+
+def test_idempotency_key_records_once_and_replays(
+    members: tuple[Group, list[User]], client: TestClient, session: Session, auth_headers: AuthHeaders
+):
+    group, users = members
+    payload = {
+        "title": "Taxi",
+        "paid_by": id_to_str(users[0].id),
+        "group_id": id_to_str(group.id),
+        "paid_on": "2025-03-01",
+        "amount": "30.0000",
+        "split_policy": "equal",
+    }
+    headers = auth_headers(users[0]) | {"Idempotency-Key": "taxi-1"}
+    first = client.post("/expense", json=payload, headers=headers)
+    retry = client.post("/expense", json=payload, headers=headers)
+    assert first.status_code == retry.status_code == status.HTTP_201_CREATED
+    assert retry.headers["Idempotent-Replayed"] == "true" and retry.headers["ETag"] == first.headers["ETag"]
+    assert retry.json() == first.json()
+    assert len(session.exec(select(Expense)).all()) == 1
+    assert balances_of(session, group)[id_to_str(users[0].id)] == Decimal("20.0000")
+
+    # the key belongs to that request, another body is refused
+    resp = client.post("/expense", json=payload | {"amount": "40.0000"}, headers=headers)
+    assert resp.status_code == status.HTTP_422_UNPROCESSABLE_CONTENT and resp.json()["code"] == "key_reused"
+
+    # a failed request leaves its key free for the corrected retry
+    headers = auth_headers(users[0]) | {"Idempotency-Key": "taxi-2"}
+    resp = client.post("/expense", json=payload | {"split_policy": "custom"}, headers=headers)
+    assert resp.status_code == status.HTTP_400_BAD_REQUEST
+    assert client.post("/expense", json=payload, headers=headers).status_code == status.HTTP_201_CREATED
+
+    # a duplicate arriving while the original is handled waits for it and is not run again
+    store = IdempotencyStore(ttl_seconds=60, lease_seconds=60, wait_seconds=10, poll_seconds=5)
+    events = get_event_hub()
+    body = ExpensePayload.model_validate(payload)
+    entered, proceed = threading.Event(), threading.Event()
+    calls = []
+
+    def handler(_session: Session):
+        calls.append(1)
+        entered.set()
+        proceed.wait(5)
+        return {"id": len(calls)}
+
+    def send():
+        return store.run(session, users[0].id, "taxi-3", "create_expense", body, 201, Response(), events, handler)
+
+    with ThreadPoolExecutor(2) as pool:
+        original = pool.submit(send)
+        entered.wait(5)
+        duplicate = pool.submit(send)
+        time.sleep(0.2)
+        proceed.set()
+        assert original.result() == {"id": 1}
+        replayed = duplicate.result()
+    assert calls == [1]
+    assert isinstance(replayed, Response) and replayed.body == b'{"id":1}'
+
+    # a write that outlasted its lease lost the key to a retry, its response is refused and it rolls back
+    store = IdempotencyStore(ttl_seconds=60, lease_seconds=0, wait_seconds=1, poll_seconds=0.01)
+    engine = session.get_bind()
+    stale = store.claim(engine, users[0].id, "taxi-4", "create_expense", "digest")
+    retry_claim = store.claim(engine, users[0].id, "taxi-4", "create_expense", "digest")
+    with Session(engine) as write_session:
+        with pytest.raises(ErrIdempotency):
+            store.complete(write_session, stale, 201, b"{}", None)
+        store.complete(write_session, retry_claim, 201, b'{"id":2}', None)
+        write_session.commit()
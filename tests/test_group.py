@@ -1,12 +1,31 @@
+import io
+import csv
+import gzip
+import json
+from collections.abc import Callable
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
 import pytest
 from fastapi import status
 from fastapi.testclient import TestClient
-from sqlmodel import Session
+from sqlalchemy import event
+from sqlmodel import Session, col, select, update
 
-from app.config.vars import JWTVars
-from app.repository.types import id_to_str
+from app.config.vars import JWTVars, LedgerVars, SyncVars, get_ledger_vars, get_sync_vars
+from app.main import app
+from app.repository.enums import MembershipStatus
+from app.repository.models import Account, BalanceCheckpoint, Expense, Group, User
+from app.repository.types import TypeId, id_to_str, str_to_id
 from app.routes.security import create_access_token
+from app.utils.analytics import get_snapshot
 from app.utils.authentication import store_user
+from app.utils.changelog import GroupRevision, read_group_revision
+from app.utils.checkpoint import create_checkpoint
+from app.utils.export import ExportFormat, export_group
+from app.utils.ledger import compute_group_balances
+
+AuthHeaders = Callable[[User], dict[str, str]]
 
 
 @pytest.fixture(name="auth_token")
@@ -22,3 +41,330 @@ def test_group_creation(auth_token: str, client: TestClient):
     headers = {"Authorization": f"Bearer {auth_token}"}
     resp = client.post("/group/create", json=payload, headers=headers)
     assert resp.status_code == status.HTTP_201_CREATED
+
+
+def post_equal_expense(
+    client: TestClient, group: Group, payer: User, amount: str, headers: dict[str, str], paid_on: str = "2025-03-01"
+) -> str:
+    payload = {
+        "title": "Coffee",
+        "paid_by": id_to_str(payer.id),
+        "group_id": id_to_str(group.id),
+        "paid_on": paid_on,
+        "amount": amount,
+        "split_policy": "equal",
+    }
+    resp = client.post("/expense", json=payload, headers=headers)
+    assert resp.status_code == status.HTTP_201_CREATED
+    return resp.json()["id"]
+
+
+def test_group_balances_as_of_replays_from_checkpoint(
+    members: tuple[Group, list[User]], client: TestClient, session: Session, auth_headers: AuthHeaders
+):
+    group, users = members
+    headers = auth_headers(users[0])
+    recorded_at = (datetime(2025, 2, 1), datetime(2025, 2, 20), datetime(2025, 3, 5))
+    for payer, recorded in zip(users, recorded_at):
+        expense_id = post_equal_expense(client, group, payer, "30.0000", headers)
+        session.exec(update(Expense).where(col(Expense.id) == str_to_id(expense_id)).values(created_at=recorded))
+    session.commit()
+
+    checkpoint = create_checkpoint(session, group.id, datetime(2025, 3, 1, tzinfo=timezone.utc))
+    assert checkpoint is not None
+    assert len(checkpoint.balances) == len(users)
+
+    def balances_on(as_of: str) -> dict[TypeId, Decimal]:
+        resp = client.get(f"/group/{id_to_str(group.id)}/balances", params={"as_of": as_of}, headers=headers)
+        assert resp.status_code == status.HTTP_200_OK
+        return {str_to_id(b["user_id"]): Decimal(b["balance"]) for b in resp.json()}
+
+    before_checkpoint = balances_on("2025-02-10T00:00:00Z")
+    assert before_checkpoint[users[0].id] == Decimal(20)
+    assert before_checkpoint[users[2].id] == Decimal(-10)
+
+    at_checkpoint = balances_on("2025-03-01T00:00:00Z")
+    assert at_checkpoint[users[0].id] == Decimal(10)
+    assert at_checkpoint[users[2].id] == Decimal(-20)
+
+    after_checkpoint = balances_on("2025-03-10T00:00:00Z")
+    assert after_checkpoint == {u.id: Decimal(0) for u in users}
+
+
+def test_checkpoint_created_in_background(
+    members: tuple[Group, list[User]], client: TestClient, session: Session, auth_headers: AuthHeaders
+):
+    group, users = members
+    headers = auth_headers(users[0])
+    ledger_vars = LedgerVars(LEDGER_CHECKPOINT_INTERVAL=2, LEDGER_CHECKPOINT_LAG_SECONDS=0)
+    app.dependency_overrides[get_ledger_vars] = lambda: ledger_vars
+
+    post_equal_expense(client, group, users[0], "30.0000", headers)
+    assert session.exec(select(BalanceCheckpoint)).all() == []
+
+    post_equal_expense(client, group, users[1], "30.0000", headers)
+    checkpoints = session.exec(select(BalanceCheckpoint).where(col(BalanceCheckpoint.group_id) == group.id)).all()
+    assert len(checkpoints) == 1
+    balances = {b.user_id: b.balance for b in checkpoints[0].balances}
+    assert balances == {users[0].id: Decimal(10), users[1].id: Decimal(10), users[2].id: Decimal(-20)}
+
+
+def test_group_analytics_from_cached_snapshot(
+    members: tuple[Group, list[User]], client: TestClient, session: Session, auth_headers: AuthHeaders
+):
+    group, users = members
+    headers = auth_headers(users[0])
+    post_equal_expense(client, group, users[0], "10.0000", headers, paid_on="2025-03-01")
+    post_equal_expense(client, group, users[1], "30.0000", headers, paid_on="2025-04-02")
+
+    resp = client.get(f"/group/{id_to_str(group.id)}/analytics", headers=headers)
+    assert resp.status_code == status.HTTP_200_OK
+    analytics = resp.json()
+    assert analytics["months"] == ["2025-03", "2025-04"]
+    spend = {str_to_id(s["user_id"]): [Decimal(v) for v in s["monthly"]] for s in analytics["spend"]}
+    assert spend[users[0].id] == [Decimal("3.3334"), Decimal(10)]
+    assert spend[users[2].id] == [Decimal("3.3333"), Decimal(10)]
+    top = [(str_to_id(t["user_id"]), Decimal(t["total"])) for t in analytics["top_payers"]]
+    assert top == [(users[1].id, Decimal(30)), (users[0].id, Decimal(10))]
+
+    resp = client.get(f"/group/{id_to_str(group.id)}/analytics/balance-curve", headers=headers)
+    assert resp.status_code == status.HTTP_200_OK
+    assert [(p["day"], Decimal(p["balance"])) for p in resp.json()] == [
+        ("2025-03-01", Decimal("6.6666")),
+        ("2025-04-02", Decimal("-3.3334")),
+    ]
+
+    revision = read_group_revision(session, group.id, timedelta(0))
+    snapshot = get_snapshot(session, group, revision)
+    assert get_snapshot(session, group, revision) is snapshot
+    assert snapshot.balances() == compute_group_balances(session, group.id)
+
+    post_equal_expense(client, group, users[2], "3.0000", headers)
+    revision = read_group_revision(session, group.id, timedelta(0))
+    refreshed = get_snapshot(session, group, revision)
+    assert refreshed is not snapshot
+    assert refreshed.balances() == compute_group_balances(session, group.id)
+
+    # a revision that may still be joined by a late commit is read but never kept
+    unsettled = GroupRevision(seq=revision.seq, settled=False)
+    assert get_snapshot(session, group, unsettled) is not refreshed
+    assert get_snapshot(session, group, revision) is refreshed
+
+
+def test_group_patch_requires_admin_and_matching_version(
+    members: tuple[Group, list[User]], client: TestClient, auth_headers: AuthHeaders
+):
+    group, users = members
+    url = f"/group/{id_to_str(group.id)}"
+
+    resp = client.patch(url, json={"name": "Web Heads"}, headers=auth_headers(users[1]))
+    assert resp.status_code == status.HTTP_403_FORBIDDEN
+
+    resp = client.patch(url, json={"can_users_edit_info": True}, headers=auth_headers(users[0]) | {"If-Match": '"1"'})
+    assert resp.status_code == status.HTTP_200_OK
+    assert resp.headers["etag"] == '"2"'
+
+    resp = client.patch(url, json={"name": "Web Heads"}, headers=auth_headers(users[1]) | {"If-Match": '"1"'})
+    assert resp.status_code == status.HTTP_412_PRECONDITION_FAILED
+
+    resp = client.patch(url, json={"name": "Web Heads"}, headers=auth_headers(users[1]))
+    assert resp.status_code == status.HTTP_200_OK
+    assert resp.json()["name"] == "Web Heads"
+
+    resp = client.patch(url, json={"can_users_invite": True}, headers=auth_headers(users[1]))
+    assert resp.status_code == status.HTTP_403_FORBIDDEN
+
+
+def test_group_patch_is_not_conflicted_by_ledger_writes(
+    members: tuple[Group, list[User]], client: TestClient, session: Session, auth_headers: AuthHeaders
+):
+    group, users = members
+    url = f"/group/{id_to_str(group.id)}"
+    headers = auth_headers(users[0])
+
+    resp = client.patch(url, json={"name": "Web Heads"}, headers=headers)
+    assert resp.status_code == status.HTTP_200_OK
+    etag = resp.headers["etag"]
+
+    # expenses and invitations are tracked by the change log, the group version is left alone
+    post_equal_expense(client, group, users[1], "12.00", auth_headers(users[1]))
+    invitee = store_user(session, name="Ned Leeds", email="ned@dailybugle.com", password="secret_password@123")
+    payload = {"group_id": id_to_str(group.id), "invitee_id": id_to_str(invitee.id)}
+    assert client.post("/group/invite", json=payload, headers=headers).status_code == status.HTTP_200_OK
+
+    resp = client.patch(url, json={"description": "friendly neighbourhood"}, headers=headers | {"If-Match": etag})
+    assert resp.status_code == status.HTTP_200_OK
+    assert resp.json()["name"] == "Web Heads"
+
+
+def test_polled_reads_revalidate_against_versions(
+    members: tuple[Group, list[User]], client: TestClient, session: Session, auth_headers: AuthHeaders
+):
+    group, users = members
+    invitee = store_user(session, name="Ned Leeds", email="ned@dailybugle.com", password="secret_password@123")
+    invitee_headers = auth_headers(invitee)
+    app.dependency_overrides[get_sync_vars] = lambda: SyncVars(SYNC_COMMIT_GRACE_SECONDS=0)
+
+    resp = client.get("/invitation/pending/user", headers=invitee_headers)
+    assert resp.status_code == status.HTTP_200_OK and resp.json() == []
+    etag = resp.headers["etag"]
+    assert etag.startswith("W/") and resp.headers["cache-control"] == "private, no-cache"
+    resp = client.get("/invitation/pending/user", headers=invitee_headers | {"If-None-Match": etag})
+    assert resp.status_code == status.HTTP_304_NOT_MODIFIED and resp.headers["etag"] == etag
+
+    # an invitation bumps the version of the invitee, the stale copy is replaced
+    payload = {"group_id": id_to_str(group.id), "invitee_id": id_to_str(invitee.id)}
+    resp = client.post("/group/invite", json=payload, headers=auth_headers(users[0]))
+    assert resp.status_code == status.HTTP_200_OK
+    account_id = resp.json()["account_id"]
+    resp = client.get("/invitation/pending/user", headers=invitee_headers | {"If-None-Match": etag})
+    assert resp.status_code == status.HTTP_200_OK and len(resp.json()) == 1
+    assert resp.headers["etag"] != etag
+    etag = resp.headers["etag"]
+
+    resp = client.get(f"/invitation/decline/{account_id}", headers=invitee_headers)
+    assert resp.status_code == status.HTTP_200_OK
+    resp = client.get("/invitation/pending/user", headers=invitee_headers | {"If-None-Match": etag})
+    assert resp.status_code == status.HTTP_200_OK and resp.json() == []
+
+    # group reads are tagged with the revision of the group, any write to the ledger moves it
+    url = f"/group/{id_to_str(group.id)}/balances"
+    headers = auth_headers(users[1])
+    etag = client.get(url, headers=headers).headers["etag"]
+    assert client.get(url, headers=headers | {"If-None-Match": etag}).status_code == status.HTTP_304_NOT_MODIFIED
+    post_equal_expense(client, group, users[0], "30.00", auth_headers(users[0]))
+    resp = client.get(url, headers=headers | {"If-None-Match": etag})
+    assert resp.status_code == status.HTTP_200_OK and resp.headers["etag"] != etag
+
+    # right after a write a late commit may not move the revision yet, so the read is not tagged
+    app.dependency_overrides[get_sync_vars] = lambda: SyncVars(SYNC_COMMIT_GRACE_SECONDS=3600)
+    resp = client.get(url, headers=headers | {"If-None-Match": resp.headers["etag"]})
+    assert resp.status_code == status.HTTP_200_OK and "etag" not in resp.headers
+
+
+def test_retried_invitation_with_idempotency_key_invites_once(
+    members: tuple[Group, list[User]], client: TestClient, session: Session, auth_headers: AuthHeaders
+):
+    group, users = members
+    invitee = store_user(session, name="Ned Leeds", email="ned@dailybugle.com", password="secret_password@123")
+    payload = {"group_id": id_to_str(group.id), "invitee_id": id_to_str(invitee.id)}
+    headers = auth_headers(users[0]) | {"Idempotency-Key": "invite-ned"}
+
+    first = client.post("/group/invite", json=payload, headers=headers)
+    retry = client.post("/group/invite", json=payload, headers=headers)
+    assert first.status_code == retry.status_code == status.HTTP_200_OK
+    assert retry.json() == first.json() and retry.headers["Idempotent-Replayed"] == "true"
+    accounts = session.exec(select(Account).where(col(Account.owner_id) == invitee.id)).all()
+    assert len(accounts) == 1
+
+    # keys are per user, another member sending the same key is not answered with this invitation
+    other = client.post(
+        "/group/invite", json=payload, headers=auth_headers(users[1]) | {"Idempotency-Key": "invite-ned"}
+    )
+    assert "Idempotent-Replayed" not in other.headers
+
+
+def test_group_dashboard_reads_in_constant_queries(
+    members: tuple[Group, list[User]], client: TestClient, session: Session, auth_headers: AuthHeaders
+):
+    group, users = members
+    engine = session.get_bind()
+    url = f"/group/{id_to_str(group.id)}/dashboard"
+
+    def dashboard(user: User) -> tuple[dict, int]:
+        statements = []
+
+        def record(_conn, _cursor, statement, *_):
+            statements.append(statement)
+
+        session.expire_all()
+        event.listen(engine, "before_cursor_execute", record)
+        resp = client.get(url, params={"expenses": 5}, headers=auth_headers(user))
+        event.remove(engine, "before_cursor_execute", record)
+        assert resp.status_code == status.HTTP_200_OK
+        return resp.json(), len(statements)
+
+    post_equal_expense(client, group, users[0], "30.00", auth_headers(users[0]))
+    small, small_queries = dashboard(users[1])
+    assert len(small["members"]) == 3 and len(small["recent_expenses"]) == 1
+
+    # a group many times the size is read with the same statements
+    for i in range(20):
+        user = store_user(
+            session, name=f"Member {i}", email=f"member{i}@dailybugle.com", password="secret_password@123"
+        )
+        membership = MembershipStatus.ACTIVE if i % 2 == 0 else MembershipStatus.PENDING
+        session.add(
+            Account(
+                owner_id=user.id,
+                group_id=group.id,
+                invited_by=users[0].id,
+                balance=Decimal(0),
+                membership_status=membership,
+                invited_at=datetime.now(timezone.utc),
+                member_since=datetime.now(timezone.utc) if membership == MembershipStatus.ACTIVE else None,
+            )
+        )
+    session.commit()
+    for _ in range(10):
+        post_equal_expense(client, group, users[0], "30.00", auth_headers(users[0]))
+    large, large_queries = dashboard(users[1])
+    assert len(large["members"]) == 13 and len(large["recent_expenses"]) == 5
+    # the user of the token, the group, its accounts with their names, the revision of the group
+    # and the latest expenses
+    assert large_queries == small_queries <= 5
+
+    # the pending invitations are only listed for the admin, unless the group lets everyone see them
+    assert large["invitations"] is None
+    admin_view, _ = dashboard(users[0])
+    assert len(admin_view["invitations"]) == 10 and sum(Decimal(m["balance"]) for m in admin_view["members"]) == 0
+    outsider = store_user(session, name="Eddie Brock", email="eddie@dailyglobe.com", password="secret_password@123")
+    assert client.get(url, headers=auth_headers(outsider)).status_code == status.HTTP_403_FORBIDDEN
+
+
+def test_group_export_streams_every_share(
+    members: tuple[Group, list[User]], client: TestClient, session: Session, auth_headers: AuthHeaders
+):
+    group, users = members
+    headers = auth_headers(users[0])
+    for day, payer in enumerate(users, start=1):
+        post_equal_expense(client, group, payer, "10.0000", headers, paid_on=f"2025-03-0{day}")
+    payload = {
+        "title": "Tickets, front row",
+        "paid_by": id_to_str(users[1].id),
+        "group_id": id_to_str(group.id),
+        "paid_on": "2025-02-01",
+        "amount": "5.0000",
+        "split_policy": "custom",
+        "splits": [{"user_id": id_to_str(u.id), "amount": "5.0000" if u is users[2] else "0.0000"} for u in users],
+    }
+    assert client.post("/expense", json=payload, headers=headers).status_code == status.HTTP_201_CREATED
+
+    resp = client.get(f"/group/{group.id}/export", headers=headers)
+    assert resp.status_code == status.HTTP_200_OK
+    assert resp.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(resp.text)))
+    # the custom split comes first as it was paid earliest, every expense has a line per member
+    assert len(rows) == 4 * 3
+    assert {r["title"] for r in rows[:3]} == {"Tickets, front row"}
+    assert {(r["user_id"], r["share"]) for r in rows[:3]} == {
+        (str(users[0].id), "0.0000"),
+        (str(users[1].id), "0.0000"),
+        (str(users[2].id), "5.0000"),
+    }
+    assert {r["share"] for r in rows[3:]} == {"3.3334", "3.3333"}
+
+    resp = client.get(f"/group/{group.id}/export", params={"format": "ndjson", "gzip": True}, headers=headers)
+    assert resp.headers["content-type"] == "application/gzip"
+    lines = gzip.decompress(resp.content).decode().splitlines()
+    expenses = [json.loads(line) for line in lines]
+    assert [e["paid_on"] for e in expenses] == ["2025-02-01", "2025-03-01", "2025-03-02", "2025-03-03"]
+    assert all(sum(Decimal(s["amount"]) for s in e["splits"]) == Decimal(e["amount"]) for e in expenses)
+
+    # batches smaller than the group give the same file as one batch does
+    small_batches = b"".join(export_group(session, group.id, ExportFormat.NDJSON, gzip=False, batch_size=1))
+    assert small_batches.decode().splitlines() == lines
+
+    outsider = store_user(session, name="Outsider", email="outsider@oscorp.com", mobile=None, password="secret@123")
+    resp = client.get(f"/group/{group.id}/export", headers=auth_headers(outsider))
+    assert resp.status_code == status.HTTP_403_FORBIDDEN
@@ -0,0 +1,73 @@
+from collections.abc import Callable
+
+import cbor2
+import msgpack
+from fastapi import status
+from fastapi.testclient import TestClient
+
+from app.repository.models import Group, User
+from app.repository.types import id_to_str
+from app.responses import negotiate_media_type
+
+AuthHeaders = Callable[[User], dict[str, str]]
+
+
+def test_negotiate_media_type():
+    assert negotiate_media_type("") == "application/json"
+    assert negotiate_media_type("*/*") == "application/json"
+    assert negotiate_media_type("application/msgpack") == "application/msgpack"
+    assert negotiate_media_type("application/cbor, application/json;q=0.5") == "application/cbor"
+    assert negotiate_media_type("application/json, application/msgpack;q=0.9") == "application/json"
+    # named alongside json with the same weight, the binary format wins
+    assert negotiate_media_type("application/json, application/msgpack") == "application/msgpack"
+    assert negotiate_media_type("text/html") == "application/json"
+
+
+def test_responses_follow_accept_and_accept_encoding(
+    members: tuple[Group, list[User]], client: TestClient, auth_headers: AuthHeaders
+):
+    group, users = members
+    headers = auth_headers(users[0])
+    for i in range(20):
+        payload = {
+            "title": f"Groceries {i}",
+            "details": "milk, eggs, bread and a lot of coffee",
+            "paid_by": id_to_str(users[i % 3].id),
+            "group_id": id_to_str(group.id),
+            "paid_on": "2025-03-01",
+            "amount": "30.0000",
+            "split_policy": "equal",
+        }
+        assert client.post("/expense", json=payload, headers=headers).status_code == status.HTTP_201_CREATED
+
+    plain = client.get("/sync", headers=headers | {"Accept-Encoding": "identity"})
+    assert plain.headers["content-type"] == "application/json"
+    assert "content-encoding" not in plain.headers
+    assert "Accept" in plain.headers["vary"]
+    expected = plain.json()
+    assert len(plain.content) > 1024
+
+    # the same values in a binary format, decimals keep their digits as strings
+    binary = client.get("/sync", headers=headers | {"Accept": "application/msgpack", "Accept-Encoding": "identity"})
+    assert binary.headers["content-type"] == "application/msgpack"
+    assert msgpack.unpackb(binary.content) == expected
+    assert len(binary.content) < len(plain.content)
+    cbor = client.get("/sync", headers=headers | {"Accept": "application/cbor"})
+    assert cbor2.loads(cbor.content) == expected
+
+    # large bodies are compressed, errors come in the format asked for and are too small to compress
+    compressed = client.get("/sync", headers=headers | {"Accept-Encoding": "gzip"})
+    assert compressed.headers["content-encoding"] == "gzip"
+    assert int(compressed.headers["content-length"]) < len(plain.content) and compressed.json() == expected
+    # a strong etag names the bytes of one representation, the version in front of its suffix is still pinned
+    expense_id = expected["expenses"][0]["id"]
+    json_etag = client.get(f"/expense/{expense_id}", headers=headers).headers["etag"]
+    packed = client.get(f"/expense/{expense_id}", headers=headers | {"Accept": "application/msgpack"})
+    assert packed.headers["etag"] == json_etag.removesuffix('"') + '-msgpack"'
+    resp = client.patch(
+        f"/expense/{expense_id}", json={"title": "Coffee"}, headers=headers | {"If-Match": packed.headers["etag"]}
+    )
+    assert resp.status_code == status.HTTP_200_OK
+    missing = client.get(f"/expense/{id_to_str(group.id)}", headers=headers | {"Accept": "application/msgpack"})
+    assert missing.status_code == status.HTTP_404_NOT_FOUND and "content-encoding" not in missing.headers
+    assert msgpack.unpackb(missing.content)["code"] == "expense_not_found"
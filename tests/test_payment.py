@@ -0,0 +1,119 @@
+from collections.abc import Callable
+from decimal import Decimal
+
+from fastapi import status
+from fastapi.testclient import TestClient
+from sqlmodel import Session, col, select
+
+from app.repository.enums import PaymentStatus
+from app.repository.models import Account, Group, Payment, User
+from app.repository.types import id_to_str
+from app.utils.ledger import compute_group_balances
+
+AuthHeaders = Callable[[User], dict[str, str]]
+
+
+def balances_of(session: Session, group: Group) -> dict[str, Decimal]:
+    accounts = session.exec(select(Account).where(col(Account.group_id) == group.id)).all()
+    for account in accounts:
+        session.refresh(account)
+    return {id_to_str(a.owner_id): a.balance for a in accounts}
+
+
+def create_equal_expense(client: TestClient, group: Group, payer: User, amount: str, headers: dict[str, str]):
+    payload = {
+        "title": "Dinner",
+        "paid_by": id_to_str(payer.id),
+        "group_id": id_to_str(group.id),
+        "paid_on": "2025-03-01",
+        "amount": amount,
+        "split_policy": "equal",
+    }
+    resp = client.post("/expense", json=payload, headers=headers)
+    assert resp.status_code == status.HTTP_201_CREATED
+
+
+def test_request_and_settle_payment(
+    members: tuple[Group, list[User]], client: TestClient, session: Session, auth_headers: AuthHeaders
+):
+    group, users = members
+    create_equal_expense(client, group, users[0], "90.0000", auth_headers(users[0]))
+
+    payload = {"group_id": id_to_str(group.id), "payer_id": id_to_str(users[1].id), "amount": "30.0000"}
+    resp = client.post("/payment/request", json=payload, headers=auth_headers(users[0]))
+    assert resp.status_code == status.HTTP_201_CREATED
+    payment_id = resp.json()["id"]
+
+    # requesting a payment does not move any balance yet
+    assert balances_of(session, group)[id_to_str(users[1].id)] == Decimal("-30")
+
+    resp = client.post(f"/payment/settle/{payment_id}", headers=auth_headers(users[2]))
+    assert resp.status_code == status.HTTP_403_FORBIDDEN
+
+    resp = client.post(f"/payment/settle/{payment_id}", headers=auth_headers(users[1]))
+    assert resp.status_code == status.HTTP_200_OK
+    assert resp.json()["status"] == "settled"
+
+    balances = balances_of(session, group)
+    assert balances[id_to_str(users[0].id)] == Decimal("30")
+    assert balances[id_to_str(users[1].id)] == Decimal("0")
+    assert {id_to_str(k): v for k, v in compute_group_balances(session, group.id).items()} == balances
+
+    resp = client.post(f"/payment/decline/{payment_id}", headers=auth_headers(users[1]))
+    assert resp.status_code == status.HTTP_400_BAD_REQUEST
+    assert resp.json()["code"] == "already_settled"
+
+
+def test_decline_and_cancel_payment(members: tuple[Group, list[User]], client: TestClient, auth_headers: AuthHeaders):
+    group, users = members
+    payload = {"group_id": id_to_str(group.id), "payer_id": id_to_str(users[1].id), "amount": "5.0000"}
+
+    resp = client.post("/payment/request", json=payload, headers=auth_headers(users[0]))
+    payment_id = resp.json()["id"]
+    resp = client.post(f"/payment/decline/{payment_id}", headers=auth_headers(users[0]))
+    assert resp.status_code == status.HTTP_403_FORBIDDEN
+    resp = client.post(f"/payment/decline/{payment_id}", headers=auth_headers(users[1]))
+    assert resp.json()["status"] == "declined"
+
+    resp = client.post("/payment/request", json=payload, headers=auth_headers(users[0]))
+    payment_id = resp.json()["id"]
+    resp = client.post(f"/payment/cancel/{payment_id}", headers=auth_headers(users[1]))
+    assert resp.status_code == status.HTTP_403_FORBIDDEN
+    resp = client.post(f"/payment/cancel/{payment_id}", headers=auth_headers(users[0]))
+    assert resp.json()["status"] == "cancelled"
+
+
+def test_settle_all_applies_plan_in_one_call(
+    members: tuple[Group, list[User]], client: TestClient, session: Session, auth_headers: AuthHeaders
+):
+    group, users = members
+    headers = auth_headers(users[0])
+    create_equal_expense(client, group, users[0], "90.0000", headers)
+    create_equal_expense(client, group, users[1], "30.0000", headers)
+
+    payload = {"group_id": id_to_str(group.id), "payer_id": id_to_str(users[2].id), "amount": "1.0000"}
+    client.post("/payment/request", json=payload, headers=headers)
+
+    resp = client.get(f"/payment/settle-plan/{id_to_str(group.id)}", headers=auth_headers(users[2]))
+    assert resp.status_code == status.HTTP_200_OK
+    plan = resp.json()
+    assert len(plan["payments"]) == 2
+
+    resp = client.post(f"/payment/settle-all/{id_to_str(group.id)}", json=plan, headers=auth_headers(users[1]))
+    assert resp.status_code == status.HTTP_403_FORBIDDEN
+
+    # the admin can only record a plan that settles the balances as they are, with real transfers
+    url = f"/payment/settle-all/{id_to_str(group.id)}"
+    inflated = {"payments": [p | {"amount": "100.0000"} for p in plan["payments"]]}
+    resp = client.post(url, json=inflated, headers=headers)
+    assert resp.status_code == status.HTTP_400_BAD_REQUEST and resp.json()["code"] == "plan_mismatch"
+    nothing = {"payments": [p | {"amount": "0.0000"} for p in plan["payments"]]}
+    assert client.post(url, json=nothing, headers=headers).status_code == status.HTTP_422_UNPROCESSABLE_CONTENT
+
+    resp = client.post(url, json=plan, headers=headers)
+    assert resp.status_code == status.HTTP_201_CREATED
+    assert all(p["status"] == "settled" for p in resp.json())
+
+    assert set(balances_of(session, group).values()) == {Decimal(0)}
+    pending = session.exec(select(Payment).where(col(Payment.status) == PaymentStatus.REQUESTED)).all()
+    assert pending == []
@@ -0,0 +1,79 @@
+from collections.abc import Callable
+from datetime import date
+from decimal import Decimal
+
+from fastapi import status
+from fastapi.testclient import TestClient
+from sqlmodel import Session, col, select
+
+from app.config.vars import LedgerVars
+from app.main import app
+from app.repository.models import Expense, Group, RecurringExpense, User
+from app.repository.types import id_to_str, str_to_id
+from app.routes.recurring import get_recurring_scheduler, materialize_due
+from app.utils.currency import RateTable
+from app.utils.ledger import compute_group_balances
+from app.utils.recurring import RecurringScheduler
+
+AuthHeaders = Callable[[User], dict[str, str]]
+
+
+def scheduler_with_batches_of(size: int) -> RecurringScheduler:
+    rate_table = RateTable(base="USD", starts={}, rates={})
+    return RecurringScheduler(lambda s, t, today: materialize_due(s, t, today, rate_table, LedgerVars(), size))
+
+
+def test_recurring_expense_catches_up_once_in_batches(
+    members: tuple[Group, list[User]], client: TestClient, session: Session, auth_headers: AuthHeaders
+):
+    group, users = members
+    headers = auth_headers(users[0])
+    scheduler = scheduler_with_batches_of(2)
+    app.dependency_overrides[get_recurring_scheduler] = lambda: scheduler
+
+    payload = {
+        "title": "Rent",
+        "paid_by": id_to_str(users[0].id),
+        "group_id": id_to_str(group.id),
+        "amount": "30.0000",
+        "split_policy": "equal",
+        "frequency": "monthly",
+        "starts_on": "2025-01-31",
+    }
+    resp = client.post("/recurring", json=payload, headers=headers)
+    assert resp.status_code == status.HTTP_201_CREATED
+    recurring_id = str_to_id(resp.json()["id"])
+    assert len(scheduler) == 1
+
+    # four months were missed, they are recorded two per transaction
+    assert scheduler.run_due(session, date(2025, 5, 15)) == 2
+    stmt = select(Expense).where(col(Expense.recurring_id) == recurring_id).order_by(col(Expense.occurrence))
+    expenses = session.exec(stmt).all()
+    assert [e.paid_on for e in expenses] == [date(2025, 1, 31), date(2025, 2, 28), date(2025, 3, 31), date(2025, 4, 30)]
+    assert [e.occurrence for e in expenses] == [0, 1, 2, 3]
+    assert scheduler.next_due() == date(2025, 5, 31)
+
+    # another scheduler loading the same templates finds nothing left to record
+    restarted = scheduler_with_batches_of(100)
+    restarted.load(session)
+    assert restarted.run_due(session, date(2025, 5, 15)) == 0
+    assert materialize_due(
+        session, recurring_id, date(2025, 5, 15), RateTable("USD", {}, {}), LedgerVars(), 100
+    ) == date(2025, 5, 31)
+    assert len(session.exec(stmt).all()) == 4
+
+    # occurrences went through the ledger like any other expense
+    balances = compute_group_balances(session, group.id)
+    assert balances[users[0].id] == Decimal("80.0000")
+    assert balances[users[1].id] == Decimal("-40.0000")
+
+    resp = client.delete(f"/recurring/{recurring_id}", headers=auth_headers(users[1]))
+    assert resp.status_code == status.HTTP_403_FORBIDDEN
+    resp = client.delete(f"/recurring/{recurring_id}", headers=headers)
+    assert resp.status_code == status.HTTP_204_NO_CONTENT
+    assert len(scheduler) == 0
+
+    resp = client.get(f"/recurring/group/{group.id}", headers=headers)
+    [template] = resp.json()
+    assert (template["occurrences"], template["next_due"], template["enabled"]) == (4, None, False)
+    assert session.get(RecurringExpense, recurring_id).enabled is False
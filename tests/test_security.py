@@ -76,5 +76,9 @@ def test_security_user_exists_disabled(
 ):
     store_user(session, username=username, password=password, enabled=False)
     payload = {"username": username, "password": password}
-    resp = client.post("/token", data=payload, headers=auth_form_headers)
-    assert resp.status_code == status.HTTP_401_UNAUTHORIZED
+    for _ in range(2):
+        # the second answer comes from the body encoded for the first
+        resp = client.post("/token", data=payload, headers=auth_form_headers)
+        assert resp.status_code == status.HTTP_401_UNAUTHORIZED
+        assert resp.headers["www-authenticate"] == "Bearer"
+        assert resp.json() == {"code": "invalid_grant", "detail": "user account is disabled, contact administrator"}
@@ -0,0 +1,57 @@
+import gzip
+from pathlib import Path
+
+import brotli
+from fastapi import status
+from fastapi.testclient import TestClient
+
+from app.utils.static import CachedStaticFiles, precompress
+
+
+def test_static_files_negotiate_precompressed_variants_and_revalidate(tmp_path: Path):
+    script = "".join(f"function handler{i}() {{ return {i}; }}\n" for i in range(200))
+    (tmp_path / "app.js").write_text(script)
+    (tmp_path / "app.0123abcd.js").write_text(script)
+    (tmp_path / "receipts").mkdir()
+    (tmp_path / "receipts" / "notes.txt").write_text(script)
+    (tmp_path / "tiny.css").write_text("a{}")
+
+    # receipts are skipped, tiny files are not worth compressing, a second run finds nothing stale
+    assert precompress(tmp_path, ("receipts",)) == 4
+    assert not (tmp_path / "receipts" / "notes.txt.gz").exists()
+    assert precompress(tmp_path, ("receipts",)) == 0
+
+    files = CachedStaticFiles(directory=str(tmp_path), immutable_dirs=("receipts",), cache_bytes=64 * 1024)
+    client = TestClient(files)
+
+    # httpx decodes the body, the raw stream shows what went over the wire
+    with client.stream("GET", "/app.js", headers={"Accept-Encoding": "gzip, br;q=0"}) as resp:
+        assert resp.headers["content-encoding"] == "gzip"
+        assert gzip.decompress(b"".join(resp.iter_raw())).decode() == script
+    with client.stream("GET", "/app.js", headers={"Accept-Encoding": "br, gzip"}) as resp:
+        assert resp.headers["content-encoding"] == "br"
+        assert brotli.decompress(b"".join(resp.iter_raw())).decode() == script
+        br_etag = resp.headers["etag"]
+    assert resp.headers["vary"] == "Accept-Encoding"
+    assert resp.headers["cache-control"] == "public, no-cache"
+
+    identity = client.get("/app.js", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in identity.headers and identity.text == script
+    assert identity.headers["etag"] != br_etag
+
+    # the etag validates the representation it was sent with, a changed file changes it
+    resp = client.get("/app.js", headers={"Accept-Encoding": "br", "If-None-Match": br_etag})
+    assert resp.status_code == status.HTTP_304_NOT_MODIFIED
+    assert resp.headers["vary"] == "Accept-Encoding"
+    resp = client.get("/app.js", headers={"Accept-Encoding": "identity", "If-None-Match": br_etag})
+    assert resp.status_code == status.HTTP_200_OK
+    (tmp_path / "app.js").write_text(script + "// changed\n")
+    resp = client.get("/app.js", headers={"Accept-Encoding": "br", "If-None-Match": br_etag})
+    assert resp.status_code == status.HTTP_200_OK
+    # the stale variant is ignored until it is precompressed again
+    assert "content-encoding" not in resp.headers and resp.text.endswith("// changed\n")
+
+    for path in ("/app.0123abcd.js", "/receipts/notes.txt"):
+        assert "immutable" in client.get(path).headers["cache-control"]
+    # the hot files read so far are held in memory within the budget
+    assert 0 < files.cache.size <= 64 * 1024
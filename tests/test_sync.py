@@ -0,0 +1,123 @@
+from collections.abc import Callable
+from datetime import datetime, timedelta, timezone
+
+from fastapi import status
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+from app.config.vars import SyncVars, get_sync_vars
+from app.main import app
+from app.repository.models import Group, User
+from app.repository.types import id_to_str
+from app.utils.authentication import store_user
+from app.utils.changelog import compact_changes
+
+AuthHeaders = Callable[[User], dict[str, str]]
+
+
+def sync_all(client: TestClient, headers: dict[str, str], cursor: str | None, limit: int) -> tuple[dict, str]:
+    """Follows the pages of one sync, later pages overwrite what earlier ones sent of the same entity."""
+    state: dict[tuple[str, str], dict | None] = {}
+    while True:
+        params = {"limit": limit} | ({"cursor": cursor} if cursor else {})
+        resp = client.get("/sync", params=params, headers=headers)
+        assert resp.status_code == status.HTTP_200_OK
+        page = resp.json()
+        for kind in ("groups", "accounts", "expenses", "tasks"):
+            for item in page[kind]:
+                state[(kind.removesuffix("s"), item["id"])] = item
+        for tombstone in page["deleted"]:
+            state[(tombstone["kind"], tombstone["id"])] = None
+        cursor = page["cursor"]
+        if not page["has_more"]:
+            return state, cursor
+
+
+def test_sync_replays_changes_after_cursor(
+    members: tuple[Group, list[User]], client: TestClient, session: Session, auth_headers: AuthHeaders
+):
+    group, users = members
+    admin, member, _ = users
+    app.dependency_overrides[get_sync_vars] = lambda: SyncVars(SYNC_COMMIT_GRACE_SECONDS=0)
+
+    # the seeded group was never written through the api, there is nothing to sync yet
+    state, cursor = sync_all(client, auth_headers(member), None, 100)
+    assert state == {}
+
+    payload = {
+        "title": "Coffee",
+        "paid_by": id_to_str(admin.id),
+        "group_id": id_to_str(group.id),
+        "paid_on": "2025-03-01",
+        "amount": "30.0000",
+        "split_policy": "equal",
+    }
+    expense_id = client.post("/expense", json=payload, headers=auth_headers(admin)).json()["id"]
+    for title in ("Coffee beans", "Espresso"):
+        resp = client.patch(f"/expense/{expense_id}", json={"title": title}, headers=auth_headers(admin))
+        assert resp.status_code == status.HTTP_200_OK
+    deadline = (datetime.now(timezone.utc) + timedelta(days=1)).isoformat()
+    task = {"group_id": id_to_str(group.id), "assignee_id": id_to_str(member.id), "title": "Buy", "deadline": deadline}
+    task_id = client.post("/task", json=task, headers=auth_headers(admin)).json()["id"]
+
+    # every entity arrives once in its latest state, however small the pages
+    for limit in (100, 2):
+        state, next_cursor = sync_all(client, auth_headers(member), cursor, limit)
+        expense = state[("expense", expense_id)]
+        assert expense is not None and expense["title"] == "Espresso"
+        assert [s["amount"] for s in expense["splits"]] == ["10.0000"] * 3
+        assert state[("task", task_id)] is not None
+        assert len([key for key in state if key[0] == "account"]) == 3
+    assert sync_all(client, auth_headers(member), next_cursor, 100)[0] == {}
+
+    # deletes come as tombstones, outsiders see none of it
+    assert client.delete(f"/expense/{expense_id}", headers=auth_headers(admin)).status_code == 204
+    state, _ = sync_all(client, auth_headers(member), next_cursor, 100)
+    assert state[("expense", expense_id)] is None
+    outsider = store_user(session, name="Eddie Brock", email="eddie@dailyglobe.com", password="secret_password@123")
+    assert sync_all(client, auth_headers(outsider), None, 100)[0] == {}
+
+    # compaction keeps the last change of every entity, replaying the log ends in the same state
+    before, _ = sync_all(client, auth_headers(member), None, 100)
+    assert compact_changes(session) > 0
+    session.commit()
+    assert sync_all(client, auth_headers(member), None, 100)[0] == before
+
+    # a change younger than the grace period may still be overtaken, the cursor waits for it
+    app.dependency_overrides[get_sync_vars] = lambda: SyncVars(SYNC_COMMIT_GRACE_SECONDS=3600)
+    client.patch(f"/task/{task_id}", json={"title": "Buy milk"}, headers=auth_headers(admin))
+    page = client.get("/sync", params={"cursor": next_cursor}, headers=auth_headers(member)).json()
+    assert [t["title"] for t in page["tasks"]] == ["Buy milk"]
+    assert page["cursor"] == next_cursor and not page["has_more"]
+
+
+def test_sync_sends_history_of_joined_group(
+    members: tuple[Group, list[User]], client: TestClient, session: Session, auth_headers: AuthHeaders
+):
+    group, users = members
+    admin = users[0]
+    app.dependency_overrides[get_sync_vars] = lambda: SyncVars(SYNC_COMMIT_GRACE_SECONDS=0)
+
+    payload = {
+        "title": "Coffee",
+        "paid_by": id_to_str(admin.id),
+        "group_id": id_to_str(group.id),
+        "paid_on": "2025-03-01",
+        "amount": "30.0000",
+        "split_policy": "equal",
+    }
+    expense_id = client.post("/expense", json=payload, headers=auth_headers(admin)).json()["id"]
+
+    # the newcomer synced before joining, their cursor is past the changes that made the expense
+    newcomer = store_user(session, name="Ned Leeds", email="ned@dailybugle.com", password="secret_password@123")
+    invite = {"group_id": id_to_str(group.id), "invitee_id": id_to_str(newcomer.id)}
+    account_id = client.post("/group/invite", json=invite, headers=auth_headers(admin)).json()["account_id"]
+    state, cursor = sync_all(client, auth_headers(newcomer), None, 100)
+    assert list(state) == [("account", account_id)]
+
+    resp = client.get(f"/invitation/accept/{account_id}", headers=auth_headers(newcomer))
+    assert resp.status_code == status.HTTP_200_OK
+    state, _ = sync_all(client, auth_headers(newcomer), cursor, 100)
+    assert state[("group", str(group.id))] is not None
+    assert state[("expense", expense_id)] is not None
+    assert len([key for key in state if key[0] == "account"]) == 4
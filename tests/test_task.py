@@ -0,0 +1,118 @@
+from collections.abc import Callable
+from datetime import datetime, timedelta, timezone
+
+from fastapi import status
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+from app.main import app
+from app.repository.enums import TaskStatus
+from app.repository.models import Group, Task, User
+from app.repository.types import id_to_str, str_to_id
+from app.routes.task import get_due_soon_scanner
+from app.utils.tasks import DueSoonScanner
+
+AuthHeaders = Callable[[User], dict[str, str]]
+
+NOW = datetime(2025, 6, 1, 12, tzinfo=timezone.utc)
+
+
+def test_tasks_page_by_deadline_and_change_status_in_bulk(
+    members: tuple[Group, list[User]], client: TestClient, session: Session, auth_headers: AuthHeaders
+):
+    group, users = members
+    admin, assignee, member = users
+    scanner = DueSoonScanner(lambda s, t: None, timedelta(hours=1), timedelta(minutes=5))
+    app.dependency_overrides[get_due_soon_scanner] = lambda: scanner
+
+    task_ids = []
+    for hours in (5, 1, 3, 2, 4):
+        payload = {
+            "group_id": id_to_str(group.id),
+            "assignee_id": id_to_str(assignee.id),
+            "title": f"due in {hours}h",
+            "deadline": (NOW + timedelta(hours=hours)).isoformat(),
+        }
+        resp = client.post("/task", json=payload, headers=auth_headers(admin))
+        assert resp.status_code == status.HTTP_201_CREATED
+        task_ids.append(str_to_id(resp.json()["id"]))
+
+    # deadline order survives pages of two, continuing after the cursor of the previous page
+    titles, cursor = [], None
+    while True:
+        params = {"limit": 2} | ({"cursor": cursor} if cursor else {})
+        page = client.get("/task/assigned", params=params, headers=auth_headers(assignee)).json()
+        titles += [t["title"] for t in page["tasks"]]
+        if (cursor := page["next_cursor"]) is None:
+            break
+    assert titles == ["due in 1h", "due in 2h", "due in 3h", "due in 4h", "due in 5h"]
+    resp = client.get(f"/task/group/{group.id}", params={"limit": 10}, headers=auth_headers(member))
+    assert len(resp.json()["tasks"]) == 5
+
+    # the assignee finishes three, one of them twice, and cannot cancel what they were given
+    body = {"task_ids": [id_to_str(i) for i in task_ids[:3] + task_ids[:1]], "status": "finished"}
+    result = client.post("/task/status", json=body, headers=auth_headers(assignee)).json()
+    assert [str_to_id(i) for i in result["updated"]] == task_ids[:3]
+    body = {"task_ids": [id_to_str(task_ids[0]), id_to_str(task_ids[3])], "status": "cancelled"}
+    result = client.post("/task/status", json=body, headers=auth_headers(assignee)).json()
+    assert result["updated"] == []
+    assert [r["code"] for r in result["rejected"]] == ["forbidden_not_assigner", "forbidden_not_assigner"]
+
+    # the admin cancels one, a finished task cannot be cancelled
+    result = client.post("/task/status", json=body, headers=auth_headers(admin)).json()
+    assert [str_to_id(i) for i in result["updated"]] == [task_ids[3]]
+    assert [r["code"] for r in result["rejected"]] == ["invalid_transition"]
+    assert session.get(Task, task_ids[0]).status == TaskStatus.FINISHED
+
+    page = client.get(f"/task/group/{group.id}", headers=auth_headers(admin)).json()
+    assert [t["title"] for t in page["tasks"]] == ["due in 4h"]
+
+    resp = client.patch(f"/task/{task_ids[4]}", json={"title": "renamed"}, headers=auth_headers(assignee))
+    assert resp.status_code == status.HTTP_403_FORBIDDEN
+    resp = client.delete(f"/task/{task_ids[4]}", headers=auth_headers(admin))
+    assert resp.status_code == status.HTTP_204_NO_CONTENT
+    assert client.get(f"/task/{task_ids[4]}", headers=auth_headers(admin)).status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_due_soon_scanner_reads_only_new_deadlines(members: tuple[Group, list[User]], session: Session):
+    group, users = members
+    reminded: list[str] = []
+    scanner = DueSoonScanner(
+        lambda _, tasks: reminded.extend(t.title for t in tasks), timedelta(hours=1), timedelta(minutes=10)
+    )
+
+    def add(title: str, deadline: datetime, task_status: TaskStatus = TaskStatus.PENDING) -> Task:
+        task = Task(
+            title=title,
+            status=task_status,
+            deadline=deadline,
+            group_id=group.id,
+            assignee_id=users[1].id,
+            assigner_id=users[0].id,
+        )
+        session.add(task)
+        session.commit()
+        return task
+
+    add("soon", NOW + timedelta(minutes=30))
+    moved = add("later", NOW + timedelta(minutes=65))
+    add("done", NOW + timedelta(minutes=20), TaskStatus.FINISHED)
+    add("far", NOW + timedelta(days=3))
+
+    # the window reaches one hour and ten minutes ahead, "far" is never read
+    assert scanner.scan(session, NOW) == 2
+    assert scanner.remind_due(session, NOW) == 1
+    assert reminded == ["soon"]
+
+    # moved out of the window before it was due, the stale entry is dropped
+    moved.deadline = NOW + timedelta(hours=5)
+    session.commit()
+    scanner.track(moved.id, moved.deadline)
+
+    # the next scan only reads the deadlines that entered the window since
+    add("new", NOW + timedelta(minutes=75))
+    assert scanner.scan(session, NOW + timedelta(minutes=10)) == 1
+    assert scanner.next_reminder() == NOW + timedelta(minutes=15)
+    assert scanner.remind_due(session, NOW + timedelta(minutes=15)) == 1
+    assert reminded == ["soon", "new"]
+    assert scanner.next_reminder() is None